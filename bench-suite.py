@@ -0,0 +1,97 @@
+"""
+Набор замеров: запускает сервер на свободном локальном порту, прогоняет
+сценарии с перебором параметров и сравнивает результаты с базовым прогоном
+
+Код выхода 1 - скорость или p99 ухудшились сильнее порога (см. ws_suite.py)
+"""
+import argparse
+import sys
+
+from ws_suite import (SCENARIOS, expand_points, run_suite, machine_info, save_json, save_csv,
+                      load_baseline, compare_with_baseline)
+from ws_backends import BACKENDS, BACKEND_WEBSOCKETS
+from ws_compression import parse_int_list
+
+
+def parse_list(value: str) -> list:
+    """Разбирает список строк через запятую"""
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Набор замеров WebSocket серверов с перебором параметров")
+    parser.add_argument("--scenarios", type=str, default=",".join(SCENARIOS),
+                       help=f"Сценарии через запятую: {', '.join(SCENARIOS)} (по умолчанию: все)")
+    parser.add_argument("--backends", type=str, default=BACKEND_WEBSOCKETS,
+                       help=f"Бэкенды server-bench.py через запятую: {', '.join(BACKENDS)} "
+                            f"(по умолчанию: {BACKEND_WEBSOCKETS})")
+    parser.add_argument("--connections", type=str, default="1,10",
+                       help="Количество подключений через запятую (по умолчанию: 1,10)")
+    parser.add_argument("--payload-sizes", type=str, default="64,1024",
+                       help="Размеры сообщений в байтах через запятую (по умолчанию: 64,1024)")
+    parser.add_argument("--durations", type=str, default="5",
+                       help="Длительности замера в секундах через запятую (по умолчанию: 5)")
+    parser.add_argument("--inflight", type=int, default=32,
+                       help="Неподтвержденных сообщений на подключение в echo-rtt (по умолчанию: 32)")
+    parser.add_argument("--broadcast-messages", type=int, default=1000,
+                       help="Количество рассылок в сценарии broadcast (по умолчанию: 1000)")
+    parser.add_argument("--host", type=str, default="127.0.0.1",
+                       help="Локальный адрес серверов (по умолчанию: 127.0.0.1)")
+    parser.add_argument("--output", type=str, default=None,
+                       help="Сохранить результаты и сведения о машине в JSON файл")
+    parser.add_argument("--csv", type=str, default=None,
+                       help="Сохранить результаты в CSV файл")
+    parser.add_argument("--baseline", type=str, default=None,
+                       help="JSON файл базового прогона (--output предыдущего запуска) для сравнения")
+    parser.add_argument("--throughput-threshold", type=float, default=0.10,
+                       help="Допустимое падение скорости относительно базы, доля (по умолчанию: 0.10)")
+    parser.add_argument("--latency-threshold", type=float, default=0.20,
+                       help="Допустимый рост p99 относительно базы, доля (по умолчанию: 0.20)")
+
+    args = parser.parse_args()
+
+    scenarios = parse_list(args.scenarios)
+    backends = parse_list(args.backends)
+    unknown = [name for name in scenarios if name not in SCENARIOS] + [name for name in backends if name not in BACKENDS]
+    if unknown:
+        print(f"Ошибка: неизвестные сценарии или бэкенды: {', '.join(unknown)}")
+        return 2
+
+    points = expand_points(scenarios, backends, parse_int_list(args.connections),
+                           parse_int_list(args.payload_sizes), [float(item) for item in parse_list(args.durations)])
+    machine = machine_info()
+
+    print(f"\n{'='*60}")
+    print(f"Набор замеров: {len(points)} точек")
+    print(f"Машина: {machine['hostname']}, {machine['processor'] or machine['machine']}, "
+          f"{machine['cpu_count']} CPU, Python {machine['python']}")
+    print(f"{'='*60}\n")
+
+    results = run_suite(points, args.host, args.inflight, args.broadcast_messages)
+
+    if args.output:
+        save_json(args.output, machine, results)
+        print(f"\nРезультаты сохранены в {args.output}")
+    if args.csv:
+        save_csv(args.csv, machine, results)
+        print(f"Результаты сохранены в {args.csv}")
+
+    if not args.baseline:
+        return 0
+    regressions = compare_with_baseline(results, load_baseline(args.baseline),
+                                        args.throughput_threshold, args.latency_threshold)
+    if regressions:
+        print(f"\nРегрессии относительно {args.baseline}:")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    print(f"\nРегрессий относительно {args.baseline} нет")
+    return 0
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(main())
+    except KeyboardInterrupt:
+        print("\nОстановка замеров...")
+        sys.exit(130)
@@ -0,0 +1,214 @@
+"""
+Замер рассылки через шину между воркерами (см. ws_bus.py)
+
+Для каждого количества воркеров (по умолчанию от 1 до числа ядер)
+запускает server-bench.py --workers N --bus, подключает клиентов (ядро
+распределяет их по воркерам через SO_REUSEPORT), и один из клиентов
+отправляет команды __BENCHMARK_BROADCAST__ с временем отправки. Рассылку
+начинает воркер публикующего клиента, остальным воркерам кадр передает
+шина. Каждый клиент считает задержку от отправки команды до получения
+рассылки.
+
+Выводятся скорость доставки (сообщений клиентам в секунду), процентили
+задержки и опоздание шины по воркерам (из таблицы участников шины).
+С одним воркером сервер запускается без шины - это база для сравнения.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import websockets
+
+from ws_bus import MessageBus, default_bus_path
+from ws_histogram import Histogram
+from ws_protocol import BENCHMARK_BROADCAST
+from ws_suite import ServerProcess, find_free_port
+from ws_compression import parse_int_list
+
+WARMUP_TEXT = "warmup"
+
+
+class BroadcastStats:
+    """Счетчики доставки рассылки клиентам замера"""
+
+    __slots__ = ("received", "warmed", "histogram", "last_receive", "done", "expected")
+
+    def __init__(self):
+        self.received = 0
+        self.warmed = set()
+        # Задержка от отправки команды до получения рассылки, мкс
+        self.histogram = Histogram()
+        self.last_receive = 0.0
+        self.done = asyncio.Event()
+        self.expected = 0
+
+
+async def receiver(index: int, websocket, stats: BroadcastStats):
+    """Читает рассылку: "<номер>:<время отправки, нс>:<заполнение>" или прогрев"""
+    try:
+        async for message in websocket:
+            if message == WARMUP_TEXT:
+                stats.warmed.add(index)
+                continue
+            sent_ns = int(message.split(":", 2)[1])
+            now = time.monotonic_ns()
+            stats.histogram.record((now - sent_ns) // 1000)
+            stats.received += 1
+            stats.last_receive = time.perf_counter()
+            if stats.received >= stats.expected > 0:
+                stats.done.set()
+    except websockets.exceptions.ConnectionClosed:
+        pass
+
+
+async def warm_up(publisher, stats: BroadcastStats, num_clients: int, timeout: float = 10.0) -> bool:
+    """Рассылает прогрев, пока его не получат все клиенты (все зарегистрированы во всех воркерах)"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        await publisher.send(BENCHMARK_BROADCAST + WARMUP_TEXT)
+        await asyncio.sleep(0.2)
+        if len(stats.warmed) >= num_clients:
+            return True
+    return False
+
+
+async def run_point(workers: int, host: str, num_clients: int, num_messages: int, payload_size: int,
+                    rate: float, timeout: float) -> dict:
+    """Один прогон: server-bench.py с workers воркерами, num_clients клиентов, num_messages рассылок"""
+    port = find_free_port(host)
+    server_args = ["--backend", "websockets", "--no-metrics", "--log-level", "connections=off"]
+    if workers > 1:
+        server_args += ["--workers", str(workers), "--bus"]
+    url = f"ws://{host}:{port}"
+    stats = BroadcastStats()
+    padding = "x" * payload_size
+    with ServerProcess("server-bench.py", host, port, server_args) as server:
+        connect_limit = asyncio.Semaphore(100)
+
+        async def connect():
+            async with connect_limit:
+                return await websockets.connect(url, compression=None, max_size=None, max_queue=None)
+
+        connections = await asyncio.gather(*(connect() for _ in range(num_clients)))
+        tasks = [asyncio.create_task(receiver(index, websocket, stats))
+                 for index, websocket in enumerate(connections)]
+        # Публикует первый клиент: он же получает рассылку, как остальные
+        publisher = connections[0]
+        try:
+            if not await warm_up(publisher, stats, num_clients):
+                print(f"Внимание: прогрев получили {len(stats.warmed)} из {num_clients} клиентов")
+            stats.expected = num_messages * len(stats.warmed)
+            start = time.perf_counter()
+            for sequence in range(num_messages):
+                await publisher.send(f"{BENCHMARK_BROADCAST}{sequence}:{time.monotonic_ns()}:{padding}")
+                if rate > 0:
+                    await asyncio.sleep(max(0.0, start + (sequence + 1) / rate - time.perf_counter()))
+            try:
+                await asyncio.wait_for(stats.done.wait(), timeout)
+            except asyncio.TimeoutError:
+                print(f"Внимание: доставлено {stats.received} из {stats.expected} за {timeout} секунд")
+            elapsed = (stats.last_receive or time.perf_counter()) - start
+            members = []
+            if workers > 1:
+                # Таблица участников шины сервера: файл по pid родительского процесса server-bench.py
+                try:
+                    bus = MessageBus(default_bus_path(server.process.pid))
+                    members = bus.members()
+                    bus.close()
+                except (OSError, ValueError):
+                    pass
+        finally:
+            for websocket in connections:
+                await websocket.close()
+            await asyncio.gather(*tasks, return_exceptions=True)
+    histogram = stats.histogram
+    return {
+        "workers": workers,
+        "clients": num_clients,
+        "messages": num_messages,
+        "payload_size": payload_size,
+        "expected": stats.expected,
+        "delivered": stats.received,
+        "elapsed": elapsed,
+        "rate": stats.received / elapsed if elapsed > 0 else 0.0,
+        "p50_ms": histogram.percentile(50.0) / 1000,
+        "p99_ms": histogram.percentile(99.0) / 1000,
+        "max_ms": histogram.max_recorded / 1000,
+        "bus_members": members,
+    }
+
+
+def print_results(results: list):
+    """Итоговая таблица замера"""
+    print(f"\n{'='*60}")
+    print("Рассылка через шину воркеров: итоги")
+    print(f"{'Воркеры':>8}{'Доставлено':>12}{'Сообщ./сек':>12}{'p50, мс':>9}{'p99, мс':>9}{'max, мс':>9}"
+          f"{'Шина, мс':>10}")
+    for result in results:
+        members = result["bus_members"]
+        bus_lag = max((member["mean_lag"] for member in members), default=0.0) / 1e6
+        print(f"{result['workers']:>8}{result['delivered']:>12}{result['rate']:>12.0f}{result['p50_ms']:>9.2f}"
+              f"{result['p99_ms']:>9.2f}{result['max_ms']:>9.2f}"
+              f"{(f'{bus_lag:.2f}' if members else '-'):>10}")
+        for member in sorted(members, key=lambda member: member["worker_id"]):
+            print(f"         воркер #{member['worker_id']}: из шины {member['delivered']}, опоздание среднее "
+                  f"{member['mean_lag'] / 1e6:.3f} мс, наибольшее {member['max_lag'] / 1e6:.3f} мс, "
+                  f"переполнений: {member['overruns']}")
+    incomplete = [result for result in results if result["delivered"] < result["expected"]]
+    if incomplete:
+        print(f"Внимание: доставлено не полностью в {len(incomplete)} прогонах")
+    print("Шина, мс - наибольшее среди воркеров среднее опоздание кадра в шине")
+    print(f"{'='*60}\n")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Замер рассылки через шину между воркерами сервера")
+    parser.add_argument("--workers", type=str, default=None,
+                       help="Количества воркеров через запятую (по умолчанию: от 1 до числа ядер)")
+    parser.add_argument("--clients", type=int, default=100,
+                       help="Количество клиентов (по умолчанию: 100)")
+    parser.add_argument("--messages", type=int, default=2000,
+                       help="Количество рассылок (по умолчанию: 2000)")
+    parser.add_argument("--payload-size", type=int, default=64,
+                       help="Размер заполнения рассылки в байтах (по умолчанию: 64)")
+    parser.add_argument("--rate", type=float, default=0.0,
+                       help="Рассылок в секунду (по умолчанию: 0 - так быстро, как возможно)")
+    parser.add_argument("--timeout", type=float, default=60.0,
+                       help="Максимальное время ожидания доставки в секундах (по умолчанию: 60)")
+    parser.add_argument("--host", type=str, default="127.0.0.1",
+                       help="Локальный адрес сервера (по умолчанию: 127.0.0.1)")
+    parser.add_argument("--result-json", type=str, default=None,
+                       help="Сохранить результаты в JSON файл")
+
+    args = parser.parse_args()
+
+    worker_counts = parse_int_list(args.workers) if args.workers else list(range(1, (os.cpu_count() or 1) + 1))
+    print(f"\n{'='*60}")
+    print(f"Замер рассылки через шину: воркеры {', '.join(str(count) for count in worker_counts)}")
+    print(f"Клиентов: {args.clients}, рассылок: {args.messages}, заполнение: {args.payload_size} байт"
+          + (f", {args.rate:g} рассылок/сек" if args.rate > 0 else ""))
+    print(f"{'='*60}\n")
+
+    results = []
+    try:
+        for workers in worker_counts:
+            result = asyncio.run(run_point(workers, args.host, args.clients, args.messages, args.payload_size,
+                                           args.rate, args.timeout))
+            print(f"Воркеров: {workers}: доставлено {result['delivered']} из {result['expected']}, "
+                  f"{result['rate']:.0f} сообщений/сек, p99 {result['p99_ms']:.2f} мс")
+            results.append(result)
+    except KeyboardInterrupt:
+        return 1
+
+    print_results(results)
+    if args.result_json:
+        with open(args.result_json, "w", encoding="utf-8") as f:
+            json.dump({"cpu_count": os.cpu_count(), "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.result_json}")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -5,13 +5,184 @@ import websocket
 import threading
 import time
 import argparse
+import asyncio
 from keyboard_input import KeyboardInputHandler
+from ws_protocol import (encode_frame, decode_header, encode_ack_request, parse_text_ack, text_ack_sequence,
+                         AckTracker, ACK_EVERY, ACK_MODES, MSG_START, MSG_DATA, MSG_END, MSG_ACK,
+                         BENCHMARK_DATA_PREFIX, BENCHMARK_ACK_PREFIX, BENCHMARK_TEXT)
+from ws_histogram import RttTracker
+from ws_loadgen import LoadGenerator
+from ws_storm import ConnectionStorm
+from ws_distributed import Coordinator, run_worker, parse_address
+from ws_schedule import SendSchedule, add_rate_arguments, ARRIVAL_UNIFORM
+from ws_compression import add_compression_arguments, client_options_from_args, COMPRESSION_DEFLATE
+from ws_stream import (MappedSource, FragmentSink, encode_client_frame, parse_stream_command, memory_usage,
+                       format_mb, stream_rate, STREAM_COMMAND, UPLOAD_COMMAND, DEFAULT_FRAGMENT_SIZE)
+from ws_session import Backoff, SessionTracker
+
+# Учет RTT по эхо-ответам сервера (создается на время замера)
+rtt_tracker = None
+# Последнее накопительное подтверждение сервера (режим coalesced)
+server_acked = 0
+# Устанавливается в on_open, сбрасывается в on_close: ожидание подключения без опроса
+connected_event = threading.Event()
+# Переподключение: остановка (закрытие клиентом), отказ после --reconnect-attempts попыток подряд
+reconnect_stop = threading.Event()
+connection_failed = threading.Event()
+open_count = 0
+# Сессия server-sender.py с продолжением после переподключения (--session, см. ws_session.py)
+session_tracker = None
+# Прием исходящих сообщений server-sender.py с подтверждениями (создается на время замера)
+ack_tracker = None
+# Подтверждения отправляются из потока приема и из основного потока (по таймеру)
+ack_lock = threading.Lock()
+ack_count = 0
+receive_done = threading.Event()
+# Потоковый прием от server-sender.py: фрагменты пишутся в download_sink по мере прихода
+download_sink = None
+download_expected = None
+download_done = threading.Event()
+# Ответ server-bench.py на потоковую загрузку: (принято байт, время приема в мкс)
+upload_reply = None
+upload_done = threading.Event()
+
+
+def send_ack(ws):
+    """Отправляет накопительное подтверждение доставки (вызывать под ack_lock)"""
+    global ack_count
+    ack = ack_tracker.make_ack()
+    if isinstance(ack, bytes):
+        ws.send(ack, opcode=websocket.ABNF.OPCODE_BINARY)
+    else:
+        ws.send(ack)
+    ack_count += 1
+
+
+def on_receive_message(ws, message) -> bool:
+    """
+    Учитывает сообщение замера приема и подтверждает доставку
+
+    Returns:
+        True, если сообщение относится к замеру приема
+    """
+    if isinstance(message, bytes):
+        header = decode_header(message)
+        if header is None:
+            return False
+        msg_type = header[0]
+        sequence = header[2]
+    elif message.startswith(BENCHMARK_DATA_PREFIX):
+        msg_type, sequence = MSG_DATA, None
+    elif message.startswith("__BENCHMARK_END__"):
+        msg_type, sequence = MSG_END, None
+    else:
+        return False
+    with ack_lock:
+        if msg_type == MSG_DATA:
+            if ack_tracker.on_data(sequence):
+                send_ack(ws)
+        elif msg_type == MSG_END:
+            # Окончательное подтверждение: отправитель считает по нему время доставки
+            send_ack(ws)
+            receive_done.set()
+    return True
+
+
+def on_download_fragment(data, fin: bool = False):
+    """Записывает фрагмент потокового приема; последний фрагмент завершает прием"""
+    download_sink.write(data)
+    if fin or (download_expected is not None and download_sink.received >= download_expected):
+        download_done.set()
+
+
+def on_cont_message(ws, data, fin):
+    """Вызывается для продолжения фрагментированного сообщения (только при потоковом приеме)"""
+    if download_sink is not None:
+        on_download_fragment(data, fin)
+
+
+def on_stream_message(message) -> bool:
+    """
+    Обрабатывает ответы на команды потоковой передачи
+
+    Returns:
+        True, если сообщение относится к потоковой передаче
+    """
+    global download_expected, upload_reply
+    if download_sink is not None and isinstance(message, bytes):
+        # Первый фрагмент сообщения (или сообщение целиком, если оно не фрагментировано)
+        on_download_fragment(message, download_expected is None or len(message) == 0)
+        return True
+    if isinstance(message, bytes):
+        return False
+    if download_sink is not None:
+        request = parse_stream_command(message, STREAM_COMMAND)
+        if request is not None:
+            download_expected = request[0]
+            if download_expected == 0:
+                # Пустое сообщение придет одним кадром
+                download_expected = None
+            return True
+    request = parse_stream_command(message, UPLOAD_COMMAND)
+    if request is not None and len(request) == 2:
+        upload_reply = request
+        upload_done.set()
+        return True
+    return False
+
+
+def record_text_echo(message):
+    """Извлекает номер из эха "__BENCHMARK_DATA__<номер>:..." и записывает RTT"""
+    start = message.find(BENCHMARK_DATA_PREFIX) + len(BENCHMARK_DATA_PREFIX)
+    end = message.find(":", start)
+    if end <= start:
+        return
+    try:
+        sequence = int(message[start:end])
+    except ValueError:
+        return
+    rtt_tracker.on_echo(sequence, time.monotonic_ns())
 
 
 def on_message(ws, message):
     """Вызывается при получении сообщения от сервера"""
+    global server_acked
+    if session_tracker is not None:
+        if isinstance(message, str):
+            notice = session_tracker.on_reply(message)
+            if notice is not None:
+                print(notice)
+                return
+        message = session_tracker.on_message(message)
+        if message is None:
+            return
+    if ack_tracker is not None and on_receive_message(ws, message):
+        return
+    if on_stream_message(message):
+        return
     # Не выводим сообщения бенчмарка, чтобы не засорять консоль
-    if "__BENCHMARK_DATA__" in message:
+    if isinstance(message, bytes):
+        header = decode_header(message)
+        if header is not None:
+            # Эхо, короткий ответ или подтверждение двоичного кадра: время отправки берем из заголовка
+            if rtt_tracker and header[0] in (MSG_DATA, MSG_ACK):
+                rtt_tracker.record_ns(time.monotonic_ns() - header[3])
+            if header[0] == MSG_ACK:
+                server_acked = header[2]
+            return
+        message = message.decode('utf-8', errors='replace')
+    if message.startswith(BENCHMARK_ACK_PREFIX):
+        # Накопительное подтверждение: RTT по последнему подтвержденному сообщению
+        acked = parse_text_ack(message)
+        if acked is not None:
+            server_acked = acked
+        sequence = text_ack_sequence(message)
+        if rtt_tracker and sequence is not None:
+            rtt_tracker.on_echo(sequence, time.monotonic_ns())
+        return
+    if BENCHMARK_DATA_PREFIX in message:
+        if rtt_tracker:
+            record_text_echo(message)
         return
     print(f"Получено от сервера: {message}")
 
@@ -23,30 +194,132 @@ def on_error(ws, error):
 
 def on_close(ws, close_status_code, close_msg):
     """Вызывается при закрытии соединения"""
+    connected_event.clear()
     print("Соединение закрыто")
 
 
 def on_open(ws):
     """Вызывается при открытии соединения"""
-    print("Подключено к серверу!")
-    
-    # Отправляем тестовое сообщение
-    ws.send("Привет от клиента!")
-    
+    global open_count
+    open_count += 1
+    if open_count == 1:
+        print("Подключено к серверу!")
+        # Отправляем тестовое сообщение
+        ws.send("Привет от клиента!")
+    else:
+        print(f"Переподключено к серверу (подключение №{open_count})")
+    # Сессия открывается или продолжается до любых других сообщений
+    if session_tracker is not None:
+        ws.send(session_tracker.open_command())
+    connected_event.set()
+
+
+class Connection:
+    """
+    Соединение клиента с переподключением
+
+    WebSocketApp из websocket-client одноразовый: после неудачной попытки
+    повторный run_forever() падает с "socket is already opened". Поэтому на
+    каждую попытку создается новый WebSocketApp, а остальной код работает
+    с текущим через этот объект (send, close, sock).
+    """
+
+    __slots__ = ("factory", "app")
 
-def run_benchmark(ws, duration, interval):
+    def __init__(self, factory):
+        """
+        Args:
+            factory: Создает новый WebSocketApp
+        """
+        self.factory = factory
+        self.app = factory()
+
+    def __getattr__(self, name):
+        return getattr(self.app, name)
+
+
+def run_connection(ws: Connection, backoff: Backoff, max_attempts: int):
+    """
+    Поток соединения: после обрыва или неудачной попытки подключается снова
+    с задержкой backoff, пока клиент не закроет соединение (reconnect_stop)
+
+    Переподключение - только после хотя бы одного удачного подключения:
+    если не удалась первая попытка (неверный URL, сервер не запущен),
+    клиент сразу завершается с ошибкой.
+
+    Args:
+        ws: Соединение клиента
+        backoff: Задержки между попытками
+        max_attempts: Попыток переподключения подряд до отказа (connection_failed);
+            0 - не переподключаться
+    """
+    attempt = 0
+    try:
+        while not reconnect_stop.is_set():
+            opened = open_count
+            ws.app.run_forever()
+            if reconnect_stop.is_set():
+                break
+            if open_count > opened:
+                backoff.reset()
+                attempt = 0
+            if open_count == 0 or attempt >= max_attempts:
+                break
+            attempt += 1
+            delay = backoff.next_delay()
+            print(f"Переподключение через {delay:.1f} с (попытка {attempt} из {max_attempts})...")
+            if reconnect_stop.wait(delay):
+                break
+            ws.app = ws.factory()
+    except Exception as e:
+        print(f"Ошибка соединения: {e}")
+    finally:
+        # Основной поток ждет подключения или отказа: поток не должен завершиться молча
+        if not reconnect_stop.is_set():
+            connection_failed.set()
+
+
+def close_connection(ws):
+    """Закрывает соединение без переподключения"""
+    reconnect_stop.set()
+    ws.close()
+
+
+def run_benchmark(ws, duration, interval, binary=False, histogram_file=None,
+                  ack_mode=None, ack_every=64, ack_interval=0.05, target_rate=0.0, arrival=ARRIVAL_UNIFORM):
     """
     Запускает замер производительности: отправка сообщений в цикле
     
+    Если сервер отвечает на сообщения (server.py, server-bench.py --echo или
+    --ack-mode), по ответам считается RTT и выводятся процентили задержки.
+    
     Args:
         ws: WebSocket соединение
         duration: Длительность теста в секундах
         interval: Интервал для вывода статистики в секундах
+        binary: Отправлять двоичные кадры (ws_protocol) вместо текстовых меток
+        histogram_file: Файл для сохранения полной гистограммы RTT (формат .hgrm)
+        ack_mode: Запросить у сервера режим подтверждения (ACK_*); None - режим сервера
+        ack_every: Режим coalesced: подтверждать каждые ack_every сообщений
+        ack_interval: Режим coalesced: подтверждать не реже чем раз в ack_interval секунд
+        target_rate: Открытый цикл: отправлять target_rate сообщений в секунду по
+            расписанию arrival (ws_schedule.py), RTT - от запланированного времени;
+            0 - отправлять в цикле как можно быстрее
+        arrival: Расписание отправки (ARRIVAL_UNIFORM / ARRIVAL_POISSON)
     """
+    global rtt_tracker, server_acked
+    rtt_tracker = RttTracker()
+    server_acked = 0
+
     print(f"\n{'='*60}")
     print("Запуск замера производительности")
     print(f"Длительность: {duration} секунд")
     print(f"Интервал статистики: {interval} секунд")
+    print(f"Формат сообщений: {'двоичный' if binary else 'текстовый'}")
+    if ack_mode:
+        print(f"Режим подтверждения: {ack_mode}")
+    if target_rate > 0:
+        print(f"Открытый цикл ({arrival}): {target_rate:g} сообщений/сек")
     print(f"{'='*60}\n")
     
     start_time = time.time()
@@ -55,18 +328,40 @@ def run_benchmark(ws, duration, interval):
     interval_start = start_time
     interval_count = 0
     
-    test_message = "__BENCHMARK_DATA__Тестовое сообщение для замера производительности"
+    test_payload = BENCHMARK_TEXT.encode('utf-8')
     
     # Отправляем метку начала замера
     if ws.sock and ws.sock.connected:
-        ws.send("__BENCHMARK_START__")
+        if ack_mode:
+            start = encode_ack_request(ack_mode, ack_every, int(ack_interval * 1000), binary)
+            ws.send(start, opcode=websocket.ABNF.OPCODE_BINARY if binary else websocket.ABNF.OPCODE_TEXT)
+        elif binary:
+            ws.send(encode_frame(MSG_START, 0, 0), opcode=websocket.ABNF.OPCODE_BINARY)
+        else:
+            ws.send("__BENCHMARK_START__")
     
     print("Начало отправки сообщений...\n")
     
+    schedule = SendSchedule(target_rate, arrival) if target_rate > 0 else None
     while time.time() < end_time:
+        if schedule is not None:
+            # Открытый цикл: ждем только если опережаем расписание
+            sent_ns = schedule.take()
+            delay = schedule.delay(sent_ns)
+            if delay > 0:
+                time.sleep(delay)
+                if time.time() >= end_time:
+                    break
+        else:
+            sent_ns = time.monotonic_ns()
         if ws.sock and ws.sock.connected:
             try:
-                ws.send(test_message)
+                if binary:
+                    ws.send(encode_frame(MSG_DATA, 0, message_count, test_payload, sent_ns),
+                            opcode=websocket.ABNF.OPCODE_BINARY)
+                else:
+                    rtt_tracker.on_sent(message_count, sent_ns)
+                    ws.send(f"{BENCHMARK_DATA_PREFIX}{message_count}:{BENCHMARK_TEXT}")
                 message_count += 1
                 interval_count += 1
             except Exception as e:
@@ -84,15 +379,22 @@ def run_benchmark(ws, duration, interval):
             print(f"[{current_time - start_time:.1f}с] "
                   f"Отправлено: {interval_count} сообщений за {elapsed:.1f}с "
                   f"({rate:.2f} сообщений/сек)")
+            interval_histogram = rtt_tracker.take_interval()
+            if interval_histogram.total_count:
+                print(f"         RTT: {interval_histogram.format_summary()}")
             interval_start = current_time
             interval_count = 0
         
-        # Небольшая задержка, чтобы не перегружать систему
-        time.sleep(0.001)
+        # Небольшая задержка, чтобы не перегружать систему (открытый цикл ждет по расписанию)
+        if schedule is None:
+            time.sleep(0.001)
     
     # Отправляем метку окончания замера
     if ws.sock and ws.sock.connected:
-        ws.send("__BENCHMARK_END__")
+        if binary:
+            ws.send(encode_frame(MSG_END, 0, message_count), opcode=websocket.ABNF.OPCODE_BINARY)
+        else:
+            ws.send("__BENCHMARK_END__")
     
     # Финальная статистика
     total_time = time.time() - start_time
@@ -103,6 +405,204 @@ def run_benchmark(ws, duration, interval):
     print(f"Всего отправлено: {message_count} сообщений")
     print(f"Общее время: {total_time:.2f} секунд")
     print(f"Средняя скорость: {total_rate:.2f} сообщений/секунду")
+    if schedule is not None:
+        print(f"Целевая скорость: {target_rate:.2f} сообщений/секунду, достигнуто {total_rate / target_rate * 100:.1f}%")
+        print(f"Наибольшее отставание от расписания: {schedule.max_lag_ns / 1e6:.1f} мс")
+        print("RTT считается от запланированного времени отправки")
+    
+    # Даем серверу время вернуть эхо на последние сообщения
+    time.sleep(0.2)
+    total_histogram = rtt_tracker.total_histogram
+    if server_acked:
+        print(f"Подтверждено сервером: {server_acked} сообщений")
+    if total_histogram.total_count:
+        print(f"Получено эхо-ответов: {total_histogram.total_count}")
+        print(f"RTT: {total_histogram.format_summary()}")
+        print(f"RTT среднее: {total_histogram.mean() / 1000:.3f} мс")
+        if histogram_file:
+            total_histogram.dump(histogram_file)
+            print(f"Гистограмма RTT сохранена в {histogram_file}")
+    else:
+        print("Эхо-ответы не получены, RTT не измерен")
+    print(f"{'='*60}\n")
+
+
+def run_receive(ws, num_messages, interval, binary=False, ack_every=64, ack_interval=0.05):
+    """
+    Замер приема: запрашивает у server-sender.py num_messages сообщений и
+    подтверждает доставку, чтобы сервер измерил скорость доставки, а не
+    скорость записи в свой буфер (см. ws_protocol.py)
+
+    Args:
+        ws: WebSocket соединение
+        num_messages: Количество запрашиваемых сообщений
+        interval: Интервал для вывода статистики в секундах
+        binary: Двоичная команда запуска и подтверждения
+        ack_every: Подтверждать каждые ack_every сообщений
+        ack_interval: Подтверждать по таймеру не реже чем раз в ack_interval секунд
+    """
+    global ack_tracker
+    ack_tracker = AckTracker(ack_every, ack_interval, binary)
+    receive_done.clear()
+
+    print(f"\n{'='*60}")
+    print("Запуск замера приема")
+    print(f"Запрошено сообщений: {num_messages}")
+    print(f"Подтверждение: каждые {ack_every} сообщений и не реже чем раз в {ack_interval * 1000:g} мс")
+    print(f"Формат сообщений: {'двоичный' if binary else 'текстовый'}")
+    print(f"{'='*60}\n")
+
+    start_time = time.time()
+    if binary:
+        ws.send(encode_frame(MSG_START, 0, num_messages, ACK_EVERY.pack(ack_every)),
+                opcode=websocket.ABNF.OPCODE_BINARY)
+    else:
+        ws.send(f"__BENCHMARK_START__:{num_messages}:{ack_every}")
+
+    interval_start = start_time
+    interval_received = 0
+    # Таймер подтверждений проверяем чаще, чем выводим статистику
+    poll = min(ack_interval, interval) / 2
+    while not receive_done.wait(poll):
+        if not (ws.sock and ws.sock.connected):
+            print("Соединение потеряно!")
+            break
+        with ack_lock:
+            if ack_tracker.is_due(time.monotonic_ns()):
+                send_ack(ws)
+        current_time = time.time()
+        if current_time - interval_start >= interval:
+            elapsed = current_time - interval_start
+            received = ack_tracker.received - interval_received
+            print(f"[{current_time - start_time:.1f}с] "
+                  f"Принято: {received} сообщений за {elapsed:.1f}с "
+                  f"({received / elapsed:.2f} сообщений/сек), подтверждено: {ack_tracker.acked}")
+            interval_start = current_time
+            interval_received = ack_tracker.received
+
+    total_time = time.time() - start_time
+    received = ack_tracker.received
+    print(f"\n{'='*60}")
+    print("Замер приема завершен!")
+    print(f"Принято: {received} из {num_messages} сообщений")
+    print(f"Общее время: {total_time:.2f} секунд")
+    print(f"Скорость приема: {received / total_time if total_time > 0 else 0:.2f} сообщений/секунду")
+    print(f"Отправлено подтверждений: {ack_count}")
+    print(f"{'='*60}\n")
+    ack_tracker = None
+
+
+def run_download(ws, size, fragment_size, output=None, interval=1.0):
+    """
+    Потоковый прием: запрашивает у server-sender.py сообщение размером size байт
+    (или его файл --stream-file) фрагментами по fragment_size и пишет фрагменты
+    в файл по мере прихода, не собирая сообщение в памяти (см. ws_stream.py)
+
+    Args:
+        ws: WebSocket соединение (WebSocketApp с on_cont_message)
+        size: Запрашиваемый размер в байтах
+        fragment_size: Размер фрагмента в байтах
+        output: Файл для принятых данных (None - только считать байты)
+        interval: Интервал для вывода статистики в секундах
+    """
+    global download_sink, download_expected
+    download_expected = None
+    download_done.clear()
+    sink = FragmentSink(output)
+    download_sink = sink
+
+    print(f"\n{'='*60}")
+    print("Запуск потокового приема")
+    print(f"Запрошено: {format_mb(size)}, фрагмент: {fragment_size} байт")
+    print(f"Принятые данные: {output or 'не сохраняются'}")
+    print(f"{'='*60}\n")
+
+    peak_rss, peak_anon = memory_usage()
+    start_time = time.time()
+    ws.send(f"{STREAM_COMMAND}:{size}:{fragment_size}")
+    interval_start = start_time
+    interval_received = 0
+    while not download_done.wait(min(interval, 0.05)):
+        rss, anon = memory_usage()
+        peak_rss, peak_anon = max(peak_rss, rss), max(peak_anon, anon)
+        if not (ws.sock and ws.sock.connected):
+            print("Соединение потеряно!")
+            break
+        current_time = time.time()
+        if current_time - interval_start >= interval:
+            elapsed = current_time - interval_start
+            received = sink.received - interval_received
+            print(f"[{current_time - start_time:.1f}с] Принято: {format_mb(received)} за {elapsed:.1f}с "
+                  f"({stream_rate(received, elapsed):.1f} МБ/сек)")
+            interval_start = current_time
+            interval_received = sink.received
+    total_time = time.time() - start_time
+    download_sink = None
+    sink.close()
+    rss, anon = memory_usage()
+    peak_rss, peak_anon = max(peak_rss, rss), max(peak_anon, anon)
+
+    print(f"\n{'='*60}")
+    print("Потоковый прием завершен!")
+    print(f"Принято: {format_mb(sink.received)} ({sink.received} байт), фрагментов: {sink.fragments}")
+    print(f"Общее время: {total_time:.2f} секунд")
+    print(f"Скорость: {stream_rate(sink.received, total_time):.1f} МБ/сек")
+    print(f"Пиковая память: RSS {format_mb(peak_rss)}, анонимная {format_mb(peak_anon)}")
+    print(f"{'='*60}\n")
+
+
+def run_upload(ws, path, fragment_size, timeout=60.0):
+    """
+    Потоковая загрузка: отправляет файл server-bench.py (--accept-uploads) одним
+    фрагментированным сообщением из отображения файла в память (см. ws_stream.py)
+
+    Args:
+        ws: WebSocket соединение
+        path: Путь к файлу
+        fragment_size: Размер фрагмента в байтах
+        timeout: Сколько секунд ждать ответа сервера после отправки
+    """
+    with MappedSource(path) as source:
+        size = len(source)
+        print(f"\n{'='*60}")
+        print("Запуск потоковой загрузки")
+        print(f"Файл: {path} ({format_mb(size)}), фрагмент: {fragment_size} байт")
+        print(f"{'='*60}\n")
+
+        upload_done.clear()
+        peak_rss, peak_anon = memory_usage()
+        start_time = time.time()
+        ws.send(f"{UPLOAD_COMMAND}:{size}")
+        opcode = websocket.ABNF.OPCODE_BINARY
+        sent = 0
+        # Маскированная копия - только текущего фрагмента, файл целиком в память не читается
+        fragments = source.fragments(fragment_size) if size else (b"",)
+        for fragment in fragments:
+            sent += len(fragment)
+            header, payload = encode_client_frame(opcode, fragment, sent >= size)
+            # Кадры сообщения идут подряд: под блокировкой отправки websocket-client
+            with ws.sock.lock:
+                ws.sock.sock.sendall(header)
+                ws.sock.sock.sendall(payload)
+            opcode = websocket.ABNF.OPCODE_CONT
+            rss, anon = memory_usage()
+            peak_rss, peak_anon = max(peak_rss, rss), max(peak_anon, anon)
+        send_time = time.time() - start_time
+        if not upload_done.wait(timeout):
+            print("Сервер не подтвердил прием (запущен ли server-bench.py с --accept-uploads?)")
+        total_time = time.time() - start_time
+
+    print(f"\n{'='*60}")
+    print("Потоковая загрузка завершена!")
+    print(f"Отправлено: {format_mb(sent)} за {send_time:.2f} секунд "
+          f"({stream_rate(sent, send_time):.1f} МБ/сек)")
+    if upload_reply is not None:
+        received, receive_us = upload_reply
+        print(f"Принято сервером: {format_mb(received)} за {receive_us / 1_000_000:.2f} секунд "
+              f"({stream_rate(received, receive_us / 1_000_000):.1f} МБ/сек)")
+    print(f"Общее время (до ответа сервера): {total_time:.2f} секунд "
+          f"({stream_rate(sent, total_time):.1f} МБ/сек)")
+    print(f"Пиковая память: RSS {format_mb(peak_rss)}, анонимная {format_mb(peak_anon)}")
     print(f"{'='*60}\n")
 
 
@@ -117,42 +617,206 @@ if __name__ == "__main__":
                        help="Интервал для вывода статистики в секундах (по умолчанию: 1)")
     parser.add_argument("--url", type=str, default="ws://127.0.0.1:8765",
                        help="URL WebSocket сервера (по умолчанию: ws://127.0.0.1:8765)")
+    parser.add_argument("--binary", action="store_true",
+                       help="Использовать двоичный формат кадров бенчмарка (см. ws_protocol.py)")
+    parser.add_argument("--histogram-file", type=str, default=None,
+                       help="Сохранить полную гистограмму RTT в файл (формат .hgrm)")
+    parser.add_argument("--loadgen", action="store_true",
+                       help="Асинхронный генератор нагрузки на несколько подключений (вместо одного потока)")
+    parser.add_argument("--connections", type=int, default=1,
+                       help="Количество подключений генератора нагрузки или одновременных попыток "
+                            "замера подключений (по умолчанию: 1)")
+    parser.add_argument("--inflight", type=int, default=0,
+                       help="Максимум неподтвержденных сообщений на подключение, 0 - без ограничения (по умолчанию: 0)")
+    parser.add_argument("--workers", type=int, default=1,
+                       help="Генератор нагрузки: количество локальных процессов-воркеров; больше 1 - "
+                            "распределенный замер с координатором, --connections делятся между воркерами "
+                            "(по умолчанию: 1)")
+    parser.add_argument("--remote-workers", type=int, default=0,
+                       help="Генератор нагрузки: ждать столько воркеров, запущенных вручную с --worker-of "
+                            "(по умолчанию: 0)")
+    parser.add_argument("--coordinator", type=str, default="127.0.0.1:0",
+                       help="Адрес HOST:PORT, на котором координатор ждет воркеров, порт 0 - любой свободный "
+                            "(по умолчанию: 127.0.0.1:0)")
+    parser.add_argument("--worker-of", type=str, default=None,
+                       help="Работать воркером координатора HOST:PORT (сценарий задает координатор)")
+    parser.add_argument("--storm", action="store_true",
+                       help="Замер подключений: открывать подключения как можно быстрее или с частотой --storm-rate, "
+                            "не больше --connections одновременных попыток")
+    parser.add_argument("--storm-rate", type=float, default=0.0,
+                       help="Частота попыток подключения в секунду, 0 - как можно быстрее (по умолчанию: 0)")
+    parser.add_argument("--storm-total", type=int, default=0,
+                       help="Количество попыток подключения, 0 - до конца --duration (по умолчанию: 0)")
+    parser.add_argument("--keep-open", action="store_true",
+                       help="Замер подключений: не закрывать подключения до конца замера")
+    parser.add_argument("--connect-timeout", type=float, default=5.0,
+                       help="Таймаут попытки подключения в секундах (по умолчанию: 5)")
+    parser.add_argument("--receive", type=int, default=0,
+                       help="Замер приема: запросить у server-sender.py N сообщений и подтверждать доставку")
+    parser.add_argument("--ack-mode", choices=ACK_MODES, default=None,
+                       help="Запросить у сервера режим ответа на сообщения замера: none, echo, compact "
+                            "или coalesced (по умолчанию: режим сервера)")
+    parser.add_argument("--ack-every", type=int, default=64,
+                       help="Подтверждать доставку каждые K принятых сообщений (--receive) или запросить "
+                            "у сервера подтверждение каждые K сообщений (--ack-mode coalesced) (по умолчанию: 64)")
+    parser.add_argument("--ack-interval", type=float, default=50.0,
+                       help="Подтверждать по таймеру не реже чем раз в T мс (--receive, --ack-mode coalesced) "
+                            "(по умолчанию: 50)")
+    parser.add_argument("--download", type=int, default=0,
+                       help="Потоковый прием: запросить у server-sender.py сообщение из N байт фрагментами")
+    parser.add_argument("--output", type=str, default=None,
+                       help="Файл для данных потокового приема (по умолчанию: только считать байты)")
+    parser.add_argument("--upload", type=str, default=None,
+                       help="Потоковая загрузка файла в server-bench.py --accept-uploads")
+    parser.add_argument("--fragment-size", type=int, default=DEFAULT_FRAGMENT_SIZE,
+                       help=f"Размер фрагмента потоковой передачи в байтах (по умолчанию: {DEFAULT_FRAGMENT_SIZE})")
+    parser.add_argument("--reconnect-attempts", type=int, default=10,
+                       help="Попыток переподключения подряд до отказа после обрыва (первое подключение "
+                            "не повторяется), 0 - не переподключаться (по умолчанию: 10)")
+    parser.add_argument("--reconnect-delay", type=float, default=0.5,
+                       help="Начальная задержка переподключения в секундах, удваивается с каждой попыткой "
+                            "(по умолчанию: 0.5)")
+    parser.add_argument("--reconnect-max-delay", type=float, default=30.0,
+                       help="Наибольшая задержка переподключения в секундах (по умолчанию: 30)")
+    parser.add_argument("--session", action="store_true",
+                       help="Открыть сессию server-sender.py и после переподключения получить пропущенные "
+                            "сообщения рассылки (см. ws_session.py)")
+    add_rate_arguments(parser)
+    # Сжатие поддерживают только асинхронные режимы: websocket-client не умеет permessage-deflate.
+    # Без значения по умолчанию явный --compression deflate виден и в режимах WebSocketApp.
+    add_compression_arguments(parser)
+    parser.set_defaults(compression=None)
     
     args = parser.parse_args()
     
+    if args.storm or args.worker_of or args.loadgen:
+        if args.compression is None:
+            args.compression = COMPRESSION_DEFLATE
+    else:
+        ignored = [f"--{name.replace('_', '-')}" for name in ("window_bits", "mem_level", "compression_level")
+                   if getattr(args, name) != parser.get_default(name)]
+        if args.compression == COMPRESSION_DEFLATE:
+            ignored.insert(0, "--compression deflate")
+        if ignored:
+            parser.error(f"{', '.join(ignored)}: сжатие permessage-deflate поддерживают только --loadgen и "
+                         "--storm (websocket-client его не умеет)")
+    
     # URL WebSocket сервера
     ws_url = args.url
     
-    # Создаем WebSocket соединение
-    ws = websocket.WebSocketApp(
+    # Замер подключений и асинхронный генератор нагрузки работают без WebSocketApp
+    if args.storm:
+        storm = ConnectionStorm(ws_url, args.connections, args.storm_rate, args.storm_total, args.keep_open,
+                                args.connect_timeout, client_options_from_args(args))
+        try:
+            histogram = asyncio.run(storm.run(args.duration, args.interval))
+        except KeyboardInterrupt:
+            exit(0)
+        if args.histogram_file and histogram.total_count:
+            histogram.dump(args.histogram_file)
+            print(f"Гистограмма задержки подключения сохранена в {args.histogram_file}")
+        exit(0)
+    
+    if args.worker_of:
+        address = parse_address(args.worker_of)
+        if not address:
+            print(f"Ошибка: неверный адрес координатора: {args.worker_of}")
+            exit(1)
+        print(f"Воркер: подключение к координатору {args.worker_of}...")
+        try:
+            completed = asyncio.run(run_worker(*address))
+        except KeyboardInterrupt:
+            exit(0)
+        except OSError as e:
+            print(f"Ошибка связи с координатором: {e}")
+            exit(1)
+        exit(0 if completed else 1)
+    
+    if args.loadgen and (args.workers != 1 or args.remote_workers > 0):
+        address = parse_address(args.coordinator)
+        if not address:
+            print(f"Ошибка: неверный адрес координатора: {args.coordinator}")
+            exit(1)
+        scenario = {
+            'url': ws_url, 'connections': args.connections, 'inflight': args.inflight, 'binary': args.binary,
+            'compression': [args.compression, args.window_bits, args.mem_level, args.compression_level],
+            'ack_mode': args.ack_mode, 'ack_every': args.ack_every, 'ack_interval': args.ack_interval / 1000,
+            'rate': args.rate, 'rate_total': args.rate_total, 'arrival': args.arrival,
+            'duration': args.duration, 'interval': args.interval,
+        }
+        coordinator = Coordinator(scenario, max(0, args.workers), args.remote_workers, *address)
+        try:
+            histogram = asyncio.run(coordinator.run())
+        except KeyboardInterrupt:
+            exit(0)
+        if args.histogram_file and histogram.total_count:
+            histogram.dump(args.histogram_file)
+            print(f"Гистограмма RTT сохранена в {args.histogram_file}")
+        exit(0)
+    
+    if args.loadgen:
+        generator = LoadGenerator(ws_url, args.connections, args.inflight, args.binary,
+                                  client_options_from_args(args), ack_mode=args.ack_mode,
+                                  ack_every=args.ack_every, ack_interval=args.ack_interval / 1000,
+                                  rate=args.rate, rate_total=args.rate_total, arrival=args.arrival)
+        try:
+            histogram = asyncio.run(generator.run(args.duration, args.interval))
+        except KeyboardInterrupt:
+            exit(0)
+        if args.histogram_file and histogram.total_count:
+            histogram.dump(args.histogram_file)
+            print(f"Гистограмма RTT сохранена в {args.histogram_file}")
+        exit(0)
+    
+    # Создаем WebSocket соединение (новый WebSocketApp на каждую попытку подключения)
+    ws = Connection(lambda: websocket.WebSocketApp(
         ws_url,
         on_open=on_open,
         on_message=on_message,
         on_error=on_error,
-        on_close=on_close
-    )
+        on_close=on_close,
+        # Фрагменты передаются по одному только при потоковом приеме, иначе сообщение собирается целиком
+        on_cont_message=on_cont_message if args.download else None
+    ))
+    
+    if args.session:
+        session_tracker = SessionTracker()
     
-    # Запускаем WebSocket в отдельном потоке
-    ws_thread = threading.Thread(target=ws.run_forever, daemon=True)
+    # Запускаем WebSocket в отдельном потоке; после обрыва он переподключается сам
+    backoff = Backoff(args.reconnect_delay, args.reconnect_max_delay)
+    ws_thread = threading.Thread(target=run_connection, args=(ws, backoff, args.reconnect_attempts), daemon=True)
     ws_thread.start()
     
     print(f"Подключение к {ws_url}...")
     
-    # Ждем установления соединения
-    connection_timeout = 5
-    start_wait = time.time()
-    while not (ws.sock and ws.sock.connected):
-        if time.time() - start_wait > connection_timeout:
+    # Ждем установления соединения (on_open), время до него выводим
+    start_wait = time.perf_counter()
+    while not connected_event.wait(0.1):
+        if connection_failed.is_set():
             print("Ошибка: не удалось установить соединение")
-            ws.close()
+            close_connection(ws)
             exit(1)
-        time.sleep(0.1)
+    print(f"Подключение установлено за {(time.perf_counter() - start_wait) * 1000:.1f} мс")
     
+    # Потоковая передача больших сообщений фрагментами
+    if args.download or args.upload:
+        if args.download:
+            run_download(ws, args.download, args.fragment_size, args.output, args.interval)
+        if args.upload:
+            run_upload(ws, args.upload, args.fragment_size)
+        print("Закрытие соединения...")
+        close_connection(ws)
+    # Замер приема исходящих сообщений server-sender.py
+    elif args.receive:
+        run_receive(ws, args.receive, args.interval, args.binary, args.ack_every, args.ack_interval / 1000)
+        print("Закрытие соединения...")
+        close_connection(ws)
     # Если включен режим замера
-    if args.benchmark:
-        run_benchmark(ws, args.duration, args.interval)
+    elif args.benchmark:
+        run_benchmark(ws, args.duration, args.interval, args.binary, args.histogram_file,
+                      args.ack_mode, args.ack_every, args.ack_interval / 1000, args.rate, args.arrival)
         print("Закрытие соединения...")
-        ws.close()
+        close_connection(ws)
     else:
         # Обычный режим: ввод с клавиатуры
         keyboard_handler = KeyboardInputHandler()
@@ -176,5 +840,7 @@ if __name__ == "__main__":
         
         print("\nЗакрытие соединения...")
         keyboard_handler.stop()
-        ws.close()
+        close_connection(ws)
+        if session_tracker is not None:
+            print(f"Итоги: {session_tracker.summary()}")
 
@@ -0,0 +1,304 @@
+"""
+Замер памяти сервера на множестве неактивных подключений (см. ws_density.py)
+
+Для каждого режима запускает server-bench.py в отдельном процессе, открывает
+к нему все большее количество подключений (--counts) и после каждого шага
+выводит RSS сервера и память на одно подключение. Клиент - легкий
+asyncio.Protocol: только рукопожатие и ответы pong на ping сервера, поэтому
+десятки тысяч подключений помещаются в одном процессе.
+
+Режимы:
+
+    raw                 бэкенд raw, подключения в множестве, без keepalive
+    raw-density         бэкенд raw, плотный режим (таблица и колесо таймеров)
+    websockets          бэкенд websockets, keepalive на каждое подключение
+    websockets-density  бэкенд websockets, плотный режим
+
+Каждому подключению нужен дескриптор и в клиенте, и в сервере, поэтому
+скрипт поднимает мягкий предел RLIMIT_NOFILE до жесткого и пропускает
+количества сверх него. Исходящие порты одного адреса ограничены диапазоном
+ip_local_port_range, поэтому подключения распределяются по адресам
+127.0.0.x (по CONNECTIONS_PER_ADDRESS на адрес).
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import resource
+import struct
+import time
+
+from ws_stream import memory_usage, format_mb
+from ws_suite import ServerProcess, find_free_port
+from ws_compression import parse_int_list
+from ws_raw import OPCODE_CLOSE, OPCODE_PING, OPCODE_PONG
+
+MODES = {
+    "raw": ("raw", False),
+    "raw-density": ("raw", True),
+    "websockets": ("websockets", False),
+    "websockets-density": ("websockets", True),
+}
+
+# Исходящих подключений с одного локального адреса
+CONNECTIONS_PER_ADDRESS = 20000
+# Дескрипторы процесса сверх подключений (файлы, сокеты сервера, журнал)
+RESERVED_FDS = 256
+
+
+class IdleClient(asyncio.Protocol):
+    """Неактивное подключение: рукопожатие, затем только pong на ping"""
+
+    __slots__ = ("bench", "transport", "buffer", "opened")
+
+    def __init__(self, bench: "IdleBench"):
+        self.bench = bench
+        self.transport = None
+        self.buffer = b""
+        self.opened = False
+
+    def connection_made(self, transport: asyncio.Transport):
+        self.transport = transport
+        key = base64.b64encode(os.urandom(16)).decode()
+        transport.write((f"GET / HTTP/1.1\r\nHost: {self.bench.host}:{self.bench.port}\r\n"
+                         "Upgrade: websocket\r\nConnection: Upgrade\r\n"
+                         f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n").encode())
+
+    def connection_lost(self, exc):
+        if self.opened:
+            self.bench.closed += 1
+        self.transport = None
+
+    def data_received(self, data: bytes):
+        self.buffer += data
+        if not self.opened:
+            end = self.buffer.find(b"\r\n\r\n")
+            if end < 0:
+                return
+            if not self.buffer.startswith(b"HTTP/1.1 101"):
+                self.transport.abort()
+                return
+            self.opened = True
+            self.buffer = self.buffer[end + 4:]
+            self.bench.opened(self)
+        self._parse_frames()
+
+    def _parse_frames(self):
+        # Кадры сервера не маскируются; сообщения (приветствие, рассылки) пропускаются
+        buffer = self.buffer
+        while len(buffer) >= 2:
+            opcode = buffer[0] & 0x0F
+            length = buffer[1] & 0x7F
+            offset = 2
+            if length == 126:
+                if len(buffer) < 4:
+                    break
+                length = struct.unpack_from("!H", buffer, 2)[0]
+                offset = 4
+            elif length == 127:
+                if len(buffer) < 10:
+                    break
+                length = struct.unpack_from("!Q", buffer, 2)[0]
+                offset = 10
+            if len(buffer) < offset + length:
+                break
+            payload = buffer[offset:offset + length]
+            buffer = buffer[offset + length:]
+            if opcode == OPCODE_PING:
+                self.bench.pings += 1
+                self._write_frame(OPCODE_PONG, payload)
+            elif opcode == OPCODE_CLOSE:
+                self.transport.close()
+                break
+        self.buffer = buffer
+
+    def _write_frame(self, opcode: int, payload: bytes):
+        # Кадры клиента маскируются (RFC 6455); маска из нулей оставляет данные как есть
+        self.transport.write(bytes((0x80 | opcode, 0x80 | len(payload))) + b"\x00\x00\x00\x00" + payload)
+
+
+class IdleBench:
+    """Открывает и держит неактивные подключения к одному серверу"""
+
+    def __init__(self, host: str, port: int, concurrency: int):
+        """
+        Args:
+            host: Хост сервера
+            port: Порт сервера
+            concurrency: Сколько подключений открывается одновременно
+        """
+        self.host = host
+        self.port = port
+        self.concurrency = concurrency
+        self.clients = []
+        self.pings = 0
+        self.closed = 0
+        self.failed = 0
+        self.waiters = {}
+
+    def opened(self, client: IdleClient):
+        waiter = self.waiters.pop(client, None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    async def _connect_one(self, index: int):
+        loop = asyncio.get_running_loop()
+        # 127.0.0.1, 127.0.0.2, ...: у каждого адреса свой диапазон исходящих портов
+        local_host = f"127.0.0.{1 + index // CONNECTIONS_PER_ADDRESS}"
+        try:
+            _, client = await loop.create_connection(lambda: IdleClient(self), self.host, self.port,
+                                                     local_addr=(local_host, 0))
+            if not client.opened:
+                waiter = self.waiters[client] = loop.create_future()
+                await asyncio.wait_for(waiter, 30)
+        except (OSError, asyncio.TimeoutError):
+            self.failed += 1
+            return
+        self.clients.append(client)
+
+    async def connect(self, count: int):
+        """Доводит количество открытых подключений до count"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def connect_one(index: int):
+            async with semaphore:
+                await self._connect_one(index)
+
+        start = len(self.clients) + self.failed
+        await asyncio.gather(*(connect_one(index) for index in range(start, start + count - len(self.clients))))
+
+    def open_count(self) -> int:
+        return sum(1 for client in self.clients if client.transport is not None)
+
+    def close(self):
+        for client in self.clients:
+            if client.transport is not None:
+                client.transport.abort()
+        self.clients.clear()
+
+
+def raise_fd_limit() -> int:
+    """Поднимает мягкий предел дескрипторов до жесткого; возвращает его"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY:
+        hard = max(soft, 1_048_576)
+    if soft != hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+            soft = hard
+        except (ValueError, OSError):
+            pass
+    return soft
+
+
+def server_args(mode: str, ping_interval: float) -> list:
+    """Аргументы server-bench.py для режима"""
+    backend, density = MODES[mode]
+    args = ["--backend", backend, "--no-metrics", "--log-level", "connections=off"]
+    if density:
+        args += ["--density", "--ping-interval", str(ping_interval), "--ping-timeout", str(ping_interval)]
+    return args
+
+
+async def run_mode(mode: str, counts: list, host: str, concurrency: int, hold: float,
+                   ping_interval: float) -> list:
+    """Прогоняет подключения по шагам counts для одного режима"""
+    port = find_free_port(host)
+    results = []
+    with ServerProcess("server-bench.py", host, port, server_args(mode, ping_interval)) as server:
+        pid = server.process.pid
+        base_rss = memory_usage(pid)[0]
+        bench = IdleBench(host, port, concurrency)
+        try:
+            for count in counts:
+                start = time.perf_counter()
+                await bench.connect(count)
+                elapsed = time.perf_counter() - start
+                if hold > 0:
+                    await asyncio.sleep(hold)
+                rss = memory_usage(pid)[0]
+                connections = bench.open_count()
+                result = {"mode": mode, "connections": connections, "rss": rss, "base_rss": base_rss,
+                          "per_connection": (rss - base_rss) / connections if connections else 0.0,
+                          "connect_time": elapsed, "pings": bench.pings, "closed": bench.closed,
+                          "failed": bench.failed}
+                print(f"{mode}: {connections} подключений за {elapsed:.1f} сек, RSS сервера {format_mb(rss)}, "
+                      f"{result['per_connection'] / 1024:.2f} КБ на подключение, ping: {bench.pings}")
+                results.append(result)
+        finally:
+            bench.close()
+    return results
+
+
+def print_results(results: list):
+    """Итоговая таблица замера"""
+    print(f"\n{'='*60}")
+    print("Неактивные подключения: итоги")
+    print(f"{'Режим':<20}{'Подключ.':>10}{'RSS, МБ':>10}{'КБ/подкл.':>11}{'ping':>8}")
+    for result in results:
+        print(f"{result['mode']:<20}{result['connections']:>10}{result['rss'] / (1024 * 1024):>10.1f}"
+              f"{result['per_connection'] / 1024:>11.2f}{result['pings']:>8}")
+    failed = sum(result["failed"] for result in results)
+    if failed:
+        print(f"Внимание: не удалось открыть подключений: {failed}")
+    print(f"{'='*60}\n")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Замер памяти сервера на множестве неактивных подключений")
+    parser.add_argument("--modes", type=str, default=",".join(MODES),
+                       help=f"Режимы через запятую: {', '.join(MODES)} (по умолчанию: все)")
+    parser.add_argument("--counts", type=str, default="1000,10000,100000",
+                       help="Количества подключений (шаги) через запятую (по умолчанию: 1000,10000,100000)")
+    parser.add_argument("--hold", type=float, default=0.0,
+                       help="Держать подключения после каждого шага столько секунд перед замером "
+                            "(по умолчанию: 0)")
+    parser.add_argument("--ping-interval", type=float, default=5.0,
+                       help="Интервал ping плотного режима в секундах (по умолчанию: 5)")
+    parser.add_argument("--concurrency", type=int, default=200,
+                       help="Одновременно открываемых подключений (по умолчанию: 200)")
+    parser.add_argument("--host", type=str, default="127.0.0.1",
+                       help="Локальный адрес сервера (по умолчанию: 127.0.0.1)")
+    parser.add_argument("--result-json", type=str, default=None,
+                       help="Сохранить результаты в JSON файл")
+
+    args = parser.parse_args()
+
+    modes = [mode.strip() for mode in args.modes.split(",") if mode.strip()]
+    unknown = [mode for mode in modes if mode not in MODES]
+    if unknown:
+        print(f"Ошибка: неизвестные режимы: {', '.join(unknown)}")
+        return 1
+    # Предел поднимается до запуска сервера: процесс сервера его наследует
+    fd_limit = raise_fd_limit()
+    counts = sorted(parse_int_list(args.counts))
+    skipped = [count for count in counts if count > fd_limit - RESERVED_FDS]
+    counts = [count for count in counts if count not in skipped]
+    print(f"\n{'='*60}")
+    print(f"Замер неактивных подключений: {', '.join(modes)}")
+    print(f"Подключения: {', '.join(str(count) for count in counts)}")
+    if skipped:
+        print(f"Пропущены (предел дескрипторов {fd_limit}): {', '.join(str(count) for count in skipped)}")
+    print(f"{'='*60}\n")
+    if not counts:
+        return 1
+
+    results = []
+    try:
+        for mode in modes:
+            results.extend(asyncio.run(run_mode(mode, counts, args.host, args.concurrency, args.hold,
+                                                args.ping_interval)))
+    except KeyboardInterrupt:
+        return 1
+
+    print_results(results)
+    if args.result_json:
+        with open(args.result_json, "w", encoding="utf-8") as f:
+            json.dump({"fd_limit": fd_limit, "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.result_json}")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
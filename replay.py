@@ -0,0 +1,201 @@
+"""
+Воспроизведение журнала входящего трафика (server-bench.py --capture) на сервере
+
+Каждое записанное подключение открывается отдельным WebSocket соединением,
+кадры отправляются в записанном порядке и с записанными интервалами
+(1x, с ускорением или так быстро, как возможно).
+"""
+import argparse
+import asyncio
+import time
+from typing import Dict, Optional
+
+import websockets
+
+from ws_capture import read_captures, REC_TEXT, REC_BINARY, REC_OPEN, REC_CLOSE
+from ws_compression import add_compression_arguments, client_options_from_args
+
+# Максимум кадров в очереди одного подключения (ожидание при переполнении)
+CONNECTION_QUEUE = 1024
+# Как часто отдавать управление циклу событий в режиме "как можно быстрее"
+YIELD_EVERY = 256
+
+
+class ReplayStats:
+    """Счетчики воспроизведения"""
+
+    __slots__ = ("sent", "connected", "failed", "max_lag")
+
+    def __init__(self):
+        self.sent = 0
+        self.connected = 0
+        self.failed = 0
+        # Наибольшее опоздание отправки относительно расписания, сек
+        self.max_lag = 0.0
+
+
+async def drain_replies(websocket):
+    """Читает и отбрасывает ответы сервера, чтобы он не упирался в очередь приема"""
+    try:
+        async for _ in websocket:
+            pass
+    except websockets.exceptions.ConnectionClosed:
+        pass
+
+
+async def run_connection(url: str, queue: asyncio.Queue, stats: ReplayStats, connect_options: dict):
+    """Отправляет кадры одного записанного подключения до метки конца (None)"""
+    try:
+        websocket = await websockets.connect(url, max_size=None, **connect_options)
+    except (OSError, websockets.exceptions.WebSocketException) as e:
+        stats.failed += 1
+        print(f"Ошибка подключения: {e}")
+        # Освобождаем очередь, чтобы планировщик не ждал это подключение
+        while await queue.get() is not None:
+            pass
+        return
+
+    stats.connected += 1
+    reader = asyncio.create_task(drain_replies(websocket))
+    try:
+        while True:
+            message = await queue.get()
+            if message is None:
+                break
+            await websocket.send(message)
+            stats.sent += 1
+    except websockets.exceptions.ConnectionClosed:
+        print("Соединение закрыто сервером во время воспроизведения")
+        while await queue.get() is not None:
+            pass
+    finally:
+        reader.cancel()
+        stats.connected -= 1
+        await websocket.close()
+
+
+async def report_progress(stats: ReplayStats, start_time: float, interval: float):
+    """Выводит скорость воспроизведения раз в interval секунд"""
+    last_sent = 0
+    last_time = start_time
+    while True:
+        await asyncio.sleep(interval)
+        now = time.monotonic()
+        elapsed = now - last_time
+        sent = stats.sent - last_sent
+        rate = sent / elapsed if elapsed > 0 else 0
+        print(f"[{now - start_time:.1f}с] Отправлено: {sent} сообщений за {elapsed:.1f}с "
+              f"({rate:.2f} сообщений/сек), подключений: {stats.connected}")
+        last_sent = stats.sent
+        last_time = now
+
+
+async def replay(paths, url: str, speed: float, interval: float, connect_options: dict):
+    """
+    Воспроизводит журналы на сервере
+
+    Args:
+        paths: Файлы журнала (несколько - например, журналы воркеров)
+        url: URL WebSocket сервера
+        speed: Ускорение относительно записи; 0 - так быстро, как возможно
+        interval: Интервал вывода статистики в секундах
+        connect_options: Дополнительные параметры websockets.connect()
+    """
+    stats = ReplayStats()
+    queues: Dict[int, asyncio.Queue] = {}
+    tasks = []
+    first_ts: Optional[int] = None
+    last_ts = 0
+    recorded_messages = 0
+
+    def open_connection(conn_id: int) -> asyncio.Queue:
+        queue = asyncio.Queue(CONNECTION_QUEUE)
+        queues[conn_id] = queue
+        tasks.append(asyncio.create_task(run_connection(url, queue, stats, connect_options)))
+        return queue
+
+    print(f"\n{'='*60}")
+    print(f"Воспроизведение {', '.join(paths)} на {url}")
+    print(f"Скорость: {f'{speed:g}x' if speed > 0 else 'как можно быстрее'}")
+    print(f"{'='*60}\n")
+
+    start_time = time.monotonic()
+    reporter = asyncio.create_task(report_progress(stats, start_time, interval))
+    try:
+        for index, record in enumerate(read_captures(paths)):
+            if first_ts is None:
+                first_ts = record.timestamp_ns
+            last_ts = record.timestamp_ns
+
+            if speed > 0:
+                target = start_time + (record.timestamp_ns - first_ts) / 1e9 / speed
+                delay = target - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                elif -delay > stats.max_lag:
+                    stats.max_lag = -delay
+            elif index % YIELD_EVERY == 0:
+                await asyncio.sleep(0)
+
+            queue = queues.get(record.conn_id)
+            if record.kind == REC_OPEN:
+                if queue is None:
+                    open_connection(record.conn_id)
+            elif record.kind == REC_CLOSE:
+                if queue is not None:
+                    await queue.put(None)
+                    del queues[record.conn_id]
+            elif record.kind in (REC_TEXT, REC_BINARY):
+                recorded_messages += 1
+                # Подключение, открытое до начала записи
+                if queue is None:
+                    queue = open_connection(record.conn_id)
+                message = record.payload.decode('utf-8') if record.kind == REC_TEXT else record.payload
+                await queue.put(message)
+
+        for queue in queues.values():
+            await queue.put(None)
+        await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        reporter.cancel()
+
+    replay_time = time.monotonic() - start_time
+    recorded_time = (last_ts - first_ts) / 1e9 if first_ts is not None else 0.0
+    recorded_rate = recorded_messages / recorded_time if recorded_time > 0 else 0
+    achieved_rate = stats.sent / replay_time if replay_time > 0 else 0
+
+    print(f"\n{'='*60}")
+    print("Воспроизведение завершено!")
+    print(f"Подключений в журнале: {len(tasks)}, не удалось подключиться: {stats.failed}")
+    print(f"Записано: {recorded_messages} сообщений за {recorded_time:.2f} секунд "
+          f"({recorded_rate:.2f} сообщений/сек)")
+    print(f"Отправлено: {stats.sent} сообщений за {replay_time:.2f} секунд "
+          f"({achieved_rate:.2f} сообщений/сек)")
+    if recorded_rate > 0:
+        print(f"Достигнутая скорость к записанной: {achieved_rate / recorded_rate:.2f}x")
+    if speed > 0:
+        print(f"Наибольшее опоздание от расписания: {stats.max_lag * 1000:.1f} мс")
+    print(f"{'='*60}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Воспроизведение журнала трафика на WebSocket сервере")
+    parser.add_argument("capture", nargs="+",
+                       help="Файлы журнала (server-bench.py --capture); несколько - объединяются по времени")
+    parser.add_argument("--url", type=str, default="ws://127.0.0.1:8765",
+                       help="URL WebSocket сервера (по умолчанию: ws://127.0.0.1:8765)")
+    parser.add_argument("--speed", type=float, default=1.0,
+                       help="Ускорение относительно записи; 0 - так быстро, как возможно (по умолчанию: 1)")
+    parser.add_argument("--interval", type=float, default=1.0,
+                       help="Интервал для вывода статистики в секундах (по умолчанию: 1)")
+    add_compression_arguments(parser)
+
+    args = parser.parse_args()
+    asyncio.run(replay(args.capture, args.url, args.speed, args.interval, client_options_from_args(args)))
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\nОстановка воспроизведения...")
@@ -1,107 +1,75 @@
 """
 WebSocket сервер для замера производительности входящих сообщений
 """
-import websockets
 import asyncio
-import time
 import argparse
-from typing import Dict
 
-from ws_utils import parse_ws_url, run_websocket_server, get_client_id
-from ws_client_manager import ClientManager
+from ws_utils import parse_ws_url
+from ws_workers import is_reuse_port_supported, start_workers, run_aggregator, make_worker_snapshot
+from ws_stats import StatsRegistry
+from ws_backends import (BenchmarkApp, create_backend, add_ack_arguments, ack_options_from_args, BACKENDS,
+                         BACKEND_WEBSOCKETS, BACKEND_RAW)
+from ws_compression import (add_compression_arguments, server_options_from_args, parse_int_list,
+                            run_compression_matrix)
+from ws_capture import CaptureWriter, DEFAULT_CAPTURE_SIZE_MB
+from ws_profile import Instrumentation, add_profile_arguments, profile_options_from_args, forward_profile_signal
+from ws_log import add_log_arguments, log_options_from_args, configure_logging, close_logging, flush_logs
+from ws_density import add_density_arguments, density_options_from_args
+from ws_bus import MessageBus, DEFAULT_BUS_SIZE_MB
 
-# Словарь для хранения статистики бенчмарка по клиентам
-benchmark_stats: Dict[websockets.WebSocketServerProtocol, dict] = {}
-# Менеджер подключений
-client_manager = ClientManager()
+# Счетчики замеров по клиентам и общие итоги сервера
+stats_registry = StatsRegistry()
 
 
-def on_client_connect(websocket: websockets.WebSocketServerProtocol):
-    """Callback при подключении клиента"""
-    client_id = get_client_id(websocket)
-    print(f"Новый клиент подключен: {client_id}")
+async def report_worker_stats(worker_id: int, stats_queue, app: BenchmarkApp, interval: float):
+    """Периодически отправляет снимок счетчиков воркера в родительский процесс"""
+    while True:
+        await asyncio.sleep(interval)
+        stats_queue.put(make_worker_snapshot(
+            worker_id, stats_registry.total_messages(), app.connection_count,
+            len(stats_registry.active)))
 
 
-def on_client_disconnect(websocket: websockets.WebSocketServerProtocol):
-    """Callback при отключении клиента"""
-    client_id = get_client_id(websocket)
-    print(f"Клиент отключен: {client_id}")
-    if websocket in benchmark_stats:
-        del benchmark_stats[websocket]
+async def run_worker(worker_id: int, stats_queue, backend, interval: float):
+    """Запускает сервер воркера на общем порту и задачу отправки статистики"""
+    reporter = asyncio.create_task(report_worker_stats(worker_id, stats_queue, backend.app, interval))
+    try:
+        await backend.serve(reuse_port=True)
+    finally:
+        reporter.cancel()
 
 
-async def handle_client(websocket: websockets.WebSocketServerProtocol, interval: float):
-    """Обработка подключения клиента"""
-    client_id = get_client_id(websocket)
-    client_manager.add_client(websocket)
-    
+def worker_main(worker_id: int, stats_queue, host: str, port: int, interval: float, echo: bool = False,
+                backend_name: str = BACKEND_WEBSOCKETS, metrics: bool = True, compression: dict = None,
+                capture: str = None, capture_size: int = DEFAULT_CAPTURE_SIZE_MB, ack_options: dict = None,
+                uploads: bool = False, upload_dir: str = None, profile_options: dict = None,
+                log_options: dict = None, density: dict = None, bus_path: str = None):
+    """Точка входа процесса-воркера"""
+    # Журнал воркера пишет его собственный поток записи
+    configure_logging(**(log_options or {}))
+    # Каждый воркер пишет собственный журнал: <путь>.<номер воркера>
+    recorder = CaptureWriter(f"{capture}.{worker_id}", capture_size) if capture else None
+    # Каждый воркер профилируется отдельно: родитель пересылает ему SIGUSR1
+    instrumentation = Instrumentation(**(profile_options or {}))
+    app = BenchmarkApp(stats_registry, echo=echo, recorder=recorder, instrumentation=instrumentation,
+                       **(ack_options or {}))
+    backend = create_backend(backend_name, app, host, port, metrics, compression, uploads, upload_dir, density)
+    if bus_path:
+        # Шину создал родитель; у воркера свое открытие файла (flock - на открытие)
+        backend.attach_bus(MessageBus(bus_path, worker_id))
     try:
-        async for message in websocket:
-            # Обработка меток бенчмарка
-            if message == "__BENCHMARK_START__":
-                # Инициализируем статистику для клиента
-                benchmark_stats[websocket] = {
-                    'start_time': time.time(),
-                    'interval_start': time.time(),
-                    'message_count': 0,
-                    'interval_count': 0,
-                    'interval': interval
-                }
-                print(f"\n{'='*60}")
-                print(f"Клиент {client_id}: Выполняется замер производительности...")
-                print(f"{'='*60}\n")
-                continue
-            elif message == "__BENCHMARK_END__":
-                # Выводим финальную статистику
-                if websocket in benchmark_stats:
-                    stats = benchmark_stats[websocket]
-                    total_time = time.time() - stats['start_time']
-                    total_rate = stats['message_count'] / total_time if total_time > 0 else 0
-                    
-                    print(f"\n{'='*60}")
-                    print(f"Клиент {client_id}: Замер завершен!")
-                    print(f"Всего получено: {stats['message_count']} сообщений")
-                    print(f"Общее время: {total_time:.2f} секунд")
-                    print(f"Средняя скорость: {total_rate:.2f} сообщений/секунду")
-                    print(f"{'='*60}\n")
-                    
-                    # Удаляем статистику клиента
-                    del benchmark_stats[websocket]
-                continue
-            elif message.startswith("__BENCHMARK_DATA__"):
-                # Обновляем статистику и проверяем интервалы
-                if websocket in benchmark_stats:
-                    stats = benchmark_stats[websocket]
-                    stats['message_count'] += 1
-                    stats['interval_count'] += 1
-                    
-                    # Проверяем, нужно ли вывести статистику за интервал
-                    current_time = time.time()
-                    if current_time - stats['interval_start'] >= stats['interval']:
-                        elapsed = current_time - stats['interval_start']
-                        rate = stats['interval_count'] / elapsed if elapsed > 0 else 0
-                        total_elapsed = current_time - stats['start_time']
-                        print(f"[Сервер] Клиент {client_id} [{total_elapsed:.1f}с] "
-                              f"Получено: {stats['interval_count']} сообщений за {elapsed:.1f}с "
-                              f"({rate:.2f} сообщений/сек)")
-                        stats['interval_start'] = current_time
-                        stats['interval_count'] = 0
-                continue
-    except websockets.exceptions.ConnectionClosed:
+        asyncio.run(run_worker(worker_id, stats_queue, backend, interval))
+    except KeyboardInterrupt:
         pass
     finally:
-        # Очищаем статистику при отключении клиента
-        client_manager.remove_client(websocket)
-
+        instrumentation.close()
+        if recorder:
+            recorder.close()
+        # Процесс multiprocessing завершается без atexit: дописываем журнал явно
+        close_logging()
 
-def create_handler(interval: float):
-    """Создает обработчик с параметром interval"""
-    async def handler(websocket: websockets.WebSocketServerProtocol):
-        await handle_client(websocket, interval)
-    return handler
 
-
-async def main():
+def main():
     # Парсинг аргументов командной строки
     parser = argparse.ArgumentParser(description="WebSocket сервер для замера производительности входящих сообщений")
     parser.add_argument("--benchmark", action="store_true", 
@@ -112,6 +80,46 @@ async def main():
                        help="Интервал для вывода статистики в секундах (по умолчанию: 1)")
     parser.add_argument("--url", type=str, default="ws://127.0.0.1:8765",
                        help="URL WebSocket сервера (по умолчанию: ws://127.0.0.1:8765)")
+    parser.add_argument("--workers", type=int, default=1,
+                       help="Количество процессов-воркеров на одном порту через SO_REUSEPORT (по умолчанию: 1)")
+    parser.add_argument("--bus", action="store_true",
+                       help="Режим --workers: рассылка через шину в общей памяти доходит до клиентов всех "
+                            "воркеров (см. ws_bus.py, только бэкенд websockets)")
+    parser.add_argument("--bus-size", type=int, default=DEFAULT_BUS_SIZE_MB,
+                       help=f"Размер кольца шины в МБ (по умолчанию: {DEFAULT_BUS_SIZE_MB})")
+    parser.add_argument("--echo", action="store_true",
+                       help="Отвечать эхом на сообщения бенчмарка (для замера RTT в client.py)")
+    add_ack_arguments(parser)
+    parser.add_argument("--backend", choices=BACKENDS, default=BACKEND_WEBSOCKETS,
+                       help="Реализация сервера: threaded (websocket_server), websockets (asyncio) "
+                            "или raw (asyncio.Protocol) (по умолчанию: websockets)")
+    parser.add_argument("--no-metrics", action="store_true",
+                       help="Не отвечать на HTTP GET /metrics (только бэкенд websockets)")
+    add_compression_arguments(parser)
+    parser.add_argument("--capture", type=str, default=None,
+                       help="Записывать все входящие кадры в журнал (см. ws_capture.py и replay.py)")
+    parser.add_argument("--capture-size", type=int, default=DEFAULT_CAPTURE_SIZE_MB,
+                       help=f"Размер заранее выделенного журнала в МБ (по умолчанию: {DEFAULT_CAPTURE_SIZE_MB})")
+    parser.add_argument("--accept-uploads", action="store_true",
+                       help="Принимать потоковую загрузку файлов (__BENCHMARK_UPLOAD__, см. ws_stream.py) "
+                            "без ограничения размера сообщения (только бэкенд websockets)")
+    parser.add_argument("--upload-dir", type=str, default=None,
+                       help="Каталог для принятых файлов (по умолчанию: только считать байты)")
+    add_profile_arguments(parser)
+    add_log_arguments(parser)
+    add_density_arguments(parser)
+    parser.add_argument("--compression-matrix", action="store_true",
+                       help="Замер сжатия: прогнать матрицу настроек permessage-deflate на локальном сервере")
+    parser.add_argument("--payload-sizes", type=str, default="64,1024,16384",
+                       help="Размеры сообщений замера сжатия через запятую (по умолчанию: 64,1024,16384)")
+    parser.add_argument("--matrix-messages", type=int, default=5000,
+                       help="Количество сообщений на комбинацию замера сжатия (по умолчанию: 5000)")
+    parser.add_argument("--matrix-window-bits", type=str, default="9,12,15",
+                       help="Размеры окна для замера сжатия через запятую (по умолчанию: 9,12,15)")
+    parser.add_argument("--matrix-mem-levels", type=str, default="5,8",
+                       help="Значения memLevel для замера сжатия через запятую (по умолчанию: 5,8)")
+    parser.add_argument("--matrix-levels", type=str, default="1,6,9",
+                       help="Уровни сжатия для замера через запятую (по умолчанию: 1,6,9)")
     
     args = parser.parse_args()
     
@@ -124,24 +132,97 @@ async def main():
     
     host, port = url_result
     
-    # Настраиваем callbacks для менеджера клиентов
-    client_manager.set_on_connect(on_client_connect)
-    client_manager.set_on_disconnect(on_client_disconnect)
+    try:
+        configure_logging(**log_options_from_args(args))
+    except ValueError as e:
+        print(f"Ошибка: {e}")
+        return
+    
+    if args.compression_matrix:
+        asyncio.run(run_compression_matrix(
+            host, port, parse_int_list(args.payload_sizes), args.matrix_messages,
+            parse_int_list(args.matrix_window_bits), parse_int_list(args.matrix_mem_levels),
+            parse_int_list(args.matrix_levels)))
+        return
+    
+    if args.density and args.backend not in (BACKEND_WEBSOCKETS, BACKEND_RAW):
+        print(f"Ошибка: режим --density недоступен для бэкенда {args.backend}")
+        return
     
-    # Создаем обработчик с параметром interval
-    handler = create_handler(args.interval)
+    if args.workers > 1:
+        if args.backend not in (BACKEND_WEBSOCKETS, BACKEND_RAW):
+            print(f"Ошибка: режим --workers недоступен для бэкенда {args.backend}")
+            return
+        if not is_reuse_port_supported():
+            print("Ошибка: SO_REUSEPORT не поддерживается на этой платформе, режим --workers недоступен")
+            return
+        if args.bus and args.backend != BACKEND_WEBSOCKETS:
+            print(f"Ошибка: режим --bus недоступен для бэкенда {args.backend}")
+            return
+        
+        print(f"WebSocket сервер ({args.backend}) запущен на ws://{host}:{port} ({args.workers} воркеров)\n"
+              "Ожидание подключений для замера производительности...")
+        worker_args = (host, port, args.interval, args.echo, args.backend,
+                       not args.no_metrics, server_options_from_args(args), args.capture, args.capture_size,
+                       ack_options_from_args(args), args.accept_uploads, args.upload_dir,
+                       profile_options_from_args(args), log_options_from_args(args),
+                       density_options_from_args(args))
+        bus = MessageBus.create(size_mb=args.bus_size) if args.bus else None
+        if bus is not None:
+            worker_args += (bus.path,)
+        try:
+            processes, stats_queue = start_workers(args.workers, worker_main, worker_args)
+            forward_profile_signal(processes)
+            run_aggregator(processes, stats_queue, args.interval, bus.summary_lines if bus else None)
+        finally:
+            if bus is not None:
+                bus.close(unlink=True)
+        return
     
+    recorder = CaptureWriter(args.capture, args.capture_size) if args.capture else None
+    instrumentation = Instrumentation(**profile_options_from_args(args))
+    app = BenchmarkApp(stats_registry, echo=args.echo, recorder=recorder, instrumentation=instrumentation,
+                       **ack_options_from_args(args))
+    backend = create_backend(args.backend, app, host, port, not args.no_metrics, server_options_from_args(args),
+                             args.accept_uploads, args.upload_dir, density_options_from_args(args))
     startup_message = (
-        f"WebSocket сервер запущен на ws://{host}:{port}\n"
+        f"WebSocket сервер ({backend.name}) запущен на ws://{host}:{port}\n"
         "Ожидание подключений для замера производительности..."
     )
     
+    try:
+        if not backend.is_async:
+            # Интервальную статистику по клиентам и итоги по серверу выводит отдельный поток
+            stats_registry.start_reporter_thread(args.interval)
+            print(startup_message)
+            backend.run()
+        else:
+            asyncio.run(serve(backend, args.interval, startup_message))
+    finally:
+        instrumentation.close()
+        flush_logs()
+        print(f"Управляющие команды: {app.router.summary()}")
+        if getattr(backend, "keepalive", None) is not None:
+            print(f"Плотный режим: {backend.keepalive.summary()}")
+        if recorder:
+            recorder.close()
+            print(recorder.summary())
+
+
+async def serve(backend, interval: float, startup_message: str):
+    """Запускает asyncio бэкенд в одном процессе"""
+    # Интервальную статистику по клиентам и итоги по серверу выводит фоновая задача
+    reporter = asyncio.create_task(stats_registry.run_reporter(interval))
+    
     # Запускаем сервер
-    await run_websocket_server(handler, host, port, startup_message)
+    try:
+        await backend.serve(startup_message=startup_message)
+    finally:
+        reporter.cancel()
 
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        main()
     except KeyboardInterrupt:
         print("\nОстановка сервера...")
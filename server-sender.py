@@ -4,95 +4,769 @@ WebSocket сервер для замера производительности
 import websockets
 import asyncio
 import time
+import json
+import random
+import argparse
 
-from ws_utils import run_websocket_server, get_client_id
-from ws_client_manager import ClientManager
+from ws_utils import parse_ws_url, run_websocket_server, get_client_id
+from ws_client_manager import ClientManager, encode_broadcast_frame, OVERFLOW_POLICIES, OVERFLOW_DROP_OLDEST
+from ws_protocol import (decode_header, encode_frame, start_ack_every, ACK_EVERY, BENCHMARK_START,
+                         BENCHMARK_ACK_PREFIX, MSG_START, MSG_END, MSG_ACK)
+from ws_sender import PayloadBuffers, SendFlow, pipelined_send
+from ws_topics import (topic_message, pattern_matches, SUBSCRIBE_COMMAND, UNSUBSCRIBE_COMMAND, PUBLISH_COMMAND,
+                       WILDCARD)
+from ws_metrics import ServerMetrics, add_messages_in
+from ws_compat import write_buffer_size
+from ws_compression import add_compression_arguments, server_options_from_args
+from ws_profile import Instrumentation, add_profile_arguments, profile_options_from_args, PROFILE_START, PROFILE_STOP
+from ws_log import get_logger, add_log_arguments, log_options_from_args, configure_logging, close_logging, INFO
+from ws_stream import (MappedSource, stream_send, memory_usage, format_mb, stream_rate, STREAM_COMMAND,
+                       DEFAULT_FRAGMENT_SIZE)
+from ws_router import CommandRouter, CommandError
+from ws_session import add_session_arguments, session_options_from_args, SESSION_COMMAND, RESUME_COMMAND
 
 # Менеджер подключений
 client_manager = ClientManager()
+# Заранее собранные буферы сообщений замера: {двоичный формат: буферы}
+payload_buffers = {False: PayloadBuffers(64, False), True: PayloadBuffers(64, True)}
+# Отвечать двоичными кадрами даже на текстовую команду запуска
+force_binary = False
+# Количество выполняющихся отправок замера (для метрик)
+active_sends = 0
+# Учет подтверждений текущей отправки по подключениям
+send_flows = {}
+# Максимум неподтвержденных сообщений на подключение (0 - без ограничения)
+send_window = 0
+# Интервал вывода хода отправки в секундах
+report_interval = 1.0
+# Файл для потоковой отправки по команде __BENCHMARK_STREAM__ (None - нулевые данные)
+stream_file = None
+# Диагностика сервера: опоздание цикла, время обработчиков, профилировщик (см. ws_profile.py)
+instrumentation = Instrumentation()
+# Сколько ждать подтверждения последних сообщений после отправки
+ACK_WAIT_TIMEOUT = 30.0
+
+# Журнал вне пути сообщений (см. ws_log.py)
+server_log = get_logger("server")
+connections_log = get_logger("connections")
+bench_log = get_logger("bench")
+stats_log = get_logger("stats")
 
 
 def on_client_connect(websocket: websockets.WebSocketServerProtocol):
     """Callback при подключении клиента"""
     client_id = get_client_id(websocket)
-    print(f"Новый клиент подключен: {client_id}")
+    connections_log.info(f"Новый клиент подключен: {client_id}", client=client_id, event="connect")
 
 
 def on_client_disconnect(websocket: websockets.WebSocketServerProtocol):
     """Callback при отключении клиента"""
     client_id = get_client_id(websocket)
-    print(f"Клиент отключен: {client_id}")
+    connections_log.info(f"Клиент отключен: {client_id}", client=client_id, event="disconnect")
+
+
+async def report_send_progress(client_id: int, websocket, flow: SendFlow, start_time: float, acks: bool):
+    """Выводит раз в report_interval секунд запись в буфер, доставку и рост буфера записи"""
+    last_time = start_time
+    last_sent = 0
+    last_acked = 0
+    while True:
+        await asyncio.sleep(report_interval)
+        now = time.monotonic()
+        elapsed = now - last_time
+        write_buffer = write_buffer_size(websocket)
+        flow.sample(write_buffer)
+        line = (f"[{now - start_time:.1f}с] Клиент {client_id}: в буфер: {flow.sent} "
+                f"({(flow.sent - last_sent) / elapsed:.2f} сообщ/сек)")
+        if acks:
+            line += (f", доставлено: {flow.acked} ({(flow.acked - last_acked) / elapsed:.2f} сообщ/сек), "
+                     f"в пути: {flow.sent - flow.acked}")
+        stats_log.info(f"{line}, буфер записи: {write_buffer / 1024:.1f} КБ", client=client_id,
+                       sent=flow.sent, acked=flow.acked, write_buffer=write_buffer)
+        last_time = now
+        last_sent = flow.sent
+        last_acked = flow.acked
+
 
+def print_send_result(client_id: int, flow: SendFlow, message_size: int, start_time: float,
+                      enqueued_time: float, acks: bool):
+    """Итоги замера: скорость записи в буфер и скорость доставки"""
+    if not bench_log.enabled(INFO):
+        return
+    num_messages = flow.target
+    total_mb = num_messages * message_size / (1024 * 1024)
+    
+    lines = [f"Клиент {client_id}: Замер завершен!",
+             f"Отправлено: {num_messages} сообщений по {message_size} байт ({total_mb:.2f} МБ)"]
+    rate = num_messages / enqueued_time if enqueued_time > 0 else 0
+    lines.append(f"Запись в буфер: {enqueued_time:.4f} секунд, {rate:.2f} сообщений/секунду, "
+                 f"{total_mb / enqueued_time if enqueued_time > 0 else 0:.2f} МБ/сек")
+    fields = {"client": client_id, "event": "result", "messages": num_messages, "message_size": message_size,
+              "enqueued_time": round(enqueued_time, 4)}
+    if not acks:
+        lines.append("Доставка: клиент не подтверждает сообщения (__BENCHMARK_START__:N:K), "
+                     "скорость доставки неизвестна")
+    elif flow.delivered_time is None:
+        lines.append(f"Доставка: подтверждено {flow.acked} из {num_messages} сообщений")
+        fields["acked"] = flow.acked
+    else:
+        delivered_time = flow.delivered_time - start_time
+        rate = num_messages / delivered_time if delivered_time > 0 else 0
+        lines.append(f"Доставка: {delivered_time:.4f} секунд, {rate:.2f} сообщений/секунду, "
+                     f"{total_mb / delivered_time if delivered_time > 0 else 0:.2f} МБ/сек")
+        fields["delivered_time"] = round(delivered_time, 4)
+    if acks:
+        lines.append(f"Наибольшее число сообщений в пути: {flow.max_in_flight} "
+                     f"(окно: {flow.window or 'без ограничения'})")
+    lines.append(f"Наибольший буфер записи: {flow.max_buffer / 1024:.1f} КБ")
+    bench_log.report(*lines, **fields)
 
-async def send_messages(websocket: websockets.WebSocketServerProtocol, num_messages: int):
-    """Отправка сообщений для бенчмарка"""
+
+async def send_messages(websocket: websockets.WebSocketServerProtocol, num_messages: int,
+                        binary: bool = False, stream_id: int = 0, ack_every: int = 0):
+    """
+    Отправка сообщений для бенчмарка
+    
+    Сообщения пишутся в транспорт пачками из заранее собранных буферов
+    размером payload_size (см. ws_sender.py), ожидание - только при
+    переполнении буфера записи. Если клиент подтверждает доставку,
+    число неподтвержденных сообщений ограничено окном send_window,
+    а в итогах выводится скорость доставки.
+    
+    Args:
+        websocket: WebSocket соединение
+        num_messages: Количество сообщений
+        binary: Отправлять двоичные кадры (ws_protocol) вместо текстовых меток
+        stream_id: Идентификатор потока для двоичных кадров
+        ack_every: Клиент подтверждает каждые ack_every сообщений (0 - без подтверждений)
+    """
+    global active_sends
     client_id = get_client_id(websocket)
-    start_time = time.time()
+    buffers = payload_buffers[binary]
+    acks = ack_every > 0
+    # Окно действует, только если клиент подтверждает доставку, и не меньше
+    # двух интервалов подтверждения: получатель без таймера (1С) подтверждает
+    # только каждые K сообщений
+    flow = SendFlow(num_messages, max(send_window, 2 * ack_every) if acks and send_window else 0)
+    send_flows[websocket] = flow
+    start_time = time.monotonic()
+    reporter = asyncio.create_task(report_send_progress(client_id, websocket, flow, start_time, acks))
+    active_sends += 1
     
     try:
-        await websocket.send(f"__BENCHMARK_START__:{num_messages}")
+        # Команда запуска повторяется клиенту с тем же K: так его узнает
+        # обработчик сообщений клиента (например, в 1С)
+        if binary:
+            await websocket.send(encode_frame(MSG_START, stream_id, num_messages,
+                                              ACK_EVERY.pack(ack_every) if acks else b""))
+        elif acks:
+            await websocket.send(f"__BENCHMARK_START__:{num_messages}:{ack_every}")
+        else:
+            await websocket.send(f"__BENCHMARK_START__:{num_messages}")
         
         # Отправляем N сообщений
-        for i in range(num_messages):
-            await websocket.send(f"__BENCHMARK_DATA__:{i}")
+        sent = await pipelined_send(websocket, num_messages, buffers, stream_id, flow)
+        if sent < num_messages:
+            bench_log.warning(f"Клиент {client_id}: соединение закрыто во время отправки ({sent} из {num_messages})",
+                              client=client_id, sent=sent)
+            return
+        enqueued_time = time.monotonic() - start_time
         
-        await websocket.send(f"__BENCHMARK_END__:{num_messages}")
+        if binary:
+            await websocket.send(encode_frame(MSG_END, stream_id, num_messages))
+        else:
+            await websocket.send(f"__BENCHMARK_END__:{num_messages}")
+        
+        if acks and not await flow.wait_delivered(ACK_WAIT_TIMEOUT):
+            bench_log.warning(f"Клиент {client_id}: не все сообщения подтверждены за {ACK_WAIT_TIMEOUT:g} секунд",
+                              client=client_id, acked=flow.acked)
     except websockets.exceptions.ConnectionClosed:
-        print(f"Клиент {client_id}: соединение закрыто во время отправки")
+        bench_log.warning(f"Клиент {client_id}: соединение закрыто во время отправки", client=client_id)
         return
+    finally:
+        active_sends -= 1
+        reporter.cancel()
+        if send_flows.get(websocket) is flow:
+            del send_flows[websocket]
     
-    end_time = time.time()
-    elapsed_time = end_time - start_time
-    rate = num_messages / elapsed_time if elapsed_time > 0 else 0
-    
-    # Выводим статистику
-    print(f"\n{'='*60}")
-    print(f"Клиент {client_id}: Замер завершен!")
-    print(f"Отправлено: {num_messages} сообщений")
-    print(f"Время отправки: {elapsed_time:.4f} секунд")
-    print(f"Скорость отправки: {rate:.2f} сообщений/секунду")
-    print(f"{'='*60}\n")
+    print_send_result(client_id, flow, buffers.message_size, start_time, enqueued_time, acks)
+
+
+async def send_stream(websocket, size: int, fragment_size: int):
+    """
+    Отправляет файл --stream-file (или size нулевых байтов) одним
+    фрагментированным сообщением из отображения в память (см. ws_stream.py)
+    """
+    global active_sends
+    client_id = get_client_id(websocket)
+    fragment_size = fragment_size or DEFAULT_FRAGMENT_SIZE
+    try:
+        source = MappedSource(stream_file) if stream_file else MappedSource.zeros(size)
+    except OSError as e:
+        server_log.warning(f"Клиент {client_id}: не удалось открыть {stream_file}: {e}", client=client_id)
+        return
+    active_sends += 1
+    try:
+        with source:
+            # Клиент узнает из ответа фактический размер сообщения
+            await websocket.send(f"{STREAM_COMMAND}:{len(source)}:{fragment_size}")
+            bench_log.report(f"Клиент {client_id}: потоковая отправка {format_mb(len(source))} "
+                             f"фрагментами по {fragment_size} байт...",
+                             client=client_id, event="stream", bytes=len(source), fragment_size=fragment_size)
+            start = time.perf_counter()
+            written = await stream_send(websocket, source, fragment_size)
+            elapsed = time.perf_counter() - start
+    except websockets.exceptions.ConnectionClosed:
+        bench_log.warning(f"Клиент {client_id}: соединение закрыто во время потоковой отправки", client=client_id)
+        return
+    finally:
+        active_sends -= 1
+    rss, anon = memory_usage()
+    bench_log.report(f"Клиент {client_id}: записано в транспорт {format_mb(written)} за {elapsed:.2f} секунд "
+                     f"({stream_rate(written, elapsed):.1f} МБ/сек)",
+                     f"Память сервера: RSS {format_mb(rss)}, из них анонимная {format_mb(anon)}",
+                     client=client_id, event="stream_result", bytes=written, elapsed=round(elapsed, 3), rss=rss)
+
+
+def ack_command(websocket, message: str, acked: int, sequence: int = 0):
+    """Подтверждение доставки: "__BENCHMARK_ACK__:M[:S]" """
+    flow = send_flows.get(websocket)
+    if flow is not None:
+        flow.on_ack(acked)
+
+
+def ack_frame(websocket, data: bytes, header: tuple):
+    """Двоичное подтверждение доставки: кадр ACK с количеством в поле последовательности"""
+    flow = send_flows.get(websocket)
+    if flow is not None:
+        flow.on_ack(header[2])
+
+
+def start_command(websocket, message: str, num_messages: int, ack_every: int = 0):
+    """
+    Команда запуска замера "__BENCHMARK_START__:N[:K]", где N - количество
+    сообщений, K - клиент подтверждает доставку каждые K сообщений
+    """
+    client_id = get_client_id(websocket)
+    bench_log.report(f"Клиент {client_id}: Начинается отправка {num_messages} сообщений...",
+                     client=client_id, event="start", messages=num_messages)
+    # Запускаем отправку сообщений в отдельной задаче
+    asyncio.create_task(send_messages(websocket, num_messages, binary=force_binary, ack_every=ack_every))
+
+
+def start_frame(websocket, data: bytes, header: tuple):
+    """Двоичная команда запуска: кадр START, количество сообщений в поле последовательности"""
+    num_messages, stream_id = header[2], header[1]
+    ack_every = start_ack_every(data, header)
+    client_id = get_client_id(websocket)
+    bench_log.report(f"Клиент {client_id}: Начинается отправка {num_messages} двоичных сообщений...",
+                     client=client_id, event="start", messages=num_messages)
+    asyncio.create_task(send_messages(websocket, num_messages, binary=True, stream_id=stream_id,
+                                      ack_every=ack_every))
+
+
+def stream_command(websocket, message: str, size: int, fragment_size: int):
+    """Потоковая отправка большого сообщения: "__BENCHMARK_STREAM__:<байт>:<фрагмент>" """
+    asyncio.create_task(send_stream(websocket, size, fragment_size))
+
+
+def profile_command(websocket, message: str):
+    """Управление профилировщиком: "__PROFILE_START__" / "__PROFILE_STOP__" """
+    reply = instrumentation.handle_control(message)
+    if reply is not None:
+        asyncio.create_task(websocket.send(reply))
+
+
+def publish_command(websocket, message: str, topic: str, text: str = ""):
+    """Публикация в тему: "__PUBLISH__:<тема>:<текст>" (см. ws_topics.py)"""
+    if not topic or WILDCARD in topic:
+        raise CommandError(f"неверная тема публикации: {topic}")
+    client_manager.publish(topic, topic_message(topic, text))
+
+
+def subscribe_command(websocket, message: str, pattern: str):
+    """Подписка и отписка: "__SUBSCRIBE__:<шаблон>", "__UNSUBSCRIBE__:<шаблон>" """
+    try:
+        if message.startswith(SUBSCRIBE_COMMAND):
+            client_manager.subscribe(websocket, pattern)
+        else:
+            client_manager.unsubscribe(websocket, pattern)
+    except ValueError as e:
+        raise CommandError(str(e)) from None
+    # Подтверждение - та же команда: клиент знает, что подписка действует
+    asyncio.create_task(websocket.send(message))
+
+
+def session_command(websocket, message: str):
+    """Новая сессия: "__SESSION__", ответ "__SESSION__:<id>" (см. ws_session.py)"""
+    if client_manager.sessions is None:
+        raise CommandError("сессии выключены (--session-buffer 0)")
+    session = client_manager.start_session(websocket)
+    client_id = get_client_id(websocket)
+    connections_log.info(f"Клиент {client_id}: сессия {session.id}", client=client_id, event="session",
+                         session=session.id)
+
+
+def resume_command(websocket, message: str, session_id: str, sequence: int):
+    """Продолжение сессии после переподключения: "__RESUME__:<id>:<N>" """
+    if client_manager.sessions is None:
+        raise CommandError("сессии выключены (--session-buffer 0)")
+    hit = client_manager.resume_session(websocket, session_id, sequence)
+    client_id = get_client_id(websocket)
+    connections_log.info(f"Клиент {client_id}: продолжение сессии {session_id} после №{sequence}: "
+                         + ("попадание" if hit else "промах"),
+                         client=client_id, event="resume", session=session_id, hit=hit)
+
+
+# Управляющие команды клиента (см. ws_router.py); остальные сообщения сервер не обрабатывает
+router = CommandRouter()
+router.register(BENCHMARK_START, start_command, ("N", int), ("K", int), required=1)
+router.register(BENCHMARK_ACK_PREFIX.rstrip(":"), ack_command, ("M", int), ("S", int), required=1)
+router.register(STREAM_COMMAND, stream_command, ("байт", int), ("фрагмент", int))
+router.register(PROFILE_START, profile_command)
+router.register(PROFILE_STOP, profile_command)
+router.register(SUBSCRIBE_COMMAND, subscribe_command, ("шаблон", str))
+router.register(UNSUBSCRIBE_COMMAND, subscribe_command, ("шаблон", str))
+router.register(PUBLISH_COMMAND, publish_command, ("тема", str), ("текст", str), required=1, rest=True)
+router.register(SESSION_COMMAND, session_command)
+router.register(RESUME_COMMAND, resume_command, ("id", str), ("N", int))
+router.register_binary(MSG_START, start_frame, "binary_start")
+router.register_binary(MSG_ACK, ack_frame, "binary_ack")
+
+
+def dispatch_message(websocket: websockets.WebSocketServerProtocol, client_id: int, message) -> str:
+    """
+    Обрабатывает сообщение клиента (отправки запускаются отдельными задачами)
+
+    Returns:
+        Имя обработчика (для времени обработки, см. ws_profile.py)
+    """
+    if isinstance(message, bytes):
+        header = decode_header(message)
+        command = router.binary.get(header[0]) if header is not None else None
+        if command is None:
+            return "binary"
+        router.dispatch_binary(command, websocket, message, header)
+        return command.label
+    command = router.route(message)
+    if command is None:
+        return "text"
+    try:
+        router.dispatch(command, websocket, message)
+    except CommandError as e:
+        server_log.warning(f"Ошибка: {e}", client=client_id)
+    return command.label
 
 
 async def handle_client(websocket: websockets.WebSocketServerProtocol):
     """Обработка подключения клиента"""
     client_id = get_client_id(websocket)
     client_manager.add_client(websocket)
+    timer = instrumentation.timer
     
     try:
         async for message in websocket:
-            # Обработка команды запуска замера
-            if message.startswith("__BENCHMARK_START__"):
-                # Парсим количество сообщений из команды
-                # Формат: "__BENCHMARK_START__:N" где N - количество сообщений
-                try:
-                    parts = message.split(":")
-                    if len(parts) == 2:
-                        num_messages = int(parts[1])
-                    else:
-                        print("Ошибка: неверный формат команды. Ожидается: __BENCHMARK_START__:N")
-                        continue
-                except (ValueError, IndexError):
-                    print(f"Ошибка: не удалось распарсить количество сообщений из команды: {message}")
-                    continue
-                
-                print(f"\n{'='*60}")
-                print(f"Клиент {client_id}: Начинается отправка {num_messages} сообщений...")
-                print(f"{'='*60}\n")
-                
-                # Запускаем отправку сообщений в отдельной задаче
-                asyncio.create_task(send_messages(websocket, num_messages))
+            add_messages_in(websocket)
+            if timer is None:
+                dispatch_message(websocket, client_id, message)
+                continue
+            start = time.perf_counter_ns()
+            handler = dispatch_message(websocket, client_id, message)
+            timer.record(handler, time.perf_counter_ns() - start)
     except websockets.exceptions.ConnectionClosed:
         pass
     finally:
-        # Очищаем при отключении клиента
+        # Очищаем при отключении клиента; отправка, ждущая окна, завершится
+        flow = send_flows.get(websocket)
+        if flow is not None:
+            flow.close()
         client_manager.remove_client(websocket)
 
 
+class BroadcastReceiveStats:
+    """Счетчики приема рассылки локальными клиентами бенчмарка"""
+    
+    __slots__ = ("received", "completed", "done")
+    
+    def __init__(self):
+        self.received = 0
+        self.completed = 0
+        self.done = asyncio.Event()
+
+
+async def broadcast_receiver(url: str, num_messages: int, num_fast: int, stats: BroadcastReceiveStats,
+                             ready: asyncio.Event):
+    """Быстрый клиент бенчмарка рассылки: читает все сообщения"""
+    async with websockets.connect(url, compression=None, max_size=None) as websocket:
+        ready.set()
+        count = 0
+        try:
+            async for _ in websocket:
+                count += 1
+                stats.received += 1
+                if count == num_messages:
+                    stats.completed += 1
+                    if stats.completed == num_fast:
+                        stats.done.set()
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+
+async def slow_receiver(url: str, ready: asyncio.Event, stop: asyncio.Event):
+    """Медленный клиент бенчмарка рассылки: подключается и ничего не читает"""
+    try:
+        async with websockets.connect(url, compression=None, max_size=None, max_queue=1) as websocket:
+            ready.set()
+            await stop.wait()
+    except (OSError, websockets.exceptions.WebSocketException):
+        ready.set()
+
+
+async def run_broadcast_benchmark(host: str, port: int, num_clients: int, num_messages: int,
+                                  payload_size: int, slow_clients: int, timeout: float):
+    """
+    Замер рассылки ClientManager.broadcast на множество локальных клиентов
+    
+    Args:
+        host: Хост сервера
+        port: Порт сервера
+        num_clients: Количество быстрых клиентов
+        num_messages: Количество рассылаемых сообщений
+        payload_size: Размер сообщения в байтах
+        slow_clients: Количество клиентов, которые не читают сообщения
+        timeout: Максимальное время ожидания доставки в секундах
+    
+    Returns:
+        Словарь с итогами замера (для --result-json)
+    """
+    url = f"ws://{host}:{port}"
+    stats = BroadcastReceiveStats()
+    stop = asyncio.Event()
+    message = "x" * payload_size
+    
+    async with websockets.serve(handle_client, host, port, compression=None):
+        print(f"Подключение {num_clients} клиентов и {slow_clients} медленных клиентов...")
+        tasks = []
+        connect_limit = asyncio.Semaphore(200)
+        
+        async def start(coroutine_factory):
+            async with connect_limit:
+                ready = asyncio.Event()
+                tasks.append(asyncio.create_task(coroutine_factory(ready)))
+                await ready.wait()
+        
+        await asyncio.gather(
+            *(start(lambda ready: broadcast_receiver(url, num_messages, num_clients, stats, ready))
+              for _ in range(num_clients)),
+            *(start(lambda ready: slow_receiver(url, ready, stop)) for _ in range(slow_clients))
+        )
+        while client_manager.get_client_count() < num_clients + slow_clients:
+            await asyncio.sleep(0.01)
+        
+        print(f"Подключено клиентов: {client_manager.get_client_count()}")
+        print(f"Рассылка {num_messages} сообщений по {payload_size} байт "
+              f"(политика: {client_manager.overflow_policy}, очередь: {client_manager.max_queue})...\n")
+        
+        # Кадр кодируется один раз на все сообщения бенчмарка
+        frame = encode_broadcast_frame(message)
+        start_time = time.time()
+        for i in range(num_messages):
+            client_manager.broadcast_frame(frame)
+            # Отдаем управление, чтобы клиенты и очереди успевали работать
+            if i % 16 == 15:
+                await asyncio.sleep(0)
+        broadcast_time = time.time() - start_time
+        
+        try:
+            await asyncio.wait_for(stats.done.wait(), timeout)
+        except asyncio.TimeoutError:
+            print(f"Внимание: не все клиенты получили сообщения за {timeout} секунд")
+        delivery_time = time.time() - start_time
+        
+        broadcast_stats = client_manager.get_broadcast_stats()
+        stop.set()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    
+    expected = num_messages * num_clients
+    print(f"\n{'='*60}")
+    print("Замер рассылки завершен!")
+    print(f"Клиентов: {num_clients} (+{slow_clients} медленных)")
+    print(f"Рассылок: {num_messages}, размер сообщения: {payload_size} байт")
+    print(f"Время рассылки: {broadcast_time:.4f} секунд "
+          f"({num_messages / broadcast_time if broadcast_time > 0 else 0:.2f} рассылок/сек)")
+    print(f"Записано кадров: {broadcast_stats['frames_written']}, "
+          f"поставлено в очередь: {broadcast_stats['frames_queued']}, "
+          f"отброшено: {broadcast_stats['frames_dropped']}, "
+          f"отключено медленных: {broadcast_stats['slow_disconnects']}")
+    print(f"Доставлено быстрым клиентам: {stats.received} из {expected} за {delivery_time:.4f} секунд "
+          f"({stats.received / delivery_time if delivery_time > 0 else 0:.2f} сообщений/сек)")
+    print(f"{'='*60}\n")
+    
+    return {
+        'clients': num_clients,
+        'slow_clients': slow_clients,
+        'messages': num_messages,
+        'payload_size': payload_size,
+        'broadcast_time': broadcast_time,
+        'delivery_time': delivery_time,
+        'expected': expected,
+        'delivered': stats.received,
+        **broadcast_stats,
+    }
+
+
+# Темы замера публикации делятся на группы "g<группа>.t<номер>" для подписок по префиксу "g<группа>.*"
+TOPIC_GROUPS = 16
+
+
+def bench_topic(index: int) -> str:
+    """Имя темы замера публикации"""
+    return f"g{index % TOPIC_GROUPS}.t{index}"
+
+
+class TopicReceiveStats:
+    """Счетчик сообщений тем, принятых локальными клиентами бенчмарка"""
+    
+    __slots__ = ("received",)
+    
+    def __init__(self):
+        self.received = 0
+
+
+async def topic_receiver(url: str, patterns: list, stats: TopicReceiveStats, ready: asyncio.Event):
+    """Клиент бенчмарка публикации: подписывается командами и читает сообщения тем"""
+    async with websockets.connect(url, compression=None, max_size=None) as websocket:
+        for pattern in patterns:
+            await websocket.send(f"{SUBSCRIBE_COMMAND}:{pattern}")
+        # Подтверждение каждой подписки - та же команда
+        for _ in patterns:
+            await websocket.recv()
+        ready.set()
+        try:
+            async for _ in websocket:
+                stats.received += 1
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+
+def scan_subscribers(subscriptions: dict, topic: str) -> list:
+    """Подписчики темы перебором всех клиентов и их шаблонов (для сравнения с индексом)"""
+    return [client for client, patterns in subscriptions.items()
+            if any(pattern_matches(pattern, topic) for pattern in patterns)]
+
+
+async def run_topic_benchmark(host: str, port: int, num_clients: int, num_messages: int, payload_size: int,
+                              num_topics: int, subscriptions: int, wildcard_clients: int, timeout: float):
+    """
+    Замер публикации в темы (ClientManager.publish) на множестве локальных клиентов
+    
+    Каждый клиент подписывается командами __SUBSCRIBE__ на subscriptions
+    случайных тем из num_topics, первые wildcard_clients клиентов - еще и на
+    группу тем по префиксу. Сервер публикует num_messages сообщений в
+    случайные темы; для сравнения отдельно замеряется подбор подписчиков
+    перебором всех клиентов.
+    
+    Args:
+        host: Хост сервера
+        port: Порт сервера
+        num_clients: Количество клиентов
+        num_messages: Количество публикаций
+        payload_size: Размер текста публикации в байтах
+        num_topics: Количество тем
+        subscriptions: Подписок на точные темы у каждого клиента
+        wildcard_clients: Количество клиентов с подпиской по префиксу
+        timeout: Максимальное время ожидания доставки в секундах
+    
+    Returns:
+        Словарь с итогами замера (для --result-json)
+    """
+    url = f"ws://{host}:{port}"
+    stats = TopicReceiveStats()
+    rng = random.Random(1)
+    text = "x" * payload_size
+    
+    async with websockets.serve(handle_client, host, port, compression=None):
+        print(f"Подключение {num_clients} клиентов: {subscriptions} подписок на {num_topics} тем, "
+              f"{wildcard_clients} клиентов с подпиской по префиксу...")
+        tasks = []
+        connect_limit = asyncio.Semaphore(200)
+        
+        async def start(patterns: list):
+            async with connect_limit:
+                ready = asyncio.Event()
+                tasks.append(asyncio.create_task(topic_receiver(url, patterns, stats, ready)))
+                await ready.wait()
+        
+        await asyncio.gather(*(
+            start([bench_topic(rng.randrange(num_topics)) for _ in range(subscriptions)] +
+                  ([f"g{index % TOPIC_GROUPS}.*"] if index < wildcard_clients else []))
+            for index in range(num_clients)))
+        topics = client_manager.topics
+        print(f"Подключено клиентов: {client_manager.get_client_count()}, подписок: "
+              f"{topics.subscription_count()}, шаблонов: {topics.pattern_count()}")
+        print(f"Публикация {num_messages} сообщений по {payload_size} байт...\n")
+        
+        published = [bench_topic(rng.randrange(num_topics)) for _ in range(num_messages)]
+        expected = 0
+        start_time = time.time()
+        for i, topic in enumerate(published):
+            # Кадр кодируется один раз на публикацию
+            expected += client_manager.publish(topic, topic_message(topic, text))
+            if i % 16 == 15:
+                await asyncio.sleep(0)
+        publish_time = time.time() - start_time
+        
+        deadline = time.monotonic() + timeout
+        while stats.received < expected and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        delivery_time = time.time() - start_time
+        if stats.received < expected:
+            print(f"Внимание: не все сообщения доставлены за {timeout} секунд")
+        
+        # Только подбор подписчиков, без записи: индекс против перебора всех клиентов
+        sample = published[:1000]
+        start = time.perf_counter()
+        for topic in sample:
+            len(topics.subscribers(topic))
+        index_time = (time.perf_counter() - start) / len(sample) if sample else 0.0
+        snapshot = {client: set(patterns) for client, patterns in topics.by_client.items()}
+        start = time.perf_counter()
+        for topic in sample:
+            scan_subscribers(snapshot, topic)
+        scan_time = (time.perf_counter() - start) / len(sample) if sample else 0.0
+        
+        broadcast_stats = client_manager.get_broadcast_stats()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    
+    print(f"\n{'='*60}")
+    print("Замер публикации в темы завершен!")
+    print(f"Клиентов: {num_clients}, тем: {num_topics}, подписок на клиента: {subscriptions} "
+          f"(+{wildcard_clients} по префиксу)")
+    print(f"Публикаций: {num_messages}, размер текста: {payload_size} байт, "
+          f"подписчиков на публикацию: {expected / num_messages if num_messages else 0:.1f}")
+    print(f"Время публикации: {publish_time:.4f} секунд "
+          f"({num_messages / publish_time if publish_time > 0 else 0:.2f} публикаций/сек)")
+    print(f"Доставлено: {stats.received} из {expected} за {delivery_time:.4f} секунд "
+          f"({stats.received / delivery_time if delivery_time > 0 else 0:.2f} сообщений/сек)")
+    print(f"Подбор подписчиков на публикацию: индекс {index_time * 1e6:.1f} мкс, "
+          f"перебор всех клиентов {scan_time * 1e6:.1f} мкс")
+    print(f"{'='*60}\n")
+    
+    return {
+        'clients': num_clients,
+        'topics': num_topics,
+        'subscriptions': subscriptions,
+        'wildcard_clients': wildcard_clients,
+        'messages': num_messages,
+        'payload_size': payload_size,
+        'publish_time': publish_time,
+        'delivery_time': delivery_time,
+        'expected': expected,
+        'delivered': stats.received,
+        'index_lookup_us': index_time * 1e6,
+        'scan_lookup_us': scan_time * 1e6,
+        **broadcast_stats,
+    }
+
+
 async def main():
-    # Создаем сервер на стандартном адресе
-    host = "127.0.0.1"
-    port = 8765
+    # Парсинг аргументов командной строки
+    parser = argparse.ArgumentParser(description="WebSocket сервер для замера производительности исходящих сообщений")
+    parser.add_argument("--url", type=str, default="ws://127.0.0.1:8765",
+                       help="URL WebSocket сервера (по умолчанию: ws://127.0.0.1:8765)")
+    parser.add_argument("--broadcast-bench", action="store_true",
+                       help="Замер рассылки на множество локальных клиентов")
+    parser.add_argument("--topic-bench", action="store_true",
+                       help="Замер публикации в темы (подписки __SUBSCRIBE__, см. ws_topics.py) "
+                            "на множестве локальных клиентов")
+    parser.add_argument("--clients", type=int, default=1000,
+                       help="Количество локальных клиентов для замера рассылки и публикации (по умолчанию: 1000)")
+    parser.add_argument("--topics", type=int, default=5000,
+                       help="Количество тем для замера публикации (по умолчанию: 5000)")
+    parser.add_argument("--subscriptions", type=int, default=5,
+                       help="Подписок на точные темы у каждого клиента в замере публикации (по умолчанию: 5)")
+    parser.add_argument("--wildcard-clients", type=int, default=50,
+                       help="Клиентов с подпиской на группу тем по префиксу в замере публикации (по умолчанию: 50)")
+    parser.add_argument("--slow-clients", type=int, default=0,
+                       help="Количество клиентов, которые не читают сообщения (по умолчанию: 0)")
+    parser.add_argument("--messages", type=int, default=1000,
+                       help="Количество рассылаемых (публикуемых) сообщений (по умолчанию: 1000)")
+    parser.add_argument("--payload-size", type=int, default=64,
+                       help="Размер сообщения замера и рассылки в байтах (по умолчанию: 64)")
+    parser.add_argument("--window", type=int, default=0,
+                       help="Максимум неподтвержденных сообщений на подключение, если клиент подтверждает "
+                            "доставку (не меньше 2K, K - интервал подтверждений клиента), "
+                            "0 - без ограничения (по умолчанию: 0)")
+    parser.add_argument("--interval", type=float, default=1.0,
+                       help="Интервал для вывода хода отправки в секундах (по умолчанию: 1)")
+    parser.add_argument("--binary", action="store_true",
+                       help="Отправлять двоичные кадры (ws_protocol) и на текстовую команду запуска")
+    parser.add_argument("--max-queue", type=int, default=1024,
+                       help="Максимум кадров в очереди медленного клиента (по умолчанию: 1024)")
+    parser.add_argument("--overflow-policy", choices=OVERFLOW_POLICIES, default=OVERFLOW_DROP_OLDEST,
+                       help="Политика при переполнении очереди клиента (по умолчанию: drop_oldest)")
+    parser.add_argument("--timeout", type=float, default=60.0,
+                       help="Максимальное время ожидания доставки рассылки в секундах (по умолчанию: 60)")
+    parser.add_argument("--result-json", type=str, default=None,
+                       help="Сохранить итоги замера рассылки или публикации в JSON файл (для bench-suite.py)")
+    parser.add_argument("--no-metrics", action="store_true",
+                       help="Не отвечать на HTTP GET /metrics (метрики Prometheus на порту сервера)")
+    parser.add_argument("--stream-file", type=str, default=None,
+                       help="Файл для потоковой отправки по команде __BENCHMARK_STREAM__ "
+                            "(по умолчанию: запрошенное клиентом количество нулевых байтов)")
+    add_compression_arguments(parser)
+    add_session_arguments(parser)
+    add_profile_arguments(parser)
+    add_log_arguments(parser)
+    
+    args = parser.parse_args()
+    
+    # Парсим URL для извлечения host и port
+    url_result = parse_ws_url(args.url)
+    if not url_result:
+        print(f"Ошибка: неверный формат URL: {args.url}")
+        print("Ожидается формат: ws://host:port")
+        return
+    
+    host, port = url_result
+    
+    try:
+        configure_logging(**log_options_from_args(args))
+    except ValueError as e:
+        print(f"Ошибка: {e}")
+        return
+    
+    global force_binary, send_window, report_interval, stream_file, instrumentation
+    instrumentation = Instrumentation(**profile_options_from_args(args))
+    force_binary = args.binary
+    stream_file = args.stream_file
+    send_window = args.window
+    report_interval = args.interval
+    payload_buffers[False] = PayloadBuffers(args.payload_size, False)
+    payload_buffers[True] = PayloadBuffers(args.payload_size, True)
+    
+    client_manager.max_queue = args.max_queue
+    client_manager.overflow_policy = args.overflow_policy
+    session_options = session_options_from_args(args)
+    if session_options is not None:
+        client_manager.enable_sessions(**session_options)
+    
+    if args.broadcast_bench or args.topic_bench:
+        if args.topic_bench:
+            result = await run_topic_benchmark(host, port, args.clients, args.messages, args.payload_size,
+                                               args.topics, args.subscriptions, args.wildcard_clients,
+                                               args.timeout)
+        else:
+            result = await run_broadcast_benchmark(host, port, args.clients, args.messages, args.payload_size,
+                                                   args.slow_clients, args.timeout)
+        if args.result_json:
+            with open(args.result_json, "w", encoding="utf-8") as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+        return
     
     # Настраиваем callbacks для менеджера клиентов
     client_manager.set_on_connect(on_client_connect)
@@ -101,11 +775,27 @@ async def main():
     startup_message = (
         f"WebSocket сервер запущен на ws://{host}:{port}\n"
         "Ожидание подключений для замера производительности исходящих сообщений...\n"
-        "Формат команды: __BENCHMARK_START__:N (где N - количество сообщений)"
+        "Формат команды: __BENCHMARK_START__:N (где N - количество сообщений)\n"
+        "или двоичный кадр START с N в поле последовательности (см. ws_protocol.py)\n"
+        "Потоковая отправка: __BENCHMARK_STREAM__:<байт>:<размер фрагмента> (см. ws_stream.py)\n"
+        "Темы: __SUBSCRIBE__:<шаблон>, __UNSUBSCRIBE__:<шаблон>, __PUBLISH__:<тема>:<текст> (см. ws_topics.py)"
+        + ("\nСессии: __SESSION__, __RESUME__:<id>:<N> (см. ws_session.py)" if session_options else "")
     )
     
+    metrics = None if args.no_metrics else ServerMetrics(client_manager, lambda: active_sends, instrumentation,
+                                                         router)
+    instrumentation.start_async()
+    
     # Запускаем сервер
-    await run_websocket_server(handle_client, host, port, startup_message)
+    try:
+        await run_websocket_server(handle_client, host, port, startup_message, metrics=metrics,
+                                   serve_options=server_options_from_args(args))
+    finally:
+        instrumentation.close()
+        close_logging()
+        print(f"Управляющие команды: {router.summary()}")
+        if client_manager.sessions is not None:
+            print(f"Сессии: {client_manager.sessions.summary()}")
 
 
 if __name__ == "__main__":
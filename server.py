@@ -1,119 +1,46 @@
 """
 Простой WebSocket сервер
 """
-from websocket_server import WebsocketServer
-import threading
-import time
+import argparse
 from keyboard_input import KeyboardInputHandler
+from ws_stats import StatsRegistry
+from ws_backends import BenchmarkApp, ThreadedBackend, add_ack_arguments, ack_options_from_args
+from ws_protocol import ACK_ECHO
+from ws_capture import CaptureWriter, DEFAULT_CAPTURE_SIZE_MB
+from ws_log import add_log_arguments, log_options_from_args, configure_logging, flush_logs
 
-# Словарь для хранения статистики бенчмарка по клиентам
-benchmark_stats = {}
+PORT = 8765
+# Интервал вывода статистики замера в секундах
+STATS_INTERVAL = 1.0
 
-def new_client(client, server):
-    """Вызывается когда новый клиент подключается"""
-    print(f"Новый клиент подключен: {client['id']}")
-    server.send_message_to_all("Новый клиент подключился!")
+# Счетчики замеров по клиентам и общие итоги сервера
+stats_registry = StatsRegistry()
+# Обработка сообщений: обычные выводятся в журнал (компонент messages), на все отвечаем эхом
+app = BenchmarkApp(stats_registry, echo=True, chat=True, greeting="Новый клиент подключился!")
 
 
-def client_left(client, server):
-    """Вызывается когда клиент отключается"""
-    client_id = client['id']
-    print(f"Клиент отключен: {client_id}")
-    # Очищаем статистику бенчмарка для отключившегося клиента
-    global benchmark_stats
-    if client_id in benchmark_stats:
-        del benchmark_stats[client_id]
-
-
-def message_received(client, server, message):
-    """Вызывается когда получено сообщение от клиента"""
-    # Исправляем декодирование: если сообщение пришло как неправильно декодированная строка
-    if isinstance(message, bytes):
-        # Если сообщение пришло как bytes, декодируем как UTF-8
-        message = message.decode('utf-8')
-    elif isinstance(message, str):
-        # Если это неправильно декодированная строка (UTF-8 байты, прочитанные как Latin-1)
-        # Преобразуем обратно в байты (Latin-1 сохраняет все байты 1:1) и декодируем как UTF-8
-        try:
-            message = message.encode('latin-1').decode('utf-8')
-        except (UnicodeEncodeError, UnicodeDecodeError):
-            pass  # Если не получилось, оставляем как есть
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Простой WebSocket сервер")
+    parser.add_argument("--capture", type=str, default=None,
+                       help="Записывать все входящие кадры в журнал (см. ws_capture.py и replay.py)")
+    parser.add_argument("--capture-size", type=int, default=DEFAULT_CAPTURE_SIZE_MB,
+                       help=f"Размер заранее выделенного журнала в МБ (по умолчанию: {DEFAULT_CAPTURE_SIZE_MB})")
+    add_ack_arguments(parser, ACK_ECHO)
+    add_log_arguments(parser)
+    args = parser.parse_args()
     
-    global benchmark_stats
-    client_id = client['id']
+    try:
+        configure_logging(**log_options_from_args(args))
+    except ValueError as e:
+        parser.error(str(e))
     
-    # Обработка меток бенчмарка
-    if message == "__BENCHMARK_START__":
-        # Инициализируем статистику для клиента
-        benchmark_stats[client_id] = {
-            'start_time': time.time(),
-            'interval_start': time.time(),
-            'message_count': 0,
-            'interval_count': 0,
-            'interval': 1.0  # Интервал статистики по умолчанию 1 секунда
-        }
-        print(f"\n{'='*60}")
-        print(f"Клиент {client_id}: Выполняется замер производительности...")
-        print(f"{'='*60}\n")
-        server.send_message(client, f"Сервер получил: {message}")
-        return
-    elif message == "__BENCHMARK_END__":
-        # Выводим финальную статистику
-        if client_id in benchmark_stats:
-            stats = benchmark_stats[client_id]
-            total_time = time.time() - stats['start_time']
-            total_rate = stats['message_count'] / total_time if total_time > 0 else 0
-            
-            print(f"\n{'='*60}")
-            print(f"Клиент {client_id}: Замер завершен!")
-            print(f"Всего получено: {stats['message_count']} сообщений")
-            print(f"Общее время: {total_time:.2f} секунд")
-            print(f"Средняя скорость: {total_rate:.2f} сообщений/секунду")
-            print(f"{'='*60}\n")
-            
-            # Удаляем статистику клиента
-            del benchmark_stats[client_id]
-        
-        server.send_message(client, f"Сервер получил: {message}")
-        return
-    elif message.startswith("__BENCHMARK_DATA__"):
-        # Обновляем статистику и проверяем интервалы
-        if client_id in benchmark_stats:
-            stats = benchmark_stats[client_id]
-            stats['message_count'] += 1
-            stats['interval_count'] += 1
-            
-            # Проверяем, нужно ли вывести статистику за интервал
-            current_time = time.time()
-            if current_time - stats['interval_start'] >= stats['interval']:
-                elapsed = current_time - stats['interval_start']
-                rate = stats['interval_count'] / elapsed if elapsed > 0 else 0
-                total_elapsed = current_time - stats['start_time']
-                print(f"[Сервер] Клиент {client_id} [{total_elapsed:.1f}с] "
-                      f"Получено: {stats['interval_count']} сообщений за {elapsed:.1f}с "
-                      f"({rate:.2f} сообщений/сек)")
-                stats['interval_start'] = current_time
-                stats['interval_count'] = 0
-        
-        # Сообщения бенчмарка не выводим в консоль, только обрабатываем
-        server.send_message(client, f"Сервер получил: {message}")
-        return
+    app.set_ack_options(**ack_options_from_args(args))
     
-    # Обычные сообщения выводим в консоль
-    print(f"Клиент {client['id']} отправил: {message}")
-    # Отправляем ответ обратно клиенту
-    server.send_message(client, f"Сервер получил: {message}")
-    # Или отправляем всем
-    # server.send_message_to_all(f"Клиент {client['id']} сказал: {message}")
-
-
-if __name__ == "__main__":
-    PORT = 8765
-    server = WebsocketServer(host="127.0.0.1", port=PORT)
+    if args.capture:
+        app.recorder = CaptureWriter(args.capture, args.capture_size)
     
-    server.set_fn_new_client(new_client)
-    server.set_fn_client_left(client_left)
-    server.set_fn_message_received(message_received)
+    # Сервер с потоком на каждого клиента (websocket_server)
+    backend = ThreadedBackend(app, "127.0.0.1", PORT)
     
     # Создаем обработчик ввода с клавиатуры
     keyboard_handler = KeyboardInputHandler()
@@ -124,9 +51,11 @@ if __name__ == "__main__":
     # Запускаем поток для ввода с клавиатуры
     keyboard_handler.start()
     
+    # Интервальную статистику замеров выводит отдельный поток
+    stats_registry.start_reporter_thread(STATS_INTERVAL)
+    
     # Запускаем сервер в отдельном потоке
-    server_thread = threading.Thread(target=server.run_forever, daemon=True)
-    server_thread.start()
+    server_thread = backend.start()
     
     # Основной цикл: проверяем очередь и отправляем сообщения всем клиентам
     try:
@@ -134,9 +63,14 @@ if __name__ == "__main__":
             # Получаем сообщение из очереди
             message = keyboard_handler.get_message(timeout=0.1)
             if message:
-                server.send_message_to_all(f"[Сервер]: {message}")
+                backend.broadcast(f"[Сервер]: {message}")
     except KeyboardInterrupt:
         keyboard_handler.stop()
     
+    flush_logs()
     print("\nОстановка сервера...")
+    print(f"Управляющие команды: {app.router.summary()}")
     keyboard_handler.stop()
+    if app.recorder:
+        app.recorder.close()
+        print(app.recorder.summary())
@@ -0,0 +1,190 @@
+"""
+Замер потоковой передачи больших сообщений фрагментами (см. ws_stream.py)
+
+Запускает сервер websockets на свободном локальном порту в этом же процессе
+и для каждого размера фрагмента передает файл (или нулевые данные заданного
+размера) одним фрагментированным сообщением в обе стороны:
+
+    сервер -> клиент  сервер пишет срезы отображения файла прямо в транспорт,
+                      клиент пишет фрагменты в файл по мере прихода
+    клиент -> сервер  клиент отправляет срезы отображения (маскирует
+                      websockets), сервер пишет фрагменты в файл
+
+Выводятся скорость (МБ/сек) и пиковая память процесса: RSS и анонимная
+часть RSS (копии данных в памяти Python). Сервер и клиент работают в одном
+процессе, поэтому память - общая для обеих сторон.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import websockets
+
+from ws_stream import (MappedSource, FragmentSink, RssSampler, stream_send, receive_stream, parse_stream_command,
+                       memory_usage, format_mb, stream_rate, STREAM_COMMAND, UPLOAD_COMMAND)
+from ws_suite import find_free_port
+from ws_compression import parse_int_list
+
+DIRECTION_OUT = "сервер -> клиент"
+DIRECTION_IN = "клиент -> сервер"
+
+
+class StreamServer:
+    """Сервер замера: отправляет источник по __BENCHMARK_STREAM__ и принимает __BENCHMARK_UPLOAD__"""
+
+    def __init__(self, source: MappedSource, output_dir: str = None):
+        """
+        Args:
+            source: Источник для отправки клиенту
+            output_dir: Каталог для принятых файлов (None - только считать байты)
+        """
+        self.source = source
+        self.output_dir = output_dir
+
+    def sink(self, name: str) -> FragmentSink:
+        """Приемник фрагментов: файл в output_dir или только счетчик"""
+        return FragmentSink(os.path.join(self.output_dir, name) if self.output_dir else None)
+
+    async def handle(self, websocket):
+        """Обработчик подключения"""
+        try:
+            async for message in websocket:
+                if isinstance(message, bytes):
+                    continue
+                request = parse_stream_command(message, STREAM_COMMAND)
+                if request is not None and len(request) == 2:
+                    await websocket.send(f"{STREAM_COMMAND}:{len(self.source)}:{request[1]}")
+                    await stream_send(websocket, self.source, request[1])
+                    continue
+                if parse_stream_command(message, UPLOAD_COMMAND) is not None:
+                    sink = self.sink(f"upload-{time.time_ns()}.bin")
+                    start = time.perf_counter()
+                    try:
+                        await receive_stream(websocket, sink)
+                    finally:
+                        sink.close()
+                    elapsed = time.perf_counter() - start
+                    await websocket.send(f"{UPLOAD_COMMAND}:{sink.received}:{int(elapsed * 1_000_000)}")
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+
+async def measure_out(websocket, server: StreamServer, fragment_size: int) -> dict:
+    """Сервер -> клиент: клиент запрашивает поток и пишет фрагменты в приемник"""
+    sampler = RssSampler()
+    sampler.start()
+    start = time.perf_counter()
+    await websocket.send(f"{STREAM_COMMAND}:{len(server.source)}:{fragment_size}")
+    await websocket.recv()
+    sink = server.sink(f"download-{fragment_size}.bin")
+    try:
+        await receive_stream(websocket, sink)
+    finally:
+        sink.close()
+    elapsed = time.perf_counter() - start
+    await sampler.stop()
+    return {"direction": DIRECTION_OUT, "bytes": sink.received, "fragments": sink.fragments,
+            "elapsed": elapsed, "peak_rss": sampler.peak_rss, "peak_anon": sampler.peak_anon}
+
+
+async def measure_in(websocket, source: MappedSource, fragment_size: int) -> dict:
+    """Клиент -> сервер: клиент отправляет источник, время - до ответа сервера о приеме"""
+    sampler = RssSampler()
+    sampler.start()
+    start = time.perf_counter()
+    await websocket.send(f"{UPLOAD_COMMAND}:{len(source)}")
+    sent = await stream_send(websocket, source, fragment_size)
+    reply = parse_stream_command(await websocket.recv(), UPLOAD_COMMAND)
+    elapsed = time.perf_counter() - start
+    await sampler.stop()
+    received = reply[0] if reply else 0
+    return {"direction": DIRECTION_IN, "bytes": received, "fragments": -(-sent // fragment_size),
+            "elapsed": elapsed, "peak_rss": sampler.peak_rss, "peak_anon": sampler.peak_anon}
+
+
+async def run_bench(source: MappedSource, fragment_sizes: list, host: str, output_dir: str = None) -> list:
+    """
+    Прогоняет замер для каждого размера фрагмента в обе стороны
+
+    Returns:
+        Список результатов (словари с направлением, байтами, временем и памятью)
+    """
+    server = StreamServer(source, output_dir)
+    port = find_free_port(host)
+    results = []
+    async with websockets.serve(server.handle, host, port, max_size=None, compression=None):
+        async with websockets.connect(f"ws://{host}:{port}", max_size=None, compression=None) as websocket:
+            for fragment_size in fragment_sizes:
+                for measure in (measure_out(websocket, server, fragment_size),
+                                measure_in(websocket, source, fragment_size)):
+                    result = await measure
+                    result["fragment_size"] = fragment_size
+                    print(f"Фрагмент {fragment_size} байт, {result['direction']}: "
+                          f"{stream_rate(result['bytes'], result['elapsed']):.1f} МБ/сек, "
+                          f"пиковый RSS {format_mb(result['peak_rss'])}, "
+                          f"анонимная {format_mb(result['peak_anon'])}")
+                    results.append(result)
+    return results
+
+
+def print_results(results: list, size: int, base_rss: int, base_anon: int):
+    """Итоговая таблица замера"""
+    print(f"\n{'='*60}")
+    print("Потоковая передача: итоги")
+    print(f"Размер сообщения: {format_mb(size)}")
+    print(f"Память до замера: RSS {format_mb(base_rss)}, анонимная {format_mb(base_anon)}")
+    print(f"{'Фрагмент':>10}  {'Направление':<17}{'МБ/сек':>9}{'RSS, МБ':>10}{'Аноним., МБ':>13}")
+    for result in results:
+        print(f"{result['fragment_size']:>10}  {result['direction']:<17}"
+              f"{stream_rate(result['bytes'], result['elapsed']):>9.1f}"
+              f"{result['peak_rss'] / (1024 * 1024):>10.1f}{result['peak_anon'] / (1024 * 1024):>13.1f}")
+    incomplete = [result for result in results if result["bytes"] != size]
+    if incomplete:
+        print(f"Внимание: передано не полностью в {len(incomplete)} замерах")
+    print(f"{'='*60}\n")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Замер потоковой передачи больших сообщений фрагментами")
+    parser.add_argument("--file", type=str, default=None,
+                       help="Передаваемый файл (по умолчанию: нулевые данные размером --size-mb)")
+    parser.add_argument("--size-mb", type=int, default=256,
+                       help="Размер нулевых данных в МБ, если не задан --file (по умолчанию: 256)")
+    parser.add_argument("--fragment-sizes", type=str, default="65536,262144,1048576,4194304",
+                       help="Размеры фрагментов в байтах через запятую (по умолчанию: 65536,262144,1048576,4194304)")
+    parser.add_argument("--output-dir", type=str, default=None,
+                       help="Каталог для принятых файлов (по умолчанию: только считать байты)")
+    parser.add_argument("--host", type=str, default="127.0.0.1",
+                       help="Локальный адрес сервера (по умолчанию: 127.0.0.1)")
+    parser.add_argument("--result-json", type=str, default=None,
+                       help="Сохранить результаты в JSON файл")
+
+    args = parser.parse_args()
+
+    fragment_sizes = parse_int_list(args.fragment_sizes)
+    base_rss, base_anon = memory_usage()
+    source = MappedSource(args.file) if args.file else MappedSource.zeros(args.size_mb * 1024 * 1024)
+    with source:
+        size = len(source)
+        print(f"\n{'='*60}")
+        print(f"Замер потоковой передачи: {args.file or 'нулевые данные'}, {format_mb(size)}")
+        print(f"Фрагменты: {', '.join(str(fragment_size) for fragment_size in fragment_sizes)} байт")
+        print(f"Принятые данные: {args.output_dir or 'не сохраняются'}")
+        print(f"{'='*60}\n")
+        try:
+            results = asyncio.run(run_bench(source, fragment_sizes, args.host, args.output_dir))
+        except KeyboardInterrupt:
+            return 1
+
+    print_results(results, size, base_rss, base_anon)
+    if args.result_json:
+        with open(args.result_json, "w", encoding="utf-8") as f:
+            json.dump({"size": size, "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.result_json}")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,57 @@
+"""Рассылка ClientManager через шину ws_bus: кадр больше допустимого шиной"""
+import asyncio
+import json
+
+import websockets
+from websockets.asyncio.server import serve
+
+from ws_bus import MessageBus
+from ws_client_manager import ClientManager, encode_broadcast_frame
+from ws_log import FORMAT_JSON, configure_logging, flush_logs
+from ws_suite import find_free_port
+
+HOST = "127.0.0.1"
+
+
+def test_oversize_broadcast_is_delivered_locally_and_not_relayed(tmp_path):
+    log_path = tmp_path / "server.log"
+    configure_logging("warning", FORMAT_JSON, str(log_path))
+    bus = MessageBus.create(str(tmp_path / "bus"), size_mb=1)
+    client_manager = ClientManager()
+    client_manager.attach_bus(bus)
+    oversize = "x" * bus.max_record
+    port = find_free_port(HOST)
+
+    async def handler(websocket):
+        client_manager.add_client(websocket)
+        try:
+            await websocket.wait_closed()
+        finally:
+            client_manager.remove_client(websocket)
+
+    async def run():
+        async with serve(handler, HOST, port):
+            async with websockets.connect(f"ws://{HOST}:{port}", max_size=None) as websocket:
+                while not client_manager.get_client_count():
+                    await asyncio.sleep(0.01)
+                client_manager.broadcast_frame(encode_broadcast_frame(oversize))
+                client_manager.broadcast_frame(encode_broadcast_frame("small"))
+                return [await websocket.recv() for _ in range(2)]
+
+    try:
+        received = asyncio.run(run())
+        published = bus.published()
+        flush_logs()
+    finally:
+        configure_logging()
+        bus.close(unlink=True)
+
+    # Оба кадра дошли до клиента этого процесса, в шину попал только малый
+    assert received == [oversize, "small"]
+    assert published == 1
+    stats = client_manager.get_broadcast_stats()
+    assert stats['broadcasts'] == 2
+    assert stats['bus_unrelayed'] == 1
+    records = [json.loads(line) for line in log_path.read_text(encoding="utf-8").splitlines()]
+    assert [(record['component'], record['level']) for record in records] == [("messages", "warning")]
+    assert records[0]['size'] == len(encode_broadcast_frame(oversize))
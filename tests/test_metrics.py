@@ -0,0 +1,51 @@
+"""Счетчики сообщений /metrics на сервере server-bench.py (бэкенд websockets)"""
+import asyncio
+import urllib.request
+
+import websockets
+
+from ws_suite import ServerProcess, find_free_port
+
+HOST = "127.0.0.1"
+
+
+def read_metrics(port: int) -> dict:
+    """Значения метрик по строке "имя{метки}" """
+    with urllib.request.urlopen(f"http://{HOST}:{port}/metrics", timeout=5) as response:
+        text = response.read().decode("utf-8")
+    values = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            name, _, value = line.rpartition(" ")
+            values[name] = float(value)
+    return values
+
+
+def client_values(metrics: dict, name: str) -> list:
+    return [value for key, value in metrics.items() if key.startswith(name + "{")]
+
+
+def test_echo_round_trip_counts_messages():
+    port = find_free_port(HOST)
+    count = 20
+
+    async def round_trip():
+        async with websockets.connect(f"ws://{HOST}:{port}") as websocket:
+            for index in range(count):
+                await websocket.send(f"__BENCHMARK_DATA__{index}:x")
+                await websocket.recv()
+            # Метрики читаются при открытом подключении: счетчики по клиенту
+            return await asyncio.get_running_loop().run_in_executor(None, read_metrics, port)
+
+    with ServerProcess("server-bench.py", HOST, port,
+                       ["--backend", "websockets", "--echo", "--log-level", "off"]):
+        metrics = asyncio.run(round_trip())
+        closed = read_metrics(port)
+
+    assert metrics["ws_messages_received_total"] == count
+    assert metrics["ws_messages_sent_total"] == count
+    assert client_values(metrics, "ws_client_messages_received_total") == [count]
+    assert client_values(metrics, "ws_client_messages_sent_total") == [count]
+    # Закрытое подключение остается в итогах сервера
+    assert closed["ws_messages_received_total"] == count
+    assert closed["ws_messages_sent_total"] == count
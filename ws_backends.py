@@ -0,0 +1,687 @@
+"""
+Серверные бэкенды с общей логикой замера и эха
+
+BenchmarkApp содержит обработку сообщений бенчмарка (текстовые метки и
+двоичные кадры ws_protocol), эхо и учет статистики в одном месте. Бэкенды
+только принимают подключения и сообщения и передают их в BenchmarkApp:
+
+    threaded    - поток на клиента, библиотека websocket_server
+    websockets  - asyncio, библиотека websockets
+    raw         - asyncio.Protocol с минимальным разбором кадров (ws_raw.py)
+
+Так один и тот же замер можно прогнать на разных реализациях сервера.
+Сообщения с данными замера обрабатываются первой же проверкой, управляющие
+команды (запуск и конец замера, профилировщик, рассылка) BenchmarkApp
+находит в таблице CommandRouter (ws_router.py).
+Время обработки сообщений (ws_profile.HandlerTimer) бэкенды записывают
+по обработчикам text и binary, только если оно включено. В плотном режиме
+(ws_density.py) бэкенды websockets и raw нумеруют подключения малыми
+целыми номерами и отправляют ping всем подключениям одним колесом таймеров.
+
+На сообщения замера BenchmarkApp отвечает в режиме подтверждения
+подключения (ws_protocol.ACK_MODES): режим по умолчанию задает сервер,
+клиент может запросить другой в команде запуска замера.
+"""
+import asyncio
+import itertools
+import os
+import threading
+import time
+from typing import Callable, Optional, Set
+
+import websockets
+from websocket_server import WebsocketServer
+
+from ws_protocol import (decode_header, encode_frame, parse_ack_request, parse_ack_mode, FRAME_MAGIC,
+                         MSG_START, MSG_DATA, MSG_END, MSG_ACK, BENCHMARK_DATA_PREFIX, BENCHMARK_START, BENCHMARK_END,
+                         BENCHMARK_ACK_PREFIX, BENCHMARK_BROADCAST,
+                         ACK_MODES, ACK_NONE, ACK_ECHO, ACK_COMPACT, ACK_COALESCED)
+from ws_stats import StatsRegistry, ConnectionStats, log_benchmark_start, log_benchmark_result
+from ws_utils import run_websocket_server, get_client_id
+from ws_client_manager import ClientManager
+from ws_raw import RawWebSocketProtocol, CLOSE_NORMAL
+from ws_sender import build_frame_header, OPCODE_BINARY
+from ws_metrics import ServerMetrics, add_messages_in
+from ws_compat import abort
+from ws_capture import CaptureWriter, REC_TEXT, REC_BINARY, REC_OPEN, REC_CLOSE
+from ws_stream import FragmentSink, receive_stream, parse_stream_command, format_mb, stream_rate, UPLOAD_COMMAND
+from ws_profile import Instrumentation, PROFILE_START, PROFILE_STOP
+from ws_log import get_logger
+from ws_density import KeepaliveScheduler
+from ws_bus import MessageBus
+from ws_router import CommandRouter, CommandError
+
+connections_log = get_logger("connections")
+messages_log = get_logger("messages")
+bench_log = get_logger("bench")
+
+BACKEND_THREADED = "threaded"
+BACKEND_WEBSOCKETS = "websockets"
+BACKEND_RAW = "raw"
+BACKENDS = (BACKEND_THREADED, BACKEND_WEBSOCKETS, BACKEND_RAW)
+
+# Первый символ двоичного кадра в строке, которую отдает websocket_server
+BINARY_FRAME_MARK = chr(FRAME_MAGIC)
+
+
+def add_ack_arguments(parser, default_mode: Optional[str] = None):
+    """Добавляет в argparse параметры режима подтверждения сообщений замера"""
+    parser.add_argument("--ack-mode", choices=ACK_MODES, default=default_mode,
+                       help="Ответ на сообщения замера, если клиент не запросил другой: none, echo (полное эхо), "
+                            "compact (короткий ответ на каждое) или coalesced (накопительное подтверждение) "
+                            f"(по умолчанию: {default_mode or 'echo при --echo, иначе none'})")
+    parser.add_argument("--ack-every", type=int, default=64,
+                       help="Режим coalesced: подтверждать каждые N сообщений (по умолчанию: 64)")
+    parser.add_argument("--ack-interval", type=float, default=50.0,
+                       help="Режим coalesced: подтверждать не реже чем раз в T мс (по умолчанию: 50)")
+
+
+def ack_options_from_args(args) -> dict:
+    """Параметры BenchmarkApp из аргументов add_ack_arguments"""
+    return {'ack_mode': args.ack_mode, 'ack_every': args.ack_every, 'ack_interval': args.ack_interval / 1000}
+
+
+class ConnectionState:
+    """Состояние подключения в BenchmarkApp"""
+
+    __slots__ = ("key", "client_id", "conn_id", "stats", "ack_mode", "ack_every", "ack_interval_ns",
+                 "received", "acked", "last_ack_ns", "last_sequence", "last_timestamp")
+
+    def __init__(self, key, client_id, conn_id: int, ack_mode: str, ack_every: int, ack_interval_ns: int):
+        self.key = key
+        self.client_id = client_id
+        # Компактный номер подключения для журнала трафика
+        self.conn_id = conn_id
+        # Счетчики текущего замера: на пути приема только увеличиваем их
+        self.stats: Optional[ConnectionStats] = None
+        self.ack_mode = ack_mode
+        self.ack_every = ack_every
+        self.ack_interval_ns = ack_interval_ns
+        self.reset_acks()
+
+    def reset_acks(self):
+        """Сбрасывает счетчики накопительного подтверждения (начало замера)"""
+        # Принято сообщений с данными (для двоичных кадров - наибольший номер + 1)
+        self.received = 0
+        self.acked = 0
+        self.last_ack_ns = time.monotonic_ns()
+        # Номер последнего текстового сообщения (как прислал клиент) или
+        # время отправки последнего двоичного кадра - для RTT по подтверждению
+        self.last_sequence = ""
+        self.last_timestamp = 0
+
+    def ack_due(self) -> bool:
+        """Пора ли отправить накопительное подтверждение"""
+        if self.received - self.acked >= self.ack_every:
+            return True
+        return self.received > self.acked and time.monotonic_ns() - self.last_ack_ns >= self.ack_interval_ns
+
+    def make_text_ack(self) -> str:
+        """Текстовое подтверждение __BENCHMARK_ACK__:M[:номер последнего сообщения]"""
+        self.acked = self.received
+        self.last_ack_ns = time.monotonic_ns()
+        if self.last_sequence.isdigit():
+            return f"{BENCHMARK_ACK_PREFIX}{self.received}:{self.last_sequence}"
+        return f"{BENCHMARK_ACK_PREFIX}{self.received}"
+
+    def make_binary_ack(self, stream_id: int) -> bytes:
+        """Двоичное подтверждение ACK со временем отправки последнего кадра"""
+        self.acked = self.received
+        self.last_ack_ns = time.monotonic_ns()
+        return encode_frame(MSG_ACK, stream_id, self.received, b"", self.last_timestamp)
+
+
+class BenchmarkApp:
+    """Общая логика замера и эха для всех бэкендов"""
+
+    def __init__(self, stats_registry: StatsRegistry, echo: bool = False, chat: bool = False,
+                 greeting: Optional[str] = None, recorder: Optional[CaptureWriter] = None,
+                 ack_mode: Optional[str] = None, ack_every: int = 64, ack_interval: float = 0.05,
+                 instrumentation: Optional[Instrumentation] = None):
+        """
+        Args:
+            stats_registry: Счетчики замеров
+            echo: Отвечать эхом на сообщения бенчмарка (для замера RTT в client.py)
+            chat: Выводить обычные сообщения в консоль и отвечать на них
+            greeting: Сообщение всем клиентам при подключении нового клиента
+            recorder: Журнал для записи всех входящих кадров (см. ws_capture.py)
+            ack_mode: Режим подтверждения по умолчанию (ACK_*); по умолчанию
+                ACK_ECHO при echo, иначе ACK_NONE
+            ack_every: Режим coalesced: подтверждать каждые ack_every сообщений
+            ack_interval: Режим coalesced: подтверждать не реже чем раз в ack_interval
+                секунд (проверяется при приходе сообщения)
+            instrumentation: Диагностика сервера (см. ws_profile.py): управляющие
+                сообщения __PROFILE_*__ и время обработчиков
+        """
+        self.stats_registry = stats_registry
+        self.instrumentation = instrumentation
+        self.handler_timer = instrumentation.timer if instrumentation is not None else None
+        self.echo = echo
+        self.set_ack_options(ack_mode, ack_every, ack_interval)
+        self.chat = chat
+        self.greeting = greeting
+        self.recorder = recorder
+        self.connection_count = 0
+        self.conn_ids = itertools.count(1)
+        # Бэкенд threaded подключает и отключает клиентов из разных потоков
+        self.count_lock = threading.Lock()
+        # Рассылка всем клиентам по __BENCHMARK_BROADCAST__: задает бэкенд
+        self.broadcast: Optional[Callable[[str], None]] = None
+        self.router = CommandRouter(self.handler_timer)
+        router = self.router
+        router.register(BENCHMARK_START, self._start_command, ("ack=режим", parse_ack_mode), ("N", int), ("T", int),
+                        required=0)
+        router.register(BENCHMARK_END, self._end_command)
+        router.register(BENCHMARK_BROADCAST.rstrip(":"), self._broadcast_command, ("текст", str), rest=True)
+        if instrumentation is not None:
+            router.register(PROFILE_START, self._profile_command)
+            router.register(PROFILE_STOP, self._profile_command)
+        router.register_binary(MSG_START, self._start_frame, "binary_start")
+        router.register_binary(MSG_END, self._end_frame, "binary_end")
+
+    def set_ack_options(self, ack_mode: Optional[str] = None, ack_every: int = 64, ack_interval: float = 0.05):
+        """Задает режим подтверждения для новых подключений (см. __init__)"""
+        self.ack_mode = ack_mode or (ACK_ECHO if self.echo else ACK_NONE)
+        self.ack_every = max(1, ack_every)
+        self.ack_interval_ns = int(ack_interval * 1_000_000_000)
+
+    def connect(self, key, client_id) -> ConnectionState:
+        """Регистрирует подключение"""
+        with self.count_lock:
+            self.connection_count += 1
+            conn_id = next(self.conn_ids)
+        connections_log.info(f"Новый клиент подключен: {client_id}", client=client_id, event="connect")
+        state = ConnectionState(key, client_id, conn_id, self.ack_mode, self.ack_every, self.ack_interval_ns)
+        if self.recorder is not None:
+            self.recorder.record(state.conn_id, REC_OPEN)
+        return state
+
+    def disconnect(self, state: ConnectionState):
+        """Удаляет подключение и его статистику"""
+        with self.count_lock:
+            self.connection_count -= 1
+        connections_log.info(f"Клиент отключен: {state.client_id}", client=state.client_id, event="disconnect")
+        if self.recorder is not None:
+            self.recorder.record(state.conn_id, REC_CLOSE)
+        self.stats_registry.finish(state.key)
+        state.stats = None
+
+    def _start(self, state: ConnectionState, request=None):
+        state.stats = self.stats_registry.start(state.key, state.client_id)
+        state.reset_acks()
+        # Режим действует до конца замера: запуск без запроса - снова режим сервера
+        state.ack_mode, state.ack_every, state.ack_interval_ns = self.ack_mode, self.ack_every, self.ack_interval_ns
+        if request is not None:
+            state.ack_mode, ack_every, ack_interval_ms = request
+            if ack_every:
+                state.ack_every = ack_every
+            if ack_interval_ms is not None:
+                state.ack_interval_ns = ack_interval_ms * 1_000_000
+        log_benchmark_start(state.client_id)
+        if state.ack_mode != ACK_NONE:
+            bench_log.info(f"Режим подтверждения: {state.ack_mode}"
+                           + (f" (каждые {state.ack_every} сообщений, {state.ack_interval_ns / 1e6:g} мс)"
+                              if state.ack_mode == ACK_COALESCED else ""),
+                           client=state.client_id, ack_mode=state.ack_mode)
+
+    def _end(self, state: ConnectionState, sent_count: int = 0):
+        state.stats = None
+        stats = self.stats_registry.finish(state.key)
+        if stats:
+            log_benchmark_result(stats, sent_count)
+
+    def _start_command(self, state: ConnectionState, message: str, mode: Optional[str] = None,
+                       ack_every: Optional[int] = None, ack_interval_ms: Optional[int] = None) -> Optional[str]:
+        # __BENCHMARK_START__[:ack=<режим>[:N[:T]]]
+        if mode is None:
+            self._start(state)
+        else:
+            self._start(state, (mode, ack_every, ack_interval_ms))
+        return f"Сервер получил: {message}" if state.ack_mode == ACK_ECHO else None
+
+    def _end_command(self, state: ConnectionState, message: str) -> Optional[str]:
+        self._end(state)
+        if state.ack_mode == ACK_COALESCED:
+            return state.make_text_ack()
+        return f"Сервер получил: {message}" if state.ack_mode == ACK_ECHO else None
+
+    def _broadcast_command(self, state: ConnectionState, message: str, text: str) -> None:
+        if self.broadcast is not None:
+            self.broadcast(text)
+
+    def _profile_command(self, state: ConnectionState, message: str) -> Optional[str]:
+        return self.instrumentation.handle_control(message)
+
+    def _start_frame(self, state: ConnectionState, data, header: tuple) -> Optional[bytes]:
+        self._start(state, parse_ack_request(data))
+        return data if state.ack_mode == ACK_ECHO else None
+
+    def _end_frame(self, state: ConnectionState, data, header: tuple) -> Optional[bytes]:
+        self._end(state, header[2])
+        if state.ack_mode == ACK_COALESCED:
+            return state.make_binary_ack(header[1])
+        return data if state.ack_mode == ACK_ECHO else None
+
+    def handle_binary(self, state: ConnectionState, data) -> Optional[bytes]:
+        """
+        Обрабатывает двоичное сообщение
+
+        Returns:
+            Ответ клиенту по режиму подтверждения подключения или None
+        """
+        if self.recorder is not None:
+            self.recorder.record(state.conn_id, REC_BINARY, data)
+        header = decode_header(data)
+        if header is None:
+            return None
+        if header[0] != MSG_DATA:
+            command = self.router.binary.get(header[0])
+            if command is not None:
+                return self.router.dispatch_binary(command, state, data, header)
+            return data if state.ack_mode == ACK_ECHO else None
+        stats = state.stats
+        if stats is not None:
+            stats.sequence.add(header[2])
+            stats.message_count += 1
+        ack_mode = state.ack_mode
+        if ack_mode == ACK_COALESCED:
+            if header[2] >= state.received:
+                state.received = header[2] + 1
+                state.last_timestamp = header[3]
+            return state.make_binary_ack(header[1]) if state.ack_due() else None
+        if ack_mode == ACK_COMPACT:
+            return encode_frame(MSG_DATA, header[1], header[2], b"", header[3])
+        return data if ack_mode == ACK_ECHO else None
+
+    def handle_text(self, state: ConnectionState, message: str) -> Optional[str]:
+        """
+        Обрабатывает текстовое сообщение
+
+        Returns:
+            Ответ клиенту или None
+        """
+        if self.recorder is not None:
+            self.recorder.record(state.conn_id, REC_TEXT, message.encode('utf-8'))
+        if message.startswith(BENCHMARK_DATA_PREFIX):
+            stats = state.stats
+            if stats is not None:
+                stats.message_count += 1
+            ack_mode = state.ack_mode
+            if ack_mode == ACK_COALESCED:
+                state.received += 1
+                # Номер сообщения, если клиент его передает: __BENCHMARK_DATA__<номер>:...
+                end = message.find(":", len(BENCHMARK_DATA_PREFIX))
+                state.last_sequence = message[len(BENCHMARK_DATA_PREFIX):end] if end > 0 else ""
+                return state.make_text_ack() if state.ack_due() else None
+            if ack_mode == ACK_COMPACT:
+                end = message.find(":", len(BENCHMARK_DATA_PREFIX))
+                return message[:end + 1] if end > 0 else BENCHMARK_DATA_PREFIX
+            return f"Сервер получил: {message}" if ack_mode == ACK_ECHO else None
+        command = self.router.route(message)
+        if command is not None:
+            try:
+                return self.router.dispatch(command, state, message)
+            except CommandError as e:
+                messages_log.warning(f"Клиент {state.client_id}: {e}", client=state.client_id)
+                return None
+        if self.chat:
+            messages_log.info(f"Клиент {state.client_id} отправил: {message}", client=state.client_id)
+            return f"Сервер получил: {message}"
+        return None
+
+
+class ThreadedBackend:
+    """Бэкенд на websocket_server: отдельный поток на каждого клиента"""
+
+    name = BACKEND_THREADED
+    is_async = False
+
+    def __init__(self, app: BenchmarkApp, host: str, port: int):
+        self.app = app
+        app.broadcast = self.broadcast
+        self.server = WebsocketServer(host=host, port=port)
+        self.server.set_fn_new_client(self._new_client)
+        self.server.set_fn_client_left(self._client_left)
+        self.server.set_fn_message_received(self._message_received)
+
+    def _new_client(self, client, server):
+        client['state'] = self.app.connect(client['id'], client['id'])
+        if self.app.greeting:
+            server.send_message_to_all(self.app.greeting)
+
+    def _client_left(self, client, server):
+        # Клиент, не завершивший рукопожатие, не зарегистрирован
+        if client and 'state' in client:
+            self.app.disconnect(client['state'])
+
+    @staticmethod
+    def send_binary(client, data: bytes):
+        """
+        Отправляет клиенту двоичный WebSocket кадр
+
+        websocket_server умеет отправлять только текст, поэтому заголовок
+        кадра собирается вручную и пишется прямо в сокет обработчика
+        """
+        client['handler'].request.sendall(build_frame_header(OPCODE_BINARY, len(data)) + data)
+
+    def _message_received(self, client, server, message):
+        timer = self.app.handler_timer
+        if timer is None:
+            self._process_message(client, server, message)
+            return
+        start = time.perf_counter_ns()
+        handler = self._process_message(client, server, message)
+        timer.record(handler, time.perf_counter_ns() - start)
+
+    def _process_message(self, client, server, message) -> str:
+        """Обрабатывает сообщение; возвращает имя обработчика"""
+        state = client['state']
+        # websocket_server отдает каждый байт кадра как символ (Latin-1),
+        # поэтому двоичный кадр узнаем по первому символу и не декодируем текст
+        if message[:1] == BINARY_FRAME_MARK:
+            reply = self.app.handle_binary(state, message.encode('latin-1'))
+            if reply is not None:
+                self.send_binary(client, reply)
+            return "binary"
+        # Текст пришел как UTF-8 байты, прочитанные как Latin-1: восстанавливаем
+        try:
+            message = message.encode('latin-1').decode('utf-8')
+        except (UnicodeEncodeError, UnicodeDecodeError):
+            pass
+        reply = self.app.handle_text(state, message)
+        if reply is not None:
+            server.send_message(client, reply)
+        return "text"
+
+    def broadcast(self, message: str):
+        """Отправляет текстовое сообщение всем клиентам"""
+        self.server.send_message_to_all(message)
+
+    def start(self) -> threading.Thread:
+        """Запускает сервер в фоновом потоке"""
+        thread = threading.Thread(target=self.server.run_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def run(self):
+        """Запускает сервер в текущем потоке"""
+        if self.app.instrumentation is not None:
+            self.app.instrumentation.start_threaded()
+        self.server.run_forever()
+
+
+class WebsocketsBackend:
+    """Бэкенд на asyncio библиотеке websockets (поддерживает /metrics и сжатие)"""
+
+    name = BACKEND_WEBSOCKETS
+    is_async = True
+
+    def __init__(self, app: BenchmarkApp, host: str, port: int, metrics: bool = False,
+                 serve_options: dict = None, uploads: bool = False, upload_dir: Optional[str] = None,
+                 density: Optional[dict] = None):
+        """
+        Args:
+            app: Общая логика замера
+            host: Хост для привязки
+            port: Порт для привязки
+            metrics: Отвечать на HTTP GET /metrics (см. ws_metrics.py)
+            serve_options: Дополнительные параметры websockets.serve()
+            uploads: Принимать потоковую загрузку файлов (__BENCHMARK_UPLOAD__, см. ws_stream.py);
+                размер сообщения при этом не ограничивается
+            upload_dir: Каталог для принятых файлов (None - только считать байты)
+            density: Параметры KeepaliveScheduler плотного режима (None - keepalive websockets
+                на каждое подключение)
+        """
+        self.app = app
+        self.host = host
+        self.port = port
+        self.uploads = uploads
+        self.upload_dir = upload_dir
+        if uploads:
+            serve_options = dict(serve_options or {}, max_size=None)
+        self.keepalive = None
+        if density is not None:
+            # Своя задача keepalive у каждого подключения не нужна: ping отправляет общее колесо
+            serve_options = dict(serve_options or {}, ping_interval=None)
+            self.keepalive = KeepaliveScheduler(self._send_ping, self._close, **density)
+        self.serve_options = serve_options
+        self.client_manager = ClientManager()
+        app.broadcast = self.broadcast
+        self.metrics = None
+        if metrics:
+            self.metrics = ServerMetrics(self.client_manager, lambda: len(app.stats_registry.active),
+                                         app.instrumentation, app.router)
+
+    def _send_ping(self, websocket, conn_id: int):
+        asyncio.create_task(self._ping(websocket, conn_id))
+
+    async def _ping(self, websocket, conn_id: int):
+        """Ping от колеса таймеров: pong отмечает, что клиент жив"""
+        try:
+            pong_waiter = await websocket.ping()
+            await pong_waiter
+        except websockets.exceptions.ConnectionClosed:
+            return
+        if self.keepalive.table.connections[conn_id] is websocket:
+            self.keepalive.seen(conn_id)
+
+    @staticmethod
+    def _close(websocket, graceful: bool):
+        if graceful:
+            asyncio.create_task(websocket.close(CLOSE_NORMAL, "idle timeout"))
+        else:
+            abort(websocket)
+
+    async def _handle(self, websocket):
+        app = self.app
+        keepalive = self.keepalive
+        start = time.perf_counter_ns()
+        conn_id = keepalive.add(websocket) if keepalive is not None else -1
+        state = app.connect(websocket, conn_id if keepalive is not None else get_client_id(websocket))
+        self.client_manager.add_client(websocket, time.perf_counter_ns() - start)
+        if app.greeting:
+            self.client_manager.broadcast(app.greeting)
+        timer = app.handler_timer
+        try:
+            async for message in websocket:
+                add_messages_in(websocket)
+                if keepalive is not None:
+                    keepalive.active(conn_id)
+                if timer is not None:
+                    start = time.perf_counter_ns()
+                if isinstance(message, bytes):
+                    reply = app.handle_binary(state, message)
+                elif self.uploads and message.startswith(UPLOAD_COMMAND):
+                    await self._receive_upload(websocket, state, message)
+                    continue
+                else:
+                    reply = app.handle_text(state, message)
+                # Время обработчика без отправки ответа, как у других бэкендов: ожидание записи в сокет не входит
+                if timer is not None:
+                    timer.record("binary" if isinstance(message, bytes) else "text", time.perf_counter_ns() - start)
+                if reply is not None:
+                    await websocket.send(reply)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            start = time.perf_counter_ns()
+            if keepalive is not None:
+                keepalive.remove(conn_id)
+            app.disconnect(state)
+            self.client_manager.remove_client(websocket, time.perf_counter_ns() - start)
+
+    async def _receive_upload(self, websocket, state: ConnectionState, message: str):
+        """Принимает следующее сообщение фрагментами в файл и отвечает итогом приема"""
+        request = parse_stream_command(message, UPLOAD_COMMAND)
+        expected = request[0] if request else 0
+        path = None
+        if self.upload_dir:
+            path = os.path.join(self.upload_dir, f"upload-{state.conn_id}-{time.time_ns()}.bin")
+        sink = FragmentSink(path)
+        start = time.perf_counter()
+        try:
+            await receive_stream(websocket, sink)
+        finally:
+            sink.close()
+        elapsed = time.perf_counter() - start
+        bench_log.info(f"Клиент {state.client_id}: принято {format_mb(sink.received)} из {format_mb(expected)} "
+                       f"({sink.fragments} фрагментов) за {elapsed:.2f} секунд "
+                       f"({stream_rate(sink.received, elapsed):.1f} МБ/сек)" + (f" -> {path}" if path else ""),
+                       client=state.client_id, event="upload", bytes=sink.received, elapsed=round(elapsed, 3))
+        await websocket.send(f"{UPLOAD_COMMAND}:{sink.received}:{int(elapsed * 1_000_000)}")
+
+    def broadcast(self, message: str):
+        """Отправляет текстовое сообщение всем клиентам (с шиной - клиентам всех воркеров)"""
+        self.client_manager.broadcast(message)
+
+    def attach_bus(self, bus: MessageBus):
+        """Рассылка через шину между воркерами (см. ws_bus.py); участником шины сервер становится в serve()"""
+        self.client_manager.attach_bus(bus)
+
+    async def serve(self, reuse_port: bool = False, startup_message: str = None):
+        """Запускает сервер и ожидает бесконечно"""
+        if self.app.instrumentation is not None:
+            self.app.instrumentation.start_async()
+        if self.keepalive is not None:
+            self.keepalive.start()
+        bus = self.client_manager.bus
+        if bus is not None:
+            bus.join(self.client_manager.deliver_frame)
+        try:
+            await run_websocket_server(self._handle, self.host, self.port, startup_message,
+                                       reuse_port=reuse_port, metrics=self.metrics,
+                                       serve_options=self.serve_options)
+        finally:
+            if self.keepalive is not None:
+                self.keepalive.stop()
+            if bus is not None:
+                bus.close()
+
+
+class RawBackend:
+    """Бэкенд на asyncio.Protocol с минимальным разбором кадров (ws_raw.py)"""
+
+    name = BACKEND_RAW
+    is_async = True
+
+    def __init__(self, app: BenchmarkApp, host: str, port: int, density: Optional[dict] = None):
+        """
+        Args:
+            app: Общая логика замера
+            host: Хост для привязки
+            port: Порт для привязки
+            density: Параметры KeepaliveScheduler плотного режима (None - без keepalive,
+                подключения в множестве)
+        """
+        self.app = app
+        app.broadcast = self.broadcast
+        self.host = host
+        self.port = port
+        self.connections: Set[RawWebSocketProtocol] = set()
+        self.keepalive = None
+        if density is not None:
+            self.keepalive = KeepaliveScheduler(self._send_ping, self._close, **density)
+
+    @staticmethod
+    def _send_ping(connection: RawWebSocketProtocol, conn_id: int):
+        connection.ping()
+
+    @staticmethod
+    def _close(connection: RawWebSocketProtocol, graceful: bool):
+        if graceful:
+            connection.close(CLOSE_NORMAL)
+        else:
+            connection.abort()
+
+    def _on_open(self, connection: RawWebSocketProtocol):
+        if self.keepalive is not None:
+            # Плотный режим: подключение - в таблице по номеру, вместо множества
+            connection.conn_id = self.keepalive.add(connection)
+            connection.state = self.app.connect(connection, connection.conn_id)
+        else:
+            connection.state = self.app.connect(connection, id(connection))
+            self.connections.add(connection)
+        if self.app.greeting:
+            self.broadcast(self.app.greeting)
+
+    def _on_message(self, connection: RawWebSocketProtocol, message):
+        if self.keepalive is not None:
+            self.keepalive.active(connection.conn_id)
+        timer = self.app.handler_timer
+        if timer is not None:
+            start = time.perf_counter_ns()
+        state = connection.state
+        if isinstance(message, bytes):
+            reply = self.app.handle_binary(state, message)
+        else:
+            reply = self.app.handle_text(state, message)
+        if reply is not None:
+            connection.send(reply)
+        if timer is not None:
+            timer.record("binary" if isinstance(message, bytes) else "text", time.perf_counter_ns() - start)
+
+    def _on_close(self, connection: RawWebSocketProtocol):
+        if connection.conn_id >= 0:
+            self.keepalive.remove(connection.conn_id)
+            connection.conn_id = -1
+        self.connections.discard(connection)
+        if connection.state is not None:
+            self.app.disconnect(connection.state)
+            connection.state = None
+
+    def _create_protocol(self) -> RawWebSocketProtocol:
+        on_data = self.keepalive.seen if self.keepalive is not None else None
+        return RawWebSocketProtocol(self._on_open, self._on_message, self._on_close, on_data)
+
+    def broadcast(self, message: str):
+        """Отправляет текстовое сообщение всем клиентам"""
+        connections = self.keepalive.table if self.keepalive is not None else self.connections
+        for connection in list(connections):
+            connection.send(message)
+
+    async def serve(self, reuse_port: bool = False, startup_message: str = None):
+        """Запускает сервер и ожидает бесконечно"""
+        if startup_message:
+            print(startup_message)
+        if self.app.instrumentation is not None:
+            self.app.instrumentation.start_async()
+        loop = asyncio.get_running_loop()
+        server = await loop.create_server(self._create_protocol, self.host, self.port,
+                                          reuse_port=reuse_port or None)
+        if self.keepalive is not None:
+            self.keepalive.start()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if self.keepalive is not None:
+                self.keepalive.stop()
+
+
+def create_backend(name: str, app: BenchmarkApp, host: str, port: int, metrics: bool = False,
+                   serve_options: dict = None, uploads: bool = False, upload_dir: Optional[str] = None,
+                   density: Optional[dict] = None):
+    """
+    Создает бэкенд по имени
+
+    Args:
+        name: Имя бэкенда (BACKEND_*)
+        app: Общая логика замера
+        host: Хост для привязки
+        port: Порт для привязки
+        metrics: Отвечать на HTTP GET /metrics (только бэкенд websockets)
+        serve_options: Параметры websockets.serve(), например сжатие (только бэкенд websockets)
+        uploads: Принимать потоковую загрузку файлов (только бэкенд websockets)
+        upload_dir: Каталог для принятых файлов (None - только считать байты)
+        density: Параметры плотного режима, см. ws_density.density_options_from_args
+            (только бэкенды websockets и raw)
+    """
+    if name == BACKEND_THREADED:
+        if density is not None:
+            raise ValueError("Плотный режим не поддерживается бэкендом threaded")
+        return ThreadedBackend(app, host, port)
+    if name == BACKEND_WEBSOCKETS:
+        return WebsocketsBackend(app, host, port, metrics, serve_options, uploads, upload_dir, density)
+    if name == BACKEND_RAW:
+        return RawBackend(app, host, port, density)
+    raise ValueError(f"Неизвестный бэкенд: {name}")
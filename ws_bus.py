@@ -0,0 +1,401 @@
+"""
+Шина рассылки между процессами-воркерами одного сервера
+
+В режиме --workers у каждого воркера свой ClientManager: рассылка,
+начатая в одном процессе, доходит только до его клиентов. Шина передает
+готовые WebSocket кадры всем воркерам:
+
+    кольцевой буфер   файл в /dev/shm, отображенный в память всех воркеров:
+                      заголовок, таблица участников и кольцо записей
+                      (длина, номер участника-отправителя, время публикации,
+                      кадр). Отправитель копирует кадр в кольцо один раз,
+                      сколько бы ни было воркеров
+    пробуждение       у каждого участника Unix датаграммный сокет рядом с
+                      файлом шины; после записи отправитель шлет в него один
+                      байт, и цикл событий участника (add_reader) дочитывает
+                      кольцо. Если байт уже ждет, новый не отправляется
+                      (EAGAIN), данные - только в кольце
+    участники         таблица в заголовке: номер воркера, pid, позиция
+                      чтения, доставлено, переполнения и опоздание. Место
+                      вышедшего или завершившегося участника переиспользуется
+
+Запись в кольцо защищена flock на файле шины (у каждого процесса свое
+открытие файла). Отправитель не ждет медленных участников: если участник
+отстал больше чем на половину кольца (вторая половина - место, которое
+отправитель может перезаписывать в этот момент), он пропускает
+непрочитанное и учитывает переполнение. Опоздание доставки - время от публикации до чтения кадра
+участником по монотонным часам системы (CLOCK_MONOTONIC общие для всех
+процессов машины).
+"""
+import asyncio
+import fcntl
+import mmap
+import os
+import socket
+import struct
+import tempfile
+import time
+from typing import Callable, List, Optional
+
+BUS_MAGIC = 0x57534255
+BUS_VERSION = 1
+
+DEFAULT_BUS_SIZE_MB = 16
+MAX_MEMBERS = 64
+
+# Состояние места в таблице участников: свободно, участник, вышел (счетчики остаются для отчета)
+MEMBER_FREE = 0
+MEMBER_ACTIVE = 1
+MEMBER_LEFT = 2
+
+# Заголовок: маркер, версия, размер кольца, позиция записи (байт с начала),
+# опубликовано кадров, версия таблицы участников
+HEADER = struct.Struct("<IIQQQQ")
+HEADER_REGION = 64
+WRITE_POS_OFFSET = 16
+POSITION = struct.Struct("<Q")
+# Участник: занят, номер воркера, pid, позиция чтения, доставлено, переполнения,
+# сумма опозданий (нс), последнее и наибольшее опоздание (нс)
+MEMBER = struct.Struct("<IIQQQQQQQ")
+MEMBERS_OFFSET = HEADER_REGION
+DATA_OFFSET = MEMBERS_OFFSET + MAX_MEMBERS * MEMBER.size
+# Запись кольца: длина кадра, номер участника-отправителя (-1 - не участник), время публикации (нс)
+RECORD = struct.Struct("<IiQ")
+# Длина записи-маркера "продолжение с начала кольца"
+WRAP = 0xFFFFFFFF
+ALIGN = 8
+
+
+def default_bus_path(pid: Optional[int] = None) -> str:
+    """Путь файла шины процесса pid (None - текущего): /dev/shm (память), иначе временный каталог"""
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(directory, f"ws-bus-{pid or os.getpid()}")
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class MessageBus:
+    """Кольцевой буфер кадров в общей памяти с пробуждением участников через Unix сокеты"""
+
+    def __init__(self, path: str, worker_id: int = -1):
+        """
+        Открывает существующую шину (см. create)
+
+        Args:
+            path: Файл шины
+            worker_id: Номер воркера (для таблицы участников и отчета)
+        """
+        self.path = path
+        self.worker_id = worker_id
+        self.slot = -1
+        self.on_frame: Optional[Callable[[bytes], None]] = None
+        self.sock: Optional[socket.socket] = None
+        self.loop = None
+        # Адреса сокетов других участников (обновляются по версии таблицы)
+        self.peers: List[str] = []
+        self.peers_version = -1
+        # Позиция чтения и счетчики участника (в таблицу пишутся после каждой пачки)
+        self.read_pos = 0
+        self.delivered = 0
+        self.overruns = 0
+        self.lag_sum = 0
+        self.last_lag = 0
+        self.max_lag = 0
+        self.fd = os.open(path, os.O_RDWR)
+        self.mm = mmap.mmap(self.fd, os.fstat(self.fd).st_size)
+        magic, version, self.capacity = HEADER.unpack_from(self.mm, 0)[:3]
+        if magic != BUS_MAGIC or version != BUS_VERSION:
+            self.close()
+            raise ValueError(f"{path}: не файл шины")
+        # Запись не больше четверти кольца: читатель успевает заметить перезапись
+        self.max_record = self.capacity // 4
+
+    @classmethod
+    def create(cls, path: Optional[str] = None, size_mb: int = DEFAULT_BUS_SIZE_MB) -> "MessageBus":
+        """
+        Создает файл шины (в родительском процессе до запуска воркеров)
+
+        Args:
+            path: Файл шины (None - default_bus_path())
+            size_mb: Размер кольца в МБ
+        """
+        path = path or default_bus_path()
+        capacity = max(1, size_mb) * 1024 * 1024
+        with open(path, "wb") as f:
+            f.truncate(DATA_OFFSET + capacity)
+            f.write(HEADER.pack(BUS_MAGIC, BUS_VERSION, capacity, 0, 0, 0))
+        return cls(path)
+
+    def _member_path(self, slot: int) -> str:
+        return f"{self.path}.{slot}.sock"
+
+    def _lock(self):
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+
+    def _unlock(self):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def _bump_membership(self):
+        version = POSITION.unpack_from(self.mm, 32)[0]
+        POSITION.pack_into(self.mm, 32, version + 1)
+
+    def join(self, on_frame: Callable[[bytes], None]):
+        """
+        Входит в шину (в работающем цикле событий): кадры других участников
+        передаются в on_frame в этом цикле
+
+        Raises:
+            RuntimeError: Нет свободного места в таблице участников
+        """
+        self.on_frame = on_frame
+        self._lock()
+        try:
+            for slot in range(MAX_MEMBERS):
+                state, _, pid = MEMBER.unpack_from(self.mm, MEMBERS_OFFSET + slot * MEMBER.size)[:3]
+                if state != MEMBER_ACTIVE or not _pid_alive(pid):
+                    break
+            else:
+                raise RuntimeError(f"Шина: больше {MAX_MEMBERS} участников")
+            self.read_pos = POSITION.unpack_from(self.mm, WRITE_POS_OFFSET)[0]
+            self.slot = slot
+            self._store_member(MEMBER_ACTIVE)
+            self._bump_membership()
+        finally:
+            self._unlock()
+        path = self._member_path(self.slot)
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(path)
+        self.sock.setblocking(False)
+        self.loop = asyncio.get_running_loop()
+        self.loop.add_reader(self.sock.fileno(), self._on_wakeup)
+
+    def leave(self):
+        """Выходит из шины"""
+        if self.slot < 0:
+            return
+        if self.loop is not None and self.sock is not None:
+            self.loop.remove_reader(self.sock.fileno())
+        self._lock()
+        try:
+            self._store_member(MEMBER_LEFT)
+            self._bump_membership()
+        finally:
+            self._unlock()
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+            try:
+                os.unlink(self._member_path(self.slot))
+            except FileNotFoundError:
+                pass
+        self.slot = -1
+
+    def _store_member(self, state: int = MEMBER_ACTIVE):
+        MEMBER.pack_into(self.mm, MEMBERS_OFFSET + self.slot * MEMBER.size, state, max(0, self.worker_id),
+                         os.getpid(), self.read_pos, self.delivered, self.overruns, self.lag_sum,
+                         self.last_lag, self.max_lag)
+
+    def publish(self, frame: bytes) -> int:
+        """
+        Копирует кадр в кольцо и будит остальных участников
+
+        Returns:
+            Номер публикации
+
+        Raises:
+            ValueError: Кадр больше четверти кольца
+        """
+        length = len(frame)
+        size = (RECORD.size + length + ALIGN - 1) & ~(ALIGN - 1)
+        if size > self.max_record:
+            raise ValueError(f"Шина: кадр {length} байт больше допустимого {self.max_record - RECORD.size}")
+        mm = self.mm
+        capacity = self.capacity
+        self._lock()
+        try:
+            write_pos, published, membership = struct.unpack_from("<QQQ", mm, WRITE_POS_OFFSET)
+            # Участник, прочитавший все, сразу пропускает свою запись (его самого не будят)
+            caught_up = self.slot >= 0 and self.read_pos == write_pos
+            offset = write_pos % capacity
+            left = capacity - offset
+            if left < size:
+                # Запись не помещается до конца кольца: продолжение с начала
+                if left >= RECORD.size:
+                    RECORD.pack_into(mm, DATA_OFFSET + offset, WRAP, -1, 0)
+                write_pos += left
+                offset = 0
+            start = DATA_OFFSET + offset
+            RECORD.pack_into(mm, start, length, self.slot, time.monotonic_ns())
+            mm[start + RECORD.size:start + RECORD.size + length] = frame
+            # Позиция записи публикуется после данных
+            struct.pack_into("<QQ", mm, WRITE_POS_OFFSET, write_pos + size, published + 1)
+        finally:
+            self._unlock()
+        if caught_up:
+            self.read_pos = write_pos + size
+            POSITION.pack_into(mm, MEMBERS_OFFSET + self.slot * MEMBER.size + 16, self.read_pos)
+        if membership != self.peers_version:
+            self._load_peers(membership)
+        self._notify()
+        return published + 1
+
+    def _load_peers(self, version: int):
+        self.peers = [self._member_path(slot) for slot, member in self._members()
+                      if member[0] == MEMBER_ACTIVE and slot != self.slot]
+        self.peers_version = version
+        if self.sock is None:
+            # Не участник (только публикует): отдельный сокет для пробуждения
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self.sock.setblocking(False)
+
+    def _notify(self):
+        sock = self.sock
+        for path in self.peers:
+            try:
+                sock.sendto(b"\x01", path)
+            except BlockingIOError:
+                # Очередь пробуждений участника полна: он и так дочитает кольцо
+                pass
+            except (FileNotFoundError, ConnectionRefusedError):
+                # Участник вышел; таблица обновится по версии
+                pass
+
+    def _on_wakeup(self):
+        sock = self.sock
+        try:
+            while True:
+                sock.recv(64)
+        except (BlockingIOError, OSError):
+            pass
+        self.poll()
+
+    def poll(self) -> int:
+        """Дочитывает кольцо и передает кадры в on_frame; возвращает количество кадров"""
+        mm = self.mm
+        capacity = self.capacity
+        # Отправитель может писать до 2 * max_record впереди позиции записи (маркер
+        # WRAP в конце кольца и запись с начала): запись с отставанием больше
+        # limit могла быть перезаписана, в том числе пока копируется
+        limit = capacity - 2 * self.max_record
+        read_pos = self.read_pos
+        count = 0
+        while True:
+            write_pos = POSITION.unpack_from(mm, WRITE_POS_OFFSET)[0]
+            if read_pos >= write_pos:
+                break
+            now = time.monotonic_ns()
+            if write_pos - read_pos > limit:
+                # Отставание больше кольца: непрочитанное перезаписано
+                self.overruns += 1
+                read_pos = write_pos
+                break
+            offset = read_pos % capacity
+            if capacity - offset < RECORD.size:
+                read_pos += capacity - offset
+                continue
+            length, origin, published_ns = RECORD.unpack_from(mm, DATA_OFFSET + offset)
+            if length == WRAP:
+                read_pos += capacity - offset
+                continue
+            start = DATA_OFFSET + offset + RECORD.size
+            frame = mm[start:start + length]
+            if POSITION.unpack_from(mm, WRITE_POS_OFFSET)[0] - read_pos > limit:
+                # Отправитель перезаписал запись, пока она копировалась
+                continue
+            read_pos += (RECORD.size + length + ALIGN - 1) & ~(ALIGN - 1)
+            if origin == self.slot:
+                # Свои кадры ClientManager уже разослал локально
+                continue
+            lag = max(0, now - published_ns)
+            self.lag_sum += lag
+            self.last_lag = lag
+            if lag > self.max_lag:
+                self.max_lag = lag
+            count += 1
+            self.on_frame(frame)
+        self.read_pos = read_pos
+        self.delivered += count
+        if self.slot >= 0:
+            self._store_member()
+        return count
+
+    def _members(self) -> list:
+        members = []
+        for slot in range(MAX_MEMBERS):
+            member = MEMBER.unpack_from(self.mm, MEMBERS_OFFSET + slot * MEMBER.size)
+            if member[0] != MEMBER_FREE:
+                members.append((slot, member))
+        return members
+
+    def published(self) -> int:
+        """Опубликовано кадров за все время шины"""
+        return POSITION.unpack_from(self.mm, 24)[0]
+
+    def members(self) -> List[dict]:
+        """Участники шины и их доставка (читается из общей памяти любым процессом)"""
+        write_pos = POSITION.unpack_from(self.mm, WRITE_POS_OFFSET)[0]
+        result = []
+        for slot, (state, worker_id, pid, read_pos, delivered, overruns, lag_sum, last_lag,
+                   max_lag) in self._members():
+            result.append({
+                'slot': slot,
+                'worker_id': worker_id,
+                'pid': pid,
+                'active': state == MEMBER_ACTIVE and _pid_alive(pid),
+                'delivered': delivered,
+                'overruns': overruns,
+                'backlog': max(0, write_pos - read_pos) if state == MEMBER_ACTIVE else 0,
+                'mean_lag': lag_sum / delivered if delivered else 0.0,
+                'last_lag': last_lag,
+                'max_lag': max_lag,
+            })
+        return result
+
+    def summary_lines(self) -> List[str]:
+        """Строки отчета по участникам"""
+        members = sorted(self.members(), key=lambda member: member['worker_id'])
+        active = sum(1 for member in members if member['active'])
+        lines = [f"Шина: опубликовано {self.published()} кадров, участников: {active}"]
+        for member in members:
+            lines.append(f"  Воркер #{member['worker_id']} (pid {member['pid']}"
+                         f"{'' if member['active'] else ', вышел'}): доставлено {member['delivered']}, "
+                         f"опоздание среднее {member['mean_lag'] / 1e6:.3f} мс, "
+                         f"наибольшее {member['max_lag'] / 1e6:.3f} мс, "
+                         f"переполнений: {member['overruns']}, не прочитано: {member['backlog']} байт")
+        return lines
+
+    def close(self, unlink: bool = False):
+        """Закрывает шину; unlink - удалить файл шины (создатель, после остановки воркеров)"""
+        self.leave()
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        if self.mm is not None:
+            if unlink:
+                for slot in range(MAX_MEMBERS):
+                    try:
+                        os.unlink(self._member_path(slot))
+                    except FileNotFoundError:
+                        pass
+            self.mm.close()
+            self.mm = None
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+        if unlink:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,146 @@
+"""
+Запись входящего трафика сервера в компактный двоичный журнал и его чтение
+
+Журнал пишется через отображение в память (mmap) заранее выделенного файла:
+запись кадра - это упаковка заголовка и копирование нагрузки в память,
+без системных вызовов на пути приема. Формат (сетевой порядок байтов):
+
+    заголовок файла: маркер CAPTURE_MAGIC (8 байт),
+                     монотонное время начала, нс (8), время начала по часам, нс (8)
+    запись:          монотонное время, нс (8), номер подключения (4),
+                     тип записи REC_* (1), длина нагрузки (4), нагрузка
+
+Неиспользованный остаток файла заполнен нулями; запись с типом 0 означает
+конец журнала (так журнал читается, даже если процесс был прерван).
+"""
+import heapq
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Iterator, List, NamedTuple
+
+CAPTURE_MAGIC = b"WSCAP\x00\x00\x01"
+FILE_HEADER = struct.Struct(">8sQQ")
+RECORD = struct.Struct(">QIBI")
+RECORD_SIZE = RECORD.size
+
+REC_END = 0
+REC_TEXT = 1
+REC_BINARY = 2
+REC_OPEN = 3
+REC_CLOSE = 4
+
+# Размер журнала по умолчанию, МБ
+DEFAULT_CAPTURE_SIZE_MB = 256
+
+
+class CaptureRecord(NamedTuple):
+    """Запись журнала"""
+    timestamp_ns: int
+    conn_id: int
+    kind: int
+    payload: bytes
+
+
+class CaptureWriter:
+    """Запись кадров в заранее выделенный файл через mmap"""
+
+    def __init__(self, path: str, size_mb: int = DEFAULT_CAPTURE_SIZE_MB):
+        """
+        Args:
+            path: Путь к файлу журнала
+            size_mb: Размер файла в МБ; при заполнении новые записи отбрасываются
+        """
+        self.path = path
+        self.capacity = size_mb * 1024 * 1024
+        with open(path, "w+b") as f:
+            if hasattr(os, "posix_fallocate"):
+                os.posix_fallocate(f.fileno(), 0, self.capacity)
+            else:
+                f.truncate(self.capacity)
+            self.mmap = mmap.mmap(f.fileno(), self.capacity)
+        FILE_HEADER.pack_into(self.mmap, 0, CAPTURE_MAGIC, time.monotonic_ns(), time.time_ns())
+        self.position = FILE_HEADER.size
+        # Бэкенд threaded пишет из потоков клиентов
+        self.lock = threading.Lock()
+        self.records = 0
+        self.dropped = 0
+        self.closed = False
+
+    def record(self, conn_id: int, kind: int, payload=b""):
+        """Добавляет запись в журнал"""
+        length = len(payload)
+        with self.lock:
+            position = self.position
+            end = position + RECORD_SIZE + length
+            if self.closed or end > self.capacity:
+                self.dropped += 1
+                return
+            RECORD.pack_into(self.mmap, position, time.monotonic_ns(), conn_id, kind, length)
+            self.mmap[position + RECORD_SIZE:end] = payload
+            self.position = end
+            self.records += 1
+
+    def close(self):
+        """Сбрасывает журнал на диск и обрезает файл до записанного размера"""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.mmap.flush()
+            self.mmap.close()
+        os.truncate(self.path, self.position)
+
+    def summary(self) -> str:
+        """Строка с итогами записи"""
+        text = f"Журнал {self.path}: {self.records} записей, {self.position / (1024 * 1024):.2f} МБ"
+        if self.dropped:
+            text += f", отброшено при переполнении: {self.dropped}"
+        return text
+
+
+def read_capture(path: str) -> Iterator[CaptureRecord]:
+    """
+    Читает записи журнала по порядку
+
+    Args:
+        path: Путь к файлу журнала
+
+    Raises:
+        ValueError: Если файл не является журналом
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < FILE_HEADER.size:
+            raise ValueError(f"{path}: файл слишком мал для журнала")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            magic, _, _ = FILE_HEADER.unpack_from(data, 0)
+            if magic != CAPTURE_MAGIC:
+                raise ValueError(f"{path}: неизвестный формат журнала")
+            position = FILE_HEADER.size
+            while position + RECORD_SIZE <= size:
+                timestamp_ns, conn_id, kind, length = RECORD.unpack_from(data, position)
+                end = position + RECORD_SIZE + length
+                if kind == REC_END or end > size:
+                    break
+                yield CaptureRecord(timestamp_ns, conn_id, kind, data[position + RECORD_SIZE:end])
+                position = end
+
+
+def read_captures(paths: List[str]) -> Iterator[CaptureRecord]:
+    """
+    Читает несколько журналов (например, воркеров) в общем порядке времени
+
+    Номера подключений разных файлов разводятся: к номеру добавляется
+    индекс файла в старших битах.
+    """
+    def tagged(index: int, path: str):
+        for record in read_capture(path):
+            yield record._replace(conn_id=(index << 24) | record.conn_id)
+
+    if len(paths) == 1:
+        return read_capture(paths[0])
+    return heapq.merge(*(tagged(index, path) for index, path in enumerate(paths)),
+                       key=lambda record: record.timestamp_ns)
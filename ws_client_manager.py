@@ -1,29 +1,159 @@
 """
 Менеджер для управления подключениями WebSocket клиентов
 """
+import asyncio
+import time
 import websockets
-from typing import Set, Callable, Optional
+from collections import deque
+from typing import Set, Callable, Optional, Dict, Union
+from websockets.frames import Frame, Opcode
+
+from ws_histogram import Histogram
+from ws_metrics import add_messages_out
+from ws_compat import is_open, can_write_frame, wait_writable, wait_send_done, write_frame, write_frames, write_paused, abort
+from ws_topics import TopicIndex
+from ws_bus import MessageBus
+from ws_log import get_logger
+from ws_session import Session, SessionStore, sequenced_chunks, RESUME_COMMAND, RESUME_HIT, RESUME_MISS, SESSION_COMMAND
+
+# Политики при переполнении исходящей очереди медленного клиента
+OVERFLOW_DROP_OLDEST = "drop_oldest"  # выбросить самый старый кадр из очереди
+OVERFLOW_SKIP = "skip"                # не ставить новый кадр в очередь
+OVERFLOW_DISCONNECT = "disconnect"    # отключить клиента
+OVERFLOW_POLICIES = (OVERFLOW_DROP_OLDEST, OVERFLOW_SKIP, OVERFLOW_DISCONNECT)
+
+# Обработка подключения/отключения дольше этого (нс) считается медленной
+SLOW_CALLBACK_NS = 10_000_000
+
+messages_log = get_logger("messages")
+
+
+def encode_broadcast_frame(message: Union[str, bytes]) -> bytes:
+    """
+    Кодирует сообщение в готовый WebSocket кадр сервера (без маски)
+    
+    Кадр кодируется один раз и пишется в транспорт всех клиентов как есть.
+    Расширения (permessage-deflate) не применяются: несжатое сообщение
+    допустимо и при согласованном сжатии (RFC 7692).
+    
+    Args:
+        message: str отправляется текстовым кадром, bytes - двоичным
+        
+    Returns:
+        Байты кадра
+    """
+    if isinstance(message, str):
+        frame = Frame(Opcode.TEXT, message.encode('utf-8'))
+    else:
+        frame = Frame(Opcode.BINARY, bytes(message))
+    return frame.serialize(mask=False)
+
+
+def _write_queued(websocket, frame: Union[bytes, tuple]):
+    """Пишет кадр рассылки: bytes или части кадра сессии одним вызовом"""
+    if frame.__class__ is tuple:
+        write_frames(websocket, frame)
+    else:
+        write_frame(websocket, frame)
+
+
+class ClientOutbox:
+    """
+    Ограниченная исходящая очередь рассылки одного клиента
+    
+    Создается только для клиента, чей буфер записи переполнился: у
+    неактивных клиентов очереди нет.
+    """
+    
+    __slots__ = ("queue", "flush_task", "dropped")
+    
+    def __init__(self):
+        self.queue: deque = deque()
+        self.flush_task: Optional[asyncio.Task] = None
+        self.dropped = 0
 
 
 class ClientManager:
     """Менеджер для управления подключениями клиентов"""
     
-    def __init__(self):
+    def __init__(self, max_queue: int = 1024, overflow_policy: str = OVERFLOW_DROP_OLDEST):
+        """
+        Args:
+            max_queue: Максимум кадров рассылки в очереди клиента, чей буфер
+                записи превысил верхнюю границу (write_limit сервера)
+            overflow_policy: Что делать при переполнении очереди (OVERFLOW_*)
+        """
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Неизвестная политика переполнения: {overflow_policy}")
         self.connected_clients: Set[websockets.WebSocketServerProtocol] = set()
         self.on_connect_callback: Optional[Callable[[websockets.WebSocketServerProtocol], None]] = None
         self.on_disconnect_callback: Optional[Callable[[websockets.WebSocketServerProtocol], None]] = None
+        self.max_queue = max_queue
+        self.overflow_policy = overflow_policy
+        self.outboxes: Dict[websockets.WebSocketServerProtocol, ClientOutbox] = {}
+        # Подписки на темы (см. ws_topics.py)
+        self.topics = TopicIndex()
+        # Шина между воркерами (см. ws_bus.py): рассылка доходит до клиентов всех процессов
+        self.bus: Optional[MessageBus] = None
+        # Сессии с кольцом последних кадров (см. ws_session.py); None - выключены
+        self.sessions: Optional[SessionStore] = None
+        # Статистика рассылки
+        self.broadcast_count = 0
+        self.publish_count = 0
+        self.frames_written = 0
+        self.frames_queued = 0
+        self.frames_dropped = 0
+        self.slow_disconnects = 0
+        # Кадры рассылки, не переданные другим воркерам (больше допустимого шиной)
+        self.bus_unrelayed = 0
+        # Время обработки подключения и отключения (callbacks и работа
+        # обработчика сервера), мкс: медленный on_connect виден при шторме подключений
+        self.connect_histogram = Histogram()
+        self.disconnect_histogram = Histogram()
+        self.slow_callbacks = 0
     
-    def add_client(self, websocket: websockets.WebSocketServerProtocol):
-        """Добавляет клиента в список подключенных"""
+    def _record_callback_time(self, histogram: Histogram, elapsed_ns: int):
+        """Учитывает время обработки подключения или отключения"""
+        histogram.record(elapsed_ns // 1000)
+        if elapsed_ns >= SLOW_CALLBACK_NS:
+            self.slow_callbacks += 1
+    
+    def add_client(self, websocket: websockets.WebSocketServerProtocol, setup_ns: int = 0):
+        """
+        Добавляет клиента в список подключенных
+        
+        Args:
+            websocket: Подключение клиента
+            setup_ns: Время, уже затраченное обработчиком сервера на подключение
+                (учитывается вместе со временем on_connect)
+        """
+        start = time.perf_counter_ns()
         self.connected_clients.add(websocket)
         if self.on_connect_callback:
             self.on_connect_callback(websocket)
+        self._record_callback_time(self.connect_histogram, setup_ns + time.perf_counter_ns() - start)
     
-    def remove_client(self, websocket: websockets.WebSocketServerProtocol):
-        """Удаляет клиента из списка подключенных"""
+    def remove_client(self, websocket: websockets.WebSocketServerProtocol, teardown_ns: int = 0):
+        """
+        Удаляет клиента из списка подключенных
+        
+        Args:
+            websocket: Подключение клиента
+            teardown_ns: Время, уже затраченное обработчиком сервера на отключение
+                (учитывается вместе со временем on_disconnect)
+        """
+        start = time.perf_counter_ns()
         self.connected_clients.discard(websocket)
+        self.topics.remove(websocket)
+        if self.sessions is not None:
+            # Подписки сессии остаются: кадры копятся в ее кольце до переподключения
+            self.sessions.detach(websocket)
+        outbox = self.outboxes.pop(websocket, None)
+        if outbox and outbox.flush_task:
+            outbox.flush_task.cancel()
         if self.on_disconnect_callback:
             self.on_disconnect_callback(websocket)
+        self._record_callback_time(self.disconnect_histogram, teardown_ns + time.perf_counter_ns() - start)
     
     def get_client_count(self) -> int:
         """Возвращает количество подключенных клиентов"""
@@ -40,4 +170,246 @@ class ClientManager:
     def set_on_disconnect(self, callback: Callable[[websockets.WebSocketServerProtocol], None]):
         """Устанавливает callback при отключении клиента"""
         self.on_disconnect_callback = callback
-
+    
+    def broadcast(self, message: Union[str, bytes]):
+        """
+        Рассылает сообщение всем подключенным клиентам без ожидания
+        
+        Кадр кодируется один раз. Клиентам с нормальным буфером записи он
+        пишется в транспорт сразу; медленным - ставится в ограниченную очередь,
+        которую дописывает фоновая задача по мере освобождения буфера.
+        
+        Args:
+            message: str отправляется текстовым кадром, bytes - двоичным
+        """
+        self.broadcast_frame(encode_broadcast_frame(message))
+    
+    def broadcast_frame(self, frame: bytes):
+        """
+        Рассылает заранее закодированный кадр (см. encode_broadcast_frame)
+        
+        С шиной кадр копируется в нее для остальных воркеров, а клиентам
+        этого процесса пишется сразу, не дожидаясь шины. Кадр больше
+        допустимого шиной (четверть кольца) получают только клиенты этого
+        процесса: он учитывается в bus_unrelayed и пишется в журнал.
+        """
+        if self.bus is not None:
+            try:
+                self.bus.publish(frame)
+            except ValueError as e:
+                self.bus_unrelayed += 1
+                messages_log.warning(f"Рассылка не передана другим воркерам: {e}", size=len(frame))
+        self.deliver_frame(frame)
+    
+    def attach_bus(self, bus: MessageBus):
+        """Рассылает через шину между воркерами; кадры других воркеров передавать в deliver_frame"""
+        self.bus = bus
+    
+    def deliver_frame(self, frame: bytes):
+        """Пишет кадр всем клиентам этого процесса (в том числе кадр из шины)"""
+        self.broadcast_count += 1
+        outboxes = self.outboxes
+        sessions = self.sessions
+        if sessions is None or not sessions.sessions:
+            for websocket in self.connected_clients:
+                self._push(websocket, outboxes.get(websocket), frame)
+            return
+        # Клиенты сессий получают кадр с номером своей сессии; отключенные
+        # сессии здесь не перебираются - они дописывают кадр из журнала позже
+        sessions.record(frame)
+        attached = sessions.by_connection
+        for websocket in self.connected_clients:
+            session = attached.get(websocket)
+            if session is None:
+                self._push(websocket, outboxes.get(websocket), frame)
+            else:
+                self._push(websocket, outboxes.get(websocket), sequenced_chunks(session.append(frame), frame))
+    
+    def enable_sessions(self, capacity: int, ttl: float):
+        """Включает сессии: клиенты могут продолжить рассылку после переподключения (см. ws_session.py)"""
+        self.sessions = SessionStore(capacity, ttl, self.topics.remove)
+    
+    def start_session(self, websocket: websockets.WebSocketServerProtocol) -> Session:
+        """
+        Открывает сессию подключения; подписки подключения переходят к сессии
+        
+        Ответ __SESSION__:<id> пишется в транспорт до кадров сессии.
+        """
+        session = self.sessions.create(websocket)
+        self._move_subscriptions(websocket, session)
+        self._write(websocket, encode_broadcast_frame(f"{SESSION_COMMAND}:{session.id}"))
+        return session
+    
+    def resume_session(self, websocket: websockets.WebSocketServerProtocol, session_id: str,
+                       sequence: int) -> bool:
+        """
+        Продолжает сессию после сообщения sequence
+        
+        При попадании пишет ответ __RESUME__:ok:<K> и K кадров из кольца сессии
+        прямо в транспорт (их не больше размера кольца, и очередь медленного
+        клиента их не отбрасывает), при промахе - __RESUME__:miss:<последний номер>.
+        
+        Returns:
+            True при попадании
+        """
+        session, frames, previous = self.sessions.resume(websocket, session_id, sequence)
+        if previous is not None:
+            # Старое подключение сессии еще не закрыто: кадры ушли бы в два подключения
+            abort(previous)
+        self._move_subscriptions(websocket, session)
+        if frames is None:
+            self._write(websocket, encode_broadcast_frame(f"{RESUME_COMMAND}:{RESUME_MISS}:{session.last}"))
+            return False
+        self._write(websocket, encode_broadcast_frame(f"{RESUME_COMMAND}:{RESUME_HIT}:{len(frames)}"))
+        for frame in frames:
+            self._write(websocket, frame)
+        return True
+    
+    def _move_subscriptions(self, websocket, session: Session):
+        """Подписки, сделанные подключением до сессии, переходят к сессии"""
+        patterns = self.topics.by_client.get(websocket)
+        if patterns:
+            for pattern in list(patterns):
+                self.topics.subscribe(session, pattern)
+            self.topics.remove(websocket)
+    
+    def _write(self, websocket, frame: bytes):
+        """Пишет служебный кадр в транспорт, минуя очередь рассылки"""
+        write_frame(websocket, frame)
+        add_messages_out(websocket, 1)
+        self.frames_written += 1
+    
+    def _deliver_session(self, session: Session, frame: bytes):
+        """Сохраняет кадр темы в кольце сессии и отправляет его с номером подключению сессии, если оно есть"""
+        # Отключенная сессия сначала дописывает пропущенную рассылку: порядок кадров в кольце сохраняется
+        self.sessions.catch_up(session)
+        sequence = session.append(frame)
+        websocket = session.connection
+        if websocket is not None:
+            self._push(websocket, self.outboxes.get(websocket), sequenced_chunks(sequence, frame))
+    
+    def subscribe(self, websocket: websockets.WebSocketServerProtocol, pattern: str) -> bool:
+        """
+        Подписывает клиента на тему или префикс тем ("orders.*", см. ws_topics.py)
+        
+        Returns:
+            True, если подписки не было
+        
+        Подписка клиента сессии принадлежит сессии и переживает переподключение.
+        
+        Raises:
+            ValueError: Неверный шаблон темы
+        """
+        return self.topics.subscribe(self._subscriber(websocket), pattern)
+    
+    def unsubscribe(self, websocket: websockets.WebSocketServerProtocol, pattern: str) -> bool:
+        """Отписывает клиента от шаблона; False, если подписки не было"""
+        return self.topics.unsubscribe(self._subscriber(websocket), pattern)
+    
+    def _subscriber(self, websocket):
+        """Подписчик в индексе тем: сессия клиента или само подключение"""
+        if self.sessions is None:
+            return websocket
+        return self.sessions.by_connection.get(websocket, websocket)
+    
+    def publish(self, topic: str, message: Union[str, bytes]) -> int:
+        """
+        Отправляет сообщение подписчикам темы без ожидания
+        
+        Кадр кодируется один раз на публикацию, подписчики берутся из индекса
+        тем: клиенты без подписки на тему не перебираются. Медленным
+        подписчикам кадр ставится в очередь, как при broadcast.
+        
+        Returns:
+            Количество подписчиков, которым отправлено сообщение
+        """
+        return self.publish_frame(topic, encode_broadcast_frame(message))
+    
+    def publish_frame(self, topic: str, frame: bytes) -> int:
+        """Отправляет заранее закодированный кадр подписчикам темы (см. publish)"""
+        self.publish_count += 1
+        subscribers = self.topics.subscribers(topic)
+        outboxes = self.outboxes
+        if self.sessions is None:
+            for websocket in subscribers:
+                self._push(websocket, outboxes.get(websocket), frame)
+        else:
+            for subscriber in subscribers:
+                if subscriber.__class__ is Session:
+                    self._deliver_session(subscriber, frame)
+                else:
+                    self._push(subscriber, outboxes.get(subscriber), frame)
+        return len(subscribers)
+    
+    def _push(self, websocket, outbox: Optional[ClientOutbox], frame: Union[bytes, tuple]):
+        """
+        Отправляет кадр клиенту или ставит его в очередь по политике переполнения
+        
+        Кадр - bytes или tuple частей кадра сессии (см. ws_session.sequenced_chunks).
+        """
+        if not is_open(websocket):
+            return
+        # Быстрый путь: буфер ниже верхней границы и очередь пуста.
+        # Во время отправки фрагментированного сообщения кадр писать нельзя.
+        if (outbox is None or not outbox.queue) and can_write_frame(websocket):
+            _write_queued(websocket, frame)
+            add_messages_out(websocket, 1)
+            self.frames_written += 1
+            return
+        
+        if outbox is None:
+            outbox = self.outboxes[websocket] = ClientOutbox()
+        queue = outbox.queue
+        if len(queue) >= self.max_queue:
+            self.frames_dropped += 1
+            outbox.dropped += 1
+            if self.overflow_policy == OVERFLOW_SKIP:
+                return
+            if self.overflow_policy == OVERFLOW_DISCONNECT:
+                self._disconnect_slow(websocket, outbox)
+                return
+            queue.popleft()
+        queue.append(frame)
+        self.frames_queued += 1
+        if outbox.flush_task is None:
+            outbox.flush_task = asyncio.create_task(self._flush(websocket, outbox))
+    
+    def _disconnect_slow(self, websocket, outbox: ClientOutbox):
+        """Отключает клиента, не успевающего принимать рассылку"""
+        self.slow_disconnects += 1
+        outbox.queue.clear()
+        # Закрывающий кадр встал бы в конец переполненного буфера, поэтому рвем соединение сразу
+        abort(websocket)
+    
+    async def _flush(self, websocket, outbox: ClientOutbox):
+        """Дописывает очередь клиента по мере освобождения буфера записи"""
+        queue = outbox.queue
+        try:
+            while queue:
+                # drain() ждет, пока буфер транспорта опустится ниже нижней границы
+                await wait_writable(websocket)
+                await wait_send_done(websocket)
+                if not is_open(websocket):
+                    queue.clear()
+                    break
+                while queue and not write_paused(websocket):
+                    _write_queued(websocket, queue.popleft())
+                    add_messages_out(websocket, 1)
+                    self.frames_written += 1
+        except ConnectionError:
+            queue.clear()
+        finally:
+            outbox.flush_task = None
+    
+    def get_broadcast_stats(self) -> dict:
+        """Возвращает статистику рассылки"""
+        return {
+            'broadcasts': self.broadcast_count,
+            'publishes': self.publish_count,
+            'frames_written': self.frames_written,
+            'frames_queued': self.frames_queued,
+            'frames_dropped': self.frames_dropped,
+            'slow_disconnects': self.slow_disconnects,
+            'bus_unrelayed': self.bus_unrelayed,
+            'queued_now': sum(len(outbox.queue) for outbox in self.outboxes.values()),
+        }
@@ -0,0 +1,96 @@
+"""
+Прямая запись кадров в подключение websockets в обход send()
+
+ClientManager, ws_sender и ws_stream пишут готовые кадры сразу в транспорт
+серверного подключения. Для этого нужны внутренние атрибуты реализации
+websockets.asyncio: состояние протокола, флаг приостановки записи (paused),
+drain(), незавершенная фрагментированная отправка (send_in_progress) и сам
+транспорт. Все обращения к ним собраны здесь. При импорте проверяются версия
+websockets (MIN_WEBSOCKETS_VERSION, с ней код написан и проверен) и наличие
+этих атрибутов: с несовместимой версией сервер падает сразу с понятной
+ошибкой, а не на первом сообщении.
+"""
+import asyncio
+import re
+
+import websockets
+from websockets.asyncio.connection import Connection
+from websockets.protocol import State
+
+MIN_WEBSOCKETS_VERSION = (14, 0)
+
+
+def _check_websockets():
+    """
+    Raises:
+        ImportError: Версия websockets ниже MIN_WEBSOCKETS_VERSION или в
+            Connection нет нужных атрибутов
+    """
+    match = re.match(r"(\d+)\.(\d+)", websockets.version.version)
+    version = (int(match.group(1)), int(match.group(2))) if match else (0, 0)
+    required = ".".join(str(part) for part in MIN_WEBSOCKETS_VERSION)
+    if version < MIN_WEBSOCKETS_VERSION:
+        raise ImportError(f"нужна библиотека websockets>={required}, установлена {websockets.version.version}")
+    # Атрибуты экземпляра задаются в __init__ и connection_made: ищем их имена в коде методов
+    names = set(Connection.__init__.__code__.co_names) | set(Connection.connection_made.__code__.co_names)
+    missing = [name for name in ("protocol", "paused", "send_in_progress", "transport") if name not in names]
+    if not callable(getattr(Connection, "drain", None)):
+        missing.append("drain")
+    if missing:
+        raise ImportError(f"websockets {websockets.version.version}: в Connection нет {', '.join(missing)}, "
+                          f"прямая запись кадров проверена с websockets>={required}")
+
+
+_check_websockets()
+
+
+def is_open(connection: Connection) -> bool:
+    """Подключение открыто (рукопожатие завершено, закрытие не начато)"""
+    return connection.protocol.state is State.OPEN
+
+
+def is_writable(connection: Connection) -> bool:
+    """Подключение открыто и транспорт не закрывается"""
+    return connection.protocol.state is State.OPEN and not connection.transport.is_closing()
+
+
+def write_paused(connection: Connection) -> bool:
+    """Буфер записи выше верхней границы (write_limit подключения)"""
+    return connection.paused
+
+
+def can_write_frame(connection: Connection) -> bool:
+    """Кадр можно писать сразу: буфер ниже верхней границы и не идет фрагментированная отправка send()"""
+    return not connection.paused and connection.send_in_progress is None
+
+
+async def wait_writable(connection: Connection):
+    """Ждет, пока буфер записи опустится ниже нижней границы"""
+    await connection.drain()
+
+
+async def wait_send_done(connection: Connection):
+    """Ждет завершения фрагментированной отправки send(), между фрагментами которой нельзя писать"""
+    while connection.send_in_progress is not None:
+        await asyncio.shield(connection.send_in_progress)
+
+
+def write_frame(connection: Connection, frame: bytes):
+    """Пишет готовый кадр в транспорт"""
+    connection.transport.write(frame)
+
+
+def write_frames(connection: Connection, chunks):
+    """Пишет готовые кадры (или их части) в транспорт одним вызовом"""
+    connection.transport.writelines(chunks)
+
+
+def write_buffer_size(connection: Connection) -> int:
+    """Байты в буфере записи транспорта"""
+    transport = connection.transport
+    return transport.get_write_buffer_size() if transport is not None else 0
+
+
+def abort(connection: Connection):
+    """Рвет соединение сразу, без закрывающего кадра"""
+    connection.transport.abort()
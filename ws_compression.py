@@ -0,0 +1,211 @@
+"""
+Настройка сжатия permessage-deflate (RFC 7692) для серверов и клиентов на websockets
+и замер "сжатие против пропускной способности"
+
+По умолчанию websockets включает permessage-deflate с окном 12 бит и memLevel 5.
+Здесь эти параметры задаются из командной строки, а замер прогоняет матрицу
+настроек по размерам сообщений и выводит процессорное время, байты на проводе
+и скорость в сообщениях/сек для каждой комбинации.
+"""
+import asyncio
+import itertools
+import time
+from typing import List, Optional
+
+import websockets
+from websockets.extensions.permessage_deflate import (ClientPerMessageDeflateFactory,
+                                                      ServerPerMessageDeflateFactory)
+
+from ws_protocol import make_text_payload
+from ws_metrics import ServerMetrics
+
+COMPRESSION_DEFLATE = "deflate"
+COMPRESSION_NONE = "none"
+COMPRESSION_CHOICES = (COMPRESSION_DEFLATE, COMPRESSION_NONE)
+
+# Значения websockets по умолчанию
+DEFAULT_WINDOW_BITS = 12
+DEFAULT_MEM_LEVEL = 5
+# Уровень zlib по умолчанию (соответствует 6)
+DEFAULT_LEVEL = -1
+
+
+def add_compression_arguments(parser):
+    """Добавляет в argparse параметры сжатия permessage-deflate"""
+    parser.add_argument("--compression", choices=COMPRESSION_CHOICES, default=COMPRESSION_DEFLATE,
+                       help="Сжатие permessage-deflate: deflate или none (по умолчанию: deflate)")
+    parser.add_argument("--window-bits", type=int, default=DEFAULT_WINDOW_BITS,
+                       help=f"Размер окна сжатия, 9-15 бит (по умолчанию: {DEFAULT_WINDOW_BITS})")
+    parser.add_argument("--mem-level", type=int, default=DEFAULT_MEM_LEVEL,
+                       help=f"memLevel zlib, 1-9 (по умолчанию: {DEFAULT_MEM_LEVEL})")
+    parser.add_argument("--compression-level", type=int, default=DEFAULT_LEVEL,
+                       help="Уровень сжатия zlib, 0-9, -1 - по умолчанию zlib (по умолчанию: -1)")
+
+
+def compress_settings(mem_level: int, level: int) -> dict:
+    """Параметры zlib.compressobj (кроме wbits)"""
+    return {'memLevel': mem_level, 'level': level}
+
+
+def server_compression_options(compression: str = COMPRESSION_DEFLATE, window_bits: int = DEFAULT_WINDOW_BITS,
+                               mem_level: int = DEFAULT_MEM_LEVEL, level: int = DEFAULT_LEVEL) -> dict:
+    """
+    Параметры websockets.serve() для сжатия
+
+    Args:
+        compression: COMPRESSION_DEFLATE или COMPRESSION_NONE
+        window_bits: Размер окна сжатия сервера и клиента в битах
+        mem_level: memLevel zlib
+        level: Уровень сжатия zlib
+
+    Returns:
+        Словарь с параметрами compression/extensions
+    """
+    if compression == COMPRESSION_NONE:
+        return {'compression': None}
+    return {
+        'compression': None,
+        'extensions': [ServerPerMessageDeflateFactory(
+            server_max_window_bits=window_bits,
+            client_max_window_bits=window_bits,
+            compress_settings=compress_settings(mem_level, level),
+        )],
+    }
+
+
+def client_compression_options(compression: str = COMPRESSION_DEFLATE, window_bits: int = DEFAULT_WINDOW_BITS,
+                               mem_level: int = DEFAULT_MEM_LEVEL, level: int = DEFAULT_LEVEL) -> dict:
+    """Параметры websockets.connect() для сжатия (см. server_compression_options)"""
+    if compression == COMPRESSION_NONE:
+        return {'compression': None}
+    return {
+        'compression': None,
+        'extensions': [ClientPerMessageDeflateFactory(
+            server_max_window_bits=window_bits,
+            client_max_window_bits=window_bits,
+            compress_settings=compress_settings(mem_level, level),
+        )],
+    }
+
+
+def server_options_from_args(args) -> dict:
+    """Параметры websockets.serve() из аргументов add_compression_arguments"""
+    return server_compression_options(args.compression, args.window_bits, args.mem_level, args.compression_level)
+
+
+def client_options_from_args(args) -> dict:
+    """Параметры websockets.connect() из аргументов add_compression_arguments"""
+    return client_compression_options(args.compression, args.window_bits, args.mem_level, args.compression_level)
+
+
+def parse_int_list(value: str) -> List[int]:
+    """Разбирает список чисел через запятую"""
+    return [int(item) for item in value.split(",") if item.strip()]
+
+
+class MatrixResult:
+    """Результат одной комбинации матрицы сжатия"""
+
+    __slots__ = ("payload_size", "messages", "elapsed", "cpu_time", "payload_bytes", "wire_bytes")
+
+    def __init__(self, payload_size: int, messages: int, elapsed: float, cpu_time: float,
+                 payload_bytes: int, wire_bytes: int):
+        self.payload_size = payload_size
+        self.messages = messages
+        self.elapsed = elapsed
+        self.cpu_time = cpu_time
+        self.payload_bytes = payload_bytes
+        self.wire_bytes = wire_bytes
+
+
+async def run_compression_case(host: str, port: int, payload_size: int, messages: int,
+                               server_options: dict, client_options: dict) -> Optional[MatrixResult]:
+    """
+    Прогоняет одну комбинацию: клиент отправляет messages текстовых сообщений
+    локальному серверу с заданными настройками сжатия
+
+    Байты на проводе - то, что сервер прочитал из сокета после рукопожатия;
+    процессорное время - суммарное для клиента и сервера (один процесс).
+    """
+    received = 0
+    done = asyncio.Event()
+    server_connections = []
+
+    async def handler(websocket):
+        nonlocal received
+        server_connections.append(websocket)
+        async for _ in websocket:
+            received += 1
+            if received == messages:
+                done.set()
+
+    # Счетчик байтов чтения подключения - тот же, что у метрик /metrics
+    metrics = ServerMetrics()
+    message = make_text_payload(payload_size)
+    async with websockets.serve(handler, host, port, create_connection=metrics.create_connection,
+                                max_size=None, **server_options):
+        async with websockets.connect(f"ws://{host}:{port}", max_size=None, **client_options) as websocket:
+            while not server_connections:
+                await asyncio.sleep(0.001)
+            connection = server_connections[0]
+            bytes_before = connection.bytes_in
+            cpu_start = time.process_time()
+            start_time = time.perf_counter()
+            for _ in range(messages):
+                await websocket.send(message)
+            try:
+                await asyncio.wait_for(done.wait(), 60.0)
+            except asyncio.TimeoutError:
+                print(f"Внимание: сервер получил {received} из {messages} сообщений")
+                return None
+            elapsed = time.perf_counter() - start_time
+            cpu_time = time.process_time() - cpu_start
+            wire_bytes = connection.bytes_in - bytes_before
+    return MatrixResult(payload_size, messages, elapsed, cpu_time,
+                        len(message.encode('utf-8')) * messages, wire_bytes)
+
+
+async def run_compression_matrix(host: str, port: int, payload_sizes: List[int], messages: int,
+                                 window_bits_list: List[int], mem_levels: List[int], levels: List[int]):
+    """
+    Замер матрицы настроек сжатия по размерам сообщений
+
+    Args:
+        host: Хост локального сервера замера
+        port: Порт локального сервера замера
+        payload_sizes: Размеры сообщений в байтах
+        messages: Количество сообщений на комбинацию
+        window_bits_list: Размеры окна сжатия
+        mem_levels: Значения memLevel
+        levels: Уровни сжатия
+    """
+    cases = [("без сжатия", server_compression_options(COMPRESSION_NONE),
+              client_compression_options(COMPRESSION_NONE))]
+    for window_bits, mem_level, level in itertools.product(window_bits_list, mem_levels, levels):
+        cases.append((f"окно={window_bits} mem={mem_level} ур={level}",
+                      server_compression_options(COMPRESSION_DEFLATE, window_bits, mem_level, level),
+                      client_compression_options(COMPRESSION_DEFLATE, window_bits, mem_level, level)))
+
+    print(f"\n{'='*60}")
+    print("Замер сжатия permessage-deflate")
+    print(f"Размеры сообщений: {', '.join(str(size) for size in payload_sizes)} байт")
+    print(f"Сообщений на комбинацию: {messages}, комбинаций настроек: {len(cases)}")
+    print(f"{'='*60}\n")
+    print(f"{'Размер':>8} {'Настройки':<26} {'сообщ/сек':>12} {'CPU, с':>8} {'мкс CPU/сообщ':>14} "
+          f"{'На проводе':>12} {'Доля':>6}")
+
+    for payload_size in payload_sizes:
+        for label, server_options, client_options in cases:
+            result = await run_compression_case(host, port, payload_size, messages,
+                                                server_options, client_options)
+            if result is None:
+                continue
+            rate = result.messages / result.elapsed if result.elapsed > 0 else 0
+            cpu_per_message = result.cpu_time / result.messages * 1_000_000
+            ratio = result.wire_bytes / result.payload_bytes if result.payload_bytes else 0
+            print(f"{payload_size:>8} {label:<26} {rate:>12.2f} {result.cpu_time:>8.3f} "
+                  f"{cpu_per_message:>14.2f} {result.wire_bytes:>12} {ratio:>6.3f}")
+        print()
+
+    print("Доля - байты на проводе (с заголовками кадров) к байтам полезной нагрузки")
+    print("CPU - процессорное время клиента и сервера вместе (один процесс)")
@@ -0,0 +1,303 @@
+"""
+Плотный режим сервера: десятки тысяч почти неактивных подключений
+
+Каждое подключение websockets держит собственную задачу keepalive (свой
+таймер ping), а состояние подключений лежит в множествах и словарях по
+объектам. В плотном режиме:
+
+    ConnectionTable     - подключения по малым целым номерам (номера
+                          закрытых подключений переиспользуются); время
+                          последней активности и неотвеченного ping - в
+                          массивах array, а не в объектах
+    TimerWheel          - одно хешированное колесо таймеров на все
+                          подключения: постановка и отмена таймера - O(1),
+                          запись в ячейке - одно целое (срок << ID_BITS | номер)
+    KeepaliveScheduler  - ping и таймауты всех подключений одной задачей
+                          asyncio поверх колеса
+
+Время в колесе идет тиками (по умолчанию 1 секунда): на пути приема
+активность отмечается записью номера текущего тика в массив, без вызова
+часов. Отмена таймера ленивая: запись в ячейке колеса срабатывает, только
+если ее срок совпадает с текущим сроком подключения.
+"""
+import asyncio
+import math
+from array import array
+from typing import Callable, Iterator, List, Optional
+
+# Номер подключения занимает младшие биты записи колеса
+ID_BITS = 24
+ID_MASK = (1 << ID_BITS) - 1
+
+DEFAULT_TICK = 1.0
+DEFAULT_WHEEL_SIZE = 512
+DEFAULT_PING_INTERVAL = 20.0
+DEFAULT_PING_TIMEOUT = 20.0
+
+
+def add_density_arguments(parser):
+    """Добавляет в argparse параметры плотного режима"""
+    parser.add_argument("--density", action="store_true",
+                       help="Плотный режим для множества неактивных подключений: компактная таблица "
+                            "подключений и общее колесо таймеров ping вместо таймера на подключение "
+                            "(бэкенды websockets и raw)")
+    parser.add_argument("--ping-interval", type=float, default=DEFAULT_PING_INTERVAL,
+                       help="Плотный режим: ping после стольких секунд без данных от клиента "
+                            f"(по умолчанию: {DEFAULT_PING_INTERVAL:g})")
+    parser.add_argument("--ping-timeout", type=float, default=DEFAULT_PING_TIMEOUT,
+                       help="Плотный режим: закрыть подключение без ответа на ping за столько секунд "
+                            f"(по умолчанию: {DEFAULT_PING_TIMEOUT:g})")
+    parser.add_argument("--idle-timeout", type=float, default=0.0,
+                       help="Плотный режим: закрыть подключение без сообщений за столько секунд "
+                            "(по умолчанию: 0 - не закрывать)")
+    parser.add_argument("--wheel-tick", type=float, default=DEFAULT_TICK,
+                       help=f"Плотный режим: шаг колеса таймеров в секундах (по умолчанию: {DEFAULT_TICK:g})")
+
+
+def density_options_from_args(args) -> Optional[dict]:
+    """Параметры KeepaliveScheduler из аргументов add_density_arguments (None - режим выключен)"""
+    if not args.density:
+        return None
+    return {
+        'ping_interval': args.ping_interval,
+        'ping_timeout': args.ping_timeout,
+        'idle_timeout': args.idle_timeout,
+        'tick': args.wheel_tick,
+    }
+
+
+class ConnectionTable:
+    """Подключения по малым целым номерам и их активность в массивах"""
+
+    __slots__ = ("connections", "free", "last_seen", "last_active", "ping_sent")
+
+    def __init__(self):
+        self.connections: List[object] = []
+        # Номера закрытых подключений для повторного использования
+        self.free: List[int] = []
+        # Тик последних данных от клиента (включая pong) и последнего сообщения
+        self.last_seen = array("q")
+        self.last_active = array("q")
+        # Тик отправки неотвеченного ping (0 - ping не ждет ответа)
+        self.ping_sent = array("q")
+
+    def add(self, connection, now: int) -> int:
+        """Регистрирует подключение и возвращает его номер"""
+        if self.free:
+            conn_id = self.free.pop()
+            self.connections[conn_id] = connection
+            self.last_seen[conn_id] = now
+            self.last_active[conn_id] = now
+            self.ping_sent[conn_id] = 0
+            return conn_id
+        conn_id = len(self.connections)
+        if conn_id > ID_MASK:
+            raise OverflowError(f"Больше {ID_MASK + 1} подключений")
+        self.connections.append(connection)
+        self.last_seen.append(now)
+        self.last_active.append(now)
+        self.ping_sent.append(0)
+        return conn_id
+
+    def remove(self, conn_id: int):
+        """Освобождает номер подключения"""
+        if self.connections[conn_id] is not None:
+            self.connections[conn_id] = None
+            self.free.append(conn_id)
+
+    def __len__(self) -> int:
+        return len(self.connections) - len(self.free)
+
+    def __iter__(self) -> Iterator:
+        return (connection for connection in self.connections if connection is not None)
+
+
+class TimerWheel:
+    """
+    Хешированное колесо таймеров
+
+    Ячейка колеса - array("q") записей (срок << ID_BITS | номер). Таймеры
+    дальше одного оборота остаются в ячейке до своего оборота.
+    """
+
+    __slots__ = ("tick", "size", "slots", "deadlines", "now", "callback", "task")
+
+    def __init__(self, callback: Callable[[int], None], tick: float = DEFAULT_TICK,
+                 size: int = DEFAULT_WHEEL_SIZE):
+        """
+        Args:
+            callback: Вызывается с номером подключения, когда его таймер сработал
+            tick: Шаг колеса в секундах
+            size: Количество ячеек
+        """
+        self.callback = callback
+        self.tick = tick
+        self.size = size
+        self.slots = [array("q") for _ in range(size)]
+        # Текущий срок таймера по номеру подключения (0 - таймера нет)
+        self.deadlines = array("q")
+        # Текущий тик (с 1: срок 0 означает отсутствие таймера)
+        self.now = 1
+        self.task: Optional[asyncio.Task] = None
+
+    def ticks(self, seconds: float) -> int:
+        """Секунды в тиках (не меньше одного)"""
+        return max(1, math.ceil(seconds / self.tick))
+
+    def schedule(self, conn_id: int, ticks: int):
+        """Ставит (или переставляет) таймер подключения через ticks тиков"""
+        deadlines = self.deadlines
+        if conn_id >= len(deadlines):
+            deadlines.frombytes(bytes(deadlines.itemsize * (conn_id + 1 - len(deadlines))))
+        deadline = self.now + max(1, ticks)
+        deadlines[conn_id] = deadline
+        self.slots[deadline % self.size].append((deadline << ID_BITS) | conn_id)
+
+    def cancel(self, conn_id: int):
+        """Отменяет таймер (запись в ячейке будет пропущена)"""
+        if conn_id < len(self.deadlines):
+            self.deadlines[conn_id] = 0
+
+    def advance(self):
+        """Переходит к следующему тику и вызывает сработавшие таймеры"""
+        self.now += 1
+        now = self.now
+        index = now % self.size
+        entries = self.slots[index]
+        if not entries:
+            return
+        self.slots[index] = array("q")
+        deadlines = self.deadlines
+        for entry in entries:
+            deadline = entry >> ID_BITS
+            if deadline > now:
+                # Следующий оборот колеса
+                self.slots[index].append(entry)
+                continue
+            conn_id = entry & ID_MASK
+            if deadlines[conn_id] == deadline:
+                deadlines[conn_id] = 0
+                self.callback(conn_id)
+
+    async def run(self):
+        """Фоновая задача: тик раз в tick секунд без накопления ошибки"""
+        loop = asyncio.get_running_loop()
+        start = loop.time() - self.now * self.tick
+        while True:
+            await asyncio.sleep(max(0.0, start + (self.now + 1) * self.tick - loop.time()))
+            self.advance()
+
+    def start(self):
+        """Запускает колесо в текущем цикле событий"""
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    def stop(self):
+        """Останавливает колесо"""
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+
+class KeepaliveScheduler:
+    """
+    Ping и таймауты всех подключений одним колесом таймеров
+
+    Бэкенд передает функции отправки ping и закрытия подключения, вызывает
+    seen() на любые данные от клиента и active() на сообщения.
+    """
+
+    def __init__(self, send_ping: Callable[[object, int], None], close: Callable[[object, bool], None],
+                 ping_interval: float = DEFAULT_PING_INTERVAL, ping_timeout: float = DEFAULT_PING_TIMEOUT,
+                 idle_timeout: float = 0.0, tick: float = DEFAULT_TICK):
+        """
+        Args:
+            send_ping: send_ping(подключение, номер) - отправить ping
+            close: close(подключение, graceful) - закрыть подключение (graceful=False -
+                клиент не отвечает, закрывающее рукопожатие не нужно)
+            ping_interval: ping после стольких секунд без данных от клиента
+            ping_timeout: Закрыть подключение без ответа на ping за столько секунд
+            idle_timeout: Закрыть подключение без сообщений за столько секунд (0 - не закрывать)
+            tick: Шаг колеса таймеров в секундах
+        """
+        self.send_ping = send_ping
+        self.close = close
+        self.table = ConnectionTable()
+        self.wheel = TimerWheel(self._check, tick)
+        self.ping_ticks = self.wheel.ticks(ping_interval)
+        self.timeout_ticks = self.wheel.ticks(ping_timeout)
+        self.idle_ticks = self.wheel.ticks(idle_timeout) if idle_timeout > 0 else 0
+        # Счетчики для отчета
+        self.pings = 0
+        self.ping_timeouts = 0
+        self.idle_closed = 0
+
+    def add(self, connection) -> int:
+        """Регистрирует подключение и ставит его таймер; возвращает номер подключения"""
+        conn_id = self.table.add(connection, self.wheel.now)
+        self.wheel.schedule(conn_id, self.ping_ticks)
+        return conn_id
+
+    def remove(self, conn_id: int):
+        """Подключение закрыто"""
+        self.wheel.cancel(conn_id)
+        self.table.remove(conn_id)
+
+    def seen(self, conn_id: int):
+        """Данные от клиента (включая pong): клиент жив"""
+        self.table.last_seen[conn_id] = self.wheel.now
+        self.table.ping_sent[conn_id] = 0
+
+    def active(self, conn_id: int):
+        """Сообщение от клиента"""
+        table = self.table
+        table.last_seen[conn_id] = table.last_active[conn_id] = self.wheel.now
+        table.ping_sent[conn_id] = 0
+
+    def _check(self, conn_id: int):
+        """Таймер подключения сработал"""
+        table = self.table
+        connection = table.connections[conn_id]
+        if connection is None:
+            return
+        now = self.wheel.now
+        ping_sent = table.ping_sent[conn_id]
+        if ping_sent and now - ping_sent >= self.timeout_ticks:
+            # С момента ping от клиента ничего не пришло
+            self.ping_timeouts += 1
+            self.close(connection, False)
+            return
+        idle_left = self.ping_ticks
+        if self.idle_ticks:
+            idle_left = self.idle_ticks - (now - table.last_active[conn_id])
+            if idle_left <= 0:
+                self.idle_closed += 1
+                self.close(connection, True)
+                return
+        if ping_sent:
+            self.wheel.schedule(conn_id, min(self.timeout_ticks - (now - ping_sent), idle_left))
+            return
+        quiet = now - table.last_seen[conn_id]
+        if quiet >= self.ping_ticks:
+            self.send_ping(connection, conn_id)
+            self.pings += 1
+            table.ping_sent[conn_id] = now
+            self.wheel.schedule(conn_id, min(self.timeout_ticks, idle_left))
+        else:
+            self.wheel.schedule(conn_id, min(self.ping_ticks - quiet, idle_left))
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def start(self):
+        """Запускает колесо таймеров (в работающем цикле событий)"""
+        self.wheel.start()
+
+    def stop(self):
+        """Останавливает колесо таймеров"""
+        self.wheel.stop()
+
+    def summary(self) -> str:
+        """Строка отчета о keepalive"""
+        return (f"подключений: {len(self.table)}, ping: {self.pings}, без ответа на ping: {self.ping_timeouts}, "
+                f"закрыто по неактивности: {self.idle_closed}")
@@ -0,0 +1,417 @@
+"""
+Распределенный генератор нагрузки: координатор и процессы-воркеры
+
+Один процесс Python упирается в одно ядро раньше сервера, поэтому нагрузку
+создают несколько воркеров (ws_loadgen.LoadGenerator в каждом), а
+координатор раздает им сценарий, запускает всех одновременно и сводит
+счетчики и гистограммы RTT в общий отчет.
+
+Воркеры подключаются к координатору по TCP: локальные процессы координатор
+запускает сам, воркеры на других машинах запускаются вручную
+(client.py --worker-of HOST:PORT). Сообщения - JSON, по одному в строке:
+
+    воркер -> координатор  hello     имя машины и pid
+    координатор -> воркер  scenario  параметры генератора (доля подключений
+                                     и частоты воркера), длительность, интервал
+    воркер -> координатор  ready     генератор создан
+    координатор -> воркер  start     всем воркерам сразу, когда готовы все
+    воркер -> координатор  interval  раз в интервал: счетчики нарастающим
+                                     итогом и гистограмма RTT за интервал
+    воркер -> координатор  final     итоги воркера и гистограмма за весь замер
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import time
+from typing import List, Optional, Tuple
+
+from ws_histogram import Histogram
+from ws_loadgen import LoadGenerator
+from ws_compression import client_compression_options
+from ws_workers import stop_workers
+
+# Сколько ждать подключения и готовности всех воркеров, сек
+WORKER_WAIT_TIMEOUT = 30.0
+# Сколько ждать итогов воркеров после окончания замера, сек
+FINAL_WAIT_TIMEOUT = 10.0
+
+
+def parse_address(value: str) -> Optional[Tuple[str, int]]:
+    """Разбирает адрес "HOST:PORT" (порт 0 - выбирает ОС)"""
+    host, _, port = value.rpartition(":")
+    if not host or not port.isdigit():
+        return None
+    return host, int(port)
+
+
+async def send_message(writer: asyncio.StreamWriter, message: dict):
+    """Отправляет сообщение протокола (JSON в одной строке)"""
+    writer.write(json.dumps(message, ensure_ascii=False).encode('utf-8') + b"\n")
+    await writer.drain()
+
+
+async def receive_message(reader: asyncio.StreamReader) -> Optional[dict]:
+    """Принимает сообщение протокола; None - соединение закрыто"""
+    line = await reader.readline()
+    if not line:
+        return None
+    return json.loads(line)
+
+
+def split_scenario(scenario: dict, index: int, num_workers: int) -> dict:
+    """
+    Доля сценария для воркера index: подключения делятся поровну (остаток -
+    первым воркерам), общая частота (rate_total) - пропорционально подключениям
+    """
+    total = scenario['connections']
+    connections = total // num_workers + (1 if index < total % num_workers else 0)
+    share = dict(scenario, connections=connections)
+    if scenario['rate_total'] and total > 0:
+        share['rate'] = scenario['rate'] * connections / total
+    return share
+
+
+class WorkerLink:
+    """Подключенный воркер на стороне координатора"""
+
+    __slots__ = ("index", "name", "writer", "connections", "ready", "done", "intervals",
+                 "sent", "acked", "connected", "failed", "lag", "final")
+
+    def __init__(self, index: int, name: str, writer: asyncio.StreamWriter):
+        self.index = index
+        self.name = name
+        self.writer = writer
+        self.connections = 0
+        self.ready = asyncio.Event()
+        self.done = asyncio.Event()
+        # Сколько интервальных снимков прислал воркер
+        self.intervals = 0
+        # Последние счетчики воркера (нарастающим итогом)
+        self.sent = 0
+        self.acked = 0
+        self.connected = 0
+        self.failed = 0
+        # Текущее отставание от расписания, сек
+        self.lag = 0.0
+        # Итоги воркера (сообщение final)
+        self.final: Optional[dict] = None
+
+
+class Coordinator:
+    """Координатор: раздает сценарий воркерам и сводит их статистику"""
+
+    def __init__(self, scenario: dict, local_workers: int = 2, remote_workers: int = 0,
+                 listen_host: str = "127.0.0.1", listen_port: int = 0):
+        """
+        Args:
+            scenario: Параметры генератора нагрузки для всех воркеров вместе
+                (см. run_worker), duration и interval
+            local_workers: Сколько процессов-воркеров запустить на этой машине
+            remote_workers: Сколько воркеров, запущенных вручную, ждать дополнительно
+            listen_host: Адрес, на котором координатор ждет воркеров
+            listen_port: Порт координатора (0 - выбирает ОС)
+        """
+        self.scenario = scenario
+        self.local_workers = local_workers
+        self.remote_workers = remote_workers
+        self.listen_host = listen_host
+        self.listen_port = listen_port
+        self.workers: List[WorkerLink] = []
+        self.joined = asyncio.Event()
+        # Устанавливается при каждом снимке или отключении воркера
+        self.progress = asyncio.Event()
+        # RTT за интервал вывода (сводится из сообщений interval) и за весь замер
+        self.interval_histogram = Histogram()
+        self.total_histogram = Histogram()
+
+    @property
+    def expected_workers(self) -> int:
+        """Сколько всего воркеров участвует в замере"""
+        return self.local_workers + self.remote_workers
+
+    async def _serve_worker(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Принимает сообщения одного воркера"""
+        hello = await receive_message(reader)
+        if hello is None or hello.get('type') != 'hello' or len(self.workers) >= self.expected_workers:
+            writer.close()
+            return
+        worker = WorkerLink(len(self.workers), f"{hello.get('host')}/{hello.get('pid')}", writer)
+        self.workers.append(worker)
+        print(f"Воркер #{worker.index} подключен: {worker.name}")
+        if len(self.workers) == self.expected_workers:
+            self.joined.set()
+        try:
+            while True:
+                message = await receive_message(reader)
+                if message is None:
+                    break
+                kind = message.get('type')
+                if kind == 'ready':
+                    worker.ready.set()
+                elif kind == 'interval':
+                    self._update(worker, message)
+                    self.interval_histogram.merge(Histogram.from_dict(message['histogram']))
+                    worker.intervals += 1
+                    self.progress.set()
+                elif kind == 'final':
+                    self._update(worker, message)
+                    worker.final = message
+                    self.total_histogram.merge(Histogram.from_dict(message['histogram']))
+                    break
+        except (ConnectionError, ValueError) as e:
+            print(f"Воркер #{worker.index}: ошибка связи: {e}")
+        finally:
+            worker.done.set()
+            worker.ready.set()
+            self.progress.set()
+            writer.close()
+
+    @staticmethod
+    def _update(worker: WorkerLink, message: dict):
+        """Запоминает счетчики воркера"""
+        worker.sent = message['sent']
+        worker.acked = message['acked']
+        worker.connected = message.get('connected', 0)
+        worker.failed = message['failed']
+        worker.lag = message.get('lag', 0.0)
+
+    def _take_interval(self) -> Histogram:
+        """Возвращает сводную гистограмму за прошедший интервал и начинает новую"""
+        histogram = self.interval_histogram
+        self.interval_histogram = Histogram()
+        return histogram
+
+    def _start_local_workers(self, port: int) -> List[multiprocessing.Process]:
+        """Запускает локальные процессы-воркеры"""
+        host = "127.0.0.1" if self.listen_host in ("0.0.0.0", "") else self.listen_host
+        processes = []
+        for _ in range(self.local_workers):
+            process = multiprocessing.Process(target=worker_process_main, args=(host, port), daemon=True)
+            process.start()
+            processes.append(process)
+        return processes
+
+    async def _wait_workers(self) -> bool:
+        """Ждет подключения и готовности всех воркеров, раздает сценарий"""
+        try:
+            await asyncio.wait_for(self.joined.wait(), WORKER_WAIT_TIMEOUT)
+        except asyncio.TimeoutError:
+            print(f"Ошибка: подключилось {len(self.workers)} из {self.expected_workers} воркеров "
+                  f"за {WORKER_WAIT_TIMEOUT:g} секунд")
+            return False
+        for worker in self.workers:
+            share = split_scenario(self.scenario, worker.index, len(self.workers))
+            worker.connections = share['connections']
+            await send_message(worker.writer, {'type': 'scenario', 'worker': worker.index, 'scenario': share})
+        try:
+            await asyncio.wait_for(asyncio.gather(*(worker.ready.wait() for worker in self.workers)),
+                                   WORKER_WAIT_TIMEOUT)
+        except asyncio.TimeoutError:
+            print("Ошибка: не все воркеры подготовились к замеру")
+            return False
+        return not any(worker.done.is_set() for worker in self.workers)
+
+    async def run(self) -> Histogram:
+        """
+        Проводит распределенный замер и выводит сводный отчет
+
+        Returns:
+            Сводная гистограмма RTT за весь замер (мкс)
+        """
+        scenario = self.scenario
+        duration = scenario['duration']
+        interval = scenario['interval']
+        server = await asyncio.start_server(self._serve_worker, self.listen_host, self.listen_port)
+        port = server.sockets[0].getsockname()[1]
+
+        print(f"\n{'='*60}")
+        print("Запуск распределенного замера (координатор)")
+        print(f"Координатор: {self.listen_host}:{port}")
+        print(f"Воркеров: {self.local_workers} локальных"
+              + (f", {self.remote_workers} удаленных (client.py --worker-of HOST:{port})"
+                 if self.remote_workers else ""))
+        print(f"Подключений всего: {scenario['connections']}")
+        print(f"Неподтвержденных сообщений на подключение: {scenario['inflight'] or 'без ограничения'}")
+        print(f"Длительность: {duration} секунд")
+        print(f"Формат сообщений: {'двоичный' if scenario['binary'] else 'текстовый'}")
+        if scenario['ack_mode']:
+            print(f"Режим подтверждения: {scenario['ack_mode']}")
+        if scenario['rate'] > 0:
+            print(f"Открытый цикл ({scenario['arrival']}): {scenario['rate']:g} сообщений/сек "
+                  f"{'всего' if scenario['rate_total'] else 'на подключение'}")
+        print(f"{'='*60}\n")
+
+        processes = self._start_local_workers(port)
+        try:
+            async with server:
+                if not await self._wait_workers():
+                    return self.total_histogram
+                # Команда запуска уходит всем воркерам подряд, без ожидания ответов
+                for worker in self.workers:
+                    worker.writer.write(json.dumps({'type': 'start'}).encode('utf-8') + b"\n")
+                await asyncio.gather(*(worker.writer.drain() for worker in self.workers), return_exceptions=True)
+                print("Начало отправки сообщений...\n")
+                elapsed = await self._report(duration, interval)
+            self._print_final(elapsed)
+        finally:
+            stop_workers(processes)
+        return self.total_histogram
+
+    async def _report(self, duration: float, interval: float) -> float:
+        """
+        Выводит сводную статистику за каждый интервал, как только снимок за
+        него прислали все работающие воркеры, пока воркеры не пришлют итоги
+        """
+        start_time = time.time()
+        deadline = start_time + duration + FINAL_WAIT_TIMEOUT
+        interval_start = start_time
+        printed = 0
+        last_sent = 0
+        last_acked = 0
+        while time.time() < deadline:
+            active = [worker for worker in self.workers if not worker.done.is_set()]
+            if not active:
+                break
+            reached = min(worker.intervals for worker in active)
+            if reached <= printed:
+                self.progress.clear()
+                try:
+                    await asyncio.wait_for(self.progress.wait(), max(0.0, deadline - time.time()))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            printed = reached
+            current_time = time.time()
+            elapsed = current_time - interval_start
+            sent = sum(worker.sent for worker in self.workers)
+            acked = sum(worker.acked for worker in self.workers)
+            rate = (sent - last_sent) / elapsed if elapsed > 0 else 0
+            ack_rate = (acked - last_acked) / elapsed if elapsed > 0 else 0
+            print(f"[{current_time - start_time:.1f}с] "
+                  f"Отправлено: {sent - last_sent} сообщений за {elapsed:.1f}с "
+                  f"({rate:.2f} сообщений/сек), "
+                  f"подтверждено: {acked - last_acked} ({ack_rate:.2f} сообщений/сек), "
+                  f"подключений: {sum(worker.connected for worker in self.workers)}")
+            if self.scenario['rate'] > 0:
+                print(f"         Отставание от расписания: "
+                      f"{max(worker.lag for worker in self.workers) * 1000:.1f} мс")
+            interval_histogram = self._take_interval()
+            if interval_histogram.total_count:
+                print(f"         RTT: {interval_histogram.format_summary()}")
+            last_sent = sent
+            last_acked = acked
+            interval_start = current_time
+        if any(worker.final is None for worker in self.workers):
+            print("Внимание: не все воркеры прислали итоги")
+        return max((worker.final['elapsed'] for worker in self.workers if worker.final), default=0.0)
+
+    def _print_final(self, send_time: float):
+        """Итоговый отчет по всем воркерам"""
+        sent = sum(worker.sent for worker in self.workers)
+        acked = sum(worker.acked for worker in self.workers)
+        failed = sum(worker.failed for worker in self.workers)
+        total_rate = sent / send_time if send_time > 0 else 0
+        ack_rate = acked / send_time if send_time > 0 else 0
+
+        print(f"\n{'='*60}")
+        print(f"Распределенный замер завершен! Воркеров: {len(self.workers)}")
+        for worker in self.workers:
+            worker_time = worker.final['elapsed'] if worker.final else 0.0
+            worker_rate = worker.sent / worker_time if worker_time > 0 else 0
+            line = (f"  Воркер #{worker.index} ({worker.name}): {worker.connections} подключений, "
+                    f"отправлено {worker.sent} ({worker_rate:.2f} сообщений/сек)")
+            if worker.final is None:
+                line += ", итоги не получены"
+            else:
+                histogram = Histogram.from_dict(worker.final['histogram'])
+                if histogram.total_count:
+                    line += f", RTT p99={histogram.percentile(99.0) / 1000:.3f} мс"
+            print(line)
+        print(f"Всего отправлено: {sent} сообщений")
+        print(f"Всего подтверждено: {acked} сообщений")
+        if failed:
+            print(f"Не удалось подключиться: {failed}")
+        print(f"Общее время: {send_time:.2f} секунд")
+        print(f"Средняя скорость: {total_rate:.2f} сообщений/секунду")
+        print(f"Скорость подтверждений: {ack_rate:.2f} сообщений/секунду")
+        scenario = self.scenario
+        if scenario['rate'] > 0:
+            target_rate = scenario['rate'] if scenario['rate_total'] else scenario['rate'] * scenario['connections']
+            print(f"Целевая скорость: {target_rate:.2f} сообщений/секунду, "
+                  f"достигнуто {total_rate / target_rate * 100:.1f}%")
+            max_lag = max((worker.final['max_lag_ns'] for worker in self.workers if worker.final), default=0)
+            print(f"Наибольшее отставание от расписания: {max_lag / 1e6:.1f} мс")
+            print("RTT считается от запланированного времени отправки")
+        if self.total_histogram.total_count:
+            print(f"RTT: {self.total_histogram.format_summary()}")
+        print(f"{'='*60}\n")
+
+
+def make_generator(scenario: dict) -> LoadGenerator:
+    """Генератор нагрузки по сценарию координатора"""
+    return LoadGenerator(scenario['url'], scenario['connections'], scenario['inflight'], scenario['binary'],
+                         client_compression_options(*scenario['compression']),
+                         ack_mode=scenario['ack_mode'], ack_every=scenario['ack_every'],
+                         ack_interval=scenario['ack_interval'], rate=scenario['rate'],
+                         rate_total=scenario['rate_total'], arrival=scenario['arrival'])
+
+
+def snapshot(generator: LoadGenerator) -> dict:
+    """Счетчики генератора нарастающим итогом"""
+    stats = generator.stats
+    return {
+        'sent': stats.sent,
+        'acked': stats.acked,
+        'connected': stats.connected,
+        'failed': stats.failed,
+        'lag': generator.schedule_lag() if generator.schedules else 0.0,
+    }
+
+
+async def run_worker(host: str, port: int) -> bool:
+    """
+    Воркер: получает сценарий у координатора, по команде запуска создает
+    нагрузку и раз в интервал отправляет счетчики и гистограмму RTT
+
+    Returns:
+        True, если замер проведен и итоги отправлены
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        await send_message(writer, {'type': 'hello', 'host': platform.node(), 'pid': os.getpid()})
+        message = await receive_message(reader)
+        if message is None or message.get('type') != 'scenario':
+            return False
+        scenario = message['scenario']
+        generator = make_generator(scenario)
+        await send_message(writer, {'type': 'ready'})
+        message = await receive_message(reader)
+        if message is None or message.get('type') != 'start':
+            return False
+
+        tasks = generator.start()
+        start_time = time.monotonic()
+        end_time = start_time + scenario['duration']
+        while time.monotonic() < end_time and not all(task.done() for task in tasks):
+            await asyncio.sleep(min(scenario['interval'], max(0.0, end_time - time.monotonic())))
+            await send_message(writer, dict(snapshot(generator), type='interval',
+                                            histogram=generator.rtt_tracker.take_interval().to_dict()))
+        elapsed = time.monotonic() - start_time
+        await generator.stop()
+
+        max_lag = max((schedule.max_lag_ns for schedule in generator.schedules), default=0)
+        await send_message(writer, dict(snapshot(generator), type='final', elapsed=elapsed, max_lag_ns=max_lag,
+                                        histogram=generator.rtt_tracker.total_histogram.to_dict()))
+        return True
+    finally:
+        writer.close()
+
+
+def worker_process_main(host: str, port: int):
+    """Точка входа процесса-воркера"""
+    try:
+        asyncio.run(run_worker(host, port))
+    except (KeyboardInterrupt, ConnectionError):
+        pass
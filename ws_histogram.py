@@ -0,0 +1,212 @@
+"""
+Гистограмма задержек с логарифмическими корзинами (в стиле HdrHistogram)
+
+Память фиксирована и определяется только диапазоном и точностью:
+значения до 2^precision_bits хранятся точно, дальше каждая степень двойки
+делится на 2^(precision_bits-1) линейных корзин, поэтому относительная
+погрешность не превышает 1/2^(precision_bits-1).
+"""
+import threading
+from array import array
+from typing import Iterable, List, Tuple
+
+DEFAULT_PERCENTILES = (50.0, 90.0, 99.0, 99.9)
+
+
+class Histogram:
+    """Гистограмма целых неотрицательных значений (например, задержек в мкс)"""
+
+    __slots__ = ("precision_bits", "half_count", "max_value", "counts",
+                 "total_count", "min_recorded", "max_recorded", "total_sum")
+
+    def __init__(self, max_value: int = 60_000_000, precision_bits: int = 8):
+        """
+        Args:
+            max_value: Максимальное записываемое значение (большие обрезаются до него)
+            precision_bits: Точность; 8 бит дают погрешность не хуже 1/128
+        """
+        self.precision_bits = precision_bits
+        self.half_count = 1 << (precision_bits - 1)
+        self.max_value = max_value
+        self.counts = array('Q', [0]) * (self._index(max_value) + 1)
+        self.total_count = 0
+        self.min_recorded = 0
+        self.max_recorded = 0
+        self.total_sum = 0
+
+    def _index(self, value: int) -> int:
+        """Индекс корзины для значения"""
+        shift = value.bit_length() - self.precision_bits
+        if shift <= 0:
+            return value
+        return shift * self.half_count + (value >> shift)
+
+    def _highest_equivalent(self, index: int) -> int:
+        """Наибольшее значение, попадающее в корзину"""
+        if index < 2 * self.half_count:
+            return index
+        shift = index // self.half_count - 1
+        sub = index - shift * self.half_count
+        return ((sub + 1) << shift) - 1
+
+    def record(self, value: int, count: int = 1):
+        """Записывает значение"""
+        if value < 0:
+            value = 0
+        elif value > self.max_value:
+            value = self.max_value
+        self.counts[self._index(value)] += count
+        if self.total_count == 0 or value < self.min_recorded:
+            self.min_recorded = value
+        if value > self.max_recorded:
+            self.max_recorded = value
+        self.total_count += count
+        self.total_sum += value * count
+
+    def merge(self, other: "Histogram"):
+        """Добавляет значения другой гистограммы с теми же параметрами"""
+        if other.total_count == 0:
+            return
+        if len(other.counts) != len(self.counts) or other.precision_bits != self.precision_bits:
+            raise ValueError("Гистограммы с разными параметрами нельзя объединить")
+        counts = self.counts
+        for index, count in enumerate(other.counts):
+            if count:
+                counts[index] += count
+        if self.total_count == 0 or other.min_recorded < self.min_recorded:
+            self.min_recorded = other.min_recorded
+        if other.max_recorded > self.max_recorded:
+            self.max_recorded = other.max_recorded
+        self.total_count += other.total_count
+        self.total_sum += other.total_sum
+
+    def to_dict(self) -> dict:
+        """Гистограмма в виде словаря для JSON (только непустые корзины)"""
+        return {
+            'max_value': self.max_value,
+            'precision_bits': self.precision_bits,
+            'counts': [[index, count] for index, count in enumerate(self.counts) if count],
+            'min': self.min_recorded,
+            'max': self.max_recorded,
+            'sum': self.total_sum,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Histogram":
+        """Восстанавливает гистограмму из словаря to_dict()"""
+        histogram = cls(data['max_value'], data['precision_bits'])
+        for index, count in data['counts']:
+            histogram.counts[index] = count
+            histogram.total_count += count
+        histogram.min_recorded = data['min']
+        histogram.max_recorded = data['max']
+        histogram.total_sum = data['sum']
+        return histogram
+
+    def reset(self):
+        """Очищает гистограмму"""
+        for index in range(len(self.counts)):
+            self.counts[index] = 0
+        self.total_count = 0
+        self.min_recorded = 0
+        self.max_recorded = 0
+        self.total_sum = 0
+
+    def mean(self) -> float:
+        """Среднее значение"""
+        return self.total_sum / self.total_count if self.total_count else 0.0
+
+    def percentile(self, percent: float) -> int:
+        """Значение, не превышаемое заданным процентом записей"""
+        if self.total_count == 0:
+            return 0
+        if percent >= 100.0:
+            return self.max_recorded
+        threshold = max(1, int(self.total_count * percent / 100.0 + 0.5))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count:
+                seen += count
+                if seen >= threshold:
+                    return min(self._highest_equivalent(index), self.max_recorded)
+        return self.max_recorded
+
+    def percentiles(self, percents: Iterable[float] = DEFAULT_PERCENTILES) -> List[Tuple[float, int]]:
+        """Список (процент, значение) для нескольких процентилей"""
+        return [(percent, self.percentile(percent)) for percent in percents]
+
+    def format_summary(self, unit_divisor: float = 1000.0, unit: str = "мс") -> str:
+        """
+        Однострочная сводка процентилей
+
+        Args:
+            unit_divisor: Делитель для перевода значений в единицы вывода
+                (по умолчанию мкс -> мс)
+            unit: Название единиц вывода
+        """
+        parts = [f"p{percent:g}={value / unit_divisor:.3f}" for percent, value in self.percentiles()]
+        parts.append(f"max={self.max_recorded / unit_divisor:.3f}")
+        return f"{', '.join(parts)} {unit} (n={self.total_count})"
+
+    def dump(self, path: str, unit_divisor: float = 1000.0):
+        """
+        Сохраняет распределение в текстовый файл в формате .hgrm
+        (его понимает HdrHistogram plotter) для сравнения прогонов
+
+        Args:
+            path: Путь к файлу
+            unit_divisor: Делитель для перевода значений в единицы вывода
+        """
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(f"{'Value':>12} {'Percentile':>14} {'TotalCount':>10} {'1/(1-Percentile)':>14}\n\n")
+            seen = 0
+            for index, count in enumerate(self.counts):
+                if not count:
+                    continue
+                seen += count
+                fraction = seen / self.total_count
+                inverse = 1.0 / (1.0 - fraction) if fraction < 1.0 else float("inf")
+                value = min(self._highest_equivalent(index), self.max_recorded)
+                f.write(f"{value / unit_divisor:12.3f} {fraction:14.12f} {seen:10d} {inverse:14.2f}\n")
+            f.write(f"#[Mean    = {self.mean() / unit_divisor:12.3f}, Max = {self.max_recorded / unit_divisor:12.3f}]\n")
+            f.write(f"#[Min     = {self.min_recorded / unit_divisor:12.3f}, TotalCount = {self.total_count:12d}]\n")
+
+
+class RttTracker:
+    """
+    Сопоставляет эхо-ответы с временем отправки и записывает RTT в гистограммы
+
+    Время отправки текстовых сообщений хранится в кольцевом массиве по номеру
+    последовательности (память фиксирована); для двоичных кадров время
+    отправки берется из заголовка. Запись идет из потока приема, а чтение
+    интервальной гистограммы - из потока замера, поэтому доступ под блокировкой.
+    """
+
+    def __init__(self, ring_size: int = 1 << 16):
+        self.ring_size = ring_size
+        self.send_times = array('q', [0]) * ring_size
+        self.lock = threading.Lock()
+        self.interval_histogram = Histogram()
+        self.total_histogram = Histogram()
+
+    def on_sent(self, sequence: int, timestamp_ns: int):
+        """Запоминает время отправки сообщения с номером sequence"""
+        self.send_times[sequence % self.ring_size] = timestamp_ns
+
+    def on_echo(self, sequence: int, now_ns: int):
+        """Учитывает эхо текстового сообщения с номером sequence"""
+        self.record_ns(now_ns - self.send_times[sequence % self.ring_size])
+
+    def record_ns(self, rtt_ns: int):
+        """Записывает RTT в наносекундах (в гистограммах хранятся мкс)"""
+        rtt_us = rtt_ns // 1000
+        with self.lock:
+            self.interval_histogram.record(rtt_us)
+            self.total_histogram.record(rtt_us)
+
+    def take_interval(self) -> Histogram:
+        """Возвращает гистограмму за прошедший интервал и начинает новую"""
+        with self.lock:
+            histogram = self.interval_histogram
+            self.interval_histogram = Histogram()
+        return histogram
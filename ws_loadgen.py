@@ -0,0 +1,339 @@
+"""
+Асинхронный генератор нагрузки: много подключений в одном цикле asyncio
+
+Каждое подключение отправляет сообщения бенчмарка без искусственных пауз,
+ограничивая число неподтвержденных (in-flight) сообщений. Подтверждением
+считается эхо-ответ сервера на сообщение (server.py, server-bench.py --echo),
+короткий ответ или накопительное подтверждение (режимы compact и coalesced,
+см. ws_protocol.py).
+
+С заданной частотой (rate) генератор работает с открытым циклом
+(ws_schedule.py): сообщения отправляются по расписанию, а RTT считается от
+запланированного времени отправки.
+"""
+import asyncio
+import time
+from typing import List, Optional
+
+import websockets
+
+from ws_protocol import (encode_frame, decode_header, make_text_payload, encode_ack_request, parse_text_ack,
+                         text_ack_sequence, MSG_START, MSG_DATA, MSG_END, MSG_ACK, ACK_COALESCED,
+                         BENCHMARK_DATA_PREFIX, BENCHMARK_TEXT)
+from ws_histogram import RttTracker
+from ws_schedule import SendSchedule, ARRIVAL_UNIFORM
+
+# Сколько сообщений отправлять подряд, прежде чем отдать управление циклу событий
+SEND_BATCH = 64
+
+
+class LoadGenStats:
+    """Общие счетчики всех подключений генератора"""
+
+    __slots__ = ("sent", "acked", "connected", "failed")
+
+    def __init__(self):
+        self.sent = 0
+        self.acked = 0
+        self.connected = 0
+        self.failed = 0
+
+
+class LoadGenerator:
+    """Генератор нагрузки на N подключений с окном неподтвержденных сообщений"""
+
+    def __init__(self, url: str, connections: int = 1, inflight: int = 0, binary: bool = False,
+                 connect_options: Optional[dict] = None, payload_size: int = 0,
+                 ack_mode: Optional[str] = None, ack_every: int = 64, ack_interval: float = 0.05,
+                 rate: float = 0.0, rate_total: bool = False, arrival: str = ARRIVAL_UNIFORM):
+        """
+        Args:
+            url: URL WebSocket сервера
+            connections: Количество подключений
+            inflight: Максимум неподтвержденных сообщений на подключение (0 - без ограничения)
+            binary: Отправлять двоичные кадры (ws_protocol) вместо текстовых меток
+            connect_options: Дополнительные параметры websockets.connect()
+                (например, сжатие из ws_compression.py)
+            payload_size: Размер полезной нагрузки сообщения в байтах
+                (0 - стандартный текст BENCHMARK_TEXT)
+            ack_mode: Запросить у сервера режим подтверждения (ACK_*); None - режим сервера
+            ack_every: Режим coalesced: подтверждать каждые ack_every сообщений
+            ack_interval: Режим coalesced: подтверждать не реже чем раз в ack_interval секунд
+            rate: Открытый цикл: сообщений в секунду на подключение (0 - как можно быстрее)
+            rate_total: rate - общая частота всех подключений
+            arrival: Расписание отправки (ARRIVAL_UNIFORM / ARRIVAL_POISSON)
+        """
+        self.url = url
+        self.connections = connections
+        # Сервер без таймера подтверждает каждые ack_every сообщений: меньшее окно не сдвинется
+        if ack_mode == ACK_COALESCED and inflight > 0:
+            inflight = max(inflight, 2 * ack_every)
+        self.inflight = inflight
+        self.ack_mode = ack_mode
+        self.ack_every = ack_every
+        self.ack_interval = ack_interval
+        # Частота на одно подключение
+        self.rate = rate / connections if rate_total and connections > 0 else rate
+        self.arrival = arrival
+        self.schedules: List[SendSchedule] = []
+        self.binary = binary
+        self.connect_options = connect_options or {}
+        self.stats = LoadGenStats()
+        self.rtt_tracker = RttTracker()
+        self.stop_event: Optional[asyncio.Event] = None
+        # Номер текстового сообщения общий для всех подключений, чтобы
+        # время отправки в кольце RttTracker не перезаписывалось соседями
+        self.next_text_sequence = 0
+        self.text = make_text_payload(payload_size) if payload_size > 0 else BENCHMARK_TEXT
+        self.payload = self.text.encode('utf-8')
+        self.tasks: List[asyncio.Task] = []
+
+    def _on_echo(self, message, window: Optional[asyncio.Semaphore], acked: int) -> int:
+        """
+        Учитывает ответ сервера: эхо, короткий ответ или накопительное подтверждение
+
+        Args:
+            message: Ответ сервера
+            window: Окно неподтвержденных сообщений подключения
+            acked: Подтверждено сообщений подключения до этого ответа
+
+        Returns:
+            Подтверждено сообщений подключения с учетом ответа
+        """
+        if isinstance(message, bytes):
+            header = decode_header(message)
+            if header is None:
+                return acked
+            if header[0] == MSG_ACK:
+                count = header[2]
+            elif header[0] == MSG_DATA:
+                count = acked + 1
+            else:
+                return acked
+            self.rtt_tracker.record_ns(time.monotonic_ns() - header[3])
+        else:
+            count = parse_text_ack(message)
+            if count is not None:
+                sequence = text_ack_sequence(message)
+            else:
+                start = message.find(BENCHMARK_DATA_PREFIX)
+                if start < 0:
+                    return acked
+                count = acked + 1
+                start += len(BENCHMARK_DATA_PREFIX)
+                end = message.find(":", start)
+                sequence = int(message[start:end]) if end > start and message[start:end].isdigit() else None
+            if sequence is not None:
+                self.rtt_tracker.on_echo(sequence, time.monotonic_ns())
+        if count <= acked:
+            return acked
+        self.stats.acked += count - acked
+        if window is not None:
+            for _ in range(count - acked):
+                window.release()
+        return count
+
+    async def _receive(self, websocket, window: Optional[asyncio.Semaphore]):
+        """Читает ответы сервера подключения"""
+        acked = 0
+        try:
+            async for message in websocket:
+                acked = self._on_echo(message, window, acked)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    async def _send_data(self, websocket, stream_id: int, sequence: int, intended_ns: Optional[int] = None):
+        """
+        Отправляет одно сообщение с данными
+
+        Args:
+            intended_ns: Запланированное время отправки (открытый цикл), от него
+                считается RTT; по умолчанию - фактическое время
+        """
+        if intended_ns is None:
+            intended_ns = time.monotonic_ns()
+        if self.binary:
+            await websocket.send(encode_frame(MSG_DATA, stream_id, sequence, self.payload, intended_ns))
+        else:
+            text_sequence = self.next_text_sequence
+            self.next_text_sequence += 1
+            self.rtt_tracker.on_sent(text_sequence, intended_ns)
+            await websocket.send(f"{BENCHMARK_DATA_PREFIX}{text_sequence}:{self.text}")
+
+    async def _drain_window(self, window: asyncio.Semaphore):
+        """Ждет, пока подтвердятся все отправленные сообщения подключения"""
+        for _ in range(self.inflight):
+            await window.acquire()
+
+    async def run_connection(self, stream_id: int):
+        """Отправляет сообщения по одному подключению до сигнала остановки"""
+        stats = self.stats
+        try:
+            websocket = await websockets.connect(self.url, **self.connect_options)
+        except (OSError, websockets.exceptions.WebSocketException) as e:
+            stats.failed += 1
+            print(f"Подключение #{stream_id}: ошибка подключения: {e}")
+            return
+
+        stats.connected += 1
+        window = asyncio.Semaphore(self.inflight) if self.inflight > 0 else None
+        receiver = asyncio.create_task(self._receive(websocket, window))
+        sequence = 0
+        schedule = None
+        if self.rate > 0:
+            # Подключения начинают со сдвигом, чтобы не отправлять пачками одновременно
+            offset_ns = int(1e9 / self.rate * stream_id / self.connections)
+            schedule = SendSchedule(self.rate, self.arrival, time.monotonic_ns() + offset_ns)
+            self.schedules.append(schedule)
+        try:
+            if self.ack_mode:
+                await websocket.send(encode_ack_request(self.ack_mode, self.ack_every,
+                                                        int(self.ack_interval * 1000), self.binary, stream_id))
+            else:
+                await websocket.send(encode_frame(MSG_START, stream_id, 0) if self.binary else "__BENCHMARK_START__")
+            while not self.stop_event.is_set():
+                for _ in range(SEND_BATCH):
+                    intended_ns = None
+                    if schedule is not None:
+                        # Ждем только если опережаем расписание; ожидание окна
+                        # после запланированного времени входит в RTT
+                        intended_ns = schedule.take()
+                        delay = schedule.delay(intended_ns)
+                        if delay > 0:
+                            await asyncio.sleep(delay)
+                            if self.stop_event.is_set():
+                                break
+                    if window is not None:
+                        await window.acquire()
+                        if self.stop_event.is_set():
+                            window.release()
+                            break
+                    await self._send_data(websocket, stream_id, sequence, intended_ns)
+                    sequence += 1
+                    stats.sent += 1
+                # Отдаем управление другим подключениям и задаче статистики
+                await asyncio.sleep(0)
+            await websocket.send(encode_frame(MSG_END, stream_id, sequence) if self.binary else "__BENCHMARK_END__")
+            # Ждем эхо на последние сообщения, но недолго
+            if window is not None:
+                try:
+                    await asyncio.wait_for(self._drain_window(window), 1.0)
+                except asyncio.TimeoutError:
+                    pass
+        except websockets.exceptions.ConnectionClosed:
+            print(f"Подключение #{stream_id}: соединение закрыто сервером")
+        finally:
+            receiver.cancel()
+            stats.connected -= 1
+            await websocket.close()
+
+    def target_rate(self) -> float:
+        """Целевая общая частота открытого цикла, сообщений в секунду"""
+        return self.rate * self.connections
+
+    def schedule_lag(self) -> float:
+        """Текущее наибольшее отставание подключений от расписания в секундах"""
+        now_ns = time.monotonic_ns()
+        return max(0.0, max((now_ns - schedule.next_ns) / 1e9 for schedule in self.schedules))
+
+    def start(self) -> List[asyncio.Task]:
+        """Запускает задачи всех подключений (без вывода в консоль)"""
+        self.stop_event = asyncio.Event()
+        self.tasks = [asyncio.create_task(self.run_connection(stream_id)) for stream_id in range(self.connections)]
+        return self.tasks
+
+    async def stop(self):
+        """Останавливает отправку и ждет завершения подключений"""
+        self.stop_event.set()
+        if not self.tasks:
+            return
+        # Подключения, ждущие подтверждений от молчащего сервера, прерываем
+        _, pending = await asyncio.wait(self.tasks, timeout=3.0)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    async def run(self, duration: float, interval: float):
+        """
+        Запускает замер и выводит статистику в формате client.py
+
+        Args:
+            duration: Длительность теста в секундах
+            interval: Интервал для вывода статистики в секундах
+        """
+        print(f"\n{'='*60}")
+        print("Запуск замера производительности (асинхронный генератор)")
+        print(f"Подключений: {self.connections}")
+        print(f"Неподтвержденных сообщений на подключение: {self.inflight or 'без ограничения'}")
+        print(f"Длительность: {duration} секунд")
+        print(f"Интервал статистики: {interval} секунд")
+        print(f"Формат сообщений: {'двоичный' if self.binary else 'текстовый'}")
+        if self.ack_mode:
+            print(f"Режим подтверждения: {self.ack_mode}")
+        if self.rate > 0:
+            print(f"Открытый цикл ({self.arrival}): {self.rate:g} сообщений/сек на подключение, "
+                  f"всего {self.target_rate():g} сообщений/сек")
+        print(f"{'='*60}\n")
+
+        tasks = self.start()
+
+        stats = self.stats
+        start_time = time.time()
+        end_time = start_time + duration
+        interval_start = start_time
+        last_sent = 0
+        last_acked = 0
+
+        print("Начало отправки сообщений...\n")
+
+        while time.time() < end_time and not all(task.done() for task in tasks):
+            await asyncio.sleep(min(interval, max(0.0, end_time - time.time())))
+            current_time = time.time()
+            elapsed = current_time - interval_start
+            if elapsed < interval and current_time < end_time:
+                continue
+            sent = stats.sent - last_sent
+            acked = stats.acked - last_acked
+            rate = sent / elapsed if elapsed > 0 else 0
+            ack_rate = acked / elapsed if elapsed > 0 else 0
+            print(f"[{current_time - start_time:.1f}с] "
+                  f"Отправлено: {sent} сообщений за {elapsed:.1f}с "
+                  f"({rate:.2f} сообщений/сек), "
+                  f"подтверждено: {acked} ({ack_rate:.2f} сообщений/сек), "
+                  f"подключений: {stats.connected}")
+            if self.schedules:
+                print(f"         Отставание от расписания: {self.schedule_lag() * 1000:.1f} мс")
+            interval_histogram = self.rtt_tracker.take_interval()
+            if interval_histogram.total_count:
+                print(f"         RTT: {interval_histogram.format_summary()}")
+            last_sent = stats.sent
+            last_acked = stats.acked
+            interval_start = current_time
+
+        send_time = time.time() - start_time
+        await self.stop()
+
+        total_rate = stats.sent / send_time if send_time > 0 else 0
+        ack_rate = stats.acked / send_time if send_time > 0 else 0
+
+        print(f"\n{'='*60}")
+        print("Замер завершен!")
+        print(f"Всего отправлено: {stats.sent} сообщений")
+        print(f"Всего подтверждено: {stats.acked} сообщений")
+        if stats.failed:
+            print(f"Не удалось подключиться: {stats.failed}")
+        print(f"Общее время: {send_time:.2f} секунд")
+        print(f"Средняя скорость: {total_rate:.2f} сообщений/секунду")
+        print(f"Скорость подтверждений: {ack_rate:.2f} сообщений/секунду")
+        if self.rate > 0:
+            target_rate = self.target_rate()
+            print(f"Целевая скорость: {target_rate:.2f} сообщений/секунду, "
+                  f"достигнуто {total_rate / target_rate * 100:.1f}%")
+            max_lag = max(schedule.max_lag_ns for schedule in self.schedules) if self.schedules else 0
+            print(f"Наибольшее отставание от расписания: {max_lag / 1e6:.1f} мс")
+            print("RTT считается от запланированного времени отправки")
+        total_histogram = self.rtt_tracker.total_histogram
+        if total_histogram.total_count:
+            print(f"RTT: {total_histogram.format_summary()}")
+        print(f"{'='*60}\n")
+        return total_histogram
@@ -0,0 +1,309 @@
+"""
+Асинхронный журнал серверов: вывод в консоль или файл вне пути сообщений
+
+Обработчики сообщений не вызывают print(): запись (время, компонент,
+уровень, текст, поля) добавляется в ограниченную очередь (deque), а
+форматирует и пишет записи фоновый поток - пачками раз в FLUSH_INTERVAL
+или сразу, когда набралось BATCH_RECORDS записей. Медленный терминал или
+канал задерживает только этот поток, а не цикл событий и не потоки
+websocket_server. Если очередь заполнена, запись отбрасывается и
+учитывается; количество отброшенных записей выводится отдельной записью.
+
+Компоненты (уровень задается для каждого отдельно, см. parse_log_levels):
+
+    server       ошибки команд клиентов и прочие сообщения сервера
+    connections  подключения и отключения клиентов
+    messages     обычные (не служебные) сообщения клиентов
+    bench        начало и итоги замеров, прием и отправка потоков
+    stats        интервальная статистика
+
+Формат вывода - текст (как раньше выводил print) или JSON lines: одна
+запись - один объект {"time", "pid", "level", "component", "message", ...поля}.
+"""
+import atexit
+import collections
+import json
+import os
+import sys
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+OFF = 100
+
+LEVELS = {"debug": DEBUG, "info": INFO, "warning": WARNING, "off": OFF}
+LEVEL_NAMES = {value: name for name, value in LEVELS.items()}
+
+COMPONENTS = ("server", "connections", "messages", "bench", "stats")
+
+FORMAT_TEXT = "text"
+FORMAT_JSON = "json"
+LOG_FORMATS = (FORMAT_TEXT, FORMAT_JSON)
+
+# Максимум записей в очереди; сверх него записи отбрасываются
+DEFAULT_MAX_RECORDS = 10000
+# Сколько ждать перед записью пачки, секунд
+FLUSH_INTERVAL = 0.05
+# Столько записей в очереди будят поток записи раньше FLUSH_INTERVAL
+BATCH_RECORDS = 512
+
+
+def add_log_arguments(parser):
+    """Добавляет в argparse параметры журнала"""
+    parser.add_argument("--log-level", type=str, default="info",
+                       help="Уровень журнала: общий и/или по компонентам через запятую, например "
+                            "warning,stats=info или connections=off,messages=off "
+                            f"(уровни: {', '.join(LEVELS)}; компоненты: {', '.join(COMPONENTS)}; "
+                            "по умолчанию: info)")
+    parser.add_argument("--log-format", choices=LOG_FORMATS, default=FORMAT_TEXT,
+                       help="Формат журнала: текст или JSON lines (по умолчанию: text)")
+    parser.add_argument("--log-file", type=str, default=None,
+                       help="Файл журнала (дописывается; по умолчанию: консоль)")
+    parser.add_argument("--log-queue", type=int, default=DEFAULT_MAX_RECORDS,
+                       help="Максимум записей в очереди журнала, сверх него записи отбрасываются "
+                            f"(по умолчанию: {DEFAULT_MAX_RECORDS})")
+
+
+def log_options_from_args(args) -> dict:
+    """Параметры configure_logging из аргументов add_log_arguments"""
+    return {
+        'levels': args.log_level,
+        'log_format': args.log_format,
+        'path': args.log_file,
+        'max_records': args.log_queue,
+    }
+
+
+def parse_log_levels(value: str) -> Tuple[int, Dict[str, int]]:
+    """
+    Разбирает "уровень,компонент=уровень,..."
+
+    Returns:
+        Tuple (общий уровень, уровни по компонентам)
+
+    Raises:
+        ValueError: Неизвестный уровень или компонент
+    """
+    default = INFO
+    levels = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        component, _, name = item.rpartition("=")
+        if name not in LEVELS:
+            raise ValueError(f"неизвестный уровень журнала: {name}")
+        if not component:
+            default = LEVELS[name]
+        elif component not in COMPONENTS:
+            raise ValueError(f"неизвестный компонент журнала: {component}")
+        else:
+            levels[component] = LEVELS[name]
+    return default, levels
+
+
+class LogPipeline:
+    """Ограниченная очередь записей и фоновый поток, который пишет их пачками"""
+
+    __slots__ = ("log_format", "path", "max_records", "records", "wakeup", "queue_lock", "write_lock", "start_lock",
+                 "thread", "closed", "pid", "file", "emitted", "dropped", "reported_dropped")
+
+    def __init__(self, log_format: str = FORMAT_TEXT, path: Optional[str] = None,
+                 max_records: int = DEFAULT_MAX_RECORDS):
+        """
+        Args:
+            log_format: FORMAT_TEXT или FORMAT_JSON
+            path: Файл журнала (None - sys.stdout)
+            max_records: Максимум записей в очереди
+        """
+        self.log_format = log_format
+        self.path = path
+        self.max_records = max(1, max_records)
+        self.file = None
+        self.emitted = 0
+        self.dropped = 0
+        self.reported_dropped = 0
+        self.reset()
+
+    def reset(self):
+        """Новая очередь и поток записи (после fork поток родителя в дочернем процессе не работает)"""
+        self.records = collections.deque()
+        self.wakeup = threading.Event()
+        # Проверка границы очереди и счетчики: emit вызывается из потоков websocket_server
+        self.queue_lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.start_lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+        self.closed = False
+        self.pid = os.getpid()
+
+    def emit(self, component: str, level: int, message: str, fields: dict):
+        """Ставит запись в очередь (вызывается на пути сообщений из любого потока)"""
+        records = self.records
+        with self.queue_lock:
+            if len(records) >= self.max_records:
+                self.dropped += 1
+                return
+            records.append((time.time(), component, level, message, fields))
+            self.emitted += 1
+        if self.thread is None:
+            self.start()
+        elif len(records) >= BATCH_RECORDS and not self.wakeup.is_set():
+            self.wakeup.set()
+
+    def start(self):
+        """Запускает поток записи (при первой записи)"""
+        with self.start_lock:
+            if self.thread is not None or self.closed:
+                return
+            if self.path and self.file is None:
+                self.file = open(self.path, "a", encoding="utf-8")
+            self.thread = threading.Thread(target=self._run, name="ws-log", daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        while not self.closed:
+            self.wakeup.wait(FLUSH_INTERVAL)
+            self.wakeup.clear()
+            self.flush()
+
+    def _format(self, record: tuple) -> str:
+        created, component, level, message, fields = record
+        if self.log_format != FORMAT_JSON:
+            return (report_block(*message) if isinstance(message, tuple) else message) + "\n"
+        if isinstance(message, tuple):
+            message = "\n".join(message)
+        entry = {"time": round(created, 6), "pid": self.pid, "level": LEVEL_NAMES.get(level, str(level)),
+                 "component": component, "message": message}
+        for key, value in fields.items():
+            entry.setdefault(key, value)
+        return json.dumps(entry, ensure_ascii=False, default=str) + "\n"
+
+    def flush(self):
+        """Пишет все записи, поставленные в очередь до вызова"""
+        with self.write_lock:
+            records = self.records
+            count = len(records)
+            dropped = self.dropped - self.reported_dropped
+            if not count and not dropped:
+                return
+            lines = [self._format(records.popleft()) for _ in range(count)]
+            if dropped:
+                self.reported_dropped += dropped
+                lines.append(self._format((time.time(), "log", WARNING,
+                                           f"[Журнал] Очередь переполнена, пропущено записей: {dropped}",
+                                           {"dropped": dropped})))
+            stream = self.file if self.file is not None else sys.stdout
+            try:
+                stream.write("".join(lines))
+                stream.flush()
+            except (OSError, ValueError):
+                # Консоль или файл закрыты: записи теряются, но сервер продолжает работу
+                pass
+
+    def close(self):
+        """Дописывает очередь и останавливает поток записи"""
+        thread = self.thread
+        self.closed = True
+        self.wakeup.set()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(1.0)
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class Logger:
+    """Журнал компонента: уровень проверяется до постановки в очередь"""
+
+    __slots__ = ("component", "level")
+
+    def __init__(self, component: str, level: int = INFO):
+        self.component = component
+        self.level = level
+
+    def enabled(self, level: int) -> bool:
+        """Будет ли записан уровень level (чтобы не собирать строку зря)"""
+        return level >= self.level
+
+    def log(self, level: int, message: str, **fields):
+        """Записывает сообщение; поля попадают только в JSON"""
+        if level >= self.level:
+            _pipeline.emit(self.component, level, message, fields)
+
+    def debug(self, message: str, **fields):
+        if DEBUG >= self.level:
+            _pipeline.emit(self.component, DEBUG, message, fields)
+
+    def info(self, message: str, **fields):
+        if INFO >= self.level:
+            _pipeline.emit(self.component, INFO, message, fields)
+
+    def warning(self, message: str, **fields):
+        if WARNING >= self.level:
+            _pipeline.emit(self.component, WARNING, message, fields)
+
+    def report(self, *lines: str, **fields):
+        """Итоговый блок (уровень INFO): в тексте - между строками '=', в JSON - строки через перевод строки"""
+        if INFO >= self.level:
+            _pipeline.emit(self.component, INFO, lines, fields)
+
+
+_pipeline = LogPipeline()
+_loggers: Dict[str, Logger] = {}
+_default_level = INFO
+_component_levels: Dict[str, int] = {}
+
+
+def get_logger(component: str) -> Logger:
+    """Журнал компонента (один объект на компонент)"""
+    logger = _loggers.get(component)
+    if logger is None:
+        logger = _loggers[component] = Logger(component, _component_levels.get(component, _default_level))
+    return logger
+
+
+def configure_logging(levels: str = "info", log_format: str = FORMAT_TEXT, path: Optional[str] = None,
+                      max_records: int = DEFAULT_MAX_RECORDS):
+    """
+    Настраивает журнал процесса (дописывает записи прежней настройки)
+
+    Args:
+        levels: Уровни, см. parse_log_levels
+        log_format: FORMAT_TEXT или FORMAT_JSON
+        path: Файл журнала (None - консоль)
+        max_records: Максимум записей в очереди
+    """
+    global _pipeline, _default_level, _component_levels
+    _default_level, _component_levels = parse_log_levels(levels)
+    for component, logger in _loggers.items():
+        logger.level = _component_levels.get(component, _default_level)
+    previous = _pipeline
+    _pipeline = LogPipeline(log_format, path, max_records)
+    previous.close()
+
+
+def flush_logs():
+    """Дописывает очередь журнала (перед прямым выводом print, чтобы не нарушить порядок)"""
+    _pipeline.flush()
+
+
+def close_logging():
+    """Дописывает очередь и останавливает поток записи"""
+    _pipeline.close()
+
+
+def log_stats() -> Tuple[int, int]:
+    """(записей поставлено в очередь, записей отброшено при переполнении)"""
+    return _pipeline.emitted, _pipeline.dropped
+
+
+def report_block(*lines: str) -> str:
+    """Текст итогового блока между строками '=' (как блоки print в отчетах), см. Logger.report"""
+    return "\n".join((f"\n{'='*60}", *lines, f"{'='*60}\n"))
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=lambda: _pipeline.reset())
+atexit.register(close_logging)
@@ -0,0 +1,294 @@
+"""
+Метрики сервера в текстовом формате Prometheus по HTTP GET /metrics
+
+Метрики отдаются на том же порту, что и WebSocket: запрос /metrics
+перехватывается хуком process_request библиотеки websockets до рукопожатия.
+Все значения собираются только в момент запроса. На пути сообщений
+остаются только целочисленные счетчики подключения: полученные сообщения
+считает цикл обработчика (add_messages_in), отправленные - send() и код
+прямой записи в транспорт (add_messages_out: ClientManager, ws_sender,
+ws_stream) - на пачку кадров. Байты берутся из счетчиков ядра TCP
+(TCP_INFO) без работы на пути сообщений.
+"""
+import asyncio
+import http
+import socket
+import struct
+from typing import Callable, Optional, Set, Tuple
+
+from websockets.asyncio.server import ServerConnection
+
+from ws_utils import get_client_id
+from ws_compat import is_open
+from ws_profile import LoopLagMonitor, SLOW_HANDLER_NS
+from ws_log import log_stats
+
+METRICS_PATH = "/metrics"
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+TCP_INFO = getattr(socket, "TCP_INFO", None)
+# struct tcp_info (linux/tcp.h, Linux 4.1+): tcpi_bytes_acked и tcpi_bytes_received
+TCP_INFO_BYTES = struct.Struct("=QQ")
+TCP_INFO_BYTES_OFFSET = 120
+TCP_INFO_SIZE = TCP_INFO_BYTES_OFFSET + TCP_INFO_BYTES.size
+
+
+def socket_bytes(transport: Optional[asyncio.BaseTransport]) -> Tuple[int, int]:
+    """
+    Байты соединения по счетчикам ядра TCP
+
+    Returns:
+        Tuple (получено, отправлено и подтверждено получателем); (0, 0), если
+        счетчики недоступны (не Linux, не TCP или сокет уже закрыт)
+    """
+    if TCP_INFO is None or transport is None:
+        return 0, 0
+    sock = transport.get_extra_info("socket")
+    if sock is None:
+        return 0, 0
+    try:
+        info = sock.getsockopt(socket.IPPROTO_TCP, TCP_INFO, TCP_INFO_SIZE)
+    except OSError:
+        return 0, 0
+    if len(info) < TCP_INFO_SIZE:
+        return 0, 0
+    acked, received = TCP_INFO_BYTES.unpack_from(info, TCP_INFO_BYTES_OFFSET)
+    return received, acked
+
+
+class MeteredServerConnection(ServerConnection):
+    """
+    Соединение websockets со счетчиками сообщений
+
+    Методы обработки кадров не переопределяются: send() только увеличивает
+    счетчик, байты читаются из счетчиков ядра при запросе /metrics.
+    """
+
+    metrics: Optional["ServerMetrics"] = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.messages_in = 0
+        self.messages_out = 0
+
+    @property
+    def bytes_in(self) -> int:
+        """Количество полученных байтов (счетчик ядра TCP)"""
+        return socket_bytes(self.transport)[0]
+
+    @property
+    def bytes_out(self) -> int:
+        """Количество отправленных и подтвержденных получателем байтов (счетчик ядра TCP)"""
+        return socket_bytes(self.transport)[1]
+
+    def connection_made(self, transport: asyncio.BaseTransport):
+        super().connection_made(transport)
+        if self.metrics is not None:
+            self.metrics.connections.add(self)
+
+    def connection_lost(self, exc: Optional[Exception]):
+        # Сокет закрывается после connection_lost: счетчики ядра еще доступны
+        if self.metrics is not None:
+            self.metrics.on_connection_lost(self)
+        super().connection_lost(exc)
+
+    async def send(self, message, *, text: Optional[bool] = None):
+        self.messages_out += 1
+        await super().send(message, text=text)
+
+
+def add_messages_in(websocket, count: int = 1):
+    """Учитывает сообщения, полученные циклом обработчика подключения"""
+    if isinstance(websocket, MeteredServerConnection):
+        websocket.messages_in += count
+
+
+def add_messages_out(websocket, count: int):
+    """Учитывает сообщения, записанные в транспорт соединения в обход send()"""
+    if isinstance(websocket, MeteredServerConnection):
+        websocket.messages_out += count
+
+
+class ServerMetrics:
+    """Состояние метрик сервера и обработчик запроса /metrics"""
+
+    def __init__(self, client_manager=None, active_benchmarks: Optional[Callable[[], int]] = None,
+                 instrumentation=None, router=None):
+        """
+        Args:
+            client_manager: ClientManager сервера (клиенты и сообщения рассылки)
+            active_benchmarks: Функция, возвращающая количество активных замеров
+            instrumentation: Диагностика сервера (ws_profile.Instrumentation): ее
+                LoopLagMonitor и время обработчиков попадают в метрики
+            router: Управляющие команды сервера (ws_router.CommandRouter): вызовы
+                и ошибки по командам
+        """
+        self.client_manager = client_manager
+        self.active_benchmarks = active_benchmarks
+        self.lag_monitor = instrumentation.lag if instrumentation is not None else LoopLagMonitor()
+        self.handler_timer = instrumentation.timer if instrumentation is not None else None
+        self.router = router
+        self.connections: Set[MeteredServerConnection] = set()
+        # Счетчики закрытых соединений
+        self.closed_messages_in = 0
+        self.closed_messages_out = 0
+        self.closed_bytes_in = 0
+        self.closed_bytes_out = 0
+        self.handshakes = 0
+        self.handshake_failures = 0
+
+    def create_connection(self, *args, **kwargs) -> MeteredServerConnection:
+        """Фабрика соединений для websockets.serve(create_connection=...)"""
+        connection = MeteredServerConnection(*args, **kwargs)
+        connection.metrics = self
+        return connection
+
+    def on_connection_lost(self, connection: MeteredServerConnection):
+        """Переносит счетчики закрытого соединения в общие итоги"""
+        self.connections.discard(connection)
+        self.closed_messages_in += connection.messages_in
+        self.closed_messages_out += self._messages_out(connection)
+        bytes_in, bytes_out = socket_bytes(connection.transport)
+        self.closed_bytes_in += bytes_in
+        self.closed_bytes_out += bytes_out
+
+    def _messages_out(self, connection: MeteredServerConnection) -> int:
+        """Исходящие сообщения соединения, включая кадры рассылки ClientManager (add_messages_out)"""
+        return connection.messages_out
+
+    def process_request(self, connection: ServerConnection, request):
+        """Хук process_request: отвечает на GET /metrics, остальное - рукопожатие"""
+        if request.path == METRICS_PATH:
+            response = connection.respond(http.HTTPStatus.OK, self.render())
+            del response.headers["Content-Type"]
+            response.headers["Content-Type"] = METRICS_CONTENT_TYPE
+            return response
+        self.handshakes += 1
+        return None
+
+    def process_response(self, connection: ServerConnection, request, response):
+        """Хук process_response: считает неудачные рукопожатия"""
+        if request.path != METRICS_PATH and response.status_code != http.HTTPStatus.SWITCHING_PROTOCOLS:
+            self.handshake_failures += 1
+        return None
+
+    def render(self) -> str:
+        """Формирует текст метрик в формате Prometheus"""
+        open_connections = [connection for connection in list(self.connections)
+                            if is_open(connection)]
+        if self.client_manager is not None:
+            connected = self.client_manager.get_client_count()
+        else:
+            connected = len(open_connections)
+
+        lines = []
+
+        def metric(name: str, metric_type: str, help_text: str, value):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            lines.append(f"{name} {value}")
+
+        def summary(name: str, help_text: str, histogram, labels: str = "", header: bool = True):
+            # Гистограмма в мкс -> summary Prometheus в секундах
+            if header:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} summary")
+            for percent, value in histogram.percentiles((50.0, 90.0, 99.0)):
+                lines.append(f'{name}{{{labels}quantile="{percent / 100:g}"}} {value / 1e6:.6f}')
+            suffix = f"{{{labels.rstrip(',')}}}" if labels else ""
+            lines.append(f"{name}_sum{suffix} {histogram.total_sum / 1e6:.6f}")
+            lines.append(f"{name}_count{suffix} {histogram.total_count}")
+
+        def per_client(name: str, help_text: str, values):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for client_id, value in values:
+                lines.append(f'{name}{{client="{client_id}"}} {value}')
+
+        messages_out = [(get_client_id(c), self._messages_out(c)) for c in open_connections]
+        # Один вызов getsockopt на соединение
+        socket_counters = [(get_client_id(c), socket_bytes(c.transport)) for c in open_connections]
+        metric("ws_connected_clients", "gauge", "Подключенные клиенты", connected)
+        metric("ws_active_benchmarks", "gauge", "Активные замеры",
+               self.active_benchmarks() if self.active_benchmarks else 0)
+        metric("ws_messages_received_total", "counter", "Полученные сообщения",
+               self.closed_messages_in + sum(c.messages_in for c in open_connections))
+        metric("ws_messages_sent_total", "counter", "Отправленные сообщения",
+               self.closed_messages_out + sum(count for _, count in messages_out))
+        metric("ws_bytes_received_total", "counter", "Полученные байты (счетчик ядра TCP)",
+               self.closed_bytes_in + sum(counters[0] for _, counters in socket_counters))
+        metric("ws_bytes_sent_total", "counter", "Отправленные и подтвержденные байты (счетчик ядра TCP)",
+               self.closed_bytes_out + sum(counters[1] for _, counters in socket_counters))
+        per_client("ws_client_messages_received_total", "Полученные сообщения по клиентам",
+                   [(get_client_id(c), c.messages_in) for c in open_connections])
+        per_client("ws_client_messages_sent_total", "Отправленные сообщения по клиентам", messages_out)
+        per_client("ws_client_bytes_received_total", "Полученные байты по клиентам",
+                   [(client_id, counters[0]) for client_id, counters in socket_counters])
+        per_client("ws_client_bytes_sent_total", "Отправленные байты по клиентам",
+                   [(client_id, counters[1]) for client_id, counters in socket_counters])
+        metric("ws_handshakes_total", "counter", "Попытки WebSocket рукопожатия", self.handshakes)
+        metric("ws_handshake_failures_total", "counter", "Неудачные WebSocket рукопожатия",
+               self.handshake_failures)
+        if self.client_manager is not None:
+            manager = self.client_manager
+            summary("ws_connect_callback_seconds", "Время обработки подключения клиента на сервере",
+                    manager.connect_histogram)
+            summary("ws_disconnect_callback_seconds", "Время обработки отключения клиента на сервере",
+                    manager.disconnect_histogram)
+            metric("ws_slow_callbacks_total", "counter", "Обработки подключения/отключения дольше 10 мс",
+                   manager.slow_callbacks)
+            metric("ws_topic_patterns", "gauge", "Темы и префиксы тем с подписчиками",
+                   manager.topics.pattern_count())
+            metric("ws_topic_publishes_total", "counter", "Публикации в темы", manager.publish_count)
+            sessions = manager.sessions
+            if sessions is not None:
+                metric("ws_sessions", "gauge", "Сессии клиентов, в том числе отключенных", len(sessions.sessions))
+                lines.append("# HELP ws_session_resumes_total Продолжения сессий после переподключения")
+                lines.append("# TYPE ws_session_resumes_total counter")
+                lines.append(f'ws_session_resumes_total{{result="hit"}} {sessions.hits}')
+                lines.append(f'ws_session_resumes_total{{result="miss"}} {sessions.misses}')
+                metric("ws_session_replayed_total", "counter", "Сообщения, повторенные из колец сессий",
+                       sessions.replayed)
+                metric("ws_sessions_expired_total", "counter", "Сессии, удаленные по --session-ttl",
+                       sessions.expired)
+            bus = manager.bus
+            if bus is not None and bus.slot >= 0:
+                metric("ws_bus_frames_delivered_total", "counter", "Кадры других воркеров, принятые из шины",
+                       bus.delivered)
+                metric("ws_bus_overruns_total", "counter", "Отставания от шины больше ее кольца", bus.overruns)
+                metric("ws_bus_frames_unrelayed_total", "counter",
+                       "Кадры рассылки больше допустимого шиной: доставлены только клиентам этого воркера",
+                       manager.bus_unrelayed)
+                metric("ws_bus_lag_seconds", "gauge", "Опоздание последнего кадра из шины",
+                       f"{bus.last_lag / 1e9:.6f}")
+                metric("ws_bus_lag_max_seconds", "gauge", "Наибольшее опоздание кадра из шины",
+                       f"{bus.max_lag / 1e9:.6f}")
+        lag_monitor = self.lag_monitor
+        metric("ws_event_loop_lag_seconds", "gauge", "Последнее опоздание цикла событий",
+               f"{lag_monitor.lag:.6f}")
+        metric("ws_event_loop_lag_max_seconds", "gauge", "Максимальное опоздание цикла событий",
+               f"{lag_monitor.max_lag:.6f}")
+        summary("ws_event_loop_lag_distribution_seconds", "Распределение опоздания цикла событий",
+                lag_monitor.histogram)
+        log_records, log_dropped = log_stats()
+        metric("ws_log_records_total", "counter", "Записи журнала, поставленные в очередь", log_records)
+        metric("ws_log_dropped_total", "counter", "Записи журнала, отброшенные при переполнении очереди",
+               log_dropped)
+        if self.router is not None:
+            commands = self.router.all_commands()
+            lines.append("# HELP ws_commands_total Вызовы управляющих команд")
+            lines.append("# TYPE ws_commands_total counter")
+            for command in commands:
+                lines.append(f'ws_commands_total{{command="{command.label}"}} {command.calls}')
+            lines.append("# HELP ws_command_errors_total Управляющие команды с неверными аргументами")
+            lines.append("# TYPE ws_command_errors_total counter")
+            for command in commands:
+                lines.append(f'ws_command_errors_total{{command="{command.label}"}} {command.errors}')
+        if self.handler_timer is not None:
+            for index, (handler, histogram) in enumerate(sorted(self.handler_timer.histograms.items())):
+                summary("ws_handler_seconds", "Время обработки сообщения по обработчикам", histogram,
+                        f'handler="{handler}",', index == 0)
+            metric("ws_slow_handlers_total", "counter",
+                   f"Обработки сообщений дольше {SLOW_HANDLER_NS // 1_000_000} мс", self.handler_timer.slow)
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,336 @@
+"""
+Встроенная диагностика сервера: опоздание цикла событий, время обработки
+сообщений и выборочный профилировщик, включаемый во время работы
+
+    LoopLagMonitor    - фоновая задача, измеряет опоздание пробуждения цикла
+                        событий (гистограмма и последнее/наибольшее значение)
+    HandlerTimer      - время обработки сообщения по обработчикам (включается
+                        ключом: два вызова часов на сообщение)
+    SamplingProfiler  - поток, который раз в интервал снимает стек потока
+                        сервера (sys._current_frames) и считает одинаковые
+                        стеки; результат - свернутые стеки (collapsed stacks)
+                        для flamegraph.pl, speedscope и подобных
+
+Профилировщик включается и выключается сигналом SIGUSR1 (повторный сигнал -
+остановка и запись файла) или управляющими сообщениями клиента, если они
+разрешены ключом:
+
+    __PROFILE_START__  ответ __PROFILE_START__:ok
+    __PROFILE_STOP__   ответ __PROFILE_STOP__:<выборок>:<путь к файлу>
+
+Пока профилировщик выключен, его потока нет и на пути сообщений ничего не
+выполняется, поэтому его можно оставлять в рабочих серверах.
+"""
+import asyncio
+import os
+import signal
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+from ws_histogram import Histogram
+from ws_log import get_logger
+
+server_log = get_logger("server")
+
+PROFILE_PREFIX = "__PROFILE_"
+PROFILE_START = "__PROFILE_START__"
+PROFILE_STOP = "__PROFILE_STOP__"
+
+# Сигнал включения/выключения профилировщика (на Windows его нет)
+PROFILE_SIGNAL = getattr(signal, "SIGUSR1", None)
+
+DEFAULT_SAMPLE_INTERVAL_MS = 5.0
+# Период проверки опоздания цикла событий в секундах
+LOOP_LAG_INTERVAL = 0.1
+# Обработка сообщения дольше этого считается медленной
+SLOW_HANDLER_NS = 10_000_000
+# Сколько самых частых функций выводить после остановки профилировщика
+TOP_FUNCTIONS = 10
+
+
+def add_profile_arguments(parser):
+    """Добавляет в argparse параметры диагностики сервера"""
+    parser.add_argument("--handler-timing", action="store_true",
+                       help="Измерять время обработки сообщений по обработчикам (в /metrics и отчете)")
+    parser.add_argument("--profile-control", action="store_true",
+                       help="Разрешить клиентам включать профилировщик сообщениями "
+                            "__PROFILE_START__/__PROFILE_STOP__ (сигнал SIGUSR1 работает всегда)")
+    parser.add_argument("--profile-dir", type=str, default=".",
+                       help="Каталог для файлов свернутых стеков профилировщика (по умолчанию: .)")
+    parser.add_argument("--profile-interval", type=float, default=DEFAULT_SAMPLE_INTERVAL_MS,
+                       help=f"Интервал выборки профилировщика в мс (по умолчанию: {DEFAULT_SAMPLE_INTERVAL_MS:g})")
+
+
+def profile_options_from_args(args) -> dict:
+    """Параметры Instrumentation из аргументов add_profile_arguments"""
+    return {
+        'profile_dir': args.profile_dir,
+        'sample_interval': args.profile_interval / 1000,
+        'control': args.profile_control,
+        'handler_timing': args.handler_timing,
+    }
+
+
+class LoopLagMonitor:
+    """Опоздание пробуждения цикла событий: последнее, наибольшее и распределение (мкс)"""
+
+    __slots__ = ("interval", "lag", "max_lag", "histogram", "task")
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL):
+        self.interval = interval
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.histogram = Histogram()
+        self.task: Optional[asyncio.Task] = None
+
+    async def run(self):
+        """Фоновая задача: засыпает на interval и измеряет, насколько проснулась позже"""
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - expected)
+            self.lag = lag
+            if lag > self.max_lag:
+                self.max_lag = lag
+            self.histogram.record(int(lag * 1_000_000))
+
+    def start(self) -> bool:
+        """Запускает задачу в текущем цикле событий; False - уже запущена"""
+        if self.task is not None:
+            return False
+        self.task = asyncio.create_task(self.run())
+        return True
+
+    def stop(self):
+        """Останавливает задачу"""
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+
+class HandlerTimer:
+    """Время обработки сообщений по обработчикам (мкс)"""
+
+    __slots__ = ("histograms", "slow")
+
+    def __init__(self):
+        self.histograms: Dict[str, Histogram] = {}
+        # Обработки дольше SLOW_HANDLER_NS
+        self.slow = 0
+
+    def record(self, handler: str, elapsed_ns: int):
+        """Записывает время одной обработки"""
+        histogram = self.histograms.get(handler)
+        if histogram is None:
+            histogram = self.histograms[handler] = Histogram()
+        histogram.record(elapsed_ns // 1000)
+        if elapsed_ns >= SLOW_HANDLER_NS:
+            self.slow += 1
+
+
+class SamplingProfiler:
+    """Выборочный профилировщик: считает свернутые стеки потока сервера"""
+
+    __slots__ = ("interval", "thread_id", "counts", "samples", "labels", "thread", "stop_event", "started")
+
+    def __init__(self, interval: float = DEFAULT_SAMPLE_INTERVAL_MS / 1000, thread_id: Optional[int] = None):
+        """
+        Args:
+            interval: Интервал выборки в секундах
+            thread_id: Поток, стек которого снимается; None - все потоки, кроме профилировщика
+        """
+        self.interval = interval
+        self.thread_id = thread_id
+        self.counts: Dict[str, int] = {}
+        self.samples = 0
+        # Подписи функций по объекту кода: одна строка на функцию
+        self.labels: Dict[object, str] = {}
+        self.thread: Optional[threading.Thread] = None
+        self.stop_event = threading.Event()
+        self.started = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None
+
+    def _label(self, code) -> str:
+        label = self.labels.get(code)
+        if label is None:
+            label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            self.labels[code] = label
+        return label
+
+    def _collapse(self, frame) -> str:
+        """Стек от корня к текущей функции через ";" """
+        names = []
+        while frame is not None:
+            names.append(self._label(frame.f_code))
+            frame = frame.f_back
+        names.reverse()
+        return ";".join(names)
+
+    def _run(self):
+        own = threading.get_ident()
+        counts = self.counts
+        while not self.stop_event.wait(self.interval):
+            frames = sys._current_frames()
+            if self.thread_id is not None:
+                frame = frames.get(self.thread_id)
+                stacks = (frame,) if frame is not None else ()
+            else:
+                stacks = [frame for thread_id, frame in frames.items() if thread_id != own]
+            for frame in stacks:
+                stack = self._collapse(frame)
+                counts[stack] = counts.get(stack, 0) + 1
+            self.samples += 1
+            # Не удерживаем кадры сервера до следующей выборки
+            frames = stacks = frame = None
+
+    def start(self):
+        """Начинает новый замер"""
+        if self.running:
+            return
+        self.counts = {}
+        self.samples = 0
+        self.started = time.monotonic()
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Останавливает замер (накопленные стеки сохраняются до следующего start)"""
+        if not self.running:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+
+    def dump(self, path: str):
+        """Записывает свернутые стеки: "функция;функция;... количество" в строке"""
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in sorted(self.counts.items(), key=lambda item: -item[1]):
+                f.write(f"{stack} {count}\n")
+
+    def top_functions(self, limit: int = TOP_FUNCTIONS) -> List[tuple]:
+        """Функции, чаще всего выполнявшиеся в момент выборки: [(функция, выборок)]"""
+        leaves: Dict[str, int] = {}
+        for stack, count in self.counts.items():
+            leaf = stack.rpartition(";")[2]
+            leaves[leaf] = leaves.get(leaf, 0) + count
+        return sorted(leaves.items(), key=lambda item: -item[1])[:limit]
+
+
+class Instrumentation:
+    """Диагностика сервера: опоздание цикла, время обработчиков и профилировщик"""
+
+    def __init__(self, profile_dir: str = ".", sample_interval: float = DEFAULT_SAMPLE_INTERVAL_MS / 1000,
+                 control: bool = False, handler_timing: bool = False):
+        """
+        Args:
+            profile_dir: Каталог для файлов свернутых стеков
+            sample_interval: Интервал выборки профилировщика в секундах
+            control: Разрешить управляющие сообщения __PROFILE_START__/__PROFILE_STOP__
+            handler_timing: Измерять время обработки сообщений (HandlerTimer)
+        """
+        self.profile_dir = profile_dir
+        self.control = control
+        self.profiler = SamplingProfiler(sample_interval)
+        self.timer = HandlerTimer() if handler_timing else None
+        self.lag = LoopLagMonitor()
+
+    def start_async(self):
+        """
+        Вызывается в работающем цикле событий: запускает LoopLagMonitor,
+        профилировщик снимает стек этого потока, SIGUSR1 переключает профилировщик
+        """
+        self.lag.start()
+        self.profiler.thread_id = threading.get_ident()
+        if PROFILE_SIGNAL is not None:
+            asyncio.get_running_loop().add_signal_handler(PROFILE_SIGNAL, self.toggle)
+
+    def start_threaded(self):
+        """Вызывается в главном потоке сервера с потоком на клиента: профилируются все потоки"""
+        if PROFILE_SIGNAL is not None:
+            signal.signal(PROFILE_SIGNAL, lambda signum, frame: self.toggle())
+
+    def start_profile(self) -> str:
+        """Включает профилировщик"""
+        if not self.profiler.running:
+            self.profiler.start()
+            server_log.info(f"[Профилировщик] Включен (pid {os.getpid()}, выборка раз в "
+                            f"{self.profiler.interval * 1000:g} мс)", event="profile_start")
+        return f"{PROFILE_START}:ok"
+
+    def stop_profile(self) -> str:
+        """Выключает профилировщик, записывает свернутые стеки и выводит отчет"""
+        profiler = self.profiler
+        if not profiler.running:
+            return f"{PROFILE_STOP}:0:"
+        profiler.stop()
+        path = os.path.join(self.profile_dir, f"profile-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}.folded")
+        profiler.dump(path)
+        elapsed = time.monotonic() - profiler.started
+        lines = [f"[Профилировщик] Выключен: {profiler.samples} выборок за {elapsed:.1f} секунд",
+                 f"Свернутые стеки: {path}"]
+        total = sum(profiler.counts.values())
+        if total:
+            lines.append("Чаще всего выполнялись:")
+            for function, count in profiler.top_functions():
+                lines.append(f"  {count * 100 / total:5.1f}%  {function}")
+        lines.extend(self.report_lines())
+        server_log.report(*lines, event="profile_stop", samples=profiler.samples, path=path)
+        return f"{PROFILE_STOP}:{profiler.samples}:{path}"
+
+    def toggle(self):
+        """Переключает профилировщик (обработчик сигнала)"""
+        if self.profiler.running:
+            self.stop_profile()
+        else:
+            self.start_profile()
+
+    def close(self):
+        """Остановка сервера: записывает профиль, если профилировщик включен"""
+        if self.profiler.running:
+            self.stop_profile()
+
+    def handle_control(self, message: str) -> Optional[str]:
+        """
+        Обрабатывает управляющее сообщение клиента
+
+        Returns:
+            Ответ клиенту; None - сообщение не управляющее или управление запрещено
+        """
+        if not self.control:
+            return None
+        if message == PROFILE_START:
+            return self.start_profile()
+        if message == PROFILE_STOP:
+            return self.stop_profile()
+        return None
+
+    def report_lines(self) -> List[str]:
+        """Строки отчета: опоздание цикла событий и время обработчиков"""
+        lines = []
+        lag = self.lag
+        if lag.histogram.total_count:
+            lines.append(f"Опоздание цикла событий: {lag.histogram.format_summary()}")
+        if self.timer is not None:
+            for handler, histogram in sorted(self.timer.histograms.items()):
+                lines.append(f"Обработчик {handler}: {histogram.format_summary()}")
+            lines.append(f"Обработок дольше {SLOW_HANDLER_NS // 1_000_000} мс: {self.timer.slow}")
+        return lines
+
+
+def forward_profile_signal(processes):
+    """Родительский процесс воркеров: пересылает SIGUSR1 всем воркерам"""
+    if PROFILE_SIGNAL is None:
+        return
+
+    def forward(signum, frame):
+        for process in processes:
+            if process.is_alive():
+                os.kill(process.pid, PROFILE_SIGNAL)
+
+    signal.signal(PROFILE_SIGNAL, forward)
@@ -0,0 +1,311 @@
+"""
+Двоичный формат кадров бенчмарка
+
+Каждый кадр - это двоичное WebSocket сообщение с фиксированным заголовком
+(сетевой порядок байтов) и полезной нагрузкой:
+
+    смещение  размер  поле
+    0         1       маркер FRAME_MAGIC (0xFF, не встречается в UTF-8)
+    1         1       тип сообщения (MSG_*)
+    2         4       идентификатор потока
+    6         8       номер последовательности
+    14        8       время отправки, нс монотонных часов отправителя
+    22        4       длина полезной нагрузки
+    26        ...     полезная нагрузка
+
+Для MSG_START и MSG_END поле последовательности содержит количество
+сообщений (запланированное или отправленное), 0 - если неизвестно.
+Время отправки имеет смысл только для часов отправителя (RTT считается
+по эху на стороне отправителя).
+
+Подтверждения доставки (замер исходящих сообщений server-sender.py).
+Получатель сообщает, сколько сообщений с данными он принял с начала
+замера (нарастающим итогом), чтобы отправитель считал скорость доставки,
+а не скорость записи в свой буфер, и ограничивал число сообщений в пути.
+Подтверждения включает получатель в команде запуска:
+
+    текст:    __BENCHMARK_START__:N:K
+    двоичный: START, N в поле последовательности, K в нагрузке (4 байта)
+
+где K - подтверждать не реже чем каждые K сообщений (0 или отсутствие K -
+без подтверждений). Отправитель повторяет команду запуска получателю с тем
+же K. Подтверждение:
+
+    текст:    __BENCHMARK_ACK__:M
+    двоичный: ACK, M в поле последовательности
+
+M - количество принятых сообщений с данными (для двоичных кадров -
+наибольший номер последовательности + 1). Кроме каждых K сообщений
+получатель подтверждает по таймеру, если с прошлого подтверждения пришли
+новые сообщения, и обязательно при получении END (окончательное M).
+Таймер необязателен (в 1С его нет): окно отправителя не меньше 2K.
+
+Ответы сервера на сообщения замера входящих (server.py, server-bench.py)
+задаются режимом подтверждения ACK_MODES: ключ сервера или запрос
+клиента в команде запуска:
+
+    текст:    __BENCHMARK_START__:ack=<режим>[:N[:T]]
+    двоичный: START, в нагрузке ACK_REQUEST (код режима, N, T в мс)
+
+    none       - без ответов
+    echo       - полное эхо сообщения
+    compact    - короткий ответ на каждое сообщение: "__BENCHMARK_DATA__<номер>:"
+                 без нагрузки или заголовок двоичного кадра DATA без нагрузки
+                 (клиенты считают RTT так же, как по эху)
+    coalesced  - накопительное подтверждение (__BENCHMARK_ACK__:M или ACK)
+                 каждые N сообщений, а при идущем потоке - не реже чем раз в
+                 T мс, и после END. Текстовое подтверждение дополняется номером
+                 последнего сообщения (__BENCHMARK_ACK__:M:S), если клиент
+                 нумерует сообщения; в двоичном ACK время отправки - из
+                 последнего подтверждаемого кадра. По ним клиент считает RTT.
+                 Таймера у сервера нет: окно клиента должно быть не меньше 2N.
+"""
+import struct
+import time
+from typing import Optional, Tuple
+
+FRAME_MAGIC = 0xFF
+
+MSG_START = 1
+MSG_DATA = 2
+MSG_END = 3
+MSG_ACK = 4
+
+HEADER = struct.Struct(">BBIQQI")
+HEADER_SIZE = HEADER.size
+# Нагрузка START: подтверждать каждые K сообщений
+ACK_EVERY = struct.Struct(">I")
+# Нагрузка START замера входящих: режим подтверждения (индекс в ACK_MODES), N, T в мс
+ACK_REQUEST = struct.Struct(">BII")
+
+ACK_NONE = "none"
+ACK_ECHO = "echo"
+ACK_COMPACT = "compact"
+ACK_COALESCED = "coalesced"
+ACK_MODES = (ACK_NONE, ACK_ECHO, ACK_COMPACT, ACK_COALESCED)
+
+# Текстовый протокол (совместимость с 1С и старыми клиентами)
+BENCHMARK_DATA_PREFIX = "__BENCHMARK_DATA__"
+BENCHMARK_TEXT = "Тестовое сообщение для замера производительности"
+BENCHMARK_ACK_PREFIX = "__BENCHMARK_ACK__:"
+BENCHMARK_START = "__BENCHMARK_START__"
+BENCHMARK_START_ACK_PREFIX = "__BENCHMARK_START__:ack="
+BENCHMARK_END = "__BENCHMARK_END__"
+# Разослать текст после двоеточия всем клиентам сервера (в режиме --workers --bus - всех воркеров)
+BENCHMARK_BROADCAST = "__BENCHMARK_BROADCAST__:"
+
+MSG_NAMES = {
+    MSG_START: "START",
+    MSG_DATA: "DATA",
+    MSG_END: "END",
+    MSG_ACK: "ACK",
+}
+
+
+def make_text_payload(size: int) -> str:
+    """Повторяющийся текст, как у клиента 1С, длиной size байт в UTF-8"""
+    unit = BENCHMARK_TEXT.encode('utf-8')
+    data = unit * (size // len(unit) + 1)
+    return data[:size].decode('utf-8', errors='ignore')
+
+
+def is_binary_frame(data) -> bool:
+    """Проверяет, что данные начинаются с заголовка двоичного кадра"""
+    return len(data) >= HEADER_SIZE and data[0] == FRAME_MAGIC
+
+
+def encode_frame(msg_type: int, stream_id: int, sequence: int, payload: bytes = b"",
+                 timestamp_ns: Optional[int] = None) -> bytes:
+    """
+    Собирает двоичный кадр
+
+    Args:
+        msg_type: Тип сообщения (MSG_*)
+        stream_id: Идентификатор потока
+        sequence: Номер последовательности (для START/END - количество сообщений)
+        payload: Полезная нагрузка
+        timestamp_ns: Время отправки в нс; по умолчанию time.monotonic_ns()
+
+    Returns:
+        Кадр в виде bytes
+    """
+    if timestamp_ns is None:
+        timestamp_ns = time.monotonic_ns()
+    return HEADER.pack(FRAME_MAGIC, msg_type, stream_id, sequence, timestamp_ns, len(payload)) + payload
+
+
+def decode_header(data) -> Optional[Tuple[int, int, int, int, int]]:
+    """
+    Разбирает заголовок кадра без копирования полезной нагрузки
+
+    Args:
+        data: bytes/bytearray/memoryview с кадром
+
+    Returns:
+        Tuple (тип, поток, последовательность, время отправки, длина нагрузки)
+        или None, если это не двоичный кадр
+    """
+    if len(data) < HEADER_SIZE or data[0] != FRAME_MAGIC:
+        return None
+    _, msg_type, stream_id, sequence, timestamp_ns, payload_length = HEADER.unpack_from(data)
+    return msg_type, stream_id, sequence, timestamp_ns, payload_length
+
+
+def frame_payload(data) -> memoryview:
+    """Возвращает полезную нагрузку кадра без копирования"""
+    return memoryview(data)[HEADER_SIZE:]
+
+
+class SequenceTracker:
+    """Отслеживает пропуски и нарушения порядка в номерах последовательности потока"""
+
+    __slots__ = ("next_sequence", "received", "lost", "reordered")
+
+    def __init__(self, first_sequence: int = 0):
+        self.next_sequence = first_sequence
+        self.received = 0
+        self.lost = 0
+        self.reordered = 0
+
+    def add(self, sequence: int):
+        """Учитывает очередной номер последовательности"""
+        self.received += 1
+        if sequence == self.next_sequence:
+            self.next_sequence = sequence + 1
+        elif sequence > self.next_sequence:
+            # Пропуск: промежуточные сообщения считаем потерянными, пока они не придут
+            self.lost += sequence - self.next_sequence
+            self.next_sequence = sequence + 1
+        else:
+            # Опоздавшее сообщение: ранее оно было засчитано как потерянное
+            self.reordered += 1
+            if self.lost > 0:
+                self.lost -= 1
+
+
+def start_ack_every(data, header: Tuple[int, int, int, int, int]) -> int:
+    """Значение K (подтверждать каждые K сообщений) из кадра START; 0 - без подтверждений"""
+    if header[4] < ACK_EVERY.size:
+        return 0
+    return ACK_EVERY.unpack_from(data, HEADER_SIZE)[0]
+
+
+def parse_text_ack(message: str) -> Optional[int]:
+    """Количество из текстового подтверждения "__BENCHMARK_ACK__:M[:S]" или None"""
+    if not message.startswith(BENCHMARK_ACK_PREFIX):
+        return None
+    value = message[len(BENCHMARK_ACK_PREFIX):].partition(":")[0]
+    return int(value) if value.isdigit() else None
+
+
+def text_ack_sequence(message: str) -> Optional[int]:
+    """
+    Номер последнего подтвержденного текстового сообщения S из
+    "__BENCHMARK_ACK__:M:S" (режим coalesced) или None, если его нет
+    """
+    value = message[len(BENCHMARK_ACK_PREFIX):].partition(":")[2]
+    return int(value) if value.isdigit() else None
+
+
+def encode_ack_request(mode: str, ack_every: int, ack_interval_ms: int, binary: bool, stream_id: int = 0):
+    """Команда запуска замера входящих с запросом режима подтверждения (str или bytes)"""
+    if binary:
+        return encode_frame(MSG_START, stream_id, 0,
+                            ACK_REQUEST.pack(ACK_MODES.index(mode), ack_every, ack_interval_ms))
+    return f"{BENCHMARK_START_ACK_PREFIX}{mode}:{ack_every}:{ack_interval_ms}"
+
+
+def parse_ack_mode(argument: str) -> str:
+    """
+    Режим подтверждения из аргумента "ack=<режим>" текстовой команды запуска
+
+    Raises:
+        ValueError: Аргумент не вида "ack=<режим>" или режим неизвестен
+    """
+    prefix = BENCHMARK_START_ACK_PREFIX[len(BENCHMARK_START) + 1:]
+    mode = argument[len(prefix):]
+    if not argument.startswith(prefix) or mode not in ACK_MODES:
+        raise ValueError(f"неверный режим подтверждения: {argument}")
+    return mode
+
+
+def parse_ack_request(message) -> Optional[Tuple[str, Optional[int], Optional[int]]]:
+    """
+    Запрос режима подтверждения из команды запуска
+
+    Args:
+        message: Текстовая команда запуска или двоичный кадр START
+
+    Returns:
+        Tuple (режим, N, T в мс) - N и T могут быть None, если не заданы;
+        None, если режим не запрошен или задан неверно
+    """
+    if isinstance(message, str):
+        if not message.startswith(BENCHMARK_START_ACK_PREFIX):
+            return None
+        parts = message[len(BENCHMARK_START_ACK_PREFIX):].split(":")
+        if parts[0] not in ACK_MODES or not all(part.isdigit() for part in parts[1:3]):
+            return None
+        ack_every = int(parts[1]) if len(parts) > 1 else None
+        ack_interval_ms = int(parts[2]) if len(parts) > 2 else None
+        return parts[0], ack_every, ack_interval_ms
+    if len(message) < HEADER_SIZE + ACK_REQUEST.size:
+        return None
+    mode, ack_every, ack_interval_ms = ACK_REQUEST.unpack_from(message, HEADER_SIZE)
+    if mode >= len(ACK_MODES):
+        return None
+    return ACK_MODES[mode], ack_every, ack_interval_ms
+
+
+class AckTracker:
+    """
+    Сторона получателя: считает сообщения с данными и решает, когда
+    отправлять накопительное подтверждение (см. описание модуля)
+    """
+
+    __slots__ = ("ack_every", "ack_interval_ns", "binary", "stream_id",
+                 "received", "acked", "last_ack_ns")
+
+    def __init__(self, ack_every: int, ack_interval: float, binary: bool = False, stream_id: int = 0):
+        """
+        Args:
+            ack_every: Подтверждать не реже чем каждые ack_every сообщений
+            ack_interval: Подтверждать по таймеру не реже чем раз в ack_interval секунд
+            binary: Отправлять двоичные подтверждения вместо текстовых
+            stream_id: Идентификатор потока для двоичных подтверждений
+        """
+        self.ack_every = ack_every
+        self.ack_interval_ns = int(ack_interval * 1_000_000_000)
+        self.binary = binary
+        self.stream_id = stream_id
+        self.received = 0
+        self.acked = 0
+        self.last_ack_ns = time.monotonic_ns()
+
+    def on_data(self, sequence: Optional[int] = None) -> bool:
+        """
+        Учитывает сообщение с данными
+
+        Args:
+            sequence: Номер последовательности двоичного кадра (None для текста)
+
+        Returns:
+            True, если пора отправить подтверждение
+        """
+        if sequence is None:
+            self.received += 1
+        elif sequence >= self.received:
+            self.received = sequence + 1
+        return self.received - self.acked >= self.ack_every
+
+    def is_due(self, now_ns: int) -> bool:
+        """Пора ли отправить подтверждение по таймеру"""
+        return self.received > self.acked and now_ns - self.last_ack_ns >= self.ack_interval_ns
+
+    def make_ack(self):
+        """Собирает подтверждение на все принятые сообщения (str или bytes)"""
+        self.acked = self.received
+        self.last_ack_ns = time.monotonic_ns()
+        if self.binary:
+            return encode_frame(MSG_ACK, self.stream_id, self.received)
+        return f"{BENCHMARK_ACK_PREFIX}{self.received}"
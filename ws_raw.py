@@ -0,0 +1,246 @@
+"""
+Минимальный WebSocket сервер на asyncio.Protocol без сторонних библиотек
+
+Реализовано только то, что нужно для замеров: рукопожатие HTTP Upgrade,
+разбор кадров клиента (маска, фрагментация, ping/close) и отправка
+кадров сервера без маски. Расширения (permessage-deflate) не поддерживаются.
+"""
+import asyncio
+import base64
+import hashlib
+from typing import Callable, Optional
+
+from ws_sender import build_frame_header, OPCODE_TEXT, OPCODE_BINARY
+
+OPCODE_CONTINUATION = 0x0
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xA
+
+WEBSOCKET_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+# Максимальный размер сообщения и HTTP запроса рукопожатия
+MAX_MESSAGE_SIZE = 16 * 1024 * 1024
+MAX_HANDSHAKE_SIZE = 16 * 1024
+
+CLOSE_NORMAL = 1000
+CLOSE_PROTOCOL_ERROR = 1002
+CLOSE_TOO_BIG = 1009
+
+
+def accept_key(key: bytes) -> bytes:
+    """Значение Sec-WebSocket-Accept для ключа клиента"""
+    return base64.b64encode(hashlib.sha1(key + WEBSOCKET_GUID).digest())
+
+
+def unmask(payload, mask: bytes) -> bytes:
+    """Снимает маску клиента одной операцией XOR над целым числом"""
+    length = len(payload)
+    if length == 0:
+        return b""
+    mask_bytes = (mask * (length // 4 + 1))[:length]
+    return (int.from_bytes(payload, 'big') ^ int.from_bytes(mask_bytes, 'big')).to_bytes(length, 'big')
+
+
+class RawWebSocketProtocol(asyncio.Protocol):
+    """
+    Соединение минимального сервера
+
+    Сообщения передаются в on_message(connection, message), где message -
+    str для текстовых и bytes для двоичных сообщений. Если задан on_data,
+    он вызывается с conn_id на каждое чтение из сокета (отметка активности
+    для общего keepalive, см. ws_density.py).
+
+    Атрибуты в __slots__: десятки тысяч подключений не держат по словарю.
+    """
+
+    __slots__ = ("on_open", "on_message", "on_close", "on_data", "conn_id", "transport", "state", "buffer",
+                 "handshake_done", "closed", "fragment_opcode", "fragments", "fragments_size")
+
+    def __init__(self, on_open: Callable, on_message: Callable, on_close: Callable,
+                 on_data: Optional[Callable[[int], None]] = None):
+        self.on_open = on_open
+        self.on_message = on_message
+        self.on_close = on_close
+        self.on_data = on_data
+        # Номер подключения в таблице бэкенда (плотный режим)
+        self.conn_id = -1
+        self.transport: Optional[asyncio.Transport] = None
+        # Данные приложения, связанные с подключением
+        self.state = None
+        self.buffer = bytearray()
+        self.handshake_done = False
+        self.closed = False
+        # Первый кадр фрагментированного сообщения и накопленные части
+        # (список создается только для фрагментированных сообщений)
+        self.fragment_opcode: Optional[int] = None
+        self.fragments = None
+        self.fragments_size = 0
+
+    # asyncio.Protocol
+
+    def connection_made(self, transport: asyncio.Transport):
+        self.transport = transport
+
+    def connection_lost(self, exc: Optional[Exception]):
+        if self.handshake_done and not self.closed:
+            self.closed = True
+            self.on_close(self)
+        self.closed = True
+
+    def pause_writing(self):
+        # Буфер записи переполнен: перестаем читать, пока клиент не примет данные
+        self.transport.pause_reading()
+
+    def resume_writing(self):
+        self.transport.resume_reading()
+
+    def data_received(self, data: bytes):
+        if self.on_data is not None and self.conn_id >= 0:
+            self.on_data(self.conn_id)
+        self.buffer += data
+        if not self.handshake_done:
+            if not self._handshake():
+                return
+        self._parse_frames()
+
+    # Рукопожатие
+
+    def _handshake(self) -> bool:
+        """Разбирает HTTP запрос Upgrade; возвращает True после успешного ответа"""
+        end = self.buffer.find(b"\r\n\r\n")
+        if end < 0:
+            if len(self.buffer) > MAX_HANDSHAKE_SIZE:
+                self._reject()
+            return False
+        request = bytes(self.buffer[:end]).decode('latin-1')
+        del self.buffer[:end + 4]
+        headers = {}
+        for line in request.split("\r\n")[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        key = headers.get("sec-websocket-key")
+        if not request.startswith("GET ") or "websocket" not in headers.get("upgrade", "").lower() or not key:
+            self._reject()
+            return False
+        self.transport.write(
+            b"HTTP/1.1 101 Switching Protocols\r\n"
+            b"Upgrade: websocket\r\n"
+            b"Connection: Upgrade\r\n"
+            b"Sec-WebSocket-Accept: " + accept_key(key.encode('latin-1')) + b"\r\n\r\n")
+        self.handshake_done = True
+        self.on_open(self)
+        return True
+
+    def _reject(self):
+        self.transport.write(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+        self.transport.close()
+        self.closed = True
+
+    # Разбор кадров
+
+    def _parse_frames(self):
+        buffer = self.buffer
+        offset = 0
+        size = len(buffer)
+        while not self.closed and size - offset >= 2:
+            first, second = buffer[offset], buffer[offset + 1]
+            length = second & 0x7F
+            position = offset + 2
+            if length == 126:
+                if size - position < 2:
+                    break
+                length = int.from_bytes(buffer[position:position + 2], 'big')
+                position += 2
+            elif length == 127:
+                if size - position < 8:
+                    break
+                length = int.from_bytes(buffer[position:position + 8], 'big')
+                position += 8
+            if not second & 0x80:
+                # Кадры клиента обязаны быть замаскированы
+                self.close(CLOSE_PROTOCOL_ERROR)
+                break
+            if length > MAX_MESSAGE_SIZE:
+                self.close(CLOSE_TOO_BIG)
+                break
+            if size - position < 4 + length:
+                break
+            mask = bytes(buffer[position:position + 4])
+            position += 4
+            payload = unmask(memoryview(buffer)[position:position + length], mask)
+            offset = position + length
+            self._on_frame(bool(first & 0x80), first & 0x0F, payload)
+        if offset:
+            del buffer[:offset]
+
+    def _on_frame(self, fin: bool, opcode: int, payload: bytes):
+        if opcode == OPCODE_TEXT or opcode == OPCODE_BINARY:
+            if fin:
+                self._deliver(opcode, payload)
+                return
+            self.fragment_opcode = opcode
+            self.fragments = [payload]
+            self.fragments_size = len(payload)
+        elif opcode == OPCODE_CONTINUATION:
+            if self.fragment_opcode is None:
+                self.close(CLOSE_PROTOCOL_ERROR)
+                return
+            self.fragments.append(payload)
+            self.fragments_size += len(payload)
+            if self.fragments_size > MAX_MESSAGE_SIZE:
+                self.close(CLOSE_TOO_BIG)
+                return
+            if fin:
+                opcode, self.fragment_opcode = self.fragment_opcode, None
+                fragments, self.fragments = self.fragments, None
+                self._deliver(opcode, b"".join(fragments))
+        elif opcode == OPCODE_PING:
+            self._write_frame(OPCODE_PONG, payload)
+        elif opcode == OPCODE_CLOSE:
+            self.close(CLOSE_NORMAL)
+        elif opcode != OPCODE_PONG:
+            self.close(CLOSE_PROTOCOL_ERROR)
+
+    def _deliver(self, opcode: int, payload: bytes):
+        if opcode == OPCODE_TEXT:
+            try:
+                message = payload.decode('utf-8')
+            except UnicodeDecodeError:
+                self.close(CLOSE_PROTOCOL_ERROR)
+                return
+            self.on_message(self, message)
+        else:
+            self.on_message(self, payload)
+
+    # Отправка
+
+    def _write_frame(self, opcode: int, payload: bytes):
+        if self.closed or self.transport.is_closing():
+            return
+        self.transport.writelines((build_frame_header(opcode, len(payload)), payload))
+
+    def send(self, message):
+        """Отправляет str текстовым кадром, bytes - двоичным"""
+        if isinstance(message, str):
+            self._write_frame(OPCODE_TEXT, message.encode('utf-8'))
+        else:
+            self._write_frame(OPCODE_BINARY, message)
+
+    def ping(self):
+        """Отправляет ping (ответ pong придет как данные, см. on_data)"""
+        self._write_frame(OPCODE_PING, b"")
+
+    def abort(self):
+        """Разрывает соединение без закрывающего кадра (клиент не отвечает)"""
+        if self.transport is not None:
+            self.transport.abort()
+
+    def close(self, code: int = CLOSE_NORMAL):
+        """Отправляет кадр закрытия и закрывает соединение"""
+        if self.closed:
+            return
+        self._write_frame(OPCODE_CLOSE, code.to_bytes(2, 'big'))
+        self.closed = True
+        self.transport.close()
+        self.on_close(self)
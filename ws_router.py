@@ -0,0 +1,191 @@
+"""
+Таблица управляющих команд сервера вместо цепочки сравнений строк
+
+Все управляющие текстовые сообщения имеют вид "__ИМЯ__[:аргумент:...]".
+Команда узнается за один шаг: если сообщение начинается с "__", имя -
+это все до следующего "__" включительно, и оно ищется в словаре команд.
+Сообщения без префикса и с незарегистрированным именем - это данные:
+маршрутизатор возвращает None после одного сравнения префикса, и вызывающий
+код обрабатывает их своим быстрым путем. Двоичные команды узнаются по типу
+кадра ws_protocol (байт после маркера) тоже одним поиском в словаре.
+
+Аргументы команды описываются при регистрации парами (имя, преобразование),
+например ("N", int): маршрутизатор разбирает их и передает обработчику
+готовыми значениями, а при ошибке поднимает CommandError с форматом
+команды. Последний аргумент может забирать остаток сообщения целиком
+(rest=True) - для текста, в котором может быть ":".
+
+По каждой команде считаются вызовы и ошибки (CommandError из разбора
+аргументов или из обработчика). Если задан
+HandlerTimer (ws_profile.py, ключ --handler-timing), время обработчика
+записывается под именем команды - так видно, сколько стоит каждый тип
+управляющего сообщения.
+"""
+import time
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+from ws_profile import HandlerTimer
+
+COMMAND_MARK = "__"
+
+
+class CommandError(ValueError):
+    """Неверные аргументы управляющей команды"""
+
+
+class Command:
+    """Зарегистрированная команда: обработчик, разбор аргументов и счетчики"""
+
+    __slots__ = ("name", "handler", "arguments", "required", "rest", "label", "calls", "errors")
+
+    def __init__(self, name: str, handler: Callable, arguments: Sequence[Tuple[str, Callable]] = (),
+                 required: Optional[int] = None, rest: bool = False, label: Optional[str] = None):
+        self.name = name
+        self.handler = handler
+        self.arguments = tuple(arguments)
+        self.required = len(self.arguments) if required is None else required
+        self.rest = rest
+        # Имя в HandlerTimer и /metrics: "__BENCHMARK_START__" -> "benchmark_start"
+        self.label = label or name.strip("_").lower()
+        self.calls = 0
+        self.errors = 0
+
+    def usage(self) -> str:
+        """Формат команды для сообщений об ошибке: __ИМЯ__:<a>[:<b>]"""
+        parts = [self.name]
+        for index, (name, _) in enumerate(self.arguments):
+            parts.append(f":<{name}>" if index < self.required else f"[:<{name}>]")
+        return "".join(parts)
+
+    def parse(self, message: str) -> list:
+        """
+        Аргументы команды из текста после имени
+
+        Raises:
+            CommandError: Лишние или недостающие аргументы, ошибка преобразования
+        """
+        tail = message[len(self.name):]
+        if not tail:
+            parts = []
+        elif tail[0] != ":" or not self.arguments:
+            raise CommandError(f"неверный формат команды, ожидается {self.usage()}")
+        elif self.rest:
+            parts = tail[1:].split(":", len(self.arguments) - 1)
+        else:
+            parts = tail[1:].split(":")
+        if not self.required <= len(parts) <= len(self.arguments):
+            raise CommandError(f"неверный формат команды, ожидается {self.usage()}")
+        try:
+            return [convert(part) for (_, convert), part in zip(self.arguments, parts)]
+        except ValueError:
+            raise CommandError(f"неверные аргументы команды: {message[:80]}, ожидается {self.usage()}") from None
+
+
+class CommandRouter:
+    """Управляющие команды по имени (текст) и по типу кадра (двоичные)"""
+
+    __slots__ = ("commands", "binary", "timer")
+
+    def __init__(self, timer: Optional[HandlerTimer] = None):
+        """
+        Args:
+            timer: Время обработки по командам (None - не измерять)
+        """
+        self.commands: Dict[str, Command] = {}
+        self.binary: Dict[int, Command] = {}
+        self.timer = timer
+
+    def register(self, name: str, handler: Callable, *arguments: Tuple[str, Callable],
+                 required: Optional[int] = None, rest: bool = False, label: Optional[str] = None) -> Command:
+        """
+        Регистрирует текстовую команду
+
+        Обработчик вызывается как handler(context, message, *аргументы) и
+        возвращает ответ клиенту или None.
+
+        Args:
+            name: Имя команды "__ИМЯ__"
+            handler: Обработчик
+            arguments: Пары (имя, преобразование строки), например ("N", int)
+            required: Сколько первых аргументов обязательны (по умолчанию: все)
+            rest: Последний аргумент - весь остаток сообщения, вместе с ":"
+            label: Имя для времени обработки (по умолчанию: из имени команды)
+
+        Raises:
+            ValueError: Имя не вида "__ИМЯ__" или уже зарегистрировано
+        """
+        if (not name.startswith(COMMAND_MARK) or not name.endswith(COMMAND_MARK)
+                or name.find(COMMAND_MARK, 2) != len(name) - 2):
+            raise ValueError(f"неверное имя команды: {name}")
+        if name in self.commands:
+            raise ValueError(f"команда уже зарегистрирована: {name}")
+        command = self.commands[name] = Command(name, handler, arguments, required, rest, label)
+        return command
+
+    def register_binary(self, msg_type: int, handler: Callable, label: str) -> Command:
+        """
+        Регистрирует двоичную команду по типу кадра (MSG_* из ws_protocol)
+
+        Обработчик вызывается как handler(context, data, header) с уже
+        разобранным заголовком и возвращает ответ клиенту или None.
+        """
+        if msg_type in self.binary:
+            raise ValueError(f"тип кадра уже зарегистрирован: {msg_type}")
+        command = self.binary[msg_type] = Command(label, handler, label=label)
+        return command
+
+    def route(self, message: str) -> Optional[Command]:
+        """Команда текстового сообщения или None - это данные"""
+        if not message.startswith(COMMAND_MARK):
+            return None
+        end = message.find(COMMAND_MARK, 2)
+        if end < 0:
+            return None
+        return self.commands.get(message[:end + 2])
+
+    def dispatch(self, command: Command, context, message: str):
+        """
+        Разбирает аргументы и вызывает обработчик команды
+
+        Returns:
+            Результат обработчика
+
+        Raises:
+            CommandError: Неверные аргументы или обработчик отклонил команду
+                (учитывается в errors команды)
+        """
+        command.calls += 1
+        timer = self.timer
+        start = time.perf_counter_ns() if timer is not None else 0
+        try:
+            return command.handler(context, message, *command.parse(message))
+        except CommandError:
+            command.errors += 1
+            raise
+        finally:
+            if timer is not None:
+                timer.record(command.label, time.perf_counter_ns() - start)
+
+    def dispatch_binary(self, command: Command, context, data, header: tuple):
+        """Вызывает обработчик двоичной команды (header - результат decode_header)"""
+        command.calls += 1
+        timer = self.timer
+        if timer is None:
+            return command.handler(context, data, header)
+        start = time.perf_counter_ns()
+        try:
+            return command.handler(context, data, header)
+        finally:
+            timer.record(command.label, time.perf_counter_ns() - start)
+
+    def all_commands(self) -> list:
+        """Все команды: текстовые, затем двоичные"""
+        return list(self.commands.values()) + list(self.binary.values())
+
+    def summary(self) -> str:
+        """Вызовы команд одной строкой (только вызывавшиеся)"""
+        used = [command for command in self.all_commands() if command.calls]
+        if not used:
+            return "команд не было"
+        return ", ".join(f"{command.label} {command.calls}"
+                         + (f" (ошибок: {command.errors})" if command.errors else "") for command in used)
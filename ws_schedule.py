@@ -0,0 +1,82 @@
+"""
+Расписание отправки для замера с открытым циклом (open-loop)
+
+При открытом цикле сообщения отправляются по заранее заданному
+расписанию с целевой частотой, а не "как только предыдущее ушло": если
+сервер тормозит, отправитель не замедляется, а отстает от расписания.
+Задержка считается от запланированного времени отправки, поэтому время,
+которое сообщение ждало своей очереди у отправителя, тоже попадает в RTT
+(поправка на coordinated omission).
+
+    uniform  - равные интервалы 1/rate
+    poisson  - пуассоновский поток: интервалы экспоненциальные со средним
+               1/rate (независимые производители, как клиенты 1С)
+"""
+import random
+import time
+from typing import Optional
+
+ARRIVAL_UNIFORM = "uniform"
+ARRIVAL_POISSON = "poisson"
+ARRIVALS = (ARRIVAL_UNIFORM, ARRIVAL_POISSON)
+
+
+def add_rate_arguments(parser):
+    """Добавляет в argparse параметры замера с открытым циклом"""
+    parser.add_argument("--rate", type=float, default=0.0,
+                       help="Открытый цикл: целевая частота сообщений в секунду на подключение; "
+                            "0 - отправлять как можно быстрее (по умолчанию: 0)")
+    parser.add_argument("--rate-total", action="store_true",
+                       help="--rate задает общую частоту всех подключений, а не частоту на подключение")
+    parser.add_argument("--arrival", choices=ARRIVALS, default=ARRIVAL_UNIFORM,
+                       help="Расписание отправки: uniform (равные интервалы) или poisson "
+                            "(экспоненциальные интервалы) (по умолчанию: uniform)")
+
+
+class SendSchedule:
+    """Запланированные моменты отправки (нс монотонных часов)"""
+
+    __slots__ = ("interval_ns", "arrival", "next_ns", "random", "max_lag_ns")
+
+    def __init__(self, rate: float, arrival: str = ARRIVAL_UNIFORM, start_ns: Optional[int] = None,
+                 seed: Optional[int] = None):
+        """
+        Args:
+            rate: Целевая частота сообщений в секунду
+            arrival: ARRIVAL_UNIFORM или ARRIVAL_POISSON
+            start_ns: Время первой отправки; по умолчанию - сейчас
+            seed: Зерно генератора интервалов poisson (для повторяемости)
+        """
+        if rate <= 0:
+            raise ValueError("Частота открытого цикла должна быть больше 0")
+        if arrival not in ARRIVALS:
+            raise ValueError(f"Неизвестное расписание: {arrival}")
+        self.interval_ns = 1e9 / rate
+        self.arrival = arrival
+        self.next_ns = float(time.monotonic_ns() if start_ns is None else start_ns)
+        self.random = random.Random(seed)
+        # Наибольшее отставание отправки от расписания
+        self.max_lag_ns = 0
+
+    def take(self) -> int:
+        """Время очередной отправки по расписанию; сдвигает расписание на следующее сообщение"""
+        intended = int(self.next_ns)
+        if self.arrival == ARRIVAL_POISSON:
+            self.next_ns += self.random.expovariate(1.0) * self.interval_ns
+        else:
+            self.next_ns += self.interval_ns
+        return intended
+
+    def delay(self, intended_ns: int, now_ns: Optional[int] = None) -> float:
+        """
+        Сколько секунд ждать до запланированного времени (0, если уже пора);
+        отставание от расписания запоминается
+        """
+        if now_ns is None:
+            now_ns = time.monotonic_ns()
+        lag = now_ns - intended_ns
+        if lag >= 0:
+            if lag > self.max_lag_ns:
+                self.max_lag_ns = lag
+            return 0.0
+        return -lag / 1e9
@@ -0,0 +1,206 @@
+"""
+Конвейерная отправка сообщений бенчмарка напрямую в транспорт
+
+Кадры пишутся в транспорт пачками без ожидания каждого send(); ожидание
+(drain) происходит только когда буфер записи превысил верхнюю границу
+(write_limit соединения). Полезная нагрузка собирается один раз и
+переиспользуется для всех сообщений.
+
+Если получатель подтверждает доставку (см. ws_protocol.py), SendFlow
+ограничивает число неподтвержденных сообщений окном (кредитом) и
+отмечает время, когда подтверждены все сообщения.
+"""
+import asyncio
+import struct
+import time
+
+from ws_protocol import HEADER, HEADER_SIZE, FRAME_MAGIC, MSG_DATA, BENCHMARK_DATA_PREFIX
+from ws_metrics import add_messages_out
+from ws_compat import is_writable, write_frames, write_paused, wait_writable
+
+OPCODE_CONTINUATION = 0x0
+OPCODE_TEXT = 0x1
+OPCODE_BINARY = 0x2
+
+# Максимальный размер пачки кадров, передаваемой в транспорт за один вызов
+BATCH_BYTES = 256 * 1024
+BATCH_MESSAGES = 256
+
+
+def build_frame_header(opcode: int, length: int, fin: bool = True, mask_key: bytes = b"") -> bytes:
+    """
+    Собирает заголовок WebSocket кадра (сервера - без маски)
+
+    Args:
+        opcode: Код операции (OPCODE_TEXT / OPCODE_BINARY / OPCODE_CONTINUATION)
+        length: Длина полезной нагрузки кадра
+        fin: Последний фрагмент сообщения
+        mask_key: Ключ маски кадра клиента (4 байта); нагрузку маскирует вызывающий
+    """
+    first = (0x80 if fin else 0) | opcode
+    mask_bit = 0x80 if mask_key else 0
+    if length <= 125:
+        return struct.pack(">BB", first, mask_bit | length) + mask_key
+    if length <= 0xFFFF:
+        return struct.pack(">BBH", first, mask_bit | 126, length) + mask_key
+    return struct.pack(">BBQ", first, mask_bit | 127, length) + mask_key
+
+
+class PayloadBuffers:
+    """Заранее собранные буферы сообщений бенчмарка заданного размера"""
+
+    __slots__ = ("message_size", "binary", "text_prefix", "frame_header", "payload")
+
+    def __init__(self, message_size: int, binary: bool):
+        """
+        Args:
+            message_size: Размер сообщения в байтах (полезная нагрузка WebSocket кадра)
+            binary: Двоичные кадры ws_protocol вместо текстовых
+        """
+        self.binary = binary
+        if binary:
+            message_size = max(message_size, HEADER_SIZE)
+            self.frame_header = build_frame_header(OPCODE_BINARY, message_size)
+            self.payload = b"x" * (message_size - HEADER_SIZE)
+            self.text_prefix = b""
+        else:
+            # "__BENCHMARK_DATA__:<номер>" и общее заполнение ":xxx..." до нужной длины
+            self.text_prefix = (BENCHMARK_DATA_PREFIX + ":").encode('ascii')
+            message_size = max(message_size, len(self.text_prefix) + 1)
+            self.frame_header = b""
+            self.payload = memoryview(b":" + b"x" * message_size)
+        self.message_size = message_size
+
+    def data_chunks(self, stream_id: int, sequence: int):
+        """Части кадра сообщения с номером sequence (без копирования нагрузки)"""
+        if not self.binary:
+            text = b"%s%d" % (self.text_prefix, sequence)
+            padding = self.message_size - len(text)
+            if padding <= 0:
+                return (build_frame_header(OPCODE_TEXT, len(text)) + text,)
+            return (build_frame_header(OPCODE_TEXT, self.message_size) + text, self.payload[:padding])
+        header = HEADER.pack(FRAME_MAGIC, MSG_DATA, stream_id, sequence, time.monotonic_ns(), len(self.payload))
+        return (self.frame_header + header, self.payload)
+
+
+class SendFlow:
+    """
+    Учет отправленных и подтвержденных получателем сообщений одного замера
+    и окно неподтвержденных сообщений
+    """
+
+    __slots__ = ("window", "target", "sent", "acked", "max_in_flight", "max_buffer",
+                 "delivered_time", "closed", "event")
+
+    def __init__(self, target: int, window: int = 0):
+        """
+        Args:
+            target: Количество сообщений замера
+            window: Максимум неподтвержденных сообщений (0 - без ограничения)
+        """
+        self.target = target
+        self.window = window
+        self.sent = 0
+        self.acked = 0
+        self.max_in_flight = 0
+        self.max_buffer = 0
+        # Монотонное время подтверждения последнего сообщения
+        self.delivered_time = None
+        self.closed = False
+        self.event = asyncio.Event()
+
+    def on_ack(self, count: int):
+        """Учитывает накопительное подтверждение получателя"""
+        if count <= self.acked:
+            return
+        self.acked = count
+        if self.acked >= self.target and self.delivered_time is None:
+            self.delivered_time = time.monotonic()
+        self.event.set()
+
+    def on_sent(self, sent: int):
+        """Учитывает сообщения, записанные в транспорт"""
+        self.sent = sent
+        in_flight = sent - self.acked
+        if in_flight > self.max_in_flight:
+            self.max_in_flight = in_flight
+
+    def close(self):
+        """Соединение закрыто: будит ожидающих"""
+        self.closed = True
+        self.event.set()
+
+    async def wait_credit(self) -> int:
+        """
+        Ждет свободного места в окне
+
+        Returns:
+            Номер сообщения, до которого (не включая) можно отправлять
+        """
+        if self.window <= 0:
+            return self.target
+        while not self.closed and self.sent - self.acked >= self.window:
+            self.event.clear()
+            await self.event.wait()
+        return self.acked + self.window
+
+    async def wait_delivered(self, timeout: float) -> bool:
+        """Ждет подтверждения всех отправленных сообщений не дольше timeout секунд"""
+        deadline = time.monotonic() + timeout
+        while not self.closed and self.acked < self.sent:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            self.event.clear()
+            try:
+                await asyncio.wait_for(self.event.wait(), remaining)
+            except asyncio.TimeoutError:
+                return False
+        return self.acked >= self.sent
+
+    def sample(self, write_buffer: int):
+        """Запоминает наибольший размер буфера записи (снимается периодически)"""
+        if write_buffer > self.max_buffer:
+            self.max_buffer = write_buffer
+
+
+async def pipelined_send(websocket, num_messages: int, buffers: PayloadBuffers, stream_id: int = 0,
+                         flow: SendFlow = None) -> int:
+    """
+    Отправляет num_messages сообщений пачками напрямую в транспорт соединения
+
+    Args:
+        websocket: Соединение websockets (asyncio)
+        num_messages: Количество сообщений
+        buffers: Заранее собранные буферы сообщений
+        stream_id: Идентификатор потока для двоичных кадров
+        flow: Учет подтверждений и окно неподтвержденных сообщений
+
+    Returns:
+        Количество отправленных сообщений (меньше num_messages, если соединение закрылось)
+    """
+    batch_limit = max(1, min(BATCH_MESSAGES, BATCH_BYTES // (buffers.message_size + 16)))
+    sent = 0
+    while sent < num_messages:
+        if not is_writable(websocket):
+            break
+        batch_end = min(num_messages, sent + batch_limit)
+        if flow is not None:
+            batch_end = min(batch_end, await flow.wait_credit())
+            if flow.closed:
+                break
+        chunks = []
+        for sequence in range(sent, batch_end):
+            chunks.extend(buffers.data_chunks(stream_id, sequence))
+        write_frames(websocket, chunks)
+        add_messages_out(websocket, batch_end - sent)
+        sent = batch_end
+        if flow is not None:
+            flow.on_sent(sent)
+        # Ждем только если буфер записи превысил верхнюю границу,
+        # иначе просто отдаем управление другим задачам
+        if write_paused(websocket):
+            await wait_writable(websocket)
+        else:
+            await asyncio.sleep(0)
+    return sent
@@ -0,0 +1,360 @@
+"""
+Сессии клиентов: кольцо последних исходящих кадров и продолжение с номера
+после переподключения
+
+Клиент открывает сессию командой, а после обрыва продолжает ее с номера
+последнего принятого сообщения:
+
+    __SESSION__               новая сессия, ответ __SESSION__:<id>
+    __RESUME__:<id>:<N>       продолжить после сообщения N; ответ
+                              __RESUME__:ok:<K> и следом K пропущенных
+                              сообщений или __RESUME__:miss:<последний номер>
+
+Сообщения рассылки и тем (ClientManager.broadcast/publish) клиент сессии
+получает с номером: "__SEQ__:<номер>:<сообщение>" (у двоичного кадра те же
+байты перед данными). Каждое такое сообщение сохраняется в кольце сессии
+из --session-buffer последних кадров, в том числе пока клиент отключен:
+подписки на темы принадлежат сессии, а не подключению. Отключенная сессия
+живет --session-ttl секунд.
+
+Кольцо хранит исходный кадр рассылки - один объект на все сессии, номер
+добавляется только при отправке (заголовок с "__SEQ__:<номер>:" пишется
+отдельной частью перед данными исходного кадра) и при повторе из кольца.
+Рассылка перебирает только подключенные сессии: кадры рассылки сохраняются
+и в общем журнале SessionStore, а отключенная сессия дописывает из него
+пропущенное при переподключении или при следующем кадре темы.
+
+Продолжение - попадание (hit), если все сообщения после N еще в кольце:
+сервер дописывает их в новое подключение из кольца. Иначе - промах (miss):
+сессии нет (истекла, или подключение попало в другой воркер) или кольцо
+уже перезаписано; клиент должен заново получить состояние целиком, а
+нумерация продолжается с номера из ответа.
+
+Замер исходящих сообщений (__BENCHMARK_START__) в сессию не входит.
+"""
+import asyncio
+import random
+import secrets
+from typing import Dict, Optional, Tuple, Union
+
+from ws_sender import build_frame_header
+
+SESSION_COMMAND = "__SESSION__"
+RESUME_COMMAND = "__RESUME__"
+SEQUENCE_PREFIX = "__SEQ__:"
+RESUME_HIT = "ok"
+RESUME_MISS = "miss"
+
+DEFAULT_SESSION_BUFFER = 1024
+DEFAULT_SESSION_TTL = 60.0
+
+_SEQUENCE_PREFIX_BYTES = SEQUENCE_PREFIX.encode()
+
+
+def add_session_arguments(parser):
+    """Добавляет в argparse параметры сессий сервера"""
+    parser.add_argument("--session-buffer", type=int, default=DEFAULT_SESSION_BUFFER,
+                       help="Сколько последних сообщений рассылки хранить на сессию для продолжения после "
+                            f"переподключения, 0 - без сессий (по умолчанию: {DEFAULT_SESSION_BUFFER})")
+    parser.add_argument("--session-ttl", type=float, default=DEFAULT_SESSION_TTL,
+                       help="Сколько секунд хранить сессию отключенного клиента "
+                            f"(по умолчанию: {DEFAULT_SESSION_TTL:g})")
+
+
+def session_options_from_args(args) -> Optional[dict]:
+    """Параметры SessionStore из аргументов add_session_arguments; None - сессии выключены"""
+    if args.session_buffer <= 0:
+        return None
+    return {'capacity': args.session_buffer, 'ttl': args.session_ttl}
+
+
+def sequenced_chunks(sequence: int, frame: bytes) -> Tuple[bytes, memoryview]:
+    """
+    Кадр сессии частями, без копирования данных: заголовок нового кадра
+    вместе с "__SEQ__:<номер>:" и данные исходного кадра
+
+    Args:
+        sequence: Номер сообщения в сессии
+        frame: Кадр сервера без маски и расширений (encode_broadcast_frame)
+    """
+    length = frame[1] & 0x7F
+    offset = 2 if length <= 125 else 4 if length == 126 else 10
+    prefix = b"%s%d:" % (_SEQUENCE_PREFIX_BYTES, sequence)
+    payload = memoryview(frame)[offset:]
+    return build_frame_header(frame[0] & 0x0F, len(prefix) + len(payload)) + prefix, payload
+
+
+def sequenced_frame(sequence: int, frame: bytes) -> bytes:
+    """Кадр сессии одним bytes: тот же тип кадра, перед данными \"__SEQ__:<номер>:\" (повтор из кольца)"""
+    return b"".join(sequenced_chunks(sequence, frame))
+
+
+def parse_sequenced(message: Union[str, bytes]) -> Optional[Tuple[int, Union[str, bytes]]]:
+    """Номер и сообщение из "__SEQ__:<номер>:<сообщение>" или None"""
+    prefix = SEQUENCE_PREFIX if isinstance(message, str) else _SEQUENCE_PREFIX_BYTES
+    if not message.startswith(prefix):
+        return None
+    end = message.find(prefix[-1:], len(prefix))
+    number = message[len(prefix):end]
+    if end < 0 or not number.isdigit():
+        return None
+    return int(number), message[end + 1:]
+
+
+class Session:
+    """Сессия клиента: номер последнего сообщения и кольцо последних кадров"""
+
+    __slots__ = ("id", "ring", "last", "connection", "expire_handle", "synced")
+
+    def __init__(self, session_id: str, capacity: int, synced: int = 0):
+        self.id = session_id
+        # Исходный кадр с номером N лежит в ring[N % capacity]
+        self.ring = [None] * capacity
+        self.last = 0
+        self.connection = None
+        self.expire_handle: Optional[asyncio.TimerHandle] = None
+        # Сколько кадров общего журнала рассылки уже в кольце (для отключенной сессии)
+        self.synced = synced
+
+    def append(self, frame: bytes) -> int:
+        """Сохраняет исходный кадр в кольце; возвращает его номер в сессии"""
+        self.last += 1
+        self.ring[self.last % len(self.ring)] = frame
+        return self.last
+
+    def frames_after(self, sequence: int) -> Optional[list]:
+        """Кадры после sequence или None, если часть из них уже перезаписана"""
+        if sequence < 0 or sequence > self.last or self.last - sequence > len(self.ring):
+            return None
+        ring = self.ring
+        capacity = len(ring)
+        return [sequenced_frame(number, ring[number % capacity]) for number in range(sequence + 1, self.last + 1)]
+
+
+class SessionStore:
+    """Сессии сервера по id и по подключению, счетчики продолжений"""
+
+    def __init__(self, capacity: int = DEFAULT_SESSION_BUFFER, ttl: float = DEFAULT_SESSION_TTL, on_expire=None):
+        """
+        Args:
+            capacity: Кадров в кольце сессии
+            ttl: Сколько секунд хранить сессию после отключения клиента
+            on_expire: Вызывается с сессией, удаленной по истечении ttl
+        """
+        self.capacity = capacity
+        self.ttl = ttl
+        self.on_expire = on_expire
+        self.sessions: Dict[str, Session] = {}
+        self.by_connection: Dict[object, Session] = {}
+        # Общий журнал последних кадров рассылки: кадр N лежит в log[N % capacity]
+        self.log = [None] * capacity
+        self.logged = 0
+        self.created = 0
+        self.hits = 0
+        self.misses = 0
+        self.replayed = 0
+        self.expired = 0
+
+    def _add(self, session_id: str) -> Session:
+        session = self.sessions[session_id] = Session(session_id, self.capacity, self.logged)
+        return session
+
+    def record(self, frame: bytes):
+        """Сохраняет кадр рассылки в общем журнале (подключенные сессии получают его сразу)"""
+        self.logged += 1
+        self.log[self.logged % self.capacity] = frame
+
+    def catch_up(self, session: Session):
+        """Дописывает в кольцо отключенной сессии рассылку из журнала, пропущенную после отключения"""
+        if session.connection is not None:
+            return
+        missed = self.logged - session.synced
+        if missed:
+            # Больше capacity кадров не поместится в кольцо: старшие только занимают номера
+            kept = min(missed, self.capacity)
+            session.last += missed - kept
+            log = self.log
+            for number in range(self.logged - kept + 1, self.logged + 1):
+                session.append(log[number % self.capacity])
+        session.synced = self.logged
+
+    def create(self, connection) -> Session:
+        """Новая сессия подключения"""
+        session = self._add(secrets.token_hex(8))
+        self.created += 1
+        self.attach(session, connection)
+        return session
+
+    def attach(self, session: Session, connection):
+        """
+        Привязывает сессию к подключению
+
+        Returns:
+            Прежнее подключение сессии, если клиент переподключился раньше,
+            чем сервер заметил обрыв (закрыть его - дело вызывающего), или None
+        """
+        if session.expire_handle is not None:
+            session.expire_handle.cancel()
+            session.expire_handle = None
+        self.catch_up(session)
+        previous = session.connection
+        if previous is not None:
+            self.by_connection.pop(previous, None)
+        current = self.by_connection.get(connection)
+        if current is not None and current is not session:
+            # Подключение вело другую сессию: та копит кадры, как после отключения
+            self.detach(connection)
+        session.connection = connection
+        self.by_connection[connection] = session
+        return previous if previous is not connection else None
+
+    def resume(self, connection, session_id: str, sequence: int) -> Tuple[Session, Optional[list], object]:
+        """
+        Продолжает сессию после сообщения sequence
+
+        Returns:
+            Tuple (сессия, кадры для повторной отправки, прежнее подключение
+            сессии или None) - кадры None при промахе; неизвестная сессия
+            создается заново с тем же id
+        """
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = self._add(session_id)
+            self.misses += 1
+            return session, None, self.attach(session, connection)
+        self.catch_up(session)
+        frames = session.frames_after(sequence)
+        previous = self.attach(session, connection)
+        if frames is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.replayed += len(frames)
+        return session, frames, previous
+
+    def detach(self, connection) -> Optional[Session]:
+        """Подключение закрыто: сессия копит кадры до переподключения или ttl"""
+        session = self.by_connection.pop(connection, None)
+        if session is None:
+            return None
+        session.connection = None
+        session.synced = self.logged
+        session.expire_handle = asyncio.get_running_loop().call_later(self.ttl, self._expire, session)
+        return session
+
+    def _expire(self, session: Session):
+        session.expire_handle = None
+        if self.sessions.get(session.id) is session and session.connection is None:
+            del self.sessions[session.id]
+            self.expired += 1
+            if self.on_expire is not None:
+                self.on_expire(session)
+
+    def summary(self) -> str:
+        """Сессии и продолжения одной строкой"""
+        resumes = self.hits + self.misses
+        return (f"сессий: {len(self.sessions)} (подключено {len(self.by_connection)}), создано: {self.created}, "
+                f"истекло: {self.expired}, продолжений: {resumes} (попаданий {self.hits}, промахов "
+                f"{self.misses}), повторено сообщений: {self.replayed}")
+
+
+class Backoff:
+    """Задержка переподключения: экспоненциальный рост со случайной составляющей"""
+
+    __slots__ = ("initial", "maximum", "factor", "attempt")
+
+    def __init__(self, initial: float = 0.5, maximum: float = 30.0, factor: float = 2.0):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.attempt = 0
+
+    def next_delay(self) -> float:
+        """
+        Задержка перед следующей попыткой
+
+        Половина задержки фиксирована, половина случайна: клиенты, оборванные
+        одновременно, не переподключаются одной волной.
+        """
+        delay = min(self.maximum, self.initial * self.factor ** self.attempt)
+        self.attempt += 1
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def reset(self):
+        """Подключение удалось: следующий обрыв - снова с начальной задержки"""
+        self.attempt = 0
+
+
+class SessionTracker:
+    """Сторона клиента: id сессии, номер последнего сообщения, пропуски и повторы"""
+
+    __slots__ = ("session_id", "last", "received", "duplicates", "gaps", "hits", "misses", "replayed")
+
+    def __init__(self):
+        self.session_id: Optional[str] = None
+        self.last = 0
+        self.received = 0
+        self.duplicates = 0
+        self.gaps = 0
+        self.hits = 0
+        self.misses = 0
+        self.replayed = 0
+
+    def open_command(self) -> str:
+        """Команда после подключения: новая сессия или продолжение текущей"""
+        if self.session_id is None:
+            return SESSION_COMMAND
+        return f"{RESUME_COMMAND}:{self.session_id}:{self.last}"
+
+    def on_reply(self, message: str) -> Optional[str]:
+        """
+        Учитывает ответ сервера на команду сессии
+
+        Returns:
+            Описание ответа для вывода; None - это не ответ сессии
+        """
+        if not message.startswith((SESSION_COMMAND + ":", RESUME_COMMAND + ":")):
+            return None
+        command, _, rest = message.partition(":")
+        if command == SESSION_COMMAND:
+            self.session_id = rest
+            self.last = 0
+            return f"Сессия {rest} открыта"
+        status, _, value = rest.partition(":")
+        count = int(value) if value.isdigit() else 0
+        if status == RESUME_HIT:
+            self.hits += 1
+            self.replayed += count
+            return f"Сессия {self.session_id} продолжена после №{self.last}: повторено {count} сообщений"
+        # Пропущенное потеряно: нумерация продолжается с номера сервера
+        self.misses += 1
+        lost_after = self.last
+        self.last = count
+        return (f"Сессия {self.session_id}: сообщения после №{lost_after} не сохранились (промах), "
+                f"нужна полная синхронизация; продолжение с №{count + 1}")
+
+    def on_message(self, message: Union[str, bytes]):
+        """
+        Снимает номер сессии с сообщения сервера
+
+        Returns:
+            Сообщение без номера (сообщения без номера - как есть); None - повтор
+        """
+        parsed = parse_sequenced(message)
+        if parsed is None:
+            return message
+        sequence, message = parsed
+        if sequence <= self.last:
+            self.duplicates += 1
+            return None
+        if sequence > self.last + 1:
+            self.gaps += 1
+        self.last = sequence
+        self.received += 1
+        return message
+
+    def summary(self) -> str:
+        """Итоги сессии одной строкой"""
+        return (f"сессия {self.session_id}: принято {self.received} сообщений (последнее №{self.last}), "
+                f"продолжений: попаданий {self.hits}, промахов {self.misses}, повторено {self.replayed}, "
+                f"пропусков: {self.gaps}, повторов: {self.duplicates}")
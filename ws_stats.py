@@ -0,0 +1,165 @@
+"""
+Статистика замера на стороне сервера с минимальной работой на пути приема
+
+На каждое сообщение обработчик только увеличивает целочисленный счетчик
+объекта ConnectionStats (без поиска в словарях, вызова часов и вывода).
+Интервальную статистику по клиентам и общие итоги по серверу выводит один
+фоновый репортер (задача asyncio или поток), который раз в интервал снимает
+значения всех счетчиков. Время берется из монотонных часов. Вывод идет
+через журнал ws_log.py (компоненты stats и bench).
+"""
+import asyncio
+import threading
+import time
+from typing import Dict, Hashable, List, Optional
+
+from ws_protocol import SequenceTracker
+from ws_log import get_logger, INFO
+
+stats_log = get_logger("stats")
+bench_log = get_logger("bench")
+
+
+class ConnectionStats:
+    """Счетчики замера одного подключения"""
+
+    __slots__ = ("client_id", "message_count", "start_time", "sequence",
+                 "reported_count", "reported_time")
+
+    def __init__(self, client_id, now: float):
+        self.client_id = client_id
+        self.message_count = 0
+        self.start_time = now
+        self.sequence = SequenceTracker()
+        # Значения на момент последнего снимка репортера
+        self.reported_count = 0
+        self.reported_time = now
+
+
+class StatsRegistry:
+    """Счетчики активных замеров и общие итоги сервера"""
+
+    def __init__(self):
+        self.active: Dict[Hashable, ConnectionStats] = {}
+        # Сообщения завершенных замеров
+        self.completed_messages = 0
+        # websocket_server начинает и завершает замеры из потока каждого подключения
+        self.lock = threading.Lock()
+        self.start_time = time.monotonic()
+        self.reported_total = 0
+        self.reported_time = self.start_time
+
+    def start(self, key: Hashable, client_id) -> ConnectionStats:
+        """Начинает замер подключения и возвращает его счетчики"""
+        stats = ConnectionStats(client_id, time.monotonic())
+        with self.lock:
+            self.active[key] = stats
+        return stats
+
+    def finish(self, key: Hashable) -> Optional[ConnectionStats]:
+        """Завершает замер подключения, сохраняя его сообщения в общем счетчике"""
+        with self.lock:
+            stats = self.active.pop(key, None)
+            if stats is not None:
+                self.completed_messages += stats.message_count
+        return stats
+
+    def total_messages(self) -> int:
+        """Суммарное количество сообщений по всем клиентам"""
+        with self.lock:
+            completed = self.completed_messages
+            active = list(self.active.values())
+        return completed + sum(stats.message_count for stats in active)
+
+    def report_interval(self):
+        """Снимает значения всех счетчиков и выводит статистику за интервал"""
+        now = time.monotonic()
+        with self.lock:
+            active: List[ConnectionStats] = list(self.active.values())
+        for stats in active:
+            count = stats.message_count
+            delta = count - stats.reported_count
+            elapsed = now - stats.reported_time
+            if delta > 0:
+                rate = delta / elapsed if elapsed > 0 else 0
+                stats_log.info(f"[Сервер] Клиент {stats.client_id} [{now - stats.start_time:.1f}с] "
+                               f"Получено: {delta} сообщений за {elapsed:.1f}с "
+                               f"({rate:.2f} сообщений/сек)",
+                               client=stats.client_id, messages=delta, interval=round(elapsed, 3),
+                               rate=round(rate, 2))
+            stats.reported_count = count
+            stats.reported_time = now
+
+        total = self.total_messages()
+        delta = total - self.reported_total
+        elapsed = now - self.reported_time
+        # Без сообщений не засоряем консоль пустыми интервалами
+        if delta > 0:
+            rate = delta / elapsed if elapsed > 0 else 0
+            stats_log.info(f"[Сервер] Всего [{now - self.start_time:.1f}с] "
+                           f"Получено: {delta} сообщений за {elapsed:.1f}с "
+                           f"({rate:.2f} сообщений/сек), всего: {total}, активных замеров: {len(active)}",
+                           messages=delta, interval=round(elapsed, 3), rate=round(rate, 2), total=total,
+                           active=len(active))
+        self.reported_total = total
+        self.reported_time = now
+
+    async def run_reporter(self, interval: float):
+        """Фоновая задача asyncio: выводит статистику раз в interval секунд"""
+        while True:
+            await asyncio.sleep(interval)
+            self.report_interval()
+
+    def start_reporter_thread(self, interval: float, stop_event: Optional[threading.Event] = None) -> threading.Thread:
+        """
+        Запускает поток-репортер для серверов без asyncio
+
+        Args:
+            interval: Интервал вывода статистики в секундах
+            stop_event: Событие остановки потока (по умолчанию - работает до выхода из процесса)
+        """
+        stop_event = stop_event or threading.Event()
+
+        def run():
+            while not stop_event.wait(interval):
+                self.report_interval()
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+
+def log_benchmark_start(client_id):
+    """Выводит сообщение о начале замера клиента"""
+    bench_log.report(f"Клиент {client_id}: Выполняется замер производительности...",
+                     client=client_id, event="start")
+
+
+def log_benchmark_result(stats: ConnectionStats, sent_count: int = 0):
+    """
+    Выводит финальную статистику замера клиента
+
+    Args:
+        stats: Счетчики завершенного замера
+        sent_count: Количество отправленных клиентом сообщений из кадра END (0 - неизвестно)
+    """
+    total_time = time.monotonic() - stats.start_time
+    total_rate = stats.message_count / total_time if total_time > 0 else 0
+    sequence = stats.sequence
+    if not bench_log.enabled(INFO):
+        return
+
+    lines = [f"Клиент {stats.client_id}: Замер завершен!",
+             f"Всего получено: {stats.message_count} сообщений"]
+    fields = {"client": stats.client_id, "event": "result", "messages": stats.message_count,
+              "elapsed": round(total_time, 3), "rate": round(total_rate, 2)}
+    if sent_count:
+        lines.append(f"Отправлено клиентом: {sent_count} сообщений")
+        fields["sent"] = sent_count
+    if sequence.received:
+        lost = max(sequence.lost, sent_count - sequence.received)
+        lines.append(f"Потеряно: {lost}, нарушений порядка: {sequence.reordered}")
+        fields.update(lost=lost, reordered=sequence.reordered)
+    lines.append(f"Общее время: {total_time:.2f} секунд")
+    lines.append(f"Средняя скорость: {total_rate:.2f} сообщений/секунду")
+    bench_log.report(*lines, **fields)
@@ -0,0 +1,215 @@
+"""
+Замер установления подключений: рукопожатий в секунду и задержка подключения
+
+Имитирует шторм переподключений (например, парк клиентов 1С после
+перезапуска сервера): несколько рабочих задач открывают подключения так
+быстро, как возможно, или с заданной общей частотой, не больше
+concurrency одновременных попыток. Подключение сразу закрывается или
+остается открытым до конца замера (тогда число открытых подключений растет).
+
+Задержка подключения - время от начала попытки (TCP connect) до завершения
+WebSocket рукопожатия. При заданной частоте попытки идут по расписанию;
+если все рабочие задачи заняты, попытка опаздывает и опоздание выводится
+отдельно.
+"""
+import asyncio
+import time
+from typing import List, Optional
+
+import websockets
+
+from ws_histogram import Histogram
+
+
+class StormStats:
+    """Счетчики замера подключений"""
+
+    __slots__ = ("attempts", "established", "timeouts", "refused", "rejected", "open", "max_lag")
+
+    def __init__(self):
+        self.attempts = 0
+        self.established = 0
+        # Неудачи: таймаут, отказ TCP/ошибка сети, отказ в рукопожатии
+        self.timeouts = 0
+        self.refused = 0
+        self.rejected = 0
+        # Подключения, оставленные открытыми (keep_open)
+        self.open = 0
+        # Наибольшее опоздание попытки от расписания, сек
+        self.max_lag = 0.0
+
+    @property
+    def failed(self) -> int:
+        """Всего неудачных попыток"""
+        return self.timeouts + self.refused + self.rejected
+
+
+class ConnectionStorm:
+    """Шторм подключений с ограничением одновременных попыток"""
+
+    def __init__(self, url: str, concurrency: int = 100, rate: float = 0.0, total: int = 0,
+                 keep_open: bool = False, timeout: float = 10.0, connect_options: Optional[dict] = None):
+        """
+        Args:
+            url: URL WebSocket сервера
+            concurrency: Максимум одновременных попыток подключения
+            rate: Общая частота попыток в секунду (0 - так быстро, как возможно)
+            total: Количество попыток (0 - до конца длительности замера)
+            keep_open: Не закрывать подключения до конца замера
+            timeout: Таймаут одной попытки в секундах
+            connect_options: Дополнительные параметры websockets.connect()
+        """
+        self.url = url
+        self.concurrency = max(1, concurrency)
+        self.rate = rate
+        self.total = total
+        self.keep_open = keep_open
+        self.timeout = timeout
+        self.connect_options = connect_options or {}
+        self.stats = StormStats()
+        # Задержка подключения в мкс: за интервал вывода и за весь замер
+        self.interval_histogram = Histogram()
+        self.total_histogram = Histogram()
+        self.connections: List = []
+        self.next_attempt = 0
+        self.start_time = 0.0
+        self.end_time = 0.0
+
+    async def _attempt(self):
+        """Одна попытка подключения"""
+        stats = self.stats
+        stats.attempts += 1
+        start = time.perf_counter_ns()
+        try:
+            websocket = await asyncio.wait_for(websockets.connect(self.url, **self.connect_options), self.timeout)
+        except asyncio.TimeoutError:
+            stats.timeouts += 1
+            return
+        except websockets.exceptions.InvalidHandshake:
+            stats.rejected += 1
+            return
+        except (OSError, websockets.exceptions.WebSocketException):
+            stats.refused += 1
+            return
+        latency_us = (time.perf_counter_ns() - start) // 1000
+        self.interval_histogram.record(latency_us)
+        self.total_histogram.record(latency_us)
+        stats.established += 1
+        if self.keep_open:
+            self.connections.append(websocket)
+            stats.open += 1
+        else:
+            await websocket.close()
+
+    async def _worker(self):
+        """Рабочая задача: берет очередную попытку из общего расписания"""
+        stats = self.stats
+        while True:
+            index = self.next_attempt
+            if (self.total and index >= self.total) or time.monotonic() >= self.end_time:
+                return
+            self.next_attempt += 1
+            if self.rate > 0:
+                delay = self.start_time + index / self.rate - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    if time.monotonic() >= self.end_time:
+                        return
+                elif -delay > stats.max_lag:
+                    stats.max_lag = -delay
+            await self._attempt()
+
+    async def close_all(self):
+        """Закрывает подключения, оставленные открытыми"""
+        connections, self.connections = self.connections, []
+        await asyncio.gather(*(websocket.close() for websocket in connections), return_exceptions=True)
+        self.stats.open = 0
+
+    async def execute(self, duration: float) -> float:
+        """
+        Выполняет замер без вывода в консоль
+
+        Args:
+            duration: Длительность в секундах (при total - ограничение сверху)
+
+        Returns:
+            Время замера в секундах
+        """
+        self.start_time = time.monotonic()
+        self.end_time = self.start_time + duration
+        workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+        return time.monotonic() - self.start_time
+
+    def take_interval(self) -> Histogram:
+        """Возвращает гистограмму за прошедший интервал и начинает новую"""
+        histogram = self.interval_histogram
+        self.interval_histogram = Histogram()
+        return histogram
+
+    async def run(self, duration: float, interval: float) -> Histogram:
+        """
+        Запускает замер и выводит статистику
+
+        Args:
+            duration: Длительность в секундах
+            interval: Интервал для вывода статистики в секундах
+
+        Returns:
+            Гистограмма задержки подключения за весь замер (мкс)
+        """
+        print(f"\n{'='*60}")
+        print(f"Замер подключений к {self.url}")
+        print(f"Одновременных попыток: {self.concurrency}")
+        print(f"Частота: {f'{self.rate:g} подключений/сек' if self.rate > 0 else 'как можно быстрее'}")
+        print(f"Попыток: {self.total or 'до конца замера'}, длительность: {duration} секунд")
+        print(f"Подключения: {'остаются открытыми' if self.keep_open else 'закрываются сразу'}")
+        print(f"{'='*60}\n")
+
+        stats = self.stats
+        measure = asyncio.create_task(self.execute(duration))
+        start_time = time.monotonic()
+        interval_start = start_time
+        last_established = 0
+        last_failed = 0
+        while not measure.done():
+            await asyncio.wait([measure], timeout=interval)
+            now = time.monotonic()
+            elapsed = now - interval_start
+            if elapsed <= 0:
+                continue
+            established = stats.established - last_established
+            print(f"[{now - start_time:.1f}с] Подключено: {established} за {elapsed:.1f}с "
+                  f"({established / elapsed:.2f} рукопожатий/сек), ошибок: {stats.failed - last_failed}, "
+                  f"открыто: {stats.open}")
+            interval_histogram = self.take_interval()
+            if interval_histogram.total_count:
+                print(f"         Подключение: {interval_histogram.format_summary()}")
+            last_established = stats.established
+            last_failed = stats.failed
+            interval_start = now
+        elapsed = measure.result()
+        open_connections = stats.open
+        await self.close_all()
+
+        rate = stats.established / elapsed if elapsed > 0 else 0
+        print(f"\n{'='*60}")
+        print("Замер подключений завершен!")
+        print(f"Попыток: {stats.attempts}, подключено: {stats.established}")
+        print(f"Ошибок: {stats.failed} (таймаут: {stats.timeouts}, отказ подключения: {stats.refused}, "
+              f"отказ в рукопожатии: {stats.rejected})")
+        if self.keep_open:
+            print(f"Открыто одновременно к концу замера: {open_connections}")
+        print(f"Общее время: {elapsed:.2f} секунд")
+        print(f"Скорость: {rate:.2f} рукопожатий/секунду")
+        if self.rate > 0:
+            print(f"Наибольшее опоздание от расписания: {stats.max_lag * 1000:.1f} мс")
+        if self.total_histogram.total_count:
+            print(f"Задержка подключения: {self.total_histogram.format_summary()}")
+            print(f"Задержка подключения, среднее: {self.total_histogram.mean() / 1000:.3f} мс")
+        print(f"{'='*60}\n")
+        return self.total_histogram
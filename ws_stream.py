@@ -0,0 +1,315 @@
+"""
+Потоковая передача больших сообщений фрагментами
+
+Файл отображается в память (mmap) и отправляется одним фрагментированным
+WebSocket сообщением: каждый фрагмент - срез memoryview отображения, в
+строки и bytes Python ничего не копируется. Сервер пишет кадры прямо в
+транспорт (как ws_sender.py), клиент websockets получает итератор
+фрагментов (маскирование - внутри библиотеки, по фрагменту), клиент
+websocket-client - кадры encode_client_frame (маскирование целыми числами
+Python: побайтовое маскирование библиотеки в десятки раз медленнее). Отправленные
+страницы отображения освобождаются (madvise), поэтому RSS не растет с
+размером файла.
+
+Прием пишет фрагменты в файл по мере прихода (recv_streaming): сообщение
+целиком в памяти не собирается.
+
+Команды (текстовые сообщения):
+
+    __BENCHMARK_STREAM__:<байт>:<фрагмент>  клиент просит server-sender.py прислать
+        файл --stream-file (или <байт> нулевых данных) фрагментами; сервер
+        отвечает той же командой с фактическим размером и затем присылает сообщение
+    __BENCHMARK_UPLOAD__:<байт>  клиент предупреждает server-bench.py
+        (--accept-uploads), что следующее сообщение - файл; после приема сервер
+        отвечает __BENCHMARK_UPLOAD__:<принято байт>:<время приема, мкс>
+
+Пока идет поток, другие сообщения в это подключение отправлять нельзя:
+кадры потока пишутся в обход очереди отправки websockets.
+"""
+import asyncio
+import mmap
+import os
+import resource
+import tempfile
+from typing import Iterator, Optional, Tuple
+
+from websockets.asyncio.server import ServerConnection
+
+from ws_sender import build_frame_header, OPCODE_BINARY, OPCODE_TEXT, OPCODE_CONTINUATION
+from ws_metrics import add_messages_out
+from ws_compat import is_writable, write_frame, write_frames, write_paused, wait_writable
+
+STREAM_COMMAND = "__BENCHMARK_STREAM__"
+UPLOAD_COMMAND = "__BENCHMARK_UPLOAD__"
+
+DEFAULT_FRAGMENT_SIZE = 1024 * 1024
+# Отправленные страницы отображения освобождаются порциями такого размера
+RELEASE_BYTES = 16 * 1024 * 1024
+
+
+class MappedSource:
+    """Источник потоковой отправки: файл, отображенный в память, или готовый буфер"""
+
+    __slots__ = ("file", "mmap", "view", "released")
+
+    def __init__(self, source=None, file=None):
+        """
+        Args:
+            source: Путь к файлу или bytes-like буфер
+            file: Уже открытый файл (вместо source), например временный
+        """
+        self.mmap = None
+        self.file = None
+        self.released = 0
+        if source is not None and not isinstance(source, str):
+            self.view = memoryview(source).cast("B")
+            return
+        self.file = file if file is not None else open(source, "rb")
+        try:
+            self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Пустой файл нельзя отобразить в память
+            self.view = memoryview(b"")
+            return
+        self.view = memoryview(self.mmap)
+
+    @classmethod
+    def zeros(cls, size: int) -> "MappedSource":
+        """Источник из size нулевых байтов: разреженный временный файл без записи на диск"""
+        file = tempfile.TemporaryFile()
+        file.truncate(size)
+        return cls(file=file)
+
+    def __len__(self) -> int:
+        return len(self.view)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def release(self, end: int):
+        """Возвращает системе страницы отображения до смещения end (уже отправленные)"""
+        if self.mmap is None or not hasattr(mmap, "MADV_DONTNEED"):
+            return
+        end -= end % mmap.PAGESIZE
+        if end > self.released:
+            self.mmap.madvise(mmap.MADV_DONTNEED, self.released, end - self.released)
+            self.released = end
+
+    def fragments(self, fragment_size: int) -> Iterator[memoryview]:
+        """Срезы memoryview по fragment_size байт (последний - короче)"""
+        view = self.view
+        total = len(view)
+        fragment_size = max(1, fragment_size)
+        # Повторная отправка снова читает страницы с начала
+        self.released = 0
+        for offset in range(0, total, fragment_size):
+            # Срезы до offset уже отправлены (итератор ленивый)
+            if offset - self.released >= RELEASE_BYTES:
+                self.release(offset)
+            yield view[offset:offset + fragment_size]
+        self.release(total)
+
+    def close(self):
+        """Освобождает отображение и закрывает файл"""
+        self.view.release()
+        if self.mmap is not None:
+            try:
+                self.mmap.close()
+            except BufferError:
+                # Срезы еще в буфере транспорта: отображение закроется сборщиком мусора
+                pass
+        if self.file is not None:
+            self.file.close()
+
+
+async def write_server_frames(websocket, source: MappedSource, fragment_size: int, binary: bool = True) -> int:
+    """
+    Пишет сообщение фрагментами прямо в транспорт серверного подключения
+
+    Returns:
+        Количество записанных байтов данных (меньше размера, если соединение закрылось)
+    """
+    total = len(source)
+    if total == 0:
+        write_frame(websocket, build_frame_header(OPCODE_BINARY if binary else OPCODE_TEXT, 0))
+        add_messages_out(websocket, 1)
+        return 0
+    opcode = OPCODE_BINARY if binary else OPCODE_TEXT
+    written = 0
+    for fragment in source.fragments(fragment_size):
+        if not is_writable(websocket):
+            break
+        written += len(fragment)
+        write_frames(websocket, (build_frame_header(opcode, len(fragment), written >= total), fragment))
+        opcode = OPCODE_CONTINUATION
+        # Ждем, только если буфер записи превысил верхнюю границу
+        if write_paused(websocket):
+            await wait_writable(websocket)
+        else:
+            await asyncio.sleep(0)
+    add_messages_out(websocket, 1)
+    return written
+
+
+async def stream_send(websocket, source: MappedSource, fragment_size: int = DEFAULT_FRAGMENT_SIZE,
+                      binary: bool = True) -> int:
+    """
+    Отправляет источник одним фрагментированным сообщением
+
+    Args:
+        websocket: Подключение websockets (серверное или клиентское)
+        source: Источник данных
+        fragment_size: Размер фрагмента в байтах
+        binary: Двоичное сообщение (текстовое - данные должны быть UTF-8)
+
+    Returns:
+        Количество отправленных байтов данных
+    """
+    if isinstance(websocket, ServerConnection):
+        return await write_server_frames(websocket, source, fragment_size, binary)
+    # Клиент обязан маскировать кадры: маскирует websockets, копируя по одному фрагменту
+    await websocket.send(source.fragments(fragment_size), text=not binary)
+    return len(source)
+
+
+def mask_payload(data, mask_key: bytes) -> bytes:
+    """Маскирует нагрузку кадра клиента (XOR с ключом, RFC 6455) одним действием над целыми числами"""
+    length = len(data)
+    if length == 0:
+        return b""
+    mask = int.from_bytes((mask_key * (length // 4 + 1))[:length], "little")
+    return (int.from_bytes(data, "little") ^ mask).to_bytes(length, "little")
+
+
+def encode_client_frame(opcode: int, data, fin: bool) -> Tuple[bytes, bytes]:
+    """
+    Кадр клиента со случайной маской для записи в сокет (websocket-client)
+
+    Returns:
+        Tuple (заголовок с ключом маски, маскированная нагрузка)
+    """
+    mask_key = os.urandom(4)
+    return build_frame_header(opcode, len(data), fin, mask_key), mask_payload(data, mask_key)
+
+
+class FragmentSink:
+    """Прием фрагментированного сообщения: запись в файл по мере прихода фрагментов"""
+
+    __slots__ = ("file", "received", "fragments")
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        Args:
+            path: Файл для записи; None - только считать байты
+        """
+        self.file = open(path, "wb") if path else None
+        self.received = 0
+        self.fragments = 0
+
+    def write(self, data):
+        """Записывает очередной фрагмент"""
+        if self.file is not None:
+            self.file.write(data)
+        self.received += len(data)
+        self.fragments += 1
+
+    def close(self):
+        """Закрывает файл"""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+async def receive_stream(websocket, sink: FragmentSink) -> int:
+    """
+    Принимает следующее сообщение фрагментами в sink
+
+    Returns:
+        Количество принятых байтов
+    """
+    async for fragment in websocket.recv_streaming(decode=False):
+        sink.write(fragment)
+    return sink.received
+
+
+def parse_stream_command(message: str, command: str) -> Optional[Tuple[int, ...]]:
+    """Числа из команды "<command>:<a>[:<b>...]" или None"""
+    if not message.startswith(command + ":"):
+        return None
+    parts = message[len(command) + 1:].split(":")
+    if not all(part.isdigit() for part in parts):
+        return None
+    return tuple(int(part) for part in parts)
+
+
+def memory_usage(pid: Optional[int] = None) -> Tuple[int, int]:
+    """
+    Текущая память процесса в байтах: (RSS, анонимная часть RSS)
+
+    Анонимная часть - это память Python (копии данных); страницы отображенного
+    файла в нее не входят. Без /proc возвращается пиковый RSS и 0 (для
+    другого процесса - нули).
+
+    Args:
+        pid: Процесс (None - текущий)
+    """
+    rss = anon = 0
+    try:
+        with open(f"/proc/{pid or 'self'}/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    rss = int(line.split()[1]) * 1024
+                elif line.startswith("RssAnon:"):
+                    anon = int(line.split()[1]) * 1024
+    except OSError:
+        if pid is None:
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return rss, anon
+
+
+class RssSampler:
+    """Фоновая задача: пиковая память процесса за время замера"""
+
+    __slots__ = ("interval", "peak_rss", "peak_anon", "task")
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_anon = 0
+        self.task: Optional[asyncio.Task] = None
+
+    def _sample(self):
+        rss, anon = memory_usage()
+        self.peak_rss = max(self.peak_rss, rss)
+        self.peak_anon = max(self.peak_anon, anon)
+
+    async def _run(self):
+        while True:
+            self._sample()
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """Начинает замер с текущего значения"""
+        self.peak_rss, self.peak_anon = memory_usage()
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Останавливает замер (с последним замером)"""
+        self._sample()
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+
+def format_mb(size: int) -> str:
+    """Размер в МБ для вывода"""
+    return f"{size / (1024 * 1024):.1f} МБ"
+
+
+def stream_rate(size: int, elapsed: float) -> float:
+    """Скорость в МБ/сек"""
+    return size / (1024 * 1024) / elapsed if elapsed > 0 else 0.0
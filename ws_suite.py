@@ -0,0 +1,429 @@
+"""
+Набор сценариев замера: запуск сервера в отдельном процессе, перебор
+параметров, сохранение результатов и сравнение с базовым прогоном
+
+Сценарии:
+
+    inbound           - клиенты отправляют серверу (server-bench.py), скорость приема
+    outbound          - сервер отправляет клиентам (server-sender.py), скорость доставки
+    echo-rtt          - эхо (server-bench.py --echo), скорость подтверждений и RTT
+    broadcast         - рассылка на много клиентов (server-sender.py --broadcast-bench)
+    connection-storm  - подключения с закрытием (ws_storm.py), рукопожатий/сек и время подключения
+
+Для каждого сценария перебираются количество подключений, размер сообщения
+и длительность (там, где параметр имеет смысл). Сервер запускается заново
+на свободном локальном порту для каждой точки перебора.
+"""
+import asyncio
+import csv
+import itertools
+import json
+import os
+import platform
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+import websockets
+
+from ws_protocol import decode_header, encode_frame, MSG_START, MSG_DATA
+from ws_histogram import Histogram
+from ws_loadgen import LoadGenerator
+from ws_storm import ConnectionStorm
+
+SCENARIO_INBOUND = "inbound"
+SCENARIO_OUTBOUND = "outbound"
+SCENARIO_ECHO = "echo-rtt"
+SCENARIO_BROADCAST = "broadcast"
+SCENARIO_STORM = "connection-storm"
+SCENARIOS = (SCENARIO_INBOUND, SCENARIO_OUTBOUND, SCENARIO_ECHO, SCENARIO_BROADCAST, SCENARIO_STORM)
+
+# Сценарии на server-bench.py (перебираются по бэкендам); остальные - на server-sender.py
+BACKEND_SCENARIOS = (SCENARIO_INBOUND, SCENARIO_ECHO, SCENARIO_STORM)
+SENDER_BACKEND = "websockets"
+
+# Количество сообщений, запрашиваемое у server-sender.py: отправка идет до закрытия подключения
+OUTBOUND_REQUEST = 10 ** 12
+
+SERVER_START_TIMEOUT = 10.0
+SERVER_STOP_TIMEOUT = 5.0
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Поля результата (порядок столбцов CSV)
+RESULT_FIELDS = ("scenario", "backend", "connections", "payload_size", "duration",
+                 "messages", "elapsed", "rate", "mb_per_sec", "p50_ms", "p99_ms", "errors")
+MACHINE_FIELDS = ("hostname", "cpu_count", "python")
+
+
+class SuitePoint:
+    """Точка перебора параметров"""
+
+    __slots__ = ("scenario", "backend", "connections", "payload_size", "duration")
+
+    def __init__(self, scenario: str, backend: str, connections: int, payload_size: int, duration: float):
+        self.scenario = scenario
+        self.backend = backend
+        self.connections = connections
+        self.payload_size = payload_size
+        self.duration = duration
+
+
+class SuiteResult:
+    """Результат одной точки перебора"""
+
+    __slots__ = RESULT_FIELDS
+
+    def __init__(self, point: SuitePoint, messages: int = 0, elapsed: float = 0.0, message_size: int = 0,
+                 histogram: Optional[Histogram] = None, errors: int = 0):
+        """
+        Args:
+            point: Параметры точки
+            messages: Количество сообщений (или подключений для connection-storm)
+            elapsed: Время замера в секундах
+            message_size: Размер сообщения на проводе для расчета МБ/сек
+            histogram: Задержки в мкс (RTT, доставка или рукопожатие)
+            errors: Количество ошибок (подключения, недоставленные сообщения)
+        """
+        self.scenario = point.scenario
+        self.backend = point.backend
+        self.connections = point.connections
+        self.payload_size = point.payload_size
+        self.duration = point.duration
+        self.messages = messages
+        self.elapsed = elapsed
+        self.rate = messages / elapsed if elapsed > 0 else 0.0
+        self.mb_per_sec = self.rate * message_size / (1024 * 1024)
+        has_latency = histogram is not None and histogram.total_count
+        self.p50_ms = histogram.percentile(50.0) / 1000 if has_latency else 0.0
+        self.p99_ms = histogram.percentile(99.0) / 1000 if has_latency else 0.0
+        self.errors = errors
+
+    def as_dict(self) -> dict:
+        return {field: getattr(self, field) for field in RESULT_FIELDS}
+
+    def format_line(self) -> str:
+        """Однострочная сводка для консоли"""
+        text = f"{self.rate:>12.2f} {'подкл/сек' if self.scenario == SCENARIO_STORM else 'сообщ/сек'}"
+        if self.mb_per_sec:
+            text += f", {self.mb_per_sec:.2f} МБ/сек"
+        if self.p99_ms:
+            text += f", p50={self.p50_ms:.3f} p99={self.p99_ms:.3f} мс"
+        if self.errors:
+            text += f", ошибок: {self.errors}"
+        return text
+
+
+def result_key(result: dict) -> Tuple:
+    """Ключ сопоставления результата с базовым прогоном"""
+    return (result["scenario"], result["backend"], result["connections"],
+            result["payload_size"], result["duration"])
+
+
+def find_free_port(host: str) -> int:
+    """Свободный локальный порт (выбирает ОС)"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+def machine_info() -> dict:
+    """Сведения о машине и окружении для сопоставления прогонов"""
+    info = {
+        "hostname": platform.node(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "websockets": websockets.__version__,
+    }
+    try:
+        with open("/proc/cpuinfo", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    info["processor"] = line.split(":", 1)[1].strip()
+                    break
+        with open("/proc/meminfo", encoding="utf-8") as f:
+            info["memory_kb"] = int(f.readline().split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        info["commit"] = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SCRIPT_DIR,
+                                        capture_output=True, text=True, timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        pass
+    return info
+
+
+class ServerProcess:
+    """Сервер бенчмарка в отдельном процессе (контекстный менеджер)"""
+
+    def __init__(self, script: str, host: str, port: int, args: List[str] = ()):
+        """
+        Args:
+            script: Имя скрипта сервера (server-bench.py, server-sender.py)
+            host: Хост сервера
+            port: Порт сервера
+            args: Дополнительные аргументы командной строки
+        """
+        self.host = host
+        self.port = port
+        self.command = [sys.executable, os.path.join(SCRIPT_DIR, script), "--url", f"ws://{host}:{port}", *args]
+        self.process: Optional[subprocess.Popen] = None
+
+    def __enter__(self) -> "ServerProcess":
+        # Вывод сервера не нужен: итоги собирает клиентская сторона
+        self.process = subprocess.Popen(self.command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + SERVER_START_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Сервер завершился при запуске: {' '.join(self.command)}")
+            try:
+                socket.create_connection((self.host, self.port), timeout=0.5).close()
+                return self
+            except OSError:
+                time.sleep(0.05)
+        self.stop()
+        raise RuntimeError(f"Сервер не начал принимать подключения за {SERVER_START_TIMEOUT} секунд")
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def stop(self):
+        """Останавливает сервер как Ctrl+C (чтобы отработали finally), при зависании - убивает"""
+        if self.process is None or self.process.poll() is not None:
+            return
+        if os.name == "posix":
+            self.process.send_signal(signal.SIGINT)
+        else:
+            self.process.terminate()
+        try:
+            self.process.wait(SERVER_STOP_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+async def run_loadgen(point: SuitePoint, url: str, inflight: int) -> SuiteResult:
+    """inbound и echo-rtt: генератор нагрузки с двоичными кадрами"""
+    generator = LoadGenerator(url, point.connections, inflight, binary=True, payload_size=point.payload_size)
+    generator.start()
+    start_time = time.perf_counter()
+    await asyncio.sleep(point.duration)
+    elapsed = time.perf_counter() - start_time
+    stats = generator.stats
+    sent, acked = stats.sent, stats.acked
+    await generator.stop()
+    message_size = len(encode_frame(MSG_DATA, 0, 0, generator.payload))
+    if inflight:
+        return SuiteResult(point, acked, elapsed, message_size, generator.rtt_tracker.total_histogram, stats.failed)
+    return SuiteResult(point, sent, elapsed, message_size, errors=stats.failed)
+
+
+async def run_outbound(point: SuitePoint, url: str) -> SuiteResult:
+    """
+    outbound: каждое подключение запрашивает у server-sender.py поток двоичных
+    кадров и считает принятые за длительность замера
+
+    Задержка доставки - разница монотонных часов приема и отметки в кадре:
+    сервер работает на той же машине, поэтому часы общие.
+    """
+    histogram = Histogram()
+    received = 0
+    errors = 0
+    message_size = 0
+    stop = asyncio.Event()
+
+    async def receive(stream_id: int):
+        nonlocal received, errors, message_size
+        try:
+            async with websockets.connect(url, compression=None, max_size=None) as websocket:
+                await websocket.send(encode_frame(MSG_START, stream_id, OUTBOUND_REQUEST))
+                while not stop.is_set():
+                    message = await websocket.recv()
+                    header = decode_header(message)
+                    if header is None or header[0] != MSG_DATA:
+                        continue
+                    histogram.record((time.monotonic_ns() - header[3]) // 1000)
+                    received += 1
+                    message_size = len(message)
+        except (OSError, websockets.exceptions.WebSocketException):
+            if not stop.is_set():
+                errors += 1
+
+    tasks = [asyncio.create_task(receive(stream_id)) for stream_id in range(point.connections)]
+    start_time = time.perf_counter()
+    await asyncio.sleep(point.duration)
+    elapsed = time.perf_counter() - start_time
+    count = received
+    stop.set()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return SuiteResult(point, count, elapsed, message_size, histogram, errors)
+
+
+async def run_storm(point: SuitePoint, url: str) -> SuiteResult:
+    """connection-storm: подключения с закрытием, не больше point.connections одновременных попыток"""
+    storm = ConnectionStorm(url, point.connections, connect_options={'compression': None})
+    elapsed = await storm.execute(point.duration)
+    return SuiteResult(point, storm.stats.established, elapsed, histogram=storm.total_histogram,
+                       errors=storm.stats.failed)
+
+
+def run_broadcast(point: SuitePoint, host: str, messages: int) -> SuiteResult:
+    """broadcast: server-sender.py --broadcast-bench сам поднимает сервер и клиентов"""
+    fd, result_path = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    try:
+        command = [sys.executable, os.path.join(SCRIPT_DIR, "server-sender.py"),
+                   "--url", f"ws://{host}:{find_free_port(host)}", "--broadcast-bench",
+                   "--clients", str(point.connections), "--messages", str(messages),
+                   "--payload-size", str(point.payload_size), "--result-json", result_path]
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        with open(result_path, encoding="utf-8") as f:
+            result = json.load(f)
+    finally:
+        os.remove(result_path)
+    return SuiteResult(point, result["delivered"], result["delivery_time"], point.payload_size,
+                       errors=result["expected"] - result["delivered"])
+
+
+def expand_points(scenarios: List[str], backends: List[str], connections_list: List[int],
+                  payload_sizes: List[int], durations: List[float]) -> List[SuitePoint]:
+    """
+    Точки перебора параметров
+
+    Параметры, не влияющие на сценарий, не перебираются: бэкенд - для
+    сценариев server-sender.py, размер сообщения - для connection-storm,
+    длительность - для broadcast (там фиксировано количество сообщений).
+    """
+    points = []
+    for scenario in scenarios:
+        scenario_backends = backends if scenario in BACKEND_SCENARIOS else [SENDER_BACKEND]
+        scenario_sizes = [0] if scenario == SCENARIO_STORM else payload_sizes
+        scenario_durations = [0.0] if scenario == SCENARIO_BROADCAST else durations
+        for backend, connections, payload_size, duration in itertools.product(
+                scenario_backends, connections_list, scenario_sizes, scenario_durations):
+            points.append(SuitePoint(scenario, backend, connections, payload_size, duration))
+    return points
+
+
+def run_point(point: SuitePoint, host: str, inflight: int, broadcast_messages: int) -> SuiteResult:
+    """Запускает сервер сценария на свободном порту и выполняет замер точки"""
+    if point.scenario == SCENARIO_BROADCAST:
+        return run_broadcast(point, host, broadcast_messages)
+
+    port = find_free_port(host)
+    url = f"ws://{host}:{port}"
+    if point.scenario == SCENARIO_OUTBOUND:
+        server = ServerProcess("server-sender.py", host, port,
+                               ["--binary", "--payload-size", str(point.payload_size), "--no-metrics"])
+        measure = run_outbound(point, url)
+    else:
+        args = ["--backend", point.backend, "--no-metrics"]
+        if point.scenario == SCENARIO_ECHO:
+            args.append("--echo")
+            measure = run_loadgen(point, url, inflight)
+        elif point.scenario == SCENARIO_INBOUND:
+            measure = run_loadgen(point, url, 0)
+        else:
+            measure = run_storm(point, url)
+        server = ServerProcess("server-bench.py", host, port, args)
+    try:
+        with server:
+            return asyncio.run(measure)
+    finally:
+        measure.close()
+
+
+def run_suite(points: List[SuitePoint], host: str, inflight: int, broadcast_messages: int) -> List[SuiteResult]:
+    """Выполняет все точки перебора и выводит результат каждой"""
+    results = []
+    for index, point in enumerate(points, 1):
+        label = (f"[{index}/{len(points)}] {point.scenario:<16} {point.backend:<10} "
+                 f"подкл={point.connections:<5} размер={point.payload_size:<6} {point.duration:g}с")
+        print(label, end=" ", flush=True)
+        try:
+            result = run_point(point, host, inflight, broadcast_messages)
+        except (RuntimeError, OSError, subprocess.CalledProcessError, KeyError, ValueError) as e:
+            print(f"ошибка: {e}")
+            result = SuiteResult(point, errors=1)
+        else:
+            print(result.format_line())
+        results.append(result)
+    return results
+
+
+def save_json(path: str, machine: dict, results: List[SuiteResult]):
+    """Сохраняет результаты и сведения о машине в JSON (его же можно указать как базовый прогон)"""
+    data = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "machine": machine,
+        "results": [result.as_dict() for result in results],
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def save_csv(path: str, machine: dict, results: List[SuiteResult]):
+    """Сохраняет результаты в CSV; сведения о машине - в столбцах каждой строки"""
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(MACHINE_FIELDS + RESULT_FIELDS)
+        machine_row = [machine.get(field, "") for field in MACHINE_FIELDS]
+        for result in results:
+            writer.writerow(machine_row + [getattr(result, field) for field in RESULT_FIELDS])
+
+
+def load_baseline(path: str) -> Dict[Tuple, dict]:
+    """Загружает результаты базового прогона (JSON из save_json) по ключам result_key"""
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    return {result_key(result): result for result in data["results"]}
+
+
+def compare_with_baseline(results: List[SuiteResult], baseline: Dict[Tuple, dict],
+                          throughput_threshold: float, latency_threshold: float) -> List[str]:
+    """
+    Сравнивает результаты с базовым прогоном и выводит таблицу изменений
+
+    Args:
+        results: Текущие результаты
+        baseline: Базовые результаты (load_baseline)
+        throughput_threshold: Допустимое падение скорости (доля, 0.1 = 10%)
+        latency_threshold: Допустимый рост p99 (доля)
+
+    Returns:
+        Список описаний регрессий (пустой - регрессий нет)
+    """
+    regressions = []
+    print(f"\n{'Сценарий':<16} {'Бэкенд':<10} {'Подкл':>6} {'Размер':>7} {'Длит':>5} "
+          f"{'Скорость':>10} {'База':>12} {'p99':>8} {'База':>8}")
+    for result in results:
+        current = result.as_dict()
+        base = baseline.get(result_key(current))
+        if base is None:
+            continue
+        rate_change = (result.rate / base["rate"] - 1.0) if base["rate"] else 0.0
+        p99_change = (result.p99_ms / base["p99_ms"] - 1.0) if base["p99_ms"] and result.p99_ms else 0.0
+        marks = []
+        if base["rate"] and rate_change < -throughput_threshold:
+            marks.append(f"скорость {rate_change:+.1%}")
+        if p99_change > latency_threshold:
+            marks.append(f"p99 {p99_change:+.1%}")
+        print(f"{result.scenario:<16} {result.backend:<10} {result.connections:>6} {result.payload_size:>7} "
+              f"{result.duration:>5g} {rate_change:>+10.1%} {base['rate']:>12.2f} "
+              f"{p99_change:>+8.1%} {base['p99_ms']:>8.3f}" + ("  РЕГРЕССИЯ" if marks else ""))
+        if marks:
+            regressions.append(f"{result.scenario}/{result.backend} подкл={result.connections} "
+                               f"размер={result.payload_size} {result.duration:g}с: {', '.join(marks)}")
+    missing = len(baseline) - sum(1 for result in results if result_key(result.as_dict()) in baseline)
+    if missing:
+        print(f"Точек базового прогона без текущего результата: {missing}")
+    return regressions
@@ -0,0 +1,175 @@
+"""
+Подписки на темы: индекс "тема -> подписчики" для ClientManager
+
+Клиент управляет подписками текстовыми командами:
+
+    __SUBSCRIBE__:<шаблон>        подписаться (ответ - та же команда)
+    __UNSUBSCRIBE__:<шаблон>      отписаться (ответ - та же команда)
+    __PUBLISH__:<тема>:<текст>    опубликовать текст в теме
+
+Подписчики получают "__TOPIC__:<тема>:<текст>". Тема - строка из частей
+через точку, например "orders.moscow.new". Шаблон - тема целиком или
+префикс с "*" в конце: "orders.*" совпадает с "orders.moscow" и
+"orders.moscow.new" (но не с "orders"), "*" - со всеми темами.
+
+Подписки хранятся в словарях "тема -> множество подключений" и "префикс ->
+множество подключений". Публикация не перебирает ни клиентов, ни шаблоны:
+это один поиск точной темы и по поиску на каждый префикс темы (по числу
+частей), то есть O(частей темы + подписчиков темы).
+"""
+from typing import Collection, Dict, Optional, Set, Tuple
+
+SUBSCRIBE_COMMAND = "__SUBSCRIBE__"
+UNSUBSCRIBE_COMMAND = "__UNSUBSCRIBE__"
+PUBLISH_COMMAND = "__PUBLISH__"
+TOPIC_MESSAGE = "__TOPIC__"
+
+SEPARATOR = "."
+WILDCARD = "*"
+
+
+def parse_topic_command(message: str) -> Optional[Tuple[str, str, str]]:
+    """
+    Разбирает команду подписки или публикации
+
+    Returns:
+        Tuple (команда, шаблон или тема, текст публикации) или None, если это не команда тем
+    """
+    if not message.startswith("__"):
+        return None
+    command, _, rest = message.partition(":")
+    if command == PUBLISH_COMMAND:
+        topic, _, text = rest.partition(":")
+        return command, topic, text
+    if command in (SUBSCRIBE_COMMAND, UNSUBSCRIBE_COMMAND):
+        return command, rest, ""
+    return None
+
+
+def topic_message(topic: str, text: str) -> str:
+    """Сообщение подписчикам темы"""
+    return f"{TOPIC_MESSAGE}:{topic}:{text}"
+
+
+def split_pattern(pattern: str) -> Tuple[str, bool]:
+    """
+    Шаблон подписки -> (тема или префикс, это префикс)
+
+    Raises:
+        ValueError: Пустой шаблон или "*" не в конце
+    """
+    if pattern == WILDCARD:
+        return "", True
+    if pattern.endswith(SEPARATOR + WILDCARD):
+        prefix = pattern[:-1]
+        if WILDCARD in prefix or prefix == SEPARATOR:
+            raise ValueError(f"неверный шаблон темы: {pattern}")
+        return prefix, True
+    if not pattern or WILDCARD in pattern:
+        raise ValueError(f"неверный шаблон темы: {pattern}")
+    return pattern, False
+
+
+def pattern_matches(pattern: str, topic: str) -> bool:
+    """Совпадает ли тема с шаблоном (проверка одного шаблона, без индекса)"""
+    key, is_prefix = split_pattern(pattern)
+    return topic.startswith(key) if is_prefix else topic == key
+
+
+class TopicIndex:
+    """Подписки клиентов: точные темы и префиксы, с обратным индексом для отключения"""
+
+    __slots__ = ("exact", "prefixes", "by_client")
+
+    def __init__(self):
+        # Тема -> подписчики и префикс ("orders." для "orders.*") -> подписчики
+        self.exact: Dict[str, Set] = {}
+        self.prefixes: Dict[str, Set] = {}
+        # Подключение -> его шаблоны (только у подписанных клиентов)
+        self.by_client: Dict[object, Set[str]] = {}
+
+    def subscribe(self, client, pattern: str) -> bool:
+        """
+        Подписывает клиента на шаблон
+
+        Returns:
+            True, если подписки не было
+
+        Raises:
+            ValueError: Неверный шаблон (см. split_pattern)
+        """
+        key, is_prefix = split_pattern(pattern)
+        table = self.prefixes if is_prefix else self.exact
+        subscribers = table.get(key)
+        if subscribers is None:
+            subscribers = table[key] = set()
+        elif client in subscribers:
+            return False
+        subscribers.add(client)
+        patterns = self.by_client.get(client)
+        if patterns is None:
+            patterns = self.by_client[client] = set()
+        patterns.add(pattern)
+        return True
+
+    def unsubscribe(self, client, pattern: str) -> bool:
+        """Отписывает клиента; False, если подписки не было"""
+        patterns = self.by_client.get(client)
+        if patterns is None or pattern not in patterns:
+            return False
+        self._discard(client, pattern)
+        patterns.discard(pattern)
+        if not patterns:
+            del self.by_client[client]
+        return True
+
+    def remove(self, client) -> int:
+        """Удаляет все подписки отключившегося клиента; возвращает их количество"""
+        patterns = self.by_client.pop(client, None)
+        if not patterns:
+            return 0
+        for pattern in patterns:
+            self._discard(client, pattern)
+        return len(patterns)
+
+    def _discard(self, client, pattern: str):
+        key, is_prefix = split_pattern(pattern)
+        table = self.prefixes if is_prefix else self.exact
+        subscribers = table[key]
+        subscribers.discard(client)
+        if not subscribers:
+            # Пустые множества не копятся при смене тем
+            del table[key]
+
+    def subscribers(self, topic: str) -> Collection:
+        """
+        Подписчики темы (точные и по префиксам, каждый один раз)
+
+        Возвращаемое множество может быть внутренним: его нельзя изменять,
+        а перебирать нужно до следующей подписки или отписки.
+        """
+        exact = self.exact.get(topic)
+        prefixes = self.prefixes
+        if not prefixes:
+            return exact or ()
+        matched = [exact] if exact else []
+        subscribers = prefixes.get("")
+        if subscribers:
+            matched.append(subscribers)
+        index = topic.find(SEPARATOR)
+        while index >= 0:
+            subscribers = prefixes.get(topic[:index + 1])
+            if subscribers:
+                matched.append(subscribers)
+            index = topic.find(SEPARATOR, index + 1)
+        if len(matched) > 1:
+            return set().union(*matched)
+        return matched[0] if matched else ()
+
+    def pattern_count(self) -> int:
+        """Количество различных шаблонов с подписчиками"""
+        return len(self.exact) + len(self.prefixes)
+
+    def subscription_count(self) -> int:
+        """Общее количество подписок"""
+        return sum(len(patterns) for patterns in self.by_client.values())
@@ -27,7 +27,8 @@ def parse_ws_url(url: str) -> Optional[Tuple[str, int]]:
     return (host, port)
 
 
-async def run_websocket_server(handler, host: str, port: int, startup_message: str = None):
+async def run_websocket_server(handler, host: str, port: int, startup_message: str = None,
+                               reuse_port: bool = False, metrics=None, serve_options: dict = None):
     """
     Запускает WebSocket сервер и ожидает бесконечно
     
@@ -36,12 +37,33 @@ async def run_websocket_server(handler, host: str, port: int, startup_message: s
         host: Хост для привязки
         port: Порт для привязки
         startup_message: Сообщение для вывода при запуске
+        reuse_port: Открыть сокет с SO_REUSEPORT, чтобы несколько процессов
+            могли слушать один порт
+        metrics: ServerMetrics (ws_metrics.py) - отвечать на HTTP GET /metrics
+            на том же порту метриками в формате Prometheus
+        serve_options: Дополнительные параметры websockets.serve()
+            (например, сжатие из ws_compression.py)
     """
     if startup_message:
         print(startup_message)
     
-    async with websockets.serve(handler, host, port):
-        await asyncio.Future()  # Запускаем бесконечный цикл
+    options = dict(serve_options or {})
+    if metrics is None:
+        async with websockets.serve(handler, host, port, reuse_port=reuse_port, **options):
+            await asyncio.Future()  # Запускаем бесконечный цикл
+        return
+    
+    # Монитор может быть уже запущен диагностикой сервера (ws_profile.Instrumentation)
+    started_lag_monitor = metrics.lag_monitor.start()
+    try:
+        async with websockets.serve(handler, host, port, reuse_port=reuse_port,
+                                    process_request=metrics.process_request,
+                                    process_response=metrics.process_response,
+                                    create_connection=metrics.create_connection, **options):
+            await asyncio.Future()  # Запускаем бесконечный цикл
+    finally:
+        if started_lag_monitor:
+            metrics.lag_monitor.stop()
 
 
 def get_client_id(websocket: websockets.WebSocketServerProtocol) -> int:
@@ -0,0 +1,196 @@
+"""
+Запуск нескольких процессов-воркеров сервера на одном порту (SO_REUSEPORT)
+и сведение их статистики в общий отчет
+"""
+import multiprocessing
+import queue
+import socket
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from ws_log import get_logger, flush_logs
+
+stats_log = get_logger("stats")
+
+
+def is_reuse_port_supported() -> bool:
+    """Проверяет, поддерживает ли платформа SO_REUSEPORT"""
+    return hasattr(socket, "SO_REUSEPORT")
+
+
+def start_workers(num_workers: int, worker_main: Callable, worker_args: Tuple = ()) -> Tuple[List[multiprocessing.Process], multiprocessing.Queue]:
+    """
+    Запускает процессы-воркеры
+
+    Каждый воркер вызывается как worker_main(worker_id, stats_queue, *worker_args)
+    и должен периодически класть в stats_queue снимки своих счетчиков
+    (см. make_worker_snapshot).
+
+    Args:
+        num_workers: Количество процессов
+        worker_main: Функция воркера (должна быть доступна на уровне модуля)
+        worker_args: Дополнительные аргументы воркера
+
+    Returns:
+        Tuple (список процессов, очередь статистики)
+    """
+    stats_queue = multiprocessing.Queue()
+    processes = []
+    for worker_id in range(num_workers):
+        process = multiprocessing.Process(
+            target=worker_main,
+            args=(worker_id, stats_queue, *worker_args),
+            daemon=True
+        )
+        process.start()
+        processes.append(process)
+    return processes, stats_queue
+
+
+def stop_workers(processes: List[multiprocessing.Process], timeout: float = 2.0):
+    """Останавливает процессы-воркеры"""
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+    for process in processes:
+        process.join(timeout)
+
+
+def make_worker_snapshot(worker_id: int, message_count: int, client_count: int, active_benchmarks: int) -> dict:
+    """
+    Формирует снимок счетчиков воркера для передачи в родительский процесс
+
+    Args:
+        worker_id: Номер воркера
+        message_count: Накопленное количество полученных сообщений
+        client_count: Количество подключенных клиентов
+        active_benchmarks: Количество активных замеров
+
+    Returns:
+        Словарь со снимком
+    """
+    return {
+        'worker_id': worker_id,
+        'message_count': message_count,
+        'client_count': client_count,
+        'active_benchmarks': active_benchmarks,
+    }
+
+
+class WorkerStatsAggregator:
+    """Сводит накопленные счетчики воркеров в общий интервальный и итоговый отчет"""
+
+    def __init__(self, num_workers: int):
+        self.num_workers = num_workers
+        self.snapshots: Dict[int, dict] = {}
+        self.reported_counts: Dict[int, int] = {}
+        self.first_message_time: Optional[float] = None
+        self.last_message_time: Optional[float] = None
+
+    def update(self, snapshot: dict):
+        """Принимает очередной снимок от воркера"""
+        self.snapshots[snapshot['worker_id']] = snapshot
+
+    def total_messages(self) -> int:
+        """Возвращает суммарное количество сообщений по всем воркерам"""
+        return sum(s['message_count'] for s in self.snapshots.values())
+
+    def print_interval(self, elapsed: float, total_elapsed: float):
+        """Выводит сводную статистику за интервал"""
+        interval_total = 0
+        per_worker = []
+        for worker_id in range(self.num_workers):
+            snapshot = self.snapshots.get(worker_id)
+            count = snapshot['message_count'] if snapshot else 0
+            delta = count - self.reported_counts.get(worker_id, 0)
+            self.reported_counts[worker_id] = count
+            interval_total += delta
+            per_worker.append(delta)
+
+        if interval_total > 0:
+            now = time.time()
+            if self.first_message_time is None:
+                self.first_message_time = now - elapsed
+            self.last_message_time = now
+
+        clients = sum(s['client_count'] for s in self.snapshots.values())
+        active = sum(s['active_benchmarks'] for s in self.snapshots.values())
+        rate = interval_total / elapsed if elapsed > 0 else 0
+        line = (f"[Сервер] [{total_elapsed:.1f}с] "
+                f"Получено: {interval_total} сообщений за {elapsed:.1f}с "
+                f"({rate:.2f} сообщений/сек), "
+                f"клиентов: {clients}, активных замеров: {active}")
+        if interval_total > 0:
+            line += "\n         По воркерам: " + ", ".join(
+                f"#{worker_id}: {count}" for worker_id, count in enumerate(per_worker))
+        stats_log.info(line, messages=interval_total, interval=round(elapsed, 3), rate=round(rate, 2),
+                       clients=clients, active=active, workers=per_worker)
+
+    def print_final(self, extra_lines: List[str] = ()):
+        """Выводит итоговую статистику по всем воркерам (и extra_lines, например, итоги шины)"""
+        total = self.total_messages()
+        active_time = 0.0
+        if self.first_message_time is not None and self.last_message_time is not None:
+            active_time = self.last_message_time - self.first_message_time
+        rate = total / active_time if active_time > 0 else 0
+
+        print(f"\n{'='*60}")
+        print(f"Итоговая статистика по {self.num_workers} воркерам")
+        for worker_id in range(self.num_workers):
+            snapshot = self.snapshots.get(worker_id)
+            count = snapshot['message_count'] if snapshot else 0
+            print(f"  Воркер #{worker_id}: {count} сообщений")
+        print(f"Всего получено: {total} сообщений")
+        print(f"Время с сообщениями: {active_time:.2f} секунд")
+        print(f"Средняя скорость: {rate:.2f} сообщений/секунду")
+        for line in extra_lines:
+            print(line)
+        print(f"{'='*60}\n")
+
+
+def run_aggregator(processes: List[multiprocessing.Process], stats_queue: multiprocessing.Queue, interval: float,
+                   final_report: Optional[Callable[[], List[str]]] = None):
+    """
+    Собирает снимки воркеров и каждые interval секунд выводит сводный отчет.
+    Работает до Ctrl+C или завершения всех воркеров, затем выводит итог.
+
+    Args:
+        processes: Процессы-воркеры
+        stats_queue: Очередь статистики
+        interval: Интервал вывода статистики в секундах
+        final_report: Дополнительные строки итога (вызывается до остановки воркеров)
+    """
+    aggregator = WorkerStatsAggregator(len(processes))
+    start_time = time.time()
+    interval_start = start_time
+    last_printed_total = 0
+
+    try:
+        while any(process.is_alive() for process in processes):
+            timeout = max(0.0, interval_start + interval - time.time())
+            try:
+                aggregator.update(stats_queue.get(timeout=timeout))
+            except queue.Empty:
+                pass
+
+            current_time = time.time()
+            if current_time - interval_start >= interval:
+                # Без сообщений не засоряем консоль пустыми интервалами
+                total = aggregator.total_messages()
+                if total != last_printed_total:
+                    aggregator.print_interval(current_time - interval_start, current_time - start_time)
+                    last_printed_total = total
+                interval_start = current_time
+    except KeyboardInterrupt:
+        pass
+    finally:
+        extra_lines = final_report() if final_report else []
+        # Забираем последние снимки, которые воркеры успели отправить
+        while True:
+            try:
+                aggregator.update(stats_queue.get_nowait())
+            except (queue.Empty, OSError, ValueError):
+                break
+        stop_workers(processes)
+        flush_logs()
+        aggregator.print_final(extra_lines)